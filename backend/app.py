@@ -1,97 +1,425 @@
 #!/usr/bin/env python3
 
 # IMPORTANT!!!!!!
-# You need to run this script with sudo privileges!!!!!! THIS IS BECAUSE WE USE NMAP PIP MODULE HERE
+# You need to run this script with sudo privileges!!!!!! THIS IS BECAUSE NMAP OS DETECTION (-O) NEEDS ROOT
+# (unless server_scan.engine is "connect", which scans with plain TCP connects)
 # sudo python3 app.py
 # OTHERWISE YOU WILL GET THIS ERROR:
 # OSError: [Errno 13] Permission denied: '/var/run/nmap/nmap.sock'
 # OR... POST 500 ERRORS: 127.0.0.1 - - [30/Nov/1998 22:45:38] "POST /api/scan/servers HTTP/1.1" 500 -
 
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response, g
 from flask_cors import CORS
 from database.db_manager import DatabaseManager
+from database.snapshot import SnapshotStore, QUERIES as SNAPSHOT_QUERIES
 from datetime import datetime, timedelta
 import os
+import time
 from pathlib import Path
 import re
 import json
+import gzip
+import zlib
+import hashlib
+import hmac
+import math
+from urllib.parse import urlencode
 from scan_dirs.scan_dirs import DirectoryScanner
+from scan_dirs.manifest import AgentRootConflict, ingest_manifest, release_root
+from scan_dirs.manifest import DEFAULT_SETTINGS as AGENT_DEFAULTS
 from scan_servers.scan_servers import SubnetScanner
+from scan_servers.engines import get_engine_class
+from jobs.scan_jobs import ScanJobManager, ScanJobConflict
+from jobs.events import EventBroadcaster, TooManySubscribers
+from backup_status.history import backup_age_series, last_fresh_backup
+from metrics.metrics import REGISTRY, Histogram, render as render_metrics
+from metrics.metrics import DEFAULT_SETTINGS as METRICS_DEFAULTS
+
+try:
+    import brotli
+except ImportError:  # Optional: without it streamed responses fall back to gzip
+    brotli = None
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
-db_manager = DatabaseManager()
+
+def load_config():
+    """Load config.json from the backend directory."""
+    config_path = Path(__file__).parent / 'config.json'
+    try:
+        with open(config_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# Events stream settings; override any of them with the "events" section of config.json
+EVENTS_DEFAULTS = {
+    'poll_interval': 0.5,  # seconds between reads of scan_jobs and the data generation
+    'heartbeat': 15,       # seconds of silence before a keep-alive comment is sent
+    'max_duration': 300,   # seconds before a stream is closed; EventSource reconnects
+    'retry': 2000,         # ms clients wait before reconnecting
+    'max_subscribers': 16  # open streams per worker process; keep it well below gunicorn's threads
+}
+
+db_manager = DatabaseManager(settings=load_config().get('database'))
+job_manager = ScanJobManager(db_manager)
+events_settings = {**EVENTS_DEFAULTS, **load_config().get('events', {})}
+event_broadcaster = EventBroadcaster(db_manager, poll_interval=events_settings['poll_interval'],
+                                     max_subscribers=events_settings['max_subscribers'])
+metrics_settings = {**METRICS_DEFAULTS, **load_config().get('metrics', {})}
+snapshot_store = SnapshotStore(load_config().get('snapshot'))
+
+REQUEST_SECONDS = Histogram(
+    'backup_checker_http_request_seconds',
+    'Time to produce each response, per route (streamed bodies are sent afterwards)',
+    ['method', 'route', 'status']
+)
+
+# Tables whose row counts /metrics reports
+METRICS_TABLES = (
+    'scanned_files', 'file_index', 'scanned_servers', 'server_backup_status', 'server_history',
+    'scan_snapshots', 'file_fingerprints', 'scan_jobs', 'dns_cache', 'response_cache', 'agent_roots'
+)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if metrics_settings['enabled']:
+        # Every worker process flushes its own metrics; started on its first request
+        REGISTRY.start_flusher(lambda: db_manager, metrics_settings['flush_interval'])
+
+@app.after_request
+def record_request_time(response):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.labels(request.method, route, response.status_code).observe(
+            time.perf_counter() - started
+        )
+    return response
 
 def format_timestamp(timestamp):
-    """Convert timestamp to ISO format string."""
-    if isinstance(timestamp, str):
-        try:
-            timestamp = datetime.fromisoformat(timestamp)
-        except ValueError:
-            return timestamp
-    return timestamp.isoformat() if timestamp else None
+    """Convert an epoch timestamp from the database to a local-time ISO format string."""
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
 
-def get_backup_status(server, files):
+def get_max_age_days():
     """
-    Determine backup status for a server based on matching files.
-    Returns: 'green', 'yellow', or 'red' based on backup age.
-    green = backup is less than 1 year old
-    yellow = backup exists but is more than 1 year old
-    red = no backup exists
+    Age in days up to which a backup counts as recent (green). Read on every
+    request so the materialized status never goes stale.
     """
-    server_identifiers = [
-        server['hostname'].lower(),
-        server['ip_address'].lower() if server['ip_address'] else None
-    ]
-    
-    matching_files = []
-    for file in files:
-        filename_lower = file['filename'].lower()
-        if any(id and id in filename_lower for id in server_identifiers if id):
-            matching_files.append(file)
-    
-    if not matching_files:
-        return 'red'  # No backup exists
-    
-    # Find most recent backup
-    most_recent = max(matching_files, key=lambda x: x['last_modified'])
-    last_modified = datetime.fromisoformat(most_recent['last_modified'])
-    age = datetime.now() - last_modified
-    
-    # Check backup age
-    if age <= timedelta(days=365):
-        return 'green'  # Less than 1 year old
+    return load_config().get('backup_status', {}).get('max_age_days', 365)
+
+def parse_bool(value):
+    """Parse a true/false query parameter."""
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(value)
+
+def parse_statuses(value):
+    """Parse a comma separated list of backup statuses."""
+    statuses = [status.strip() for status in value.split(',') if status.strip()]
+    if not statuses or any(status not in DatabaseManager.BACKUP_STATUSES for status in statuses):
+        raise ValueError(value)
+    return statuses
+
+FILE_FILTERS = {
+    'path_prefix': str,
+    'filename': str,
+    'modified_after': datetime.fromisoformat,
+    'modified_before': datetime.fromisoformat,
+    'min_size': int,
+    'max_size': int
+}
+
+SERVER_FILTERS = {
+    'hostname': str,
+    'ip_address': str,
+    'status': parse_statuses,
+    'is_reachable': parse_bool
+}
+
+def parse_list_args(filter_parsers):
+    """
+    Read filters, sort/order and limit/offset paging from the query string.
+    Raises ValueError with a message suitable for a 400 response.
+    """
+    filters = {}
+    for name, parse in filter_parsers.items():
+        value = request.args.get(name)
+        if value:
+            try:
+                filters[name] = parse(value)
+            except ValueError:
+                raise ValueError(f'Invalid value for {name}: {value}')
+
+    paging = {}
+    for name in ('limit', 'offset'):
+        value = request.args.get(name)
+        if value is not None:
+            try:
+                paging[name] = int(value)
+            except ValueError:
+                paging[name] = -1
+            if paging[name] < 0:
+                raise ValueError(f'{name} must be a non-negative integer')
+
+    return {
+        'filters': filters,
+        'sort': request.args.get('sort') or None,
+        'order': request.args.get('order', 'asc'),
+        'limit': paging.get('limit'),
+        'offset': paging.get('offset', 0)
+    }
+
+def list_response(key, total, rows, query):
+    """Build the JSON body shared by the list endpoints."""
+    body = {
+        'status': 'success',
+        'count': len(rows),
+        'total': total,
+        key: rows
+    }
+    if query['limit'] is not None:
+        body['limit'] = query['limit']
+        body['offset'] = query['offset']
+    return body
+
+STREAM_FORMATS = ('json', 'ndjson', 'columnar')
+STREAM_CHUNK_ROWS = 500
+
+def format_file(file):
+    """Convert a scanned_files row to its API representation."""
+    return {
+        'id': file[0],
+        'filename': file[1],
+        'filepath': file[2],
+        'last_modified': format_timestamp(file[3]),
+        'size': file[4],
+        'scan_time': format_timestamp(file[5])
+    }
+
+def get_response_format():
+    """Pick json, ndjson or columnar from ?format= or the Accept header."""
+    fmt = request.args.get('format')
+    if fmt is None:
+        best = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+        fmt = 'ndjson' if best == 'application/x-ndjson' else 'json'
+    if fmt not in STREAM_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(STREAM_FORMATS)}")
+    return fmt
+
+def generate_ndjson(rows, formatter):
+    """One JSON object per line, STREAM_CHUNK_ROWS lines per chunk."""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(formatter(row)))
+        if len(lines) >= STREAM_CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def generate_columnar(rows, formatter, columns, total):
+    """
+    A single JSON document that names the columns once and sends each row as
+    an array: {"status": ..., "total": ..., "columns": [...], "rows": [[...], ...], "count": ...}
+    """
+    yield json.dumps({'status': 'success', 'total': total, 'columns': list(columns)})[:-1]
+    yield ', "rows": ['
+    count = 0
+    values = []
+    for row in rows:
+        record = formatter(row)
+        values.append(json.dumps([record[column] for column in columns]))
+        count += 1
+        if len(values) >= STREAM_CHUNK_ROWS:
+            yield (',' if count > len(values) else '') + ','.join(values)
+            values = []
+    if values:
+        yield (',' if count > len(values) else '') + ','.join(values)
+    yield f'], "count": {count}}}'
+
+def get_stream_encoding():
+    """Negotiate br (when the optional brotli module is installed), gzip or no compression."""
+    offers = (['br'] if brotli is not None else []) + ['gzip', 'identity']
+    return request.accept_encodings.best_match(offers) or 'identity'
+
+def compress_stream(chunks, encoding):
+    """Compress a stream of text chunks, flushing after each so the client can decode as it goes."""
+    if encoding == 'br':
+        compressor = brotli.Compressor()
+        for chunk in chunks:
+            yield compressor.process(chunk.encode()) + compressor.flush()
+        yield compressor.finish()
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            yield compressor.compress(chunk.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    else:
+        for chunk in chunks:
+            yield chunk.encode()
+
+def stream_response(fmt, rows, formatter, columns, total):
+    """Stream rows as NDJSON or columnar JSON with negotiated compression."""
+    if fmt == 'ndjson':
+        chunks = generate_ndjson(rows, formatter)
+        mimetype = 'application/x-ndjson'
     else:
-        return 'yellow'  # Backup exists but is more than 1 year old
+        chunks = generate_columnar(rows, formatter, columns, total)
+        mimetype = 'application/json'
+
+    encoding = get_stream_encoding()
+    response = Response(compress_stream(chunks, encoding), mimetype=mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
+# Responses of the list endpoints are cached per data generation; override
+# with the "response_cache" section of config.json
+RESPONSE_CACHE_DEFAULTS = {
+    'enabled': True,
+    'max_entries': 256  # cached bodies kept across all endpoints and query strings
+}
+
+def get_cache_settings():
+    return {**RESPONSE_CACHE_DEFAULTS, **load_config().get('response_cache', {})}
+
+def response_cache_key(*extra):
+    """Identify a response by path, normalized query string and whatever else it depends on."""
+    args = urlencode(sorted(request.args.items(multi=True)))
+    return '|'.join([request.path, args] + [str(value) for value in extra])
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    response.last_modified = datetime.fromtimestamp(last_modified)
+    # Let browsers keep the body but revalidate it on every use
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def is_not_modified(etag, last_modified):
+    """Whether the client's If-None-Match (or, without one, If-Modified-Since) is still current."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since is not None:
+        return request.if_modified_since.timestamp() >= last_modified
+    return False
+
+def cached_response(build, key_extra=(), last_modified=None):
+    """
+    Serve a GET endpoint whose data only changes with the data generation.
+
+    The ETag combines the generation, the time the response last changed
+    (the generation's changed_at, or last_modified if later) and the cache
+    key, so validating a client's copy costs a single row read and a
+    matching If-None-Match is answered with 304 without building anything.
+    build() returns either a JSON-serializable body, which is stored
+    gzip-compressed in the response_cache table and shared by every worker
+    process until the generation moves on, or a Response (streamed formats),
+    which is sent with the same validators but not cached.
+    """
+    generation, changed_at = db_manager.get_data_generation()
+    last_modified = max(changed_at, last_modified or 0)
+    key = response_cache_key(*key_extra)
+    etag = f'{generation}-{last_modified}-{hashlib.sha1(key.encode()).hexdigest()[:16]}'
+    if is_not_modified(etag, last_modified):
+        return set_validators(Response(status=304), etag, last_modified)
+
+    settings = get_cache_settings()
+    body = db_manager.get_cached_response(key, etag) if settings['enabled'] else None
+    if body is None:
+        data = build()
+        if isinstance(data, Response):
+            return set_validators(data, etag, last_modified)
+        body = gzip.compress(json.dumps(data).encode(), compresslevel=6)
+        if settings['enabled']:
+            db_manager.put_cached_response(key, generation, etag, body, settings['max_entries'])
+
+    if request.accept_encodings.best_match(['gzip', 'identity']) == 'gzip':
+        response = Response(body, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(gzip.decompress(body), mimetype='application/json')
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    return set_validators(response, etag, last_modified)
+
+def query_files(query, stream=False):
+    """A page of files from the shared inventory snapshot when it is current, else from SQLite."""
+    snapshot = snapshot_store.current(db_manager)
+    SNAPSHOT_QUERIES.labels('files', 'snapshot' if snapshot is not None else 'database').inc()
+    if snapshot is not None:
+        return snapshot.query_files(**query, stream=stream)
+    return db_manager.query_scanned_files(**query, stream=stream)
+
+def query_servers(fresh_since, query):
+    """A page of servers from the shared inventory snapshot when it is current, else from SQLite."""
+    snapshot = snapshot_store.current(db_manager)
+    SNAPSHOT_QUERIES.labels('servers', 'snapshot' if snapshot is not None else 'database').inc()
+    if snapshot is not None:
+        return snapshot.query_servers(fresh_since, **query)
+    return db_manager.query_servers(fresh_since, **query)
 
 @app.route('/api/files', methods=['GET'])
 def get_files():
-    """Get all scanned files from the database."""
+    """
+    Get scanned files, optionally filtered, sorted and paged in the inventory
+    snapshot (or the database while the snapshot is being rebuilt).
+    format=ndjson or format=columnar streams the rows from a cursor instead of
+    building the whole response in memory.
+    """
     try:
-        files = db_manager.get_all_scanned_files()
-        formatted_files = []
-        
-        for file in files:
-            formatted_files.append({
-                'id': file[0],
-                'filename': file[1],
-                'filepath': file[2],
-                'last_modified': format_timestamp(file[3]),
-                'size': file[4],
-                'scan_time': format_timestamp(file[5])
-            })
-        
-        # Sort by query parameter if provided
-        sort_by = request.args.get('sort')
-        if sort_by:
-            reverse = request.args.get('order', 'asc') == 'desc'
-            formatted_files.sort(key=lambda x: x.get(sort_by, ''), reverse=reverse)
-        
+        query = parse_list_args(FILE_FILTERS)
+        fmt = get_response_format()
+
+        def build():
+            if fmt != 'json':
+                total, files = query_files(query, stream=True)
+                return stream_response(fmt, files, format_file, DatabaseManager.FILE_COLUMNS, total)
+
+            total, files = query_files(query)
+            formatted_files = [format_file(file) for file in files]
+            return list_response('files', total, formatted_files, query)
+
+        # Streamed bodies depend on the negotiated format and compression too
+        return cached_response(build, key_extra=(fmt, get_stream_encoding()) if fmt != 'json' else ())
+    except ValueError as e:
         return jsonify({
-            'status': 'success',
-            'count': len(formatted_files),
-            'files': formatted_files
-        }), 200
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/files/fingerprints', methods=['GET'])
+def get_file_fingerprints():
+    """
+    Backup files the content fingerprints flag: truncated since the previous
+    fingerprint, touched without their content changing, and duplicates.
+    """
+    try:
+        def build():
+            report = db_manager.get_fingerprint_report()
+            flagged = {
+                status: [
+                    {'filepath': filepath, 'size': size, 'hashed_at': format_timestamp(hashed_at)}
+                    for filepath, size, hashed_at in report[status]
+                ]
+                for status in ('truncated', 'touched')
+            }
+            return {
+                'status': 'success',
+                **flagged,
+                'duplicates': report['duplicates']
+            }
+
+        return cached_response(build)
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -100,74 +428,223 @@ def get_files():
 
 @app.route('/api/servers', methods=['GET'])
 def get_servers():
-    """Get all scanned servers with their backup status."""
+    """Get scanned servers with their backup status, optionally filtered, sorted and paged."""
     try:
-        servers = db_manager.get_all_servers()
-        files = db_manager.get_all_scanned_files()
-        
-        # Format servers
-        formatted_servers = []
-        formatted_files = []
-        
-        # Format files for backup checking
-        for file in files:
-            formatted_files.append({
-                'filename': file[1],
-                'filepath': file[2],
-                'last_modified': format_timestamp(file[3])
-            })
-        
-        # Format and check backup status for each server
-        for server in servers:
-            server_data = {
-                'id': server[0],
-                'hostname': server[1],
-                'ip_address': server[2],
-                'detected_os': server[3],
-                'open_ports': server[4],
-                'last_scan': format_timestamp(server[5]),
-                'is_reachable': bool(server[6]),
-                'scan_time': format_timestamp(server[7])
+        query = parse_list_args(SERVER_FILTERS)
+        max_age_days = get_max_age_days()
+        # Oldest last_modified that still counts as a recent (green) backup
+        fresh_since = datetime.now() - timedelta(days=max_age_days)
+        # Statuses turn yellow as backups age, without any write to the database
+        status_changed = db_manager.get_last_status_change(fresh_since, max_age_days * 86400)
+
+        return cached_response(
+            lambda: build_servers_response(query, fresh_since),
+            key_extra=(max_age_days,),
+            last_modified=status_changed
+        )
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+def build_servers_response(query, fresh_since):
+    """Body of /api/servers for parsed list arguments."""
+    total, servers = query_servers(fresh_since, query)
+    
+    formatted_servers = []
+    for server in servers:
+        formatted_servers.append({
+            'id': server[0],
+            'hostname': server[1],
+            'ip_address': server[2],
+            'detected_os': server[3],
+            'open_ports': server[4],
+            'last_scan': format_timestamp(server[5]),
+            'is_reachable': bool(server[6]),
+            'scan_time': format_timestamp(server[7]),
+            'backup_filename': server[8],
+            'backup_last_modified': format_timestamp(server[9]),
+            'backup_status': server[10],
+            'mac_address': server[11],
+            'last_full_scan': format_timestamp(server[12])
+        })
+    
+    return list_response('servers', total, formatted_servers, query)
+
+HISTORY_MAX_POINTS = 2000
+
+def parse_history_range(default_days=90):
+    """
+    Read start/end (ISO datetimes, default the last default_days days) from
+    the query string as epoch seconds. Raises ValueError with a message
+    suitable for a 400 response.
+    """
+    now = int(datetime.now().timestamp())
+    try:
+        end = int(datetime.fromisoformat(request.args['end']).timestamp()) if request.args.get('end') else now
+        start = (int(datetime.fromisoformat(request.args['start']).timestamp())
+                 if request.args.get('start') else end - default_days * 86400)
+    except ValueError:
+        raise ValueError('start and end must be ISO format datetimes')
+    if start > end:
+        raise ValueError('start must not be after end')
+    return start, end
+
+def parse_history_step(start, end):
+    """Read step (seconds between points, default one day) from the query string."""
+    try:
+        step = int(request.args.get('step', 86400))
+    except ValueError:
+        step = 0
+    if step <= 0:
+        raise ValueError('step must be a positive number of seconds')
+    if (end - start) // step + 1 > HISTORY_MAX_POINTS:
+        raise ValueError(f'At most {HISTORY_MAX_POINTS} points per request; use a larger step')
+    return step
+
+@app.route('/api/history/servers/<hostname>', methods=['GET'])
+def get_server_history(hostname):
+    """
+    Backup age trend of one server: its recorded state sampled every step
+    seconds between start and end, and until when it last had a fresh backup.
+    """
+    try:
+        start, end = parse_history_range()
+        step = parse_history_step(start, end)
+        max_age = get_max_age_days() * 86400
+        points = backup_age_series(db_manager, hostname, start, end, step, max_age)
+        for point in points:
+            point['time'] = format_timestamp(point['time'])
+            if point.get('backup_last_modified') is not None:
+                point['backup_last_modified'] = format_timestamp(point['backup_last_modified'])
+            if point.get('backup_age') is not None:
+                point['backup_age_days'] = round(point['backup_age'] / 86400, 2)
+        return jsonify({
+            'status': 'success',
+            'hostname': hostname,
+            'start': format_timestamp(start),
+            'end': format_timestamp(end),
+            'step': step,
+            'last_fresh_backup': format_timestamp(last_fresh_backup(db_manager, hostname, max_age)),
+            'points': points
+        }), 200
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/history/scans', methods=['GET'])
+def get_scan_history():
+    """Totals recorded at each backup status refresh between start and end."""
+    try:
+        start, end = parse_history_range()
+        snapshots = [
+            {
+                'recorded_at': format_timestamp(row[0]),
+                'servers': row[1],
+                'servers_with_backup': row[2],
+                'files': row[3],
+                'total_size': row[4],
+                'changes': row[5]
             }
-            server_data['backup_status'] = get_backup_status(server_data, formatted_files)
-            formatted_servers.append(server_data)
-        
-        # Sort by query parameter if provided
-        sort_by = request.args.get('sort')
-        if sort_by:
-            reverse = request.args.get('order', 'asc') == 'desc'
-            formatted_servers.sort(key=lambda x: x.get(sort_by, ''), reverse=reverse)
-        
+            for row in db_manager.get_scan_snapshots(start, end)
+        ]
         return jsonify({
             'status': 'success',
-            'count': len(formatted_servers),
-            'servers': formatted_servers
+            'count': len(snapshots),
+            'snapshots': snapshots
         }), 200
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': str(e)
         }), 500
 
+def run_directory_scan(progress):
+    """Job body for a directory scan."""
+    config_path = Path(__file__).parent / 'config.json'
+    scanner = DirectoryScanner(db_manager, str(config_path))
+    results = scanner.scan_directories(progress=progress)
+    
+    if not results:
+        raise RuntimeError('No files found during scan')
+    total_files = sum(len(files) for files in results.values())
+    stats = scanner.stats
+    message = (
+        f'Directory scan completed successfully. Found {total_files} files '
+        f'({stats["added"]} added, {stats["changed"]} changed, '
+        f'{stats["removed"]} removed, {stats["unchanged"]} unchanged).'
+    )
+    # Roots walked only in part keep their previous files where they could not be listed
+    incomplete = [f'{directory} ({health["status"]})' for directory, health in scanner.health.items()
+                  if health['status'] != 'complete']
+    if incomplete:
+        message += f' Not fully scanned: {", ".join(incomplete)}.'
+    return {
+        'message': message,
+        'files': total_files,
+        'stats': stats,
+        'health': scanner.health
+    }
+
+def run_server_scan(progress, full=False):
+    """Job body for a server scan; full=True runs OS detection on every host."""
+    config_path = Path(__file__).parent / 'config.json'
+    with SubnetScanner(db_manager, str(config_path), full=full) as scanner:
+        results = scanner.scan_all_subnets(progress=progress)
+    
+    if not results:
+        raise RuntimeError('No servers found during scan')
+    stats = scanner.stats
+    return {
+        'message': (
+            f'Server scan completed successfully. Found {len(results)} servers '
+            f'({stats["full"]} fully scanned, {stats["probed"]} unchanged since their last full scan).'
+        ),
+        'servers': len(results),
+        'stats': stats,
+        'dns': dict(scanner.resolver.stats, hit_rate=scanner.resolver.hit_rate)
+    }
+
+def start_scan_job(kind, run, params=None):
+    """Start a scan job, or attach to the identical one already running."""
+    try:
+        job, created = job_manager.submit(kind, params or {}, run)
+    except ScanJobConflict as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 409
+    return jsonify({
+        'status': 'success',
+        'message': f'{kind.capitalize()} scan started.' if created
+                   else f'Attached to the {kind} scan already in progress.',
+        'job_id': job['id'],
+        'job': ScanJobManager.describe(job)
+    }), 202
+
 @app.route('/api/scan/directories', methods=['POST'])
 def scan_directories():
-    """Trigger a directory scan."""
+    """Start a directory scan in the background and return its job id."""
     try:
-        config_path = Path(__file__).parent / 'config.json'
-        scanner = DirectoryScanner(db_manager, str(config_path))
-        results = scanner.scan_directories()
-        
-        if results:
-            total_files = sum(len(files) for files in results.values())
-            return jsonify({
-                'status': 'success',
-                'message': f'Directory scan completed successfully. Found {total_files} files.'
-            }), 200
-        else:
-            return jsonify({
-                'status': 'error',
-                'message': 'No files found during scan'
-            }), 500
+        return start_scan_job('directories', run_directory_scan)
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -176,35 +653,244 @@ def scan_directories():
 
 @app.route('/api/scan/servers', methods=['POST'])
 def scan_servers():
-    """Trigger a server scan."""
+    """Start a server scan in the background and return its job id."""
     try:
-        # Check for root privileges
-        if os.geteuid() != 0:
+        # Check for root privileges if the configured engine needs raw sockets
+        try:
+            engine = get_engine_class(load_config().get('server_scan', {}))
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 500
+        if engine.requires_root and os.geteuid() != 0:
             return jsonify({
                 'status': 'error',
                 'message': 'Server scanning requires root privileges. Please run the Flask app with sudo.'
             }), 500
-            
-        config_path = Path(__file__).parent / 'config.json'
-        scanner = SubnetScanner(db_manager, str(config_path))
-        results = scanner.scan_all_subnets()
-        
-        if results:
+
+        # ?full=true (or {"full": true}) skips the fingerprint check and rescans every host fully
+        body = request.get_json(silent=True) or {}
+        full = parse_bool(request.args.get('full', str(body.get('full', False))))
+        if full:
+            return start_scan_job('servers', lambda progress: run_server_scan(progress, full=True),
+                                  {'full': True})
+        return start_scan_job('servers', run_server_scan)
+    except ValueError:
+        return jsonify({
+            'status': 'error',
+            'message': 'full must be true or false'
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/scan/jobs', methods=['GET'])
+def list_scan_jobs():
+    """List the most recent scan jobs."""
+    try:
+        return jsonify({
+            'status': 'success',
+            'jobs': job_manager.list_jobs()
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/scan/jobs/<job_id>', methods=['GET'])
+def get_scan_job(job_id):
+    """Report a scan job's status, phase, progress, rate and ETA."""
+    try:
+        job = job_manager.get_job(job_id)
+        if job is None:
             return jsonify({
-                'status': 'success',
-                'message': f'Server scan completed successfully. Found {len(results)} servers.'
-            }), 200
-        else:
+                'status': 'error',
+                'message': f'Unknown job: {job_id}'
+            }), 404
+        return jsonify({
+            'status': 'success',
+            'job': job
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+def get_agent_settings():
+    return {**AGENT_DEFAULTS, **load_config().get('agents', {})}
+
+def check_agent_request(settings):
+    """
+    An error response if agents are disabled or the request lacks the
+    configured token, else None. Without a token anyone who can reach the
+    API could report fake backups, so no agent is accepted until one is set.
+    """
+    if not settings['enabled']:
+        return jsonify({
+            'status': 'error',
+            'message': 'Agent ingestion is disabled'
+        }), 404
+    token = settings['token']
+    if not token:
+        return jsonify({
+            'status': 'error',
+            'message': 'Agent ingestion requires agents.token to be set in config.json'
+        }), 403
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({
+            'status': 'error',
+            'message': 'Missing or invalid agent token'
+        }), 401
+    return None
+
+def agent_scanner():
+    return DirectoryScanner(db_manager, str(Path(__file__).parent / 'config.json'), incremental=True)
+
+@app.route('/api/agents/<agent>/manifests', methods=['POST'])
+def post_agent_manifest(agent):
+    """
+    Apply a manifest chunk from a remote scan agent (scan_dirs/agent.py):
+    NDJSON, optionally gzip-compressed (Content-Encoding: gzip), read as it
+    arrives. Chunks are idempotent, so agents retry failed ones as they are.
+    """
+    settings = get_agent_settings()
+    error = check_agent_request(settings)
+    if error is not None:
+        return error
+    try:
+        stream = request.stream
+        encoding = request.headers.get('Content-Encoding', 'identity').lower()
+        if encoding == 'gzip':
+            stream = gzip.GzipFile(fileobj=stream, mode='rb')
+        elif encoding != 'identity':
             return jsonify({
                 'status': 'error',
-                'message': 'No servers found during scan'
-            }), 500
+                'message': f'Unsupported Content-Encoding: {encoding}'
+            }), 415
+        result = ingest_manifest(agent_scanner(), agent, stream, settings['max_chunk_files'])
+        return jsonify({
+            'status': 'success',
+            'agent': agent,
+            **result
+        }), 200
+    except AgentRootConflict as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 409
+    except (ValueError, EOFError, zlib.error, gzip.BadGzipFile) as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Invalid manifest: {e}'
+        }), 400
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': str(e)
         }), 500
 
+@app.route('/api/agents', methods=['GET'])
+def list_agent_roots():
+    """The roots remote agents report and the state of their manifests."""
+    try:
+        roots = [
+            {
+                **row,
+                **{key: format_timestamp(row[key]) for key in ('started_at', 'updated_at', 'completed_at')}
+            }
+            for row in db_manager.get_agent_roots()
+        ]
+        return jsonify({
+            'status': 'success',
+            'count': len(roots),
+            'roots': roots
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/agents/<agent>/roots', methods=['DELETE'])
+def delete_agent_root(agent):
+    """Stop accepting an agent's manifests for ?root= and remove the files it reported there."""
+    error = check_agent_request(get_agent_settings())
+    if error is not None:
+        return error
+    root = request.args.get('root')
+    if not root or not os.path.isabs(root):
+        return jsonify({
+            'status': 'error',
+            'message': 'root must be an absolute path'
+        }), 400
+    try:
+        removed = release_root(agent_scanner(), agent, root)
+        return jsonify({
+            'status': 'success',
+            'message': f'Released {root}; {removed} files removed.',
+            'removed': removed
+        }), 200
+    except KeyError:
+        return jsonify({
+            'status': 'error',
+            'message': f'Agent {agent} does not report {root}'
+        }), 404
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+def format_event(event, data):
+    """One Server-Sent Events message."""
+    return f'event: {event}\ndata: {json.dumps(data, default=str)}\n\n'
+
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """
+    Server-Sent Events stream of scan progress ('job' events) and data
+    changes ('generation' events), starting with the current state. Works
+    whichever worker runs the scan; streams are closed after max_duration
+    seconds and the browser's EventSource reconnects on its own. Each open
+    stream holds a worker thread, so beyond max_subscribers per process the
+    request is refused with 503 and Retry-After.
+    """
+    broadcaster = event_broadcaster
+    settings = events_settings
+
+    stream = broadcaster.subscribe(heartbeat=settings['heartbeat'], max_duration=settings['max_duration'])
+    try:
+        # Subscribe now, while the request can still be refused
+        first = next(stream)
+    except TooManySubscribers as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 503, {'Retry-After': str(max(1, math.ceil(settings['retry'] / 1000)))}
+
+    def generate():
+        try:
+            yield f"retry: {int(settings['retry'])}\n\n"
+            yield format_event(*first)
+            for message in stream:
+                if message is None:
+                    yield ': keep-alive\n\n'
+                else:
+                    yield format_event(*message)
+        finally:
+            stream.close()
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Keep reverse proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/api/config', methods=['GET'])
 def get_config():
     """Get the current configuration."""
@@ -245,6 +931,13 @@ def update_config():
             print(f"  Filtered values: {filtered_values}")
             config[field] = filtered_values
         
+        # Keep settings the frontend does not edit (scanner tuning etc.)
+        try:
+            with open('config.json', 'r') as f:
+                config = {**json.load(f), **config}
+        except (OSError, ValueError):
+            pass
+        
         print("Final config to save:", json.dumps(config, indent=2))
         
         # Write the new configuration
@@ -257,6 +950,33 @@ def update_config():
         print(f"Error updating config: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Prometheus metrics summed over every process that flushed them (worker
+    processes and standalone scans), plus table row counts read now.
+    """
+    if not metrics_settings['enabled']:
+        return jsonify({
+            'status': 'error',
+            'message': 'Metrics are disabled'
+        }), 404
+    try:
+        # Include this process's latest changes without waiting for its flusher
+        REGISTRY.flush(db_manager)
+        counts = db_manager.count_rows(METRICS_TABLES)
+        body = render_metrics(db_manager.get_metric_samples(), {
+            ('backup_checker_table_rows', 'Rows per table at scrape time'): {
+                (('table', table),): count for table, count in counts.items()
+            }
+        })
+        return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint for Docker."""
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+from collections import deque
+from typing import Dict, Iterable, List, Set
+
+class BackupMatcher:
+    """
+    Matches backup filenames to servers in a single pass over the files.
+
+    A file belongs to a server when the server's lowercased hostname or IP
+    address occurs anywhere in the lowercased filename (the same substring
+    rule the API has always used). All identifiers are compiled into one
+    Aho-Corasick automaton, so each filename is read once no matter how
+    many servers there are. Build one matcher per set of servers and reuse
+    it for every lookup.
+    """
+
+    def __init__(self, servers: Iterable[Dict]):
+        self.servers = list(servers)
+
+        # Map each distinct identifier to the servers that use it
+        owners = {}
+        for index, server in enumerate(self.servers):
+            for identifier in (server.get('hostname'), server.get('ip_address')):
+                if identifier:
+                    owners.setdefault(identifier.lower(), set()).add(index)
+
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [frozenset()]
+        self._build(owners)
+
+    def _build(self, owners: Dict[str, Set[int]]):
+        """Build the trie, then the failure links and merged outputs breadth first."""
+        outputs = [set()]
+        for identifier, indexes in owners.items():
+            state = 0
+            for char in identifier:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    outputs.append(set())
+                    self._goto[state][char] = next_state
+                state = next_state
+            outputs[state].update(indexes)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                outputs[next_state] |= outputs[self._fail[next_state]]
+
+        self._output = [frozenset(output) for output in outputs]
+
+    def match(self, filename: str) -> Set[int]:
+        """Return the indexes of all servers whose hostname or IP occurs in filename."""
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        found = set()
+        state = 0
+        for char in filename.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+    def match_files(self, files: Iterable[Dict]) -> List[Dict]:
+        """
+        Match every file against every server in one pass over the files.
+        Returns one entry per server (in the order given to the constructor)
+        with the matching 'files' and the 'newest' match by last_modified.
+        """
+        matches = [{'files': [], 'newest': None} for _ in self.servers]
+        for file in files:
+            for index in self.match(file['filename']):
+                entry = matches[index]
+                entry['files'].append(file)
+                newest = entry['newest']
+                if newest is None or file['last_modified'] > newest['last_modified']:
+                    entry['newest'] = file
+        return matches
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import sys
+from pathlib import Path
+from typing import Dict
+
+# Add the parent directory to the Python path to import the database module
+sys.path.append(str(Path(__file__).parent.parent))
+from database.db_manager import DatabaseManager
+from backup_status.backup_matcher import BackupMatcher
+from backup_status.history import record_history
+
+def refresh_backup_status(db_manager: DatabaseManager, history: Dict = None) -> int:
+    """
+    Recompute the newest matching backup for every server and store it in
+    server_backup_status, then record the result in the history (history
+    is the "history" section of config.json). Called by the scanners after
+    they change files or servers. Returns the number of servers that have
+    at least one backup.
+    """
+    servers = [
+        {'id': row[0], 'hostname': row[1], 'ip_address': row[2]}
+        for row in db_manager.get_all_servers()
+    ]
+    matcher = BackupMatcher(servers)
+    newest = [None] * len(servers)
+    counts = [0] * len(servers)
+
+    for file in db_manager.iter_scanned_files():
+        for index in matcher.match(file[1]):
+            counts[index] += 1
+            if newest[index] is None or file[3] > newest[index][3]:
+                newest[index] = file
+
+    db_manager.replace_backup_status([
+        (server['id'], file[1], file[2], file[3], count)
+        for server, file, count in zip(servers, newest, counts)
+        if file is not None
+    ])
+    record_history(db_manager, history)
+    return sum(1 for file in newest if file is not None)
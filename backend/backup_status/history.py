@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Add the parent directory to the Python path to import the database module
+sys.path.append(str(Path(__file__).parent.parent))
+from database.db_manager import DatabaseManager
+
+DAY = 86400
+WEEK = 7 * DAY
+
+# History settings; override any of them with the "history" section of config.json
+DEFAULT_SETTINGS = {
+    'enabled': True,
+    'raw_days': 30,           # keep every recorded change this long
+    'daily_days': 365,        # then one state per day until this age, one per week after
+    'max_days': None,         # drop history older than this (None keeps it forever)
+    'vacuum_threshold': 0.25  # VACUUM once this fraction of the database is free pages
+}
+
+def apply_retention(db_manager: DatabaseManager, settings: Dict = None, now: int = None) -> Dict:
+    """
+    Downsample and expire history according to settings. Tiers are aligned to
+    whole days and weeks, and each run only reads rows that crossed into a
+    tier since the previous run. Returns counts of deleted rows per tier and
+    whether the database was vacuumed.
+    """
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    now = int(time.time()) if now is None else now
+    stats = {'daily': 0, 'weekly': 0, 'expired': 0, 'vacuumed': False}
+
+    daily_cutoff = (now - settings['raw_days'] * DAY) // DAY * DAY
+    stats['daily'] = db_manager.downsample_history('daily', daily_cutoff, DAY)
+    weekly_cutoff = (now - settings['daily_days'] * DAY) // WEEK * WEEK
+    stats['weekly'] = db_manager.downsample_history('weekly', weekly_cutoff, WEEK)
+    if settings['max_days'] is not None:
+        stats['expired'] = db_manager.expire_history(now - settings['max_days'] * DAY)
+
+    if settings['vacuum_threshold'] is not None and any(stats[tier] for tier in ('daily', 'weekly', 'expired')):
+        stats['vacuumed'] = db_manager.compact(settings['vacuum_threshold'])
+    return stats
+
+def record_history(db_manager: DatabaseManager, settings: Dict = None, now: int = None) -> int:
+    """
+    Record the current backup state of every server and apply the retention
+    policy. Returns the number of servers whose state changed.
+    """
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    if not settings['enabled']:
+        return 0
+    now = int(time.time()) if now is None else now
+    changes = db_manager.record_history(now)
+    apply_retention(db_manager, settings, now)
+    return changes
+
+def backup_age_series(db_manager: DatabaseManager, hostname: str, start: int, end: int,
+                      step: int, max_age: int) -> List[Dict]:
+    """
+    Sample a server's recorded state every step seconds from start to end.
+    Each point has the backup in effect at that time, its age in seconds
+    and its status under max_age; points before the first record, or while
+    the host was gone, have state None.
+    """
+    rows = db_manager.get_server_history(hostname, start, end)
+    points = []
+    index = -1
+    for at in range(start, end + 1, step):
+        while index + 1 < len(rows) and rows[index + 1][0] <= at:
+            index += 1
+        row = rows[index] if index >= 0 else None
+        point = {'time': at, 'state': None}
+        if row is not None and row[1]:
+            _, _, ip_address, is_reachable, backup_filepath, backup_last_modified, match_count = row
+            age = at - backup_last_modified if backup_last_modified is not None else None
+            point.update({
+                'state': 'present',
+                'ip_address': ip_address,
+                'is_reachable': bool(is_reachable),
+                'backup_filepath': backup_filepath,
+                'backup_last_modified': backup_last_modified,
+                'backup_age': age,
+                'match_count': match_count,
+                'backup_status': 'red' if age is None else 'green' if age <= max_age else 'yellow'
+            })
+        elif row is not None:
+            point['state'] = 'removed'
+        points.append(point)
+    return points
+
+def last_fresh_backup(db_manager: DatabaseManager, hostname: str, max_age: int,
+                      now: int = None) -> Optional[int]:
+    """
+    Until when the server last had a fresh (green) backup: the newest backup
+    ever recorded plus max_age, or now if it is still fresh. None if no
+    backup was ever recorded.
+    """
+    newest = db_manager.get_newest_recorded_backup(hostname)
+    if newest is None:
+        return None
+    now = int(time.time()) if now is None else now
+    return min(newest + max_age, now)
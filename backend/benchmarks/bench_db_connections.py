@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Compare API-style read latency while a scan is writing, with the old
+connection-per-call/rollback-journal setup versus reused connections
+with WAL and tuned pragmas.
+
+    python3 benchmarks/bench_db_connections.py --files 50000 --readers 8 --duration 10
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from datetime import datetime, timedelta
+
+# Add the parent directory to the Python path to import the database module
+sys.path.append(str(Path(__file__).parent.parent))
+from database.db_manager import DatabaseManager
+
+MODES = {
+    # What every DatabaseManager call did before connection management existed
+    'legacy': {
+        'reuse_connections': False,
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+        'retries': 0
+    },
+    'tuned': {}
+}
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+def seed(db_manager, files, servers):
+    now = datetime.now()
+    with db_manager.bulk_writer(batch_size=10000) as writer:
+        for i in range(files):
+            writer.add('/nas01', f'host{i % servers}_10.0.{i % 250}.{i % 200}.tar.gz',
+                       f'/nas01/dir{i % 100}/host{i}.tar.gz', now - timedelta(hours=i), i, i, i)
+    for i in range(servers):
+        db_manager.update_server(f'host{i}', {'ip_address': f'10.0.{i // 250}.{i % 250}',
+                                              'is_reachable': True, 'last_scan': now})
+
+def run_mode(name, settings, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        db_manager = DatabaseManager(db_path, settings=settings)
+        seed(db_manager, args.files, args.servers)
+        stop = threading.Event()
+        latencies = []
+        errors = [0]
+        writes = [0]
+        lock = threading.Lock()
+
+        def reader(index):
+            local = []
+            fresh_since = datetime.now() - timedelta(days=365)
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    if index % 2:
+                        db_manager.query_servers(fresh_since, sort='hostname', limit=50)
+                    else:
+                        db_manager.query_scanned_files(sort='last_modified', order='desc', limit=50)
+                    local.append((time.perf_counter() - start) * 1000)
+                except Exception:
+                    with lock:
+                        errors[0] += 1
+            with lock:
+                latencies.extend(local)
+
+        def writer():
+            # A scan rewriting batches of rows as fast as it can
+            i = 0
+            while not stop.is_set():
+                with db_manager.bulk_writer(batch_size=args.batch) as bulk:
+                    for _ in range(args.batch):
+                        path = f'/nas01/dir{i % 100}/host{i % args.files}.tar.gz'
+                        bulk.update('/nas01', path, datetime.now(), i, i, i)
+                        i += 1
+                writes[0] += args.batch
+
+        threads = [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+        threads.append(threading.Thread(target=writer))
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        return {
+            'mode': name,
+            'queries': len(latencies),
+            'errors': errors[0],
+            'rows_written': writes[0],
+            'qps': round(len(latencies) / args.duration, 1),
+            'p50_ms': round(percentile(latencies, 50), 3) if latencies else None,
+            'p95_ms': round(percentile(latencies, 95), 3) if latencies else None,
+            'p99_ms': round(percentile(latencies, 99), 3) if latencies else None,
+            'max_ms': round(max(latencies), 3) if latencies else None
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=20000)
+    parser.add_argument('--servers', type=int, default=500)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--batch', type=int, default=2000, help='rows per writer transaction')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per mode')
+    parser.add_argument('--modes', default=','.join(MODES))
+    args = parser.parse_args()
+
+    results = [run_mode(name, MODES[name], args) for name in args.modes.split(',')]
+    print(json.dumps({'benchmark': 'db_connections', 'args': vars(args), 'results': results}, indent=2))
+
+if __name__ == '__main__':
+    main()
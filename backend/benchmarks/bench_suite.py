@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite over synthetic backup trees and server inventories.
+
+For each size it measures DB ingest rate, DirectoryScanner throughput (a
+full scan, then an incremental rescan of the unchanged tree) and the
+latency and memory of /api/files and /api/servers through Flask's test
+client, with the response cache off, on, and for conditional requests.
+Results are written as JSON; --compare checks them against an earlier
+run and exits with status 1 if any metric regressed beyond --tolerance.
+
+    python3 benchmarks/bench_suite.py --sizes 10k,100k --output results.json
+    python3 benchmarks/bench_suite.py --sizes 10k --compare results.json
+
+Trees are generated under --workdir (a temporary directory by default)
+and reused by later runs with the same workdir, size and seed.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from pathlib import Path
+from datetime import datetime
+from unittest import mock
+
+# Add the parent directory to the Python path to import the backend modules
+sys.path.append(str(Path(__file__).parent.parent))
+import app as app_module
+from database.db_manager import DatabaseManager
+from scan_dirs.scan_dirs import DirectoryScanner
+
+try:
+    from .synthetic import generate_inventory, generate_tree, iter_backup_files, parse_count
+except ImportError:
+    # Run as a script: this directory is already on the Python path
+    from synthetic import generate_inventory, generate_tree, iter_backup_files, parse_count
+
+BACKEND_DIR = Path(__file__).parent.parent
+
+# Requests timed against each size; {hostname} is a host of the inventory
+API_REQUESTS = [
+    ('files.page', '/api/files?limit=50&sort=last_modified&order=desc'),
+    ('files.filter', '/api/files?filename={hostname}&limit=50'),
+    ('files.ndjson', '/api/files?format=ndjson'),
+    ('servers.page', '/api/servers?limit=50&sort=hostname'),
+    ('servers.all', '/api/servers')
+]
+
+def servers_for(files: int) -> int:
+    """Inventory size for a tree: one server per 50 files, at least 100."""
+    return max(100, files // 50)
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+def latency_metrics(seconds, prefix=''):
+    milliseconds = [value * 1000 for value in seconds]
+    return {
+        f'{prefix}p50_ms': round(percentile(milliseconds, 50), 3),
+        f'{prefix}p95_ms': round(percentile(milliseconds, 95), 3),
+        f'{prefix}max_ms': round(max(milliseconds), 3)
+    }
+
+def reset_peak_rss() -> bool:
+    """Reset the process's peak resident set size (Linux only); False if unsupported."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    """Peak resident set size since the last reset, in MiB, or None if unknown."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+def timed(func):
+    """Run func with the peak RSS reset; returns (result, seconds, peak RSS in MiB)."""
+    reset = reset_peak_rss()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    return result, seconds, peak_rss_mb() if reset else None
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_inventory(db_manager: DatabaseManager, inventory):
+    now = datetime.now()
+    for server in inventory:
+        db_manager.update_server(server['hostname'], {**server, 'last_scan': now, 'last_full_scan': now})
+
+def bench_ingest(workdir, label, files, inventory, seed):
+    """Rows per second written through BulkFileWriter, without touching the filesystem."""
+    db_manager = DatabaseManager(os.path.join(workdir, f'ingest-{label}.db'))
+    try:
+        def ingest():
+            with db_manager.bulk_writer() as writer:
+                for relpath, size, mtime in iter_backup_files(files, inventory, seed):
+                    writer.add('/nas01/', os.path.basename(relpath), '/nas01/' + relpath,
+                               datetime.fromtimestamp(mtime), size, 0, int(mtime * 1e9))
+        _, seconds, rss = timed(ingest)
+        _, server_seconds, _ = timed(lambda: load_inventory(db_manager, inventory))
+        return [
+            {'name': 'ingest.files', 'size': label, 'metrics': {
+                'rows': files, 'seconds': round(seconds, 3),
+                'rows_per_second': round(files / seconds, 1), 'peak_rss_mb': rss
+            }},
+            {'name': 'ingest.servers', 'size': label, 'metrics': {
+                'rows': len(inventory), 'seconds': round(server_seconds, 3),
+                'rows_per_second': round(len(inventory) / server_seconds, 1)
+            }}
+        ]
+    finally:
+        db_manager.close()
+        for suffix in ('', '-wal', '-shm'):
+            path = os.path.join(workdir, f'ingest-{label}.db{suffix}')
+            if os.path.exists(path):
+                os.remove(path)
+
+def bench_scan(db_manager, config_path, label, files):
+    """DirectoryScanner throughput for the first scan and an incremental rescan of the same tree."""
+    results = []
+    for name, incremental in (('scan.full', False), ('scan.incremental', True)):
+        scanner = DirectoryScanner(db_manager, config_path, incremental=incremental)
+        _, seconds, rss = timed(scanner.scan_directories)
+        results.append({'name': name, 'size': label, 'metrics': {
+            'files': files, 'seconds': round(seconds, 3),
+            'files_per_second': round(files / seconds, 1), 'peak_rss_mb': rss, **scanner.stats
+        }})
+    return results
+
+def bench_api(db_manager, config, label, hostname, repeat):
+    """Latency, body size and peak Python allocations of each API request."""
+    client = app_module.app.test_client()
+    results = []
+    for name, template in API_REQUESTS:
+        path = template.format(hostname=hostname)
+        metrics = {}
+
+        def get(headers=None):
+            response = client.get(path, headers=headers or {})
+            body = response.get_data()
+            if response.status_code not in (200, 304):
+                raise RuntimeError(f'{path} answered {response.status_code}')
+            return response, body
+
+        def run(headers=None):
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                get(headers)
+                times.append(time.perf_counter() - start)
+            return times
+
+        uncached = {**config, 'response_cache': {'enabled': False}}
+        with mock.patch.object(app_module, 'load_config', return_value=uncached):
+            metrics.update(latency_metrics(run()))
+            tracemalloc.start()
+            _, body = get()
+            metrics['peak_alloc_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+            tracemalloc.stop()
+            metrics['bytes'] = len(body)
+
+        cached = {**config, 'response_cache': {'enabled': True}}
+        with mock.patch.object(app_module, 'load_config', return_value=cached):
+            response, _ = get()
+            metrics.update(latency_metrics(run(), 'cached_'))
+            metrics.update(latency_metrics(run({'If-None-Match': response.headers['ETag']}), 'not_modified_'))
+        results.append({'name': f'api.{name}', 'size': label, 'metrics': metrics})
+    return results
+
+def bench_size(workdir, label, files, args):
+    inventory = generate_inventory(servers_for(files), args.seed)
+    root = os.path.join(workdir, f'tree-{label}', '')
+    start = time.perf_counter()
+    if generate_tree(root, files, inventory, args.seed):
+        print(f'Generated {files} files in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+
+    results = bench_ingest(workdir, label, files, inventory, args.seed)
+
+    with open(BACKEND_DIR / 'config.json') as f:
+        config = json.load(f)
+    config['directories_to_scan'] = [root]
+    config_path = os.path.join(workdir, f'config-{label}.json')
+    with open(config_path, 'w') as f:
+        json.dump(config, f)
+
+    db_path = os.path.join(workdir, f'scan-{label}.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    db_manager = DatabaseManager(db_path)
+    try:
+        load_inventory(db_manager, inventory)
+        results += bench_scan(db_manager, config_path, label, files)
+        with mock.patch.object(app_module, 'db_manager', db_manager):
+            results += bench_api(db_manager, config, label, inventory[0]['hostname'], args.repeat)
+    finally:
+        db_manager.close()
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Compare metrics with the same name and size in a baseline run. Rates
+    (_per_second) should not drop, p50/p95 latencies and memory (_mb) should
+    not grow, by more than tolerance; maximum latencies are too noisy to
+    judge. Returns a list of regression descriptions.
+    """
+    previous = {(result['name'], result['size']): result['metrics'] for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get((result['name'], result['size']))
+        if old is None:
+            continue
+        for metric, value in result['metrics'].items():
+            before = old.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(before, (int, float)) or before <= 0:
+                continue
+            if metric.endswith('_per_second'):
+                change = (before - value) / before
+            elif metric.endswith(('p50_ms', 'p95_ms', '_mb')):
+                change = (value - before) / before
+            else:
+                continue
+            if change > tolerance:
+                regressions.append(f"{result['name']} [{result['size']}] {metric}: {before} -> {value}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10k,100k,1M', help='comma-separated file counts (10k, 100k, 1M, ...)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=20, help='timed repetitions per API request')
+    parser.add_argument('--workdir', help='where trees and databases live (kept, so trees are reused)')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    parser.add_argument('--compare', help='JSON results of an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown')
+    args = parser.parse_args()
+
+    started_at = datetime.now()
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+        results = []
+        for label in args.sizes.split(','):
+            label = label.strip()
+            print(f'Benchmarking {label} files...', file=sys.stderr)
+            results += bench_size(workdir, label, parse_count(label), args)
+
+    report = {
+        'benchmark': 'suite',
+        'started_at': started_at.isoformat(),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': vars(args),
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'Regression: {regression}', file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Deterministic synthetic data for benchmarks: server inventories and NAS
+backup trees named like the ones under example/, with hostnames and IP
+addresses embedded in the filenames.
+
+    python3 benchmarks/synthetic.py /tmp/nas --files 100000 --servers 2000
+"""
+
+import os
+import json
+import zlib
+import random
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Tuple
+
+# Hostname prefixes, detected OS names and open port lists the inventory draws from
+HOST_PREFIXES = ['ub', 'rhel', 'docker', 'checkmk', 'tnas', 'tokei', 'test-san', 'web', 'db', 'k8s-node']
+OS_NAMES = ['Linux 5.15', 'Linux 4.18', 'Microsoft Windows Server 2019', 'FreeBSD 13.1', None]
+PORT_SETS = ['22', '22,80,443', '22,5432', '3389,445', '22,2049,111', '']
+
+# Backup directory, then a filename pattern for a host, its IP, a version index and the backup date
+CATEGORIES = [
+    ('Acronis', '{host}_{ip}_sda_{tb}TB_{date}.tib'),
+    ('DD', '{host}_{ip}_sda_{tb}TB_{date}.dd'),
+    ('Ghost', '{host}_{ip}_{date}.gho'),
+    ('Tar', '{host}_{ip}_rhel94_{date}.tar.gz'),
+    ('NetApp', '{host}-{ip}-{date}.txt'),
+    ('Time', '{host}_{ip}_{date}.cfg'),
+    ('TrueNAS', '{host}_{ip}_notes_{date}.cfg')
+]
+
+def parse_count(value: str) -> int:
+    """Parse counts like 10000, 10k or 1M."""
+    value = value.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    return int(float(value[:-1] if multiplier > 1 else value) * multiplier)
+
+def generate_inventory(servers: int, seed: int = 0) -> List[Dict]:
+    """
+    A server inventory as the subnet scan would store it: unique hostnames
+    (a prefix plus a zero-padded number) and unique addresses in 10.0.0.0/8.
+    """
+    rng = random.Random(seed)
+    addresses = rng.sample(range(1, 2 ** 24 - 1), servers)
+    width = len(str(servers))
+    inventory = []
+    for i, address in enumerate(addresses):
+        inventory.append({
+            'hostname': f'{HOST_PREFIXES[i % len(HOST_PREFIXES)]}{i:0{width}d}',
+            'ip_address': f'10.{address >> 16}.{(address >> 8) & 255}.{address & 255}',
+            'detected_os': rng.choice(OS_NAMES),
+            'open_ports': rng.choice(PORT_SETS),
+            'is_reachable': rng.random() < 0.9
+        })
+    return inventory
+
+def _stable_index(value: str, modulo: int) -> int:
+    """Bucket value the same way in every process (hash() is salted per process)."""
+    return zlib.crc32(value.encode()) % modulo
+
+def iter_backup_files(files: int, inventory: List[Dict], seed: int = 0, backed_up: float = 0.8,
+                      orphans: float = 0.05, max_age_days: int = 400,
+                      now: datetime = None) -> Iterator[Tuple[str, int, float]]:
+    """
+    Yield (relative path, size, mtime) for `files` backup files. About
+    `backed_up` of the inventory has backups, spread over the categories,
+    and `orphans` of the files belong to hosts that are not in the inventory.
+    Each host's files live in their own directory under the category.
+    """
+    rng = random.Random(seed)
+    now = now or datetime.now()
+    hosts = [server for server in inventory if rng.random() < backed_up] or inventory
+    for i in range(files):
+        if not hosts or rng.random() < orphans:
+            host = {'hostname': f'old{i:07d}', 'ip_address': f'192.168.{(i >> 8) & 255}.{i & 255}'}
+        else:
+            host = hosts[i % len(hosts)]
+        category, pattern = CATEGORIES[_stable_index(host['hostname'], len(CATEGORIES))]
+        modified = now - timedelta(seconds=rng.randrange(max_age_days * 86400))
+        name = pattern.format(
+            host=host['hostname'], ip=host['ip_address'], tb=rng.choice((1, 2, 6, 19)),
+            date=f'{modified:%Y%m%d}_{i}'
+        )
+        # Log-uniform sizes between 1 MiB and 512 GiB; files are sparse, so they cost no space
+        size = int(2 ** rng.uniform(20, 39))
+        yield os.path.join(category, host['hostname'], name), size, modified.timestamp()
+
+def generate_tree(root: str, files: int, inventory: List[Dict], seed: int = 0, **options) -> bool:
+    """
+    Create a backup tree of `files` sparse files under root. A marker file
+    next to root records the parameters, so an identical tree is reused
+    rather than recreated; returns whether the tree was (re)generated.
+    """
+    marker = os.path.normpath(root) + '.synthetic.json'
+    params = {'files': files, 'servers': len(inventory), 'seed': seed, **options}
+    try:
+        with open(marker) as f:
+            if json.load(f) == params:
+                return False
+    except (OSError, ValueError):
+        pass
+
+    if os.path.isdir(root) and os.listdir(root):
+        raise ValueError(f'{root} is not empty and holds no matching synthetic tree')
+    os.makedirs(root, exist_ok=True)
+    made = set()
+    for relpath, size, mtime in iter_backup_files(files, inventory, seed, **options):
+        path = os.path.join(root, relpath)
+        parent = os.path.dirname(path)
+        if parent not in made:
+            os.makedirs(parent, exist_ok=True)
+            made.add(parent)
+        with open(path, 'wb') as f:
+            f.truncate(size)
+        os.utime(path, (mtime, mtime))
+    with open(marker, 'w') as f:
+        json.dump(params, f)
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root')
+    parser.add_argument('--files', type=parse_count, default=10000)
+    parser.add_argument('--servers', type=parse_count, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--inventory', help='also write the inventory to this JSON file')
+    args = parser.parse_args()
+
+    inventory = generate_inventory(args.servers, args.seed)
+    generated = generate_tree(args.root, args.files, inventory, args.seed)
+    if args.inventory:
+        with open(args.inventory, 'w') as f:
+            json.dump(inventory, f, indent=2)
+    print(f"{'Generated' if generated else 'Reused'} {args.files} files for {args.servers} servers in {args.root}")
+
+if __name__ == '__main__':
+    main()
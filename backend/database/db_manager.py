@@ -1,17 +1,108 @@
 import sqlite3
 import os
+import sys
+import time
+import threading
+import functools
+import itertools
 from datetime import datetime
-from typing import List, Tuple, Optional, Dict
+from typing import List, Tuple, Optional, Dict, Iterator, Iterable
 from pathlib import Path
 
+try:
+    from .migrations import migrate, get_version
+except ImportError:
+    from migrations import migrate, get_version
+
+# Add the parent directory to the Python path to import the metrics module
+sys.path.append(str(Path(__file__).parent.parent))
+from metrics.metrics import Counter, Histogram
+
+DB_CALL_SECONDS = Histogram(
+    'backup_checker_db_call_seconds', 'Duration of DatabaseManager calls, including busy retries', ['method']
+)
+DB_BUSY_RETRIES = Counter(
+    'backup_checker_db_busy_retries_total', 'DatabaseManager calls retried because the database was busy', ['method']
+)
+SCAN_WRITE_SECONDS = Histogram(
+    'backup_checker_scan_db_write_seconds', 'Duration of each batched scan write transaction'
+)
+SCAN_ROWS_WRITTEN = Counter(
+    'backup_checker_scan_db_rows_written_total', 'File rows added, changed or removed by batched scan writes'
+)
+
+def to_epoch(value) -> Optional[int]:
+    """
+    Timestamps are stored as integer seconds since the epoch. Accepts a
+    datetime (naive values are local time), a number or None.
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value)
+
+def retry_on_busy(method):
+    """
+    Retry a DatabaseManager method when SQLite reports the database as
+    locked or busy even after busy_timeout, backing off exponentially. Call
+    durations and retries are recorded per method.
+    """
+    seconds = DB_CALL_SECONDS.labels(method.__name__)
+    retries = DB_BUSY_RETRIES.labels(method.__name__)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        attempts = self.settings['retries']
+        start = time.perf_counter()
+        try:
+            for attempt in range(attempts + 1):
+                try:
+                    return method(self, *args, **kwargs)
+                except sqlite3.OperationalError as e:
+                    message = str(e).lower()
+                    if attempt == attempts or ('locked' not in message and 'busy' not in message):
+                        raise
+                    retries.inc()
+                    time.sleep(self.settings['retry_backoff'] * (2 ** attempt))
+        finally:
+            seconds.observe(time.perf_counter() - start)
+    return wrapper
+
+def bump_generation(cursor: sqlite3.Cursor):
+    """
+    Advance the data generation inside the caller's transaction. Every write
+    that changes what the API returns calls this, so cached responses of
+    the previous generation stop being served as soon as it commits.
+    """
+    cursor.execute(
+        'UPDATE data_generation SET generation = generation + 1, changed_at = ? WHERE id = 1',
+        (int(time.time()),)
+    )
+
 class DatabaseManager:
-    def __init__(self, db_path: str = None):
+    # Connection settings; override any of them with the "database" section of config.json
+    DEFAULT_SETTINGS = {
+        'reuse_connections': True,  # one connection per thread instead of one per call
+        'journal_mode': 'WAL',      # readers do not block behind scan writes
+        'synchronous': 'NORMAL',    # safe with WAL, fsyncs only at checkpoints
+        'cache_size': -65536,       # negative means KiB: 64 MiB page cache
+        'mmap_size': 268435456,     # 256 MiB memory-mapped I/O
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,       # ms to wait on a lock before SQLITE_BUSY
+        'retries': 3,               # retry_on_busy attempts after that
+        'retry_backoff': 0.05       # seconds, doubled on every retry
+    }
+
+    def __init__(self, db_path: str = None, settings: Dict = None):
         if db_path is None:
             # Create database in the backend directory
             backend_dir = Path(__file__).parent.parent
             self.db_path = os.path.join(backend_dir, "backup_checker.db")
         else:
             self.db_path = db_path
+        self.settings = {**self.DEFAULT_SETTINGS, **(settings or {})}
+        self._local = threading.local()
 
         # Ensure the database directory exists and is writable
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
@@ -26,40 +117,65 @@ class DatabaseManager:
             print(f"Warning: Could not set database permissions: {e}")
             print(f"You might need to manually run: chmod 666 {self.db_path}")
 
+    def _new_connection(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        """Open a connection with the configured pragmas applied."""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.settings['busy_timeout'] / 1000,
+            check_same_thread=check_same_thread
+        )
+        conn.execute(f"PRAGMA journal_mode = {self.settings['journal_mode']}")
+        conn.execute(f"PRAGMA synchronous = {self.settings['synchronous']}")
+        conn.execute(f"PRAGMA cache_size = {int(self.settings['cache_size'])}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.settings['mmap_size'])}")
+        conn.execute(f"PRAGMA temp_store = {self.settings['temp_store']}")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.settings['busy_timeout'])}")
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Return this thread's connection, opening it on first use (or after a
+        fork). Use it as `with self._connect() as conn:` to commit on success
+        and roll back on error.
+        """
+        if not self.settings['reuse_connections']:
+            return self._new_connection()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._new_connection()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """Close the calling thread's reused connection, if any."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+
     def _init_db(self):
-        """Initialize the database with required tables if they don't exist."""
+        """Create the schema, or upgrade an existing database to the current version."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Create table for scanned files
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS scanned_files (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    filename TEXT NOT NULL,
-                    filepath TEXT NOT NULL,
-                    last_modified TIMESTAMP,
-                    size INTEGER,
-                    scan_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Create table for scanned servers with additional nmap information
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS scanned_servers (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    hostname TEXT NOT NULL,
-                    ip_address TEXT,
-                    detected_os TEXT,
-                    open_ports TEXT,
-                    last_scan TIMESTAMP,
-                    is_reachable BOOLEAN,
-                    scan_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            conn.commit()
-            conn.close()
+            conn = self._new_connection()
+            try:
+                upgraded = get_version(conn) == 0 and conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scanned_servers'"
+                ).fetchone() is not None
+                migrate(conn)
+                # Databases from before server_backup_status have files and
+                # servers but no status: every server would show red until
+                # the next scan
+                backfill = upgraded and conn.execute('''
+                    SELECT NOT EXISTS (SELECT 1 FROM server_backup_status)
+                        AND EXISTS (SELECT 1 FROM scanned_files) AND EXISTS (SELECT 1 FROM scanned_servers)
+                ''').fetchone()[0]
+            finally:
+                conn.close()
+            if backfill:
+                # Imported here: backup_status imports this module
+                from backup_status.backup_status import refresh_backup_status
+                refresh_backup_status(self)
                 
         except sqlite3.Error as e:
             print(f"Database initialization error: {e}")
@@ -68,47 +184,365 @@ class DatabaseManager:
             print(f"File writable (if exists): {os.path.exists(self.db_path) and os.access(self.db_path, os.W_OK)}")
             raise
 
-    def clear_scanned_files(self):
-        """Remove all entries from the scanned_files table."""
+    @retry_on_busy
+    def clear_scanned_files(self, keep_roots: Iterable[str] = ()):
+        """Remove all entries from the scanned_files table, except the files indexed under keep_roots."""
+        keep_roots = list(keep_roots)
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
-                cursor.execute('DELETE FROM scanned_files')
+                if keep_roots:
+                    placeholders = ', '.join('?' * len(keep_roots))
+                    cursor.execute(f'''
+                        DELETE FROM scanned_files WHERE filepath NOT IN (
+                            SELECT filepath FROM file_index WHERE root IN ({placeholders}) AND removed_at IS NULL
+                        )
+                    ''', keep_roots)
+                    cursor.execute(f'DELETE FROM file_index WHERE root NOT IN ({placeholders})', keep_roots)
+                else:
+                    cursor.execute('DELETE FROM scanned_files')
+                    cursor.execute('DELETE FROM file_index')
+                bump_generation(cursor)
                 conn.commit()
         except sqlite3.Error as e:
             print(f"Error clearing scanned files: {e}")
             raise
 
+    @retry_on_busy
     def clear_scanned_servers(self):
         """Remove all entries from the scanned_servers table."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('DELETE FROM scanned_servers')
+                bump_generation(cursor)
                 conn.commit()
         except sqlite3.Error as e:
             print(f"Error clearing scanned servers: {e}")
             raise
 
+    @retry_on_busy
     def add_scanned_file(self, filename: str, filepath: str, last_modified: datetime, size: int) -> int:
         """Add a scanned file to the database."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT INTO scanned_files (filename, filepath, last_modified, size)
                     VALUES (?, ?, ?, ?)
-                ''', (filename, filepath, last_modified, size))
-                conn.commit()
-                return cursor.lastrowid
+                    ON CONFLICT (filepath) DO UPDATE SET
+                        filename = excluded.filename,
+                        last_modified = excluded.last_modified,
+                        size = excluded.size,
+                        scan_time = ?
+                ''', (filename, filepath, to_epoch(last_modified), size, int(time.time())))
+                bump_generation(cursor)
+                cursor.execute('SELECT id FROM scanned_files WHERE filepath = ?', (filepath,))
+                return cursor.fetchone()[0]
         except sqlite3.Error as e:
             print(f"Error adding scanned file: {e}")
             raise
 
+    @retry_on_busy
+    def has_file_index(self) -> bool:
+        """Return True if any live file_index rows exist."""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT 1 FROM file_index WHERE removed_at IS NULL LIMIT 1')
+                return cursor.fetchone() is not None
+        except sqlite3.Error as e:
+            print(f"Error checking file index: {e}")
+            raise
+
+    @retry_on_busy
+    def get_file_index(self, root: str) -> Dict[str, Tuple]:
+        """Return {filepath: (inode, size, mtime_ns)} for the live files under a scan root."""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT filepath, inode, size, mtime_ns FROM file_index
+                    WHERE root = ? AND removed_at IS NULL
+                ''', (root,))
+                return {row[0]: row[1:] for row in cursor}
+        except sqlite3.Error as e:
+            print(f"Error retrieving file index: {e}")
+            raise
+
+    @retry_on_busy
+    def get_file_index_under(self, directory: str) -> Dict[str, Tuple]:
+        """Return {filepath: (inode, size, mtime_ns)} for the live files anywhere below a directory."""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT filepath, inode, size, mtime_ns FROM file_index
+                    WHERE filepath >= ? AND filepath < ? AND removed_at IS NULL
+                ''', self._prefix_range(os.path.join(directory, '')))
+                return {row[0]: row[1:] for row in cursor}
+        except sqlite3.Error as e:
+            print(f"Error retrieving file index: {e}")
+            raise
+
+    @retry_on_busy
+    def get_file_index_entries(self, filepaths: Iterable[str]) -> Dict[str, Tuple]:
+        """Return {filepath: (inode, size, mtime_ns)} for those of the given files that are live in the index."""
+        filepaths = list(filepaths)
+        entries = {}
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                for start in range(0, len(filepaths), 500):
+                    chunk = filepaths[start:start + 500]
+                    cursor.execute(f'''
+                        SELECT filepath, inode, size, mtime_ns FROM file_index
+                        WHERE filepath IN ({','.join('?' * len(chunk))}) AND removed_at IS NULL
+                    ''', chunk)
+                    entries.update((row[0], row[1:]) for row in cursor)
+                return entries
+        except sqlite3.Error as e:
+            print(f"Error retrieving file index: {e}")
+            raise
+
+    @retry_on_busy
+    def get_indexed_roots(self) -> List[str]:
+        """Return the scan roots that still have live files in the index."""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT DISTINCT root FROM file_index WHERE removed_at IS NULL')
+                return [row[0] for row in cursor]
+        except sqlite3.Error as e:
+            print(f"Error retrieving indexed roots: {e}")
+            raise
+
+    @retry_on_busy
+    def get_file_index_between(self, root: str, after: str = None, through: str = None) -> Dict[str, Tuple]:
+        """
+        Return {filepath: (inode, size, mtime_ns)} for the live files of a scan
+        root whose paths sort after `after` and up to `through` (None: unbounded).
+        """
+        clauses, params = ['root = ?', 'removed_at IS NULL'], [root]
+        if after is not None:
+            clauses.append('filepath > ?')
+            params.append(after)
+        if through is not None:
+            clauses.append('filepath <= ?')
+            params.append(through)
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"SELECT filepath, inode, size, mtime_ns FROM file_index WHERE {' AND '.join(clauses)}",
+                    params
+                )
+                return {row[0]: row[1:] for row in cursor}
+        except sqlite3.Error as e:
+            print(f"Error retrieving file index: {e}")
+            raise
+
+    AGENT_ROOT_COLUMNS = (
+        'root', 'agent', 'scan_id', 'last_seq', 'changes', 'started_at', 'updated_at', 'completed_at'
+    )
+
+    @retry_on_busy
+    def claim_agent_root(self, agent: str, root: str, scan_id: str) -> str:
+        """
+        Make an agent the owner of a scan root unless another agent already is,
+        and start tracking scan_id as its manifest if it is a new one.
+        Returns the owning agent.
+        """
+        now = int(time.time())
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO agent_roots (root, agent, scan_id, last_seq, changes, started_at, updated_at)
+                    VALUES (?, ?, ?, -1, 0, ?, ?)
+                    ON CONFLICT (root) DO NOTHING
+                ''', (root, agent, scan_id, now, now))
+                cursor.execute('SELECT agent FROM agent_roots WHERE root = ?', (root,))
+                owner = cursor.fetchone()[0]
+                if owner == agent:
+                    cursor.execute('''
+                        UPDATE agent_roots
+                        SET scan_id = ?, last_seq = -1, changes = 0, started_at = ?, updated_at = ?
+                        WHERE root = ? AND scan_id != ?
+                    ''', (scan_id, now, now, root, scan_id))
+                conn.commit()
+                return owner
+        except sqlite3.Error as e:
+            print(f"Error claiming agent root: {e}")
+            raise
+
+    @retry_on_busy
+    def record_agent_chunk(self, root: str, scan_id: str, seq: int, changes: int, final: bool) -> int:
+        """
+        Record a manifest chunk applied to an agent's root; the final one
+        completes the manifest. Returns the rows the manifest's chunks have
+        changed so far.
+        """
+        now = int(time.time())
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE agent_roots
+                    SET last_seq = MAX(last_seq, ?), changes = changes + ?, updated_at = ?,
+                        completed_at = CASE WHEN ? THEN ? ELSE completed_at END
+                    WHERE root = ? AND scan_id = ?
+                ''', (seq, changes, now, final, now, root, scan_id))
+                cursor.execute('SELECT changes FROM agent_roots WHERE root = ? AND scan_id = ?', (root, scan_id))
+                row = cursor.fetchone()
+                conn.commit()
+                return row[0] if row else changes
+        except sqlite3.Error as e:
+            print(f"Error recording agent manifest chunk: {e}")
+            raise
+
+    @retry_on_busy
+    def get_agent_roots(self, agent: str = None) -> List[Dict]:
+        """Retrieve the scan roots remote agents report, optionally only one agent's."""
+        where, params = ('WHERE agent = ?', (agent,)) if agent is not None else ('', ())
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"SELECT {', '.join(self.AGENT_ROOT_COLUMNS)} FROM agent_roots {where} ORDER BY agent, root",
+                    params
+                )
+                return [dict(zip(self.AGENT_ROOT_COLUMNS, row)) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error retrieving agent roots: {e}")
+            raise
+
+    @retry_on_busy
+    def release_agent_root(self, root: str):
+        """Forget which agent owns a scan root."""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM agent_roots WHERE root = ?', (root,))
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error releasing agent root: {e}")
+            raise
+
+    SCAN_JOB_COLUMNS = (
+        'id', 'kind', 'params', 'status', 'phase', 'processed', 'total', 'message',
+        'result', 'owner_pid', 'created_at', 'started_at', 'updated_at', 'finished_at'
+    )
+
+    @retry_on_busy
+    def create_scan_job(self, job_id: str, kind: str, params: str, owner_pid: int):
+        """Insert a new running scan job."""
+        now = int(time.time())
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO scan_jobs (
+                        id, kind, params, status, phase, owner_pid,
+                        created_at, started_at, updated_at
+                    )
+                    VALUES (?, ?, ?, 'running', 'starting', ?, ?, ?, ?)
+                ''', (job_id, kind, params, owner_pid, now, now, now))
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error creating scan job: {e}")
+            raise
+
+    @retry_on_busy
+    def update_scan_job(self, job_id: str, **fields):
+        """Update the given columns of a scan job and stamp updated_at."""
+        unknown = set(fields) - set(self.SCAN_JOB_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown scan job columns: {', '.join(sorted(unknown))}")
+        fields['updated_at'] = int(time.time())
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f'UPDATE scan_jobs SET {assignments} WHERE id = ?',
+                    list(fields.values()) + [job_id]
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error updating scan job: {e}")
+            raise
+
+    @retry_on_busy
+    def get_scan_job(self, job_id: str) -> Optional[Dict]:
+        """Retrieve a scan job as a dict, or None if it does not exist."""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"SELECT {', '.join(self.SCAN_JOB_COLUMNS)} FROM scan_jobs WHERE id = ?",
+                    (job_id,)
+                )
+                row = cursor.fetchone()
+                return dict(zip(self.SCAN_JOB_COLUMNS, row)) if row else None
+        except sqlite3.Error as e:
+            print(f"Error retrieving scan job: {e}")
+            raise
+
+    @retry_on_busy
+    def get_scan_jobs(self, kind: str = None, active_only: bool = False, limit: int = 20) -> List[Dict]:
+        """Retrieve the most recent scan jobs, newest first."""
+        clauses, params = [], []
+        if kind is not None:
+            clauses.append('kind = ?')
+            params.append(kind)
+        if active_only:
+            clauses.append("status = 'running'")
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"SELECT {', '.join(self.SCAN_JOB_COLUMNS)} FROM scan_jobs{where} "
+                    f"ORDER BY created_at DESC LIMIT ?",
+                    params + [limit]
+                )
+                return [dict(zip(self.SCAN_JOB_COLUMNS, row)) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error retrieving scan jobs: {e}")
+            raise
+
+    @retry_on_busy
+    def count_indexed_files(self, roots: List[str]) -> int:
+        """Number of live files the file index holds for the given roots."""
+        if not roots:
+            return 0
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT COUNT(*) FROM file_index
+                    WHERE removed_at IS NULL AND root IN ({', '.join('?' * len(roots))})
+                ''', roots)
+                return cursor.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Error counting indexed files: {e}")
+            raise
+
+    def bulk_writer(self, batch_size: int = None, flush_interval: float = None) -> 'BulkFileWriter':
+        """Return a BulkFileWriter for ingesting many files in large transactions."""
+        return BulkFileWriter(
+            self._new_connection(),
+            batch_size=batch_size or BulkFileWriter.DEFAULT_BATCH_SIZE,
+            flush_interval=flush_interval or BulkFileWriter.DEFAULT_FLUSH_INTERVAL,
+            settings=self.settings
+        )
+
+    @retry_on_busy
     def get_all_scanned_files(self) -> List[Tuple]:
         """Retrieve all scanned files from the database."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT * FROM scanned_files')
                 return cursor.fetchall()
@@ -116,65 +550,916 @@ class DatabaseManager:
             print(f"Error retrieving scanned files: {e}")
             raise
 
+    def iter_scanned_files(self, batch_size: int = 10000) -> Iterator[Tuple]:
+        """Yield (id, filename, filepath, last_modified) for every scanned file without loading them all."""
+        try:
+            conn = self._new_connection()
+            cursor = conn.cursor()
+            cursor.execute('SELECT id, filename, filepath, last_modified FROM scanned_files')
+            yield from self._iter_cursor(conn, cursor, batch_size)
+        except sqlite3.Error as e:
+            print(f"Error retrieving scanned files: {e}")
+            raise
+
+    @retry_on_busy
+    def replace_backup_status(self, rows: List[Tuple]):
+        """
+        Replace the materialized backup status in one transaction. Each row is
+        (server_id, backup_filename, backup_filepath, backup_last_modified, match_count).
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM server_backup_status')
+                cursor.executemany('''
+                    INSERT INTO server_backup_status (
+                        server_id, backup_filename, backup_filepath,
+                        backup_last_modified, match_count
+                    )
+                    VALUES (?, ?, ?, ?, ?)
+                ''', rows)
+                bump_generation(cursor)
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error replacing backup status: {e}")
+            raise
+
+    HISTORY_COLUMNS = (
+        'present', 'ip_address', 'is_reachable', 'backup_filepath', 'backup_last_modified', 'match_count'
+    )
+
+    @retry_on_busy
+    def record_history(self, recorded_at: int) -> int:
+        """
+        Append the current backup state of every server to server_history,
+        writing a row only for servers whose state differs from their latest
+        row (servers that disappeared get a row with present = 0), plus one
+        scan_snapshots row of totals. Returns the number of changes recorded.
+        """
+        changed = ' OR '.join(f'h.{column} IS NOT c.{column}' for column in self.HISTORY_COLUMNS)
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DROP TABLE IF EXISTS temp.current_history')
+                cursor.execute('''
+                    CREATE TEMP TABLE current_history AS
+                    SELECT s.hostname, 1 AS present, s.ip_address, s.is_reachable,
+                           b.backup_filepath, b.backup_last_modified, b.match_count
+                    FROM scanned_servers s
+                    LEFT JOIN server_backup_status b ON b.server_id = s.id
+                ''')
+                # Hosts whose latest row says present but that are gone now
+                cursor.execute('''
+                    INSERT INTO current_history (hostname, present)
+                    SELECT h.hostname, 0 FROM server_history h
+                    WHERE h.present
+                      AND h.recorded_at = (
+                          SELECT MAX(recorded_at) FROM server_history WHERE hostname = h.hostname
+                      )
+                      AND h.hostname NOT IN (SELECT hostname FROM current_history)
+                ''')
+                # The latest row per host is found with an index seek on (hostname, recorded_at)
+                cursor.execute(f'''
+                    INSERT INTO server_history (hostname, recorded_at, {', '.join(self.HISTORY_COLUMNS)})
+                    SELECT c.hostname, ?, {', '.join('c.' + column for column in self.HISTORY_COLUMNS)}
+                    FROM current_history c
+                    LEFT JOIN server_history h ON h.hostname = c.hostname AND h.recorded_at = (
+                        SELECT MAX(recorded_at) FROM server_history WHERE hostname = c.hostname
+                    )
+                    WHERE h.id IS NULL OR {changed}
+                    ON CONFLICT (hostname, recorded_at) DO UPDATE SET
+                        {', '.join(f'{column} = excluded.{column}' for column in self.HISTORY_COLUMNS)}
+                ''', (recorded_at,))
+                changes = cursor.rowcount
+                cursor.execute('''
+                    INSERT OR REPLACE INTO scan_snapshots (
+                        recorded_at, servers, servers_with_backup, files, total_size, changes
+                    )
+                    SELECT ?,
+                           (SELECT COUNT(*) FROM current_history WHERE present),
+                           (SELECT COUNT(*) FROM current_history WHERE backup_filepath IS NOT NULL),
+                           COUNT(*), SUM(size), ?
+                    FROM scanned_files
+                ''', (recorded_at, changes))
+                cursor.execute('DROP TABLE temp.current_history')
+                if changes:
+                    bump_generation(cursor)
+                return changes
+        except sqlite3.Error as e:
+            print(f"Error recording history: {e}")
+            raise
+
+    @retry_on_busy
+    def get_server_history(self, hostname: str, start: int, end: int) -> List[Tuple]:
+        """
+        Return the history rows of a server recorded between start and end,
+        preceded by the row in effect at start if there is one. Rows are
+        (recorded_at, *HISTORY_COLUMNS), oldest first.
+        """
+        select = f"SELECT recorded_at, {', '.join(self.HISTORY_COLUMNS)} FROM server_history"
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT * FROM (
+                        {select} WHERE hostname = ? AND recorded_at <= ?
+                        ORDER BY recorded_at DESC LIMIT 1
+                    )
+                    UNION ALL
+                    SELECT * FROM (
+                        {select} WHERE hostname = ? AND recorded_at > ? AND recorded_at <= ?
+                        ORDER BY recorded_at
+                    )
+                ''', (hostname, start, hostname, start, end))
+                return cursor.fetchall()
+        except sqlite3.Error as e:
+            print(f"Error retrieving server history: {e}")
+            raise
+
+    @retry_on_busy
+    def get_newest_recorded_backup(self, hostname: str) -> Optional[int]:
+        """The newest backup_last_modified ever recorded for a server, or None."""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'SELECT MAX(backup_last_modified) FROM server_history WHERE hostname = ?',
+                    (hostname,)
+                )
+                return cursor.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Error retrieving server history: {e}")
+            raise
+
+    @retry_on_busy
+    def get_scan_snapshots(self, start: int, end: int) -> List[Tuple]:
+        """Return scan_snapshots rows recorded between start and end, oldest first."""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT recorded_at, servers, servers_with_backup, files, total_size, changes
+                    FROM scan_snapshots WHERE recorded_at >= ? AND recorded_at <= ?
+                    ORDER BY recorded_at
+                ''', (start, end))
+                return cursor.fetchall()
+        except sqlite3.Error as e:
+            print(f"Error retrieving scan snapshots: {e}")
+            raise
+
+    @retry_on_busy
+    def downsample_history(self, tier: str, cutoff: int, bucket: int) -> int:
+        """
+        Thin history recorded before cutoff to at most one row per host and
+        bucket seconds (the last state of each bucket), then drop rows that
+        repeat the host's previous state. Only rows since the tier's previous
+        run are read, so each row is visited once per tier. Returns the
+        number of rows deleted.
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT processed_until FROM history_retention WHERE tier = ?', (tier,))
+                row = cursor.fetchone()
+                start = row[0] if row else 0
+                if cutoff <= start:
+                    return 0
+
+                cursor.execute(f'''
+                    SELECT id, hostname, recorded_at, {', '.join(self.HISTORY_COLUMNS)}
+                    FROM server_history WHERE recorded_at >= ? AND recorded_at < ?
+                    ORDER BY hostname, recorded_at
+                ''', (start, cutoff))
+                rows = cursor.fetchall()
+                delete = []
+                for hostname, host_rows in itertools.groupby(rows, key=lambda row: row[1]):
+                    cursor.execute(f'''
+                        SELECT {', '.join(self.HISTORY_COLUMNS)} FROM server_history
+                        WHERE hostname = ? AND recorded_at < ?
+                        ORDER BY recorded_at DESC LIMIT 1
+                    ''', (hostname, start))
+                    previous = cursor.fetchone()
+                    host_rows = list(host_rows)
+                    for row, following in zip(host_rows, host_rows[1:] + [None]):
+                        state = tuple(row[3:])
+                        if following is not None and following[2] // bucket == row[2] // bucket:
+                            # Superseded by a later row of the same bucket
+                            delete.append(row[0])
+                        elif state == previous:
+                            # Thinning left two equal states next to each other
+                            delete.append(row[0])
+                        else:
+                            previous = state
+                cursor.executemany('DELETE FROM server_history WHERE id = ?', [(i,) for i in delete])
+
+                cursor.execute('''
+                    DELETE FROM scan_snapshots
+                    WHERE recorded_at >= ? AND recorded_at < ? AND recorded_at NOT IN (
+                        SELECT MAX(recorded_at) FROM scan_snapshots
+                        WHERE recorded_at >= ? AND recorded_at < ?
+                        GROUP BY recorded_at / ?
+                    )
+                ''', (start, cutoff, start, cutoff, bucket))
+                cursor.execute('''
+                    INSERT INTO history_retention (tier, processed_until) VALUES (?, ?)
+                    ON CONFLICT (tier) DO UPDATE SET processed_until = excluded.processed_until
+                ''', (tier, cutoff))
+                return len(delete)
+        except sqlite3.Error as e:
+            print(f"Error downsampling history: {e}")
+            raise
+
+    @retry_on_busy
+    def expire_history(self, cutoff: int) -> int:
+        """
+        Delete history recorded before cutoff. Each host keeps its last row
+        before cutoff, which is still in effect at cutoff, unless it says the
+        host was gone. Returns the number of server_history rows deleted.
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    DELETE FROM server_history
+                    WHERE recorded_at < ? AND (
+                        NOT present OR (hostname, recorded_at) NOT IN (
+                            SELECT hostname, MAX(recorded_at) FROM server_history
+                            WHERE recorded_at < ? GROUP BY hostname
+                        )
+                    )
+                ''', (cutoff, cutoff))
+                deleted = cursor.rowcount
+                cursor.execute('DELETE FROM scan_snapshots WHERE recorded_at < ?', (cutoff,))
+                return deleted
+        except sqlite3.Error as e:
+            print(f"Error expiring history: {e}")
+            raise
+
+    def compact(self, threshold: float) -> bool:
+        """VACUUM the database if more than threshold of its pages are free. Returns whether it did."""
+        conn = self._new_connection()
+        try:
+            page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+            free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not page_count or free_pages / page_count <= threshold:
+                return False
+            conn.execute('VACUUM')
+            return True
+        except sqlite3.Error as e:
+            print(f"Error compacting database: {e}")
+            raise
+        finally:
+            conn.close()
+
+    FILE_COLUMNS = ('id', 'filename', 'filepath', 'last_modified', 'size', 'scan_time')
+    SERVER_COLUMNS = (
+        'id', 'hostname', 'ip_address', 'detected_os', 'open_ports', 'last_scan',
+        'is_reachable', 'scan_time', 'backup_filename', 'backup_last_modified', 'backup_status',
+        'mac_address', 'last_full_scan'
+    )
+    BACKUP_STATUSES = ('green', 'yellow', 'red')
+
+    @staticmethod
+    def _prefix_range(prefix: str) -> Tuple[str, str]:
+        """Bounds for an index-friendly prefix match: lower <= value < upper."""
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    @staticmethod
+    def _like_pattern(value: str) -> str:
+        """LIKE pattern matching value anywhere, with wildcards in value escaped."""
+        escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return f'%{escaped}%'
+
+    def _file_filters(self, filters: Dict) -> Tuple[List[str], List]:
+        """Translate /api/files filters into WHERE clauses on scanned_files."""
+        clauses, params = [], []
+        for name, value in filters.items():
+            if name == 'path_prefix':
+                clauses.append('filepath >= ? AND filepath < ?')
+                params.extend(self._prefix_range(value))
+            elif name == 'filename':
+                clauses.append("filename LIKE ? ESCAPE '\\'")
+                params.append(self._like_pattern(value))
+            elif name == 'modified_after':
+                clauses.append('last_modified >= ?')
+                params.append(to_epoch(value))
+            elif name == 'modified_before':
+                clauses.append('last_modified < ?')
+                params.append(to_epoch(value))
+            elif name == 'min_size':
+                clauses.append('size >= ?')
+                params.append(value)
+            elif name == 'max_size':
+                clauses.append('size <= ?')
+                params.append(value)
+            else:
+                raise ValueError(f'Unknown file filter: {name}')
+        return clauses, params
+
+    def _server_filters(self, filters: Dict) -> Tuple[List[str], List]:
+        """Translate /api/servers filters into WHERE clauses on the joined server rows."""
+        clauses, params = [], []
+        for name, value in filters.items():
+            if name in ('hostname', 'ip_address'):
+                clauses.append(f"{name} LIKE ? ESCAPE '\\'")
+                params.append(self._like_pattern(value))
+            elif name == 'status':
+                clauses.append(f"backup_status IN ({', '.join('?' * len(value))})")
+                params.extend(value)
+            elif name == 'is_reachable':
+                clauses.append('is_reachable = ?')
+                params.append(1 if value else 0)
+            else:
+                raise ValueError(f'Unknown server filter: {name}')
+        return clauses, params
+
+    def _paged_query(self, select: str, params: List, clauses: List[str], where_params: List,
+                     columns: Tuple[str, ...], sort: Optional[str], order: str,
+                     limit: Optional[int], offset: int, stream: bool = False) -> Tuple[int, Iterable[Tuple]]:
+        """
+        Run select (a query over a derived table) with the given filters, a
+        whitelisted ORDER BY and LIMIT/OFFSET. Returns (total matching rows, page).
+        With stream=True the page is a generator that fetches rows in batches
+        and closes its connection once exhausted.
+        """
+        if sort is not None and sort not in columns:
+            raise ValueError(f"Cannot sort by '{sort}'. Valid columns: {', '.join(columns)}")
+        if order not in ('asc', 'desc'):
+            raise ValueError("order must be 'asc' or 'desc'")
+
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        query = f'SELECT * FROM ({select}){where}'
+        order_by = f' ORDER BY {sort} {order.upper()}, id {order.upper()}' if sort else ''
+
+        # Streamed pages outlive this call, so they get a connection of their own
+        conn = self._new_connection(check_same_thread=False) if stream else self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT COUNT(*) FROM ({query})', params + where_params)
+            total = cursor.fetchone()[0]
+            cursor.execute(
+                f'{query}{order_by} LIMIT ? OFFSET ?',
+                params + where_params + [-1 if limit is None else limit, offset]
+            )
+            if stream:
+                return total, self._iter_cursor(conn, cursor)
+            return total, cursor.fetchall()
+        except Exception:
+            if stream:
+                conn.close()
+            raise
+
+    @staticmethod
+    def _iter_cursor(conn: sqlite3.Connection, cursor: sqlite3.Cursor,
+                     batch_size: int = 1000) -> Iterator[Tuple]:
+        """Yield the rows of an executed cursor in batches, then close its connection."""
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
+    @retry_on_busy
+    def query_scanned_files(self, filters: Dict = None, sort: str = None, order: str = 'asc',
+                            limit: int = None, offset: int = 0,
+                            stream: bool = False) -> Tuple[int, Iterable[Tuple]]:
+        """
+        Retrieve one page of scanned files with filtering, sorting and paging done in SQLite.
+        Returns (total matching rows, rows in FILE_COLUMNS order); with stream=True
+        the rows are a generator so large listings are never held in memory.
+        """
+        try:
+            clauses, where_params = self._file_filters(filters or {})
+            return self._paged_query(
+                f"SELECT {', '.join(self.FILE_COLUMNS)} FROM scanned_files", [],
+                clauses, where_params, self.FILE_COLUMNS, sort, order, limit, offset, stream
+            )
+        except sqlite3.Error as e:
+            print(f"Error retrieving scanned files: {e}")
+            raise
+
+    @retry_on_busy
+    def query_servers(self, fresh_since: datetime, filters: Dict = None, sort: str = None,
+                      order: str = 'asc', limit: int = None, offset: int = 0) -> Tuple[int, List[Tuple]]:
+        """
+        Retrieve one page of servers joined with their newest matching backup.
+        backup_status is 'green' for backups modified at or after fresh_since,
+        'yellow' for older ones and 'red' when there is no backup.
+        Returns (total matching rows, rows in SERVER_COLUMNS order).
+        """
+        try:
+            clauses, where_params = self._server_filters(filters or {})
+            return self._paged_query('''
+                    SELECT s.id, s.hostname, s.ip_address, s.detected_os, s.open_ports,
+                           s.last_scan, s.is_reachable, s.scan_time,
+                           b.backup_filename, b.backup_last_modified,
+                           CASE
+                               WHEN b.backup_last_modified IS NULL THEN 'red'
+                               WHEN b.backup_last_modified >= ? THEN 'green'
+                               ELSE 'yellow'
+                           END AS backup_status,
+                           s.mac_address, s.last_full_scan
+                    FROM scanned_servers s
+                    LEFT JOIN server_backup_status b ON b.server_id = s.id
+                ''', [to_epoch(fresh_since)],
+                clauses, where_params, self.SERVER_COLUMNS, sort, order, limit, offset
+            )
+        except sqlite3.Error as e:
+            print(f"Error retrieving servers: {e}")
+            raise
+
+    @retry_on_busy
+    def read_inventory(self) -> Tuple[int, List[Tuple], Iterator[Tuple]]:
+        """
+        Read everything the list endpoints serve as of a single data
+        generation. Returns (generation, servers, files): servers in
+        SERVER_COLUMNS order without backup_status, which depends on the
+        reader's maximum age, and files in FILE_COLUMNS order; both ordered by
+        id. The files are streamed from a read transaction that ends, closing
+        its connection, once they are exhausted.
+        """
+        conn = self._new_connection(check_same_thread=False)
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN')
+            cursor.execute('SELECT generation FROM data_generation WHERE id = 1')
+            generation = cursor.fetchone()[0]
+            cursor.execute('''
+                SELECT s.id, s.hostname, s.ip_address, s.detected_os, s.open_ports,
+                       s.last_scan, s.is_reachable, s.scan_time,
+                       b.backup_filename, b.backup_last_modified,
+                       s.mac_address, s.last_full_scan
+                FROM scanned_servers s
+                LEFT JOIN server_backup_status b ON b.server_id = s.id
+                ORDER BY s.id
+            ''')
+            servers = cursor.fetchall()
+            cursor.execute(f"SELECT {', '.join(self.FILE_COLUMNS)} FROM scanned_files ORDER BY id")
+            return generation, servers, self._iter_cursor(conn, cursor)
+        except sqlite3.Error as e:
+            conn.close()
+            print(f"Error reading inventory: {e}")
+            raise
+
+    @retry_on_busy
     def update_server(self, hostname: str, data: Dict) -> int:
         """Add or update a server in the database."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
-                
-                # Check if server exists
+                # mac_address and last_full_scan keep their stored values when not given
+                cursor.execute('''
+                    INSERT INTO scanned_servers (
+                        hostname, ip_address, detected_os, open_ports,
+                        last_scan, is_reachable, mac_address, last_full_scan
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (hostname) DO UPDATE SET
+                        ip_address = excluded.ip_address,
+                        detected_os = excluded.detected_os,
+                        open_ports = excluded.open_ports,
+                        last_scan = excluded.last_scan,
+                        is_reachable = excluded.is_reachable,
+                        mac_address = COALESCE(excluded.mac_address, mac_address),
+                        last_full_scan = COALESCE(excluded.last_full_scan, last_full_scan),
+                        scan_time = ?
+                ''', (
+                    hostname,
+                    data.get('ip_address'),
+                    data.get('detected_os'),
+                    data.get('open_ports'),
+                    to_epoch(data.get('last_scan')),
+                    data.get('is_reachable'),
+                    data.get('mac_address'),
+                    to_epoch(data.get('last_full_scan')),
+                    int(time.time())
+                ))
+                bump_generation(cursor)
                 cursor.execute('SELECT id FROM scanned_servers WHERE hostname = ?', (hostname,))
-                result = cursor.fetchone()
-                
-                if result:
-                    # Update existing server
-                    server_id = result[0]
-                    cursor.execute('''
-                        UPDATE scanned_servers 
-                        SET ip_address = ?,
-                            detected_os = ?,
-                            open_ports = ?,
-                            last_scan = ?,
-                            is_reachable = ?,
-                            scan_time = CURRENT_TIMESTAMP
-                        WHERE id = ?
-                    ''', (
-                        data.get('ip_address'),
-                        data.get('detected_os'),
-                        data.get('open_ports'),
-                        data.get('last_scan'),
-                        data.get('is_reachable'),
-                        server_id
-                    ))
-                    return server_id
-                else:
-                    # Insert new server
-                    cursor.execute('''
-                        INSERT INTO scanned_servers (
-                            hostname, ip_address, detected_os, open_ports,
-                            last_scan, is_reachable
-                        )
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (
-                        hostname,
-                        data.get('ip_address'),
-                        data.get('detected_os'),
-                        data.get('open_ports'),
-                        data.get('last_scan'),
-                        data.get('is_reachable')
-                    ))
-                    return cursor.lastrowid
+                return cursor.fetchone()[0]
         except sqlite3.Error as e:
             print(f"Error updating server: {e}")
             raise
 
+    @retry_on_busy
+    def get_server_fingerprints(self) -> Dict[str, Dict]:
+        """
+        Return {ip_address: fingerprint} with the hostname, mac_address, detected_os,
+        open_ports and last_full_scan last stored for each address (the most
+        recently scanned server if several share one).
+        """
+        columns = ('hostname', 'mac_address', 'detected_os', 'open_ports', 'last_full_scan')
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT ip_address, {', '.join(columns)} FROM scanned_servers
+                    WHERE ip_address IS NOT NULL
+                    ORDER BY scan_time, id
+                ''')
+                return {row[0]: dict(zip(columns, row[1:])) for row in cursor}
+        except sqlite3.Error as e:
+            print(f"Error retrieving server fingerprints: {e}")
+            raise
+
+    @retry_on_busy
+    def get_dns_cache(self, now: int) -> Dict[str, Tuple[Optional[str], int]]:
+        """Return {ip_address: (hostname, expires_at)} for reverse DNS entries still valid at now."""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'SELECT ip_address, hostname, expires_at FROM dns_cache WHERE expires_at > ?',
+                    (now,)
+                )
+                return {row[0]: row[1:] for row in cursor}
+        except sqlite3.Error as e:
+            print(f"Error retrieving DNS cache: {e}")
+            raise
+
+    @retry_on_busy
+    def save_dns_cache(self, rows: List[Tuple], now: int):
+        """
+        Store reverse DNS results, each (ip_address, hostname, resolved_at, expires_at),
+        and drop entries that expired before now.
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO dns_cache (ip_address, hostname, resolved_at, expires_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (ip_address) DO UPDATE SET
+                        hostname = excluded.hostname,
+                        resolved_at = excluded.resolved_at,
+                        expires_at = excluded.expires_at
+                ''', rows)
+                cursor.execute('DELETE FROM dns_cache WHERE expires_at <= ?', (now,))
+        except sqlite3.Error as e:
+            print(f"Error saving DNS cache: {e}")
+            raise
+
+    FINGERPRINT_COLUMNS = ('filepath', 'device', 'inode', 'size', 'mtime_ns', 'scheme',
+                           'partial_hash', 'full_hash', 'status', 'hashed_at')
+
+    @retry_on_busy
+    def get_fingerprints(self) -> Dict[str, Dict]:
+        """Return {filepath: fingerprint} for every stored file fingerprint."""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'SELECT {", ".join(self.FINGERPRINT_COLUMNS)} FROM file_fingerprints')
+                return {row[0]: dict(zip(self.FINGERPRINT_COLUMNS, row)) for row in cursor}
+        except sqlite3.Error as e:
+            print(f"Error retrieving file fingerprints: {e}")
+            raise
+
+    @retry_on_busy
+    def save_fingerprints(self, rows: List[Dict]):
+        """Store file fingerprints (dicts with FINGERPRINT_COLUMNS), replacing those of the same paths."""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(f'''
+                    INSERT INTO file_fingerprints ({', '.join(self.FINGERPRINT_COLUMNS)})
+                    VALUES ({', '.join('?' * len(self.FINGERPRINT_COLUMNS))})
+                    ON CONFLICT (filepath) DO UPDATE SET
+                        {', '.join(f'{column} = excluded.{column}' for column in self.FINGERPRINT_COLUMNS[1:])}
+                ''', [tuple(row[column] for column in self.FINGERPRINT_COLUMNS) for row in rows])
+                bump_generation(cursor)
+        except sqlite3.Error as e:
+            print(f"Error saving file fingerprints: {e}")
+            raise
+
+    @retry_on_busy
+    def get_fingerprint_report(self) -> Dict[str, List]:
+        """
+        Fingerprint findings for files still present in scanned_files:
+        'truncated' and 'touched' files as (filepath, size, hashed_at), and
+        'duplicates' as lists of filepaths whose size and partial hash (and
+        full hash, where both files have one) match.
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                report = {}
+                for status in ('truncated', 'touched'):
+                    cursor.execute('''
+                        SELECT fp.filepath, fp.size, fp.hashed_at FROM file_fingerprints fp
+                        JOIN scanned_files sf ON sf.filepath = fp.filepath
+                        WHERE fp.status = ?
+                        ORDER BY fp.filepath
+                    ''', (status,))
+                    report[status] = cursor.fetchall()
+
+                cursor.execute('''
+                    SELECT fp.partial_hash, fp.size, fp.full_hash, fp.filepath FROM file_fingerprints fp
+                    JOIN scanned_files sf ON sf.filepath = fp.filepath
+                    WHERE fp.partial_hash IN (
+                        SELECT partial_hash FROM file_fingerprints
+                        GROUP BY partial_hash, size HAVING COUNT(*) > 1
+                    )
+                    ORDER BY fp.partial_hash, fp.size, fp.full_hash IS NULL, fp.full_hash, fp.filepath
+                ''')
+                duplicates = []
+                for _, group in itertools.groupby(cursor, key=lambda row: row[:2]):
+                    # Files whose full hashes differ are not duplicates, whatever their samples say
+                    clusters = []
+                    for _, _, full, filepath in group:
+                        cluster = next((c for c in clusters if full is None or c[0] in (None, full)), None)
+                        if cluster is None:
+                            clusters.append([full, filepath])
+                        else:
+                            cluster[0] = cluster[0] or full
+                            cluster.append(filepath)
+                    duplicates.extend(cluster[1:] for cluster in clusters if len(cluster) > 2)
+                report['duplicates'] = duplicates
+                return report
+        except sqlite3.Error as e:
+            print(f"Error retrieving fingerprint report: {e}")
+            raise
+
+    @retry_on_busy
+    def add_metric_samples(self, rows: List[Tuple], now: int):
+        """
+        Merge metric samples (family, kind, help, sample, labels, value) into
+        the metrics table: gauges replace the stored value, counter and
+        histogram samples are added to it.
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO metrics (family, kind, help, sample, labels, value, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (sample, labels) DO UPDATE SET
+                        value = CASE WHEN excluded.kind = 'gauge' THEN excluded.value
+                                     ELSE metrics.value + excluded.value END,
+                        help = excluded.help,
+                        updated_at = excluded.updated_at
+                ''', [row + (now,) for row in rows])
+        except sqlite3.Error as e:
+            print(f"Error saving metrics: {e}")
+            raise
+
+    @retry_on_busy
+    def get_metric_samples(self) -> List[Tuple]:
+        """Return every stored metric sample as (family, kind, help, sample, labels, value)."""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT family, kind, help, sample, labels, value FROM metrics
+                    ORDER BY family, sample, labels
+                ''')
+                return cursor.fetchall()
+        except sqlite3.Error as e:
+            print(f"Error retrieving metrics: {e}")
+            raise
+
+    @retry_on_busy
+    def count_rows(self, tables: Iterable[str]) -> Dict[str, int]:
+        """Return {table: row count} for the given tables."""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                counts = {}
+                for table in tables:
+                    cursor.execute(f'SELECT COUNT(*) FROM "{table}"')
+                    counts[table] = cursor.fetchone()[0]
+                return counts
+        except sqlite3.Error as e:
+            print(f"Error counting rows: {e}")
+            raise
+
+    @retry_on_busy
+    def get_data_generation(self) -> Tuple[int, int]:
+        """Return (generation, changed_at) of the data the API serves."""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT generation, changed_at FROM data_generation WHERE id = 1')
+                return cursor.fetchone()
+        except sqlite3.Error as e:
+            print(f"Error retrieving data generation: {e}")
+            raise
+
+    @retry_on_busy
+    def get_last_status_change(self, fresh_since: datetime, max_age: int) -> Optional[int]:
+        """
+        When the most recent backup to turn yellow did so, i.e. the newest
+        backup older than fresh_since plus max_age seconds, or None. Server
+        responses change at that moment without any write.
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT MAX(backup_last_modified) FROM server_backup_status
+                    WHERE backup_last_modified < ?
+                ''', (to_epoch(fresh_since),))
+                newest_stale = cursor.fetchone()[0]
+                return newest_stale + max_age if newest_stale is not None else None
+        except sqlite3.Error as e:
+            print(f"Error retrieving backup status changes: {e}")
+            raise
+
+    @retry_on_busy
+    def get_cached_response(self, cache_key: str, etag: str) -> Optional[bytes]:
+        """Return the cached body stored for cache_key under etag, or None."""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'SELECT body FROM response_cache WHERE cache_key = ? AND etag = ?',
+                    (cache_key, etag)
+                )
+                row = cursor.fetchone()
+                return row[0] if row else None
+        except sqlite3.Error as e:
+            print(f"Error retrieving cached response: {e}")
+            raise
+
+    @retry_on_busy
+    def put_cached_response(self, cache_key: str, generation: int, etag: str, body: bytes,
+                            max_entries: int):
+        """
+        Cache a response body, drop entries of older generations and keep at
+        most max_entries, evicting the oldest.
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO response_cache (cache_key, generation, etag, body, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (cache_key) DO UPDATE SET
+                        generation = excluded.generation,
+                        etag = excluded.etag,
+                        body = excluded.body,
+                        created_at = excluded.created_at
+                ''', (cache_key, generation, etag, body, int(time.time())))
+                cursor.execute('DELETE FROM response_cache WHERE generation < ?', (generation,))
+                cursor.execute('''
+                    DELETE FROM response_cache WHERE cache_key NOT IN (
+                        SELECT cache_key FROM response_cache
+                        ORDER BY created_at DESC, rowid DESC LIMIT ?
+                    )
+                ''', (max_entries,))
+        except sqlite3.Error as e:
+            print(f"Error caching response: {e}")
+            raise
+
+    @retry_on_busy
     def get_all_servers(self) -> List[Tuple]:
         """Retrieve all servers from the database."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT * FROM scanned_servers')
                 return cursor.fetchall()
         except sqlite3.Error as e:
             print(f"Error retrieving servers: {e}")
             raise
+
+
+class BulkFileWriter:
+    """
+    Buffers scanned_files/file_index writes and applies them with executemany,
+    one transaction per flush, on a connection of its own that close()
+    closes. A flush happens once batch_size operations are pending or
+    flush_interval seconds have passed since the previous flush (checked
+    whenever a row is queued), and on close(). A flush that finds the
+    database locked is rolled back and re-run under retry_on_busy, with the
+    retries and retry_backoff of the DatabaseManager's settings.
+
+    Operations are kept per path, so a later one replaces an earlier one
+    queued for the same file in the same batch: a file deleted and recreated
+    between two flushes ends up added, not removed. An update of a file
+    added or removed earlier in the batch is queued as an add, since the
+    row it would update may not exist yet.
+    """
+
+    DEFAULT_BATCH_SIZE = 5000
+    DEFAULT_FLUSH_INTERVAL = 2.0
+
+    def __init__(self, conn: sqlite3.Connection, batch_size: int = DEFAULT_BATCH_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, settings: Dict = None):
+        self.settings = {**DatabaseManager.DEFAULT_SETTINGS, **(settings or {})}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self._conn = conn
+        self._pending = {}  # filepath -> (operation, row), in queue order
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def add(self, root: str, filename: str, filepath: str, last_modified: datetime,
+            size: int, inode: int = None, mtime_ns: int = None):
+        """Queue a newly seen file."""
+        self._queue(filepath, 'add', (root, filename, filepath, to_epoch(last_modified),
+                                      size, inode, mtime_ns))
+
+    def update(self, root: str, filepath: str, last_modified: datetime,
+               size: int, inode: int = None, mtime_ns: int = None):
+        """Queue a file whose inode, size or mtime changed."""
+        if self._pending.get(filepath, ('update',))[0] != 'update':
+            self.add(root, os.path.basename(filepath), filepath, last_modified,
+                     size, inode, mtime_ns)
+        else:
+            self._queue(filepath, 'update', (root, filepath, to_epoch(last_modified),
+                                             size, inode, mtime_ns))
+
+    def remove(self, filepath: str):
+        """Queue a file that disappeared; its file_index row is tombstoned."""
+        self._queue(filepath, 'remove', (filepath,))
+
+    def _queue(self, filepath: str, operation: str, row: Tuple):
+        # Re-insert so the dict keeps the order of each path's last operation
+        self._pending.pop(filepath, None)
+        self._pending[filepath] = (operation, row)
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if (self.pending >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write all pending operations in a single transaction."""
+        if self.pending:
+            added, changed, removed = [], [], []
+            batches = {'add': added, 'update': changed, 'remove': removed}
+            for operation, row in self._pending.values():
+                batches[operation].append(row)
+            start = time.perf_counter()
+            try:
+                self._write_batch(added, changed, removed)
+            except sqlite3.Error as e:
+                print(f"Error flushing file batch: {e}")
+                raise
+            SCAN_WRITE_SECONDS.observe(time.perf_counter() - start)
+            SCAN_ROWS_WRITTEN.inc(self.pending)
+            self.rows_written += self.pending
+            self._pending = {}
+        self._last_flush = time.monotonic()
+
+    @retry_on_busy
+    def _write_batch(self, added: List[Tuple], changed: List[Tuple], removed: List[Tuple]):
+        """Apply one batch in a transaction; rolled back as a whole if it fails."""
+        now = int(time.time())
+        with self._conn:
+            cursor = self._conn.cursor()
+            if added:
+                cursor.executemany('''
+                    INSERT INTO scanned_files (filename, filepath, last_modified, size)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (filepath) DO UPDATE SET
+                        filename = excluded.filename,
+                        last_modified = excluded.last_modified,
+                        size = excluded.size,
+                        scan_time = ?
+                ''', [row[1:5] + (now,) for row in added])
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO file_index
+                        (filepath, root, inode, size, mtime_ns, removed_at)
+                    VALUES (?, ?, ?, ?, ?, NULL)
+                ''', [(row[2], row[0], row[5], row[4], row[6]) for row in added])
+            if changed:
+                cursor.executemany('''
+                    UPDATE scanned_files
+                    SET last_modified = ?, size = ?, scan_time = ?
+                    WHERE filepath = ?
+                ''', [(row[2], row[3], now, row[1]) for row in changed])
+                cursor.executemany('''
+                    UPDATE file_index SET root = ?, inode = ?, size = ?, mtime_ns = ?
+                    WHERE filepath = ?
+                ''', [(row[0], row[4], row[3], row[5], row[1]) for row in changed])
+            if removed:
+                cursor.executemany(
+                    'DELETE FROM scanned_files WHERE filepath = ?', removed
+                )
+                cursor.executemany('''
+                    UPDATE file_index SET removed_at = ?
+                    WHERE filepath = ?
+                ''', [(now, filepath) for filepath, in removed])
+            bump_generation(cursor)
+
+    def close(self):
+        """Flush any pending rows and close the connection."""
+        try:
+            self.flush()
+        finally:
+            self._conn.close()
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations.
+
+The schema version is kept in SQLite's PRAGMA user_version. MIGRATIONS[n]
+upgrades a database from version n to n + 1; migrate() applies whatever is
+missing, each migration in its own transaction, so existing databases are
+upgraded in place when DatabaseManager opens them. Never edit a migration
+that has shipped: append a new one instead.
+"""
+
+import sqlite3
+from datetime import datetime, timezone
+from typing import Callable, List
+
+def _text_to_epoch(value, utc: bool):
+    """
+    Convert a stored timestamp to integer seconds since the epoch. Values
+    written from Python datetimes are naive local time; CURRENT_TIMESTAMP
+    defaults are UTC.
+    """
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value)
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if utc and parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+def _rebuild_table(conn: sqlite3.Connection, table: str, create: str, copy: str):
+    """
+    Recreate table with a new definition. create is the CREATE TABLE statement
+    for {table}_new, copy the INSERT ... SELECT that fills it from the old table.
+    """
+    conn.execute(create)
+    conn.execute(copy)
+    conn.execute(f'DROP TABLE {table}')
+    conn.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+def _initial_schema(conn: sqlite3.Connection):
+    """Version 1: the schema created before migrations existed."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scanned_files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT NOT NULL,
+            filepath TEXT NOT NULL,
+            last_modified TIMESTAMP,
+            size INTEGER,
+            scan_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scanned_servers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            hostname TEXT NOT NULL,
+            ip_address TEXT,
+            detected_os TEXT,
+            open_ports TEXT,
+            last_scan TIMESTAMP,
+            is_reachable BOOLEAN,
+            scan_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+# Versions 2 to 4 add tables that releases from before migrations created
+# on startup, so a database being upgraded may already have them
+
+def _file_index(conn: sqlite3.Connection):
+    """
+    Version 2: the persistent per-file record used by incremental directory
+    scans. Rows are tombstoned (removed_at set) instead of deleted so a
+    rescan can tell a removed file from one it has never seen.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS file_index (
+            filepath TEXT PRIMARY KEY,
+            root TEXT NOT NULL,
+            inode INTEGER,
+            size INTEGER,
+            mtime_ns INTEGER,
+            removed_at TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_file_index_root
+        ON file_index (root)
+    ''')
+
+def _server_backup_status(conn: sqlite3.Connection):
+    """
+    Version 3: the newest matching backup per server, refreshed by the
+    scanners. The green/yellow/red status is derived from it at query time.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS server_backup_status (
+            server_id INTEGER PRIMARY KEY,
+            backup_filename TEXT,
+            backup_filepath TEXT,
+            backup_last_modified TIMESTAMP,
+            match_count INTEGER NOT NULL DEFAULT 0,
+            refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _scan_jobs(conn: sqlite3.Connection):
+    """
+    Version 4: background scan jobs. Progress is written here so any worker
+    process can report on a job started by another one.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scan_jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT,
+            status TEXT NOT NULL,
+            phase TEXT,
+            processed INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            message TEXT,
+            result TEXT,
+            owner_pid INTEGER,
+            created_at REAL,
+            started_at REAL,
+            updated_at REAL,
+            finished_at REAL
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scan_jobs_kind_status
+        ON scan_jobs (kind, status)
+    ''')
+
+def _epoch_timestamps_and_indexes(conn: sqlite3.Connection):
+    """
+    Version 5: integer epoch timestamps (scan_jobs' float seconds are
+    truncated too), one row per filepath and per hostname (keeping the
+    newest), and indexes for the lookups the API and scanners make.
+    """
+    conn.create_function('local_epoch', 1, lambda value: _text_to_epoch(value, False), deterministic=True)
+    conn.create_function('utc_epoch', 1, lambda value: _text_to_epoch(value, True), deterministic=True)
+
+    _rebuild_table(conn, 'scanned_files', '''
+        CREATE TABLE scanned_files_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT NOT NULL,
+            filepath TEXT NOT NULL,
+            last_modified INTEGER,
+            size INTEGER,
+            scan_time INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+        )
+    ''', '''
+        INSERT INTO scanned_files_new (id, filename, filepath, last_modified, size, scan_time)
+        SELECT id, filename, filepath, local_epoch(last_modified), size, utc_epoch(scan_time)
+        FROM scanned_files
+        WHERE id IN (SELECT MAX(id) FROM scanned_files GROUP BY filepath)
+    ''')
+    conn.execute('CREATE UNIQUE INDEX idx_scanned_files_filepath ON scanned_files (filepath)')
+    conn.execute('CREATE INDEX idx_scanned_files_last_modified ON scanned_files (last_modified)')
+
+    _rebuild_table(conn, 'file_index', '''
+        CREATE TABLE file_index_new (
+            filepath TEXT PRIMARY KEY,
+            root TEXT NOT NULL,
+            inode INTEGER,
+            size INTEGER,
+            mtime_ns INTEGER,
+            removed_at INTEGER
+        )
+    ''', '''
+        INSERT INTO file_index_new (filepath, root, inode, size, mtime_ns, removed_at)
+        SELECT filepath, root, inode, size, mtime_ns, utc_epoch(removed_at)
+        FROM file_index
+    ''')
+    conn.execute('CREATE INDEX idx_file_index_root ON file_index (root)')
+
+    _rebuild_table(conn, 'scanned_servers', '''
+        CREATE TABLE scanned_servers_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            hostname TEXT NOT NULL,
+            ip_address TEXT,
+            detected_os TEXT,
+            open_ports TEXT,
+            last_scan INTEGER,
+            is_reachable BOOLEAN,
+            scan_time INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+        )
+    ''', '''
+        INSERT INTO scanned_servers_new (
+            id, hostname, ip_address, detected_os, open_ports, last_scan, is_reachable, scan_time
+        )
+        SELECT id, hostname, ip_address, detected_os, open_ports,
+               local_epoch(last_scan), is_reachable, utc_epoch(scan_time)
+        FROM scanned_servers
+        WHERE id IN (SELECT MAX(id) FROM scanned_servers GROUP BY hostname)
+    ''')
+    conn.execute('CREATE UNIQUE INDEX idx_scanned_servers_hostname ON scanned_servers (hostname)')
+    conn.execute('CREATE INDEX idx_scanned_servers_ip_address ON scanned_servers (ip_address)')
+
+    _rebuild_table(conn, 'server_backup_status', '''
+        CREATE TABLE server_backup_status_new (
+            server_id INTEGER PRIMARY KEY,
+            backup_filename TEXT,
+            backup_filepath TEXT,
+            backup_last_modified INTEGER,
+            match_count INTEGER NOT NULL DEFAULT 0,
+            refreshed_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+        )
+    ''', '''
+        INSERT INTO server_backup_status_new (
+            server_id, backup_filename, backup_filepath, backup_last_modified,
+            match_count, refreshed_at
+        )
+        SELECT server_id, backup_filename, backup_filepath, local_epoch(backup_last_modified),
+               match_count, utc_epoch(refreshed_at)
+        FROM server_backup_status
+        WHERE server_id IN (SELECT id FROM scanned_servers)
+    ''')
+
+    _rebuild_table(conn, 'scan_jobs', '''
+        CREATE TABLE scan_jobs_new (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT,
+            status TEXT NOT NULL,
+            phase TEXT,
+            processed INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            message TEXT,
+            result TEXT,
+            owner_pid INTEGER,
+            created_at INTEGER,
+            started_at INTEGER,
+            updated_at INTEGER,
+            finished_at INTEGER
+        )
+    ''', '''
+        INSERT INTO scan_jobs_new (
+            id, kind, params, status, phase, processed, total, message, result, owner_pid,
+            created_at, started_at, updated_at, finished_at
+        )
+        SELECT id, kind, params, status, phase, processed, total, message, result, owner_pid,
+               CAST(created_at AS INTEGER), CAST(started_at AS INTEGER),
+               CAST(updated_at AS INTEGER), CAST(finished_at AS INTEGER)
+        FROM scan_jobs
+    ''')
+    conn.execute('CREATE INDEX idx_scan_jobs_kind_status ON scan_jobs (kind, status)')
+
+def _dns_cache(conn: sqlite3.Connection):
+    """Version 6: reverse DNS results (hostname NULL for failed lookups) kept until expires_at."""
+    conn.execute('''
+        CREATE TABLE dns_cache (
+            ip_address TEXT PRIMARY KEY,
+            hostname TEXT,
+            resolved_at INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL
+        )
+    ''')
+
+def _server_fingerprints(conn: sqlite3.Connection):
+    """Version 7: MAC address and time of the last full (OS detection) scan per server."""
+    conn.execute('ALTER TABLE scanned_servers ADD COLUMN mac_address TEXT')
+    conn.execute('ALTER TABLE scanned_servers ADD COLUMN last_full_scan INTEGER')
+    conn.execute('UPDATE scanned_servers SET last_full_scan = last_scan')
+
+def _response_cache(conn: sqlite3.Connection):
+    """
+    Version 8: a data generation bumped by every write the API can see, and
+    API responses cached per generation so all worker processes share them.
+    """
+    conn.execute('''
+        CREATE TABLE data_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL,
+            changed_at INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO data_generation (id, generation, changed_at)
+        VALUES (1, 1, CAST(strftime('%s', 'now') AS INTEGER))
+    ''')
+    conn.execute('''
+        CREATE TABLE response_cache (
+            cache_key TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL,
+            etag TEXT NOT NULL,
+            body BLOB NOT NULL,
+            created_at INTEGER NOT NULL
+        )
+    ''')
+
+def _history(conn: sqlite3.Connection):
+    """
+    Version 9: append-only history. server_history holds one row per change
+    of a server's backup state (a row is in effect until the host's next
+    one), scan_snapshots one row of totals per backup status refresh, and
+    history_retention how far each downsampling tier has got.
+    """
+    conn.execute('''
+        CREATE TABLE server_history (
+            id INTEGER PRIMARY KEY,
+            hostname TEXT NOT NULL,
+            recorded_at INTEGER NOT NULL,
+            present BOOLEAN NOT NULL DEFAULT 1,
+            ip_address TEXT,
+            is_reachable BOOLEAN,
+            backup_filepath TEXT,
+            backup_last_modified INTEGER,
+            match_count INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE UNIQUE INDEX idx_server_history_hostname_recorded_at
+        ON server_history (hostname, recorded_at)
+    ''')
+    conn.execute('CREATE INDEX idx_server_history_recorded_at ON server_history (recorded_at)')
+    conn.execute('''
+        CREATE TABLE scan_snapshots (
+            recorded_at INTEGER PRIMARY KEY,
+            servers INTEGER NOT NULL,
+            servers_with_backup INTEGER NOT NULL,
+            files INTEGER NOT NULL,
+            total_size INTEGER,
+            changes INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE history_retention (
+            tier TEXT PRIMARY KEY,
+            processed_until INTEGER NOT NULL
+        )
+    ''')
+
+def _file_fingerprints(conn: sqlite3.Connection):
+    """
+    Version 10: content fingerprints of backup files, valid while the file's
+    device, inode, size and mtime match, and the status the last rehash
+    found (new, modified, touched or truncated).
+    """
+    conn.execute('''
+        CREATE TABLE file_fingerprints (
+            filepath TEXT PRIMARY KEY,
+            device INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            scheme TEXT NOT NULL,
+            partial_hash TEXT NOT NULL,
+            full_hash TEXT,
+            status TEXT NOT NULL,
+            hashed_at INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_file_fingerprints_partial_hash ON file_fingerprints (partial_hash)')
+    conn.execute('CREATE INDEX idx_file_fingerprints_status ON file_fingerprints (status)')
+
+def _metrics(conn: sqlite3.Connection):
+    """
+    Version 11: metric samples summed over every process that flushed them
+    (counters and histograms) or last set by any of them (gauges).
+    """
+    conn.execute('''
+        CREATE TABLE metrics (
+            sample TEXT NOT NULL,
+            labels TEXT NOT NULL,
+            family TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            help TEXT NOT NULL,
+            value REAL NOT NULL,
+            updated_at INTEGER NOT NULL,
+            PRIMARY KEY (sample, labels)
+        )
+    ''')
+
+def _agent_roots(conn: sqlite3.Connection):
+    """
+    Version 12: scan roots whose files remote agents report in manifests,
+    with the manifest each one is receiving (scan_id, its last chunk and
+    the rows its chunks changed so far) and when one last completed.
+    """
+    conn.execute('''
+        CREATE TABLE agent_roots (
+            root TEXT PRIMARY KEY,
+            agent TEXT NOT NULL,
+            scan_id TEXT NOT NULL,
+            last_seq INTEGER NOT NULL,
+            changes INTEGER NOT NULL,
+            started_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL,
+            completed_at INTEGER
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_agent_roots_agent ON agent_roots (agent)')
+
+MIGRATIONS: List[Callable[[sqlite3.Connection], None]] = [
+    _initial_schema,
+    _file_index,
+    _server_backup_status,
+    _scan_jobs,
+    _epoch_timestamps_and_indexes,
+    _dns_cache,
+    _server_fingerprints,
+    _response_cache,
+    _history,
+    _file_fingerprints,
+    _metrics,
+    _agent_roots
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Apply all pending migrations and return the resulting schema version.
+    Safe to call from several processes at once: each migration runs under
+    BEGIN IMMEDIATE and is skipped if another process applied it first.
+    """
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        for version, migration in enumerate(MIGRATIONS, start=1):
+            if get_version(conn) >= version:
+                continue
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if get_version(conn) < version:
+                    migration(conn)
+                    conn.execute(f'PRAGMA user_version = {version}')
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return get_version(conn)
+    finally:
+        conn.isolation_level = isolation_level
@@ -15,17 +15,17 @@ def format_size(size_bytes: int) -> str:
     return f"{size_bytes:.2f} PB"
 
 def format_timestamp(timestamp) -> str:
-    """Format timestamp to readable format."""
-    if isinstance(timestamp, str):
-        try:
-            timestamp = datetime.fromisoformat(timestamp)
-        except ValueError:
-            return timestamp
-    return timestamp.strftime("%Y-%m-%d %H:%M:%S")
+    """Format an epoch timestamp to readable local time."""
+    if timestamp is None:
+        return 'N/A'
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
 
 def print_scanned_files(cursor: sqlite3.Cursor):
     """Pretty print scanned files from database."""
-    cursor.execute('SELECT * FROM scanned_files ORDER BY scan_time DESC')
+    cursor.execute('''
+        SELECT id, filename, filepath, last_modified, size, scan_time
+        FROM scanned_files ORDER BY scan_time DESC
+    ''')
     files = cursor.fetchall()
     
     if not files:
@@ -49,7 +49,10 @@ def print_scanned_files(cursor: sqlite3.Cursor):
 
 def print_scanned_servers(cursor: sqlite3.Cursor):
     """Pretty print scanned servers from database."""
-    cursor.execute('SELECT * FROM scanned_servers ORDER BY scan_time DESC')
+    cursor.execute('''
+        SELECT id, hostname, ip_address, detected_os, open_ports, last_scan, is_reachable, scan_time
+        FROM scanned_servers ORDER BY scan_time DESC
+    ''')
     servers = cursor.fetchall()
     
     if not servers:
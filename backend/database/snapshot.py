@@ -0,0 +1,602 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import mmap
+import time
+import fcntl
+import heapq
+import bisect
+import threading
+from array import array
+from pathlib import Path
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Add the parent directory to the Python path to import the metrics module
+sys.path.append(str(Path(__file__).parent.parent))
+from metrics.metrics import Counter, Histogram
+
+try:
+    from .db_manager import DatabaseManager, to_epoch
+except ImportError:
+    from db_manager import DatabaseManager, to_epoch
+
+BUILD_SECONDS = Histogram(
+    'backup_checker_snapshot_build_seconds', 'Time to build and publish an inventory snapshot'
+)
+QUERIES = Counter(
+    'backup_checker_snapshot_queries_total', 'List queries per table, answered from the snapshot or the database',
+    ['table', 'source']
+)
+
+# Inventory snapshot settings; override any of them with the "snapshot" section of config.json
+DEFAULT_SETTINGS = {
+    'enabled': True,
+    'path': None,                 # default: next to the database, as <database>.snapshot
+    'min_rebuild_interval': 10.0  # seconds the data must stay unchanged before a build, and between builds
+}
+
+MAGIC = b'BCSNAP01'
+NULL = -2 ** 63
+SECTION_KEYS = ('values', 'offsets', 'data', 'folded', 'nulls', 'order', 'ranks')
+
+# Stored columns per table: (name, kind); servers leave out backup_status,
+# which is derived from backup_last_modified at query time
+FILE_SCHEMA = (
+    ('id', 'int'), ('filename', 'str'), ('filepath', 'str'),
+    ('last_modified', 'int'), ('size', 'int'), ('scan_time', 'int')
+)
+SERVER_SCHEMA = (
+    ('id', 'int'), ('hostname', 'str'), ('ip_address', 'str'), ('detected_os', 'str'),
+    ('open_ports', 'str'), ('last_scan', 'int'), ('is_reachable', 'int'), ('scan_time', 'int'),
+    ('backup_filename', 'str'), ('backup_last_modified', 'int'),
+    ('mac_address', 'str'), ('last_full_scan', 'int')
+)
+
+def _sort_order(values: list, nulls: Optional[bytearray] = None) -> array:
+    """Row numbers sorted like SQLite's ORDER BY column, id (NULLs first, text by bytes)."""
+    if nulls is None:
+        key = values.__getitem__
+    else:
+        key = lambda row: (not nulls[row], values[row])
+    return array('i', sorted(range(len(values)), key=key))
+
+def _encode_table(schema: Tuple, rows: Iterable[Tuple]) -> Tuple[dict, List[bytes]]:
+    """
+    Lay a table out column by column. Returns its header entry, with section
+    offsets relative to the table, and the sections. Integers are int64 with
+    NULL stored as -2**63; text is one NUL-terminated UTF-8 value after the
+    other with int64 start offsets, a NULL flag per row, and an ASCII
+    lower-cased copy for case-insensitive substring search like LIKE's.
+    Every column gets a sort order (row numbers) and its inverse (ranks).
+    """
+    values = {name: [] for name, _ in schema}
+    count = 0
+    for row in rows:
+        count += 1
+        for (name, kind), value in zip(schema, row):
+            if kind == 'int':
+                values[name].append(NULL if value is None else int(value))
+            else:
+                values[name].append(None if value is None else str(value).encode())
+
+    sections = []
+    size = 0
+
+    def add(data: bytes) -> int:
+        nonlocal size
+        offset = size
+        sections.append(data)
+        size += len(data)
+        padding = -len(data) % 8
+        if padding:
+            sections.append(b'\0' * padding)
+            size += padding
+        return offset
+
+    header = {'rows': count, 'columns': {}}
+    for name, kind in schema:
+        column = values[name]
+        if kind == 'int':
+            column = array('q', column)
+            order = _sort_order(column)
+            header['columns'][name] = {'kind': 'int', 'values': add(column.tobytes())}
+        else:
+            nulls = bytearray(value is None for value in column)
+            column = [value or b'' for value in column]
+            order = _sort_order(column, nulls if any(nulls) else None)
+            offsets = array('q', [0])
+            for value in column:
+                offsets.append(offsets[-1] + len(value) + 1)
+            data = b'\0'.join(column) + b'\0' if column else b''
+            header['columns'][name] = {
+                'kind': 'str',
+                'offsets': add(offsets.tobytes()),
+                'data': add(data),
+                'size': len(data),
+                'folded': add(data.lower()),
+                'nulls': add(bytes(nulls))
+            }
+        ranks = array('i', bytes(4 * count))
+        for position, row in enumerate(order):
+            ranks[row] = position
+        header['columns'][name]['order'] = add(order.tobytes())
+        header['columns'][name]['ranks'] = add(ranks.tobytes())
+    return header, sections
+
+def build_snapshot(db_manager: DatabaseManager, path: str) -> int:
+    """
+    Read the inventory in one transaction, write it as a snapshot file and
+    atomically replace path with it. Returns the snapshot's generation.
+    """
+    start = time.perf_counter()
+    generation, servers, files = db_manager.read_inventory()
+    tables = {}
+    for name, schema, rows in (('servers', SERVER_SCHEMA, servers), ('files', FILE_SCHEMA, files)):
+        tables[name] = _encode_table(schema, rows)
+
+    # Offsets in the header are relative to the sections, which start at the
+    # first 8-byte boundary after it
+    header = {'generation': generation, 'built_at': int(time.time()), 'tables': {}}
+    position = 0
+    for name, (table_header, sections) in tables.items():
+        for spec in table_header['columns'].values():
+            for key in SECTION_KEYS:
+                if key in spec:
+                    spec[key] += position
+        header['tables'][name] = table_header
+        position += sum(len(section) for section in sections)
+    header_bytes = json.dumps(header).encode()
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            prefix = MAGIC + len(header_bytes).to_bytes(8, 'little') + header_bytes
+            f.write(prefix + b'\0' * (-len(prefix) % 8))
+            for _, sections in tables.values():
+                for section in sections:
+                    f.write(section)
+        os.chmod(tmp_path, 0o666)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    BUILD_SECONDS.observe(time.perf_counter() - start)
+    return generation
+
+class _RangeFilter:
+    """Rows whose rank in a column's sort order lies in [lo, hi)."""
+
+    def __init__(self, table: '_Table', column: str, lo: int, hi: int):
+        self.column = column
+        self.order = table.orders[column]
+        self.ranks = table.ranks[column]
+        self.lo = lo
+        self.hi = max(lo, hi)
+        self.count = self.hi - self.lo
+
+    def rows(self) -> Iterable[int]:
+        return self.order[self.lo:self.hi]
+
+    def test(self, row: int) -> bool:
+        return self.lo <= self.ranks[row] < self.hi
+
+class _SetFilter:
+    """An explicit list of matching rows."""
+
+    column = None
+
+    def __init__(self, rows: List[int]):
+        self._rows = rows
+        self._set = None
+        self.count = len(rows)
+
+    def rows(self) -> Iterable[int]:
+        return self._rows
+
+    def test(self, row: int) -> bool:
+        if self._set is None:
+            self._set = set(self._rows)
+        return row in self._set
+
+class _PredicateFilter:
+    """Rows passing a test; can only narrow down other filters' rows."""
+
+    column = None
+    count = None
+
+    def __init__(self, test: Callable[[int], bool]):
+        self.test = test
+
+class _Table:
+    """Read-only column views of one table in a mapped snapshot."""
+
+    def __init__(self, mapped: mmap.mmap, spec: dict, base: int):
+        self.count = spec['rows']
+        self._mapped = mapped
+        spec = {
+            name: {key: value + base if key in SECTION_KEYS else value for key, value in column.items()}
+            for name, column in spec['columns'].items()
+        }
+        view = memoryview(mapped)
+        n = self.count
+        self.values = {}
+        self.text = {}
+        self.orders = {}
+        self.ranks = {}
+        self._getters = {}
+        for name, column in spec.items():
+            if column['kind'] == 'int':
+                self.values[name] = view[column['values']:column['values'] + 8 * n].cast('q')
+            else:
+                self.text[name] = (
+                    view[column['offsets']:column['offsets'] + 8 * (n + 1)].cast('q'),
+                    column['data'], column['folded'], column['size'],
+                    view[column['nulls']:column['nulls'] + n]
+                )
+            self.orders[name] = view[column['order']:column['order'] + 4 * n].cast('i')
+            self.ranks[name] = view[column['ranks']:column['ranks'] + 4 * n].cast('i')
+
+    def getter(self, name: str) -> Callable[[int], object]:
+        """A function reading one column of a row, None for NULL."""
+        getter = self._getters.get(name)
+        if getter is not None:
+            return getter
+        if name in self.values:
+            values = self.values[name]
+
+            def getter(row):
+                value = values[row]
+                return None if value == NULL else value
+        else:
+            offsets, data, _, _, nulls = self.text[name]
+            mapped = self._mapped
+
+            def getter(row):
+                if nulls[row]:
+                    return None
+                return mapped[data + offsets[row]:data + offsets[row + 1] - 1].decode()
+        self._getters[name] = getter
+        return getter
+
+    def rows(self, rows: Iterable[int], columns: Iterable[str]) -> Iterable[Tuple]:
+        """The given rows as tuples of the given columns."""
+        getters = [self.getter(name) for name in columns]
+        for row in rows:
+            yield tuple([get(row) for get in getters])
+
+    def _text_at(self, name: str, position: int) -> bytes:
+        """The raw value at a position of the column's sort order (NULL as empty)."""
+        offsets, data, _, _, _ = self.text[name]
+        row = self.orders[name][position]
+        return self._mapped[data + offsets[row]:data + offsets[row + 1] - 1]
+
+    def bisect(self, name: str, target) -> int:
+        """First position in name's sort order whose value is >= target (an int or bytes)."""
+        lo, hi = 0, self.count
+        if name in self.values:
+            values, order = self.values[name], self.orders[name]
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if values[order[mid]] < target:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+        # NULLs sort first; no non-NULL text is below them
+        nulls, order = self.text[name][4], self.orders[name]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if nulls[order[mid]] or self._text_at(name, mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def range_filter(self, name: str, lower=None, upper=None) -> _RangeFilter:
+        """Rows with lower <= value < upper (either bound may be omitted), never NULL ones."""
+        lo = self.bisect(name, NULL + 1 if name in self.values else b'') if lower is None else self.bisect(name, lower)
+        hi = self.count if upper is None else self.bisect(name, upper)
+        return _RangeFilter(self, name, lo, hi)
+
+    def contains_filter(self, name: str, needle: str) -> _SetFilter:
+        """Rows whose text contains needle, ignoring ASCII case like SQLite's LIKE."""
+        offsets, _, folded, size, nulls = self.text[name]
+        needle = needle.encode().lower()
+        rows = []
+        position = folded
+        end = folded + size
+        while True:
+            found = self._mapped.find(needle, position, end)
+            if found < 0:
+                break
+            row = bisect.bisect_right(offsets, found - folded) - 1
+            if found + len(needle) < folded + offsets[row + 1] and not nulls[row]:
+                rows.append(row)
+            position = folded + offsets[row + 1]
+        return _SetFilter(rows)
+
+    @staticmethod
+    def _positions(order, lo: int, hi: int, descending: bool, offset: int, end: Optional[int]) -> List[int]:
+        """Rows at positions [lo, hi) of a sort order (None: row numbers), paged, optionally backwards."""
+        if descending:
+            stop = lo - 1 if end is None else max(lo - 1, hi - 1 - end)
+            positions = range(hi - 1 - offset, stop, -1)
+        else:
+            positions = range(lo + offset, hi if end is None else min(hi, lo + end))
+        if order is None:
+            return list(positions)
+        if not descending:
+            return order[positions.start:max(positions.start, positions.stop)].tolist()
+        return [order[position] for position in positions]
+
+    def select(self, filters: List, sort: Optional[str], descending: bool,
+               limit: Optional[int], offset: int, sort_key: Callable = None) -> Tuple[int, List[int]]:
+        """
+        Rows matching every filter, sorted by a stored column (or by
+        sort_key(row), then id, for derived ones) and paged. Returns (total,
+        rows). Without a sort rows come in id order, and order is ignored
+        like the SQL query does. The filter with the fewest candidates
+        drives and the others test its rows in O(1) each; a page is then
+        read straight off the sort order when the driver is a range of it,
+        found by walking the sort order when matches are dense, or picked
+        from the matches with a heap.
+        """
+        end = None if limit is None else offset + limit
+        if sort is None:
+            descending = False
+        drivers = [f for f in filters if f.count is not None]
+        driver = min(drivers, key=lambda f: f.count) if drivers else None
+        others = [f for f in filters if f is not driver]
+        if others:
+            candidates = driver.rows() if driver is not None else range(self.count)
+            matched = [row for row in candidates if all(f.test(row) for f in others)]
+            total = len(matched)
+        else:
+            matched = None
+            total = driver.count if driver is not None else self.count
+
+        if sort_key is not None:
+            rows = matched if matched is not None else driver.rows() if driver is not None else range(self.count)
+            return total, sorted(rows, key=lambda row: (sort_key(row), row), reverse=descending)[offset:end]
+
+        order = self.orders[sort] if sort is not None else None
+        if driver is None and matched is None:
+            return total, self._positions(order, 0, self.count, descending, offset, end)
+        if sort is not None and driver is not None and driver.column == sort:
+            # The driver is a range of this sort order already
+            if matched is None:
+                return total, self._positions(order, driver.lo, driver.hi, descending, offset, end)
+            return total, (matched[::-1] if descending else matched)[offset:end]
+        if end is not None and end * self.count < total * total:
+            # Dense matches: walking the sort order reaches a page sooner than sorting them
+            tests = [f.test for f in filters]
+            rows = []
+            for position in (range(self.count - 1, -1, -1) if descending else range(self.count)):
+                row = order[position] if order is not None else position
+                if all(test(row) for test in tests):
+                    rows.append(row)
+                    if len(rows) == end:
+                        break
+            return total, rows[offset:]
+
+        if matched is None:
+            matched = list(driver.rows())
+        if sort is None:
+            if driver is not None and driver.column is not None:
+                matched.sort()
+            return total, matched[offset:end]
+        rank = self.ranks[sort].__getitem__
+        if end is not None:
+            pick = heapq.nlargest if descending else heapq.nsmallest
+            return total, pick(end, matched, key=rank)[offset:]
+        return total, sorted(matched, key=rank, reverse=descending)[offset:]
+
+class Snapshot:
+    """A mapped snapshot file: the inventory of one data generation, shared by every process mapping it."""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._stat = os.fstat(f.fileno())
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not an inventory snapshot')
+        length = int.from_bytes(mapped[len(MAGIC):len(MAGIC) + 8], 'little')
+        header = json.loads(mapped[len(MAGIC) + 8:len(MAGIC) + 8 + length])
+        base = len(MAGIC) + 8 + length
+        base += -base % 8
+        self.generation = header['generation']
+        self.built_at = header['built_at']
+        self.files = _Table(mapped, header['tables']['files'], base)
+        self.servers = _Table(mapped, header['tables']['servers'], base)
+
+    @staticmethod
+    def _check_order(sort: Optional[str], order: str, columns: Tuple[str, ...]):
+        if sort is not None and sort not in columns:
+            raise ValueError(f"Cannot sort by '{sort}'. Valid columns: {', '.join(columns)}")
+        if order not in ('asc', 'desc'):
+            raise ValueError("order must be 'asc' or 'desc'")
+
+    def query_files(self, filters: Dict = None, sort: str = None, order: str = 'asc',
+                    limit: int = None, offset: int = 0, stream: bool = False) -> Tuple[int, Iterable[Tuple]]:
+        """Same contract and results as DatabaseManager.query_scanned_files."""
+        self._check_order(sort, order, DatabaseManager.FILE_COLUMNS)
+        table = self.files
+        ranges = {}
+        filter_list = []
+        for name, value in (filters or {}).items():
+            if name == 'path_prefix':
+                lower, upper = DatabaseManager._prefix_range(value)
+                filter_list.append(table.range_filter('filepath', lower.encode(), upper.encode()))
+            elif name == 'filename':
+                filter_list.append(table.contains_filter('filename', value))
+            elif name in ('modified_after', 'modified_before'):
+                ranges.setdefault('last_modified', {})['lower' if name == 'modified_after' else 'upper'] = to_epoch(value)
+            elif name == 'min_size':
+                ranges.setdefault('size', {})['lower'] = value
+            elif name == 'max_size':
+                ranges.setdefault('size', {})['upper'] = value + 1
+            else:
+                raise ValueError(f'Unknown file filter: {name}')
+        for column, bounds in ranges.items():
+            filter_list.append(table.range_filter(column, bounds.get('lower'), bounds.get('upper')))
+
+        total, rows = table.select(filter_list, sort, order == 'desc', limit, offset)
+        page = table.rows(rows, DatabaseManager.FILE_COLUMNS)
+        return total, page if stream else list(page)
+
+    def query_servers(self, fresh_since: datetime, filters: Dict = None, sort: str = None,
+                      order: str = 'asc', limit: int = None, offset: int = 0) -> Tuple[int, List[Tuple]]:
+        """Same contract and results as DatabaseManager.query_servers."""
+        self._check_order(sort, order, DatabaseManager.SERVER_COLUMNS)
+        table = self.servers
+        fresh = to_epoch(fresh_since)
+        backups = table.values['backup_last_modified']
+
+        def status(row):
+            modified = backups[row]
+            if modified == NULL:
+                return 'red'
+            return 'green' if modified >= fresh else 'yellow'
+
+        filter_list = []
+        for name, value in (filters or {}).items():
+            if name in ('hostname', 'ip_address'):
+                filter_list.append(table.contains_filter(name, value))
+            elif name == 'status':
+                wanted = set(value)
+                filter_list.append(_PredicateFilter(lambda row: status(row) in wanted))
+            elif name == 'is_reachable':
+                reachable = table.values['is_reachable']
+                wanted = 1 if value else 0
+                filter_list.append(_PredicateFilter(lambda row: reachable[row] == wanted))
+            else:
+                raise ValueError(f'Unknown server filter: {name}')
+
+        total, rows = table.select(filter_list, sort, order == 'desc', limit, offset,
+                                   sort_key=status if sort == 'backup_status' else None)
+        # backup_status takes the place of the row number in SERVER_COLUMNS
+        columns = [column if column != 'backup_status' else 'id' for column in DatabaseManager.SERVER_COLUMNS]
+        position = DatabaseManager.SERVER_COLUMNS.index('backup_status')
+        page = [
+            values[:position] + (status(row),) + values[position + 1:]
+            for row, values in zip(rows, table.rows(rows, columns))
+        ]
+        return total, page
+
+class SnapshotStore:
+    """
+    Publishes and maps inventory snapshots for the web workers.
+
+    current() returns the mapped snapshot of the data generation the
+    database is at, or None while there is none, in which case the caller
+    queries SQLite. A worker that finds the published file stale rebuilds
+    it on a background thread, but only once the data has not changed for
+    min_rebuild_interval seconds: during a scan every batch of writes bumps
+    the generation, and a build would compete with the scan for an
+    inventory that is stale again before it is done. An exclusive flock on
+    <path>.lock lets one process across all workers build at a time, and
+    the others map the published file, so every worker shares one copy of
+    the data in the page cache however many workers there are. A snapshot's mapping stays valid
+    for requests still reading it after a newer file replaces it.
+    """
+
+    def __init__(self, settings: Dict = None):
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        self._snapshots = {}     # path -> Snapshot
+        self._building = set()   # paths this process is building
+        self._threads = []       # its builder threads
+        self._last_build = {}    # path -> monotonic time of the last build
+        self._lock = threading.Lock()
+
+    def path_for(self, db_manager: DatabaseManager) -> str:
+        return self.settings['path'] or db_manager.db_path + '.snapshot'
+
+    def current(self, db_manager: DatabaseManager) -> Optional[Snapshot]:
+        """The snapshot of the database's current generation, if published; starts a rebuild if not."""
+        if not self.settings['enabled']:
+            return None
+        generation, changed_at = db_manager.get_data_generation()
+        path = self.path_for(db_manager)
+        snapshot = self._snapshots.get(path)
+        if snapshot is not None and snapshot.generation == generation:
+            return snapshot
+
+        snapshot = self._map(path, snapshot)
+        if snapshot is not None and snapshot.generation == generation:
+            return snapshot
+        self._start_build(db_manager, path, changed_at)
+        return None
+
+    def _map(self, path: str, mapped: Optional[Snapshot]) -> Optional[Snapshot]:
+        """Map the published file if it is not the one already mapped."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if mapped is not None and (stat.st_ino, stat.st_mtime_ns) == (mapped._stat.st_ino, mapped._stat.st_mtime_ns):
+            return mapped
+        try:
+            snapshot = Snapshot(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error mapping snapshot {path}: {e}")
+            return None
+        self._snapshots[path] = snapshot
+        return snapshot
+
+    def _start_build(self, db_manager: DatabaseManager, path: str, changed_at: int):
+        if time.time() - changed_at < self.settings['min_rebuild_interval']:
+            # Still changing, e.g. during a scan
+            return
+        with self._lock:
+            last = self._last_build.get(path)
+            if path in self._building or (
+                    last is not None and time.monotonic() - last < self.settings['min_rebuild_interval']):
+                return
+            self._building.add(path)
+            self._last_build[path] = time.monotonic()
+        thread = threading.Thread(target=self._build, args=(db_manager, path), daemon=True,
+                                  name='snapshot-builder')
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()] + [thread]
+        thread.start()
+
+    def join(self, timeout: float = None):
+        """Wait for the builds this process started, e.g. before removing the database's directory."""
+        with self._lock:
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join(timeout)
+
+    def _build(self, db_manager: DatabaseManager, path: str):
+        try:
+            self.refresh(db_manager, path)
+        except Exception as e:
+            print(f"Error building snapshot {path}: {e}")
+        finally:
+            with self._lock:
+                self._building.discard(path)
+
+    def refresh(self, db_manager: DatabaseManager, path: str = None, wait: bool = False) -> Optional[Snapshot]:
+        """
+        Build and publish a snapshot now unless the published one is current
+        or another process is building it (then wait=True waits for it).
+        Returns the mapped snapshot, or None if another process is building.
+        """
+        path = path or self.path_for(db_manager)
+        fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+            except BlockingIOError:
+                return None
+            generation, _ = db_manager.get_data_generation()
+            snapshot = self._map(path, self._snapshots.get(path))
+            if snapshot is None or snapshot.generation != generation:
+                build_snapshot(db_manager, path)
+                snapshot = self._map(path, snapshot)
+            return snapshot
+        finally:
+            os.close(fd)
@@ -7,7 +7,11 @@ backlog = 2048
 
 # Worker processes
 workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = 'sync'
+# Threaded workers: an open /api/events stream holds a thread, not a whole worker.
+# Each worker serves at most events.max_subscribers streams (16 by default), so
+# keep threads well above it to leave room for ordinary API requests
+worker_class = 'gthread'
+threads = 32
 worker_connections = 1000
 timeout = 30
 keepalive = 2
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import threading
+from pathlib import Path
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Add the parent directory to the Python path to import the database module
+sys.path.append(str(Path(__file__).parent.parent))
+from database.db_manager import DatabaseManager
+
+try:
+    from .scan_jobs import ScanJobManager
+except ImportError:
+    from scan_jobs import ScanJobManager
+
+class TooManySubscribers(Exception):
+    """The process already streams events to max_subscribers clients."""
+
+class EventBroadcaster:
+    """
+    Live scan progress and data change notifications for the events stream.
+
+    Scanners already write their progress to scan_jobs and every visible
+    write bumps the data generation, so any worker process can tell what
+    happened by reading those two tables, whichever process ran the scan.
+    One poller thread per process reads them every poll_interval seconds
+    while anyone is subscribed and turns changes into 'job' and
+    'generation' events; subscribers only wait on a condition variable, so
+    a thousand open streams still cost one small query per interval.
+
+    Events are (sequence, event, data) tuples. Sequence numbers are local
+    to the process, so a new subscription always starts with a snapshot of
+    the current generation and the recent jobs instead of replaying
+    history; a subscriber that falls more than `history` events behind
+    gets a fresh snapshot as well.
+
+    Every open stream holds a web server thread, so at most max_subscribers
+    (None: no limit) are served at once; subscribe() raises
+    TooManySubscribers beyond that.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, poll_interval: float = 0.5,
+                 history: int = 256, recent_jobs: int = 10, max_subscribers: int = None):
+        self.db_manager = db_manager
+        self.poll_interval = poll_interval
+        self.max_subscribers = max_subscribers
+        self.recent_jobs = recent_jobs
+        self._events = deque(maxlen=history)
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._subscribers = 0
+        self._poller = None
+        self._baseline = False   # whether the running poller's starting state is recorded
+        self._generation = None
+        self._jobs = {}
+
+    @staticmethod
+    def job_event(job: Dict, previous: Optional[Dict] = None) -> Dict:
+        """
+        A job as sent to clients: the ScanJobManager description plus named
+        counters for its kind. current_rate is the rate since the previous
+        progress update, rate the average over the whole job.
+        """
+        event = ScanJobManager.describe(job)
+        current_rate = None
+        if previous is not None and job['updated_at'] > previous['updated_at']:
+            current_rate = round(
+                (job['processed'] - previous['processed']) / (job['updated_at'] - previous['updated_at']), 3
+            )
+        event['current_rate'] = current_rate
+        if job['kind'] == 'directories':
+            event['progress'] = {
+                'files_walked': job['processed'],
+                'files_per_second': current_rate if current_rate is not None else event['rate']
+            }
+        elif job['kind'] == 'servers':
+            event['progress'] = {
+                'hosts_discovered': job['total'],
+                'hosts_scanned': job['processed'],
+                'hosts_per_second': current_rate if current_rate is not None else event['rate']
+            }
+        return event
+
+    def snapshot(self) -> List[Tuple[str, Dict]]:
+        """Current state as (event, data) pairs: the data generation, then recent jobs oldest first."""
+        generation, changed_at = self.db_manager.get_data_generation()
+        events = [('generation', {'generation': generation, 'changed_at': changed_at})]
+        jobs = self.db_manager.get_scan_jobs(limit=self.recent_jobs)
+        events.extend(('job', self.job_event(job)) for job in reversed(jobs))
+        return events
+
+    def _publish(self, event: str, data: Dict):
+        """Append an event; the caller holds the condition."""
+        self._sequence += 1
+        self._events.append((self._sequence, event, data))
+
+    def _read(self) -> Tuple[Tuple[int, int], List[Dict]]:
+        return self.db_manager.get_data_generation(), self.db_manager.get_scan_jobs(limit=self.recent_jobs)
+
+    def _apply(self, generation: Tuple[int, int], jobs: List[Dict], publish: bool = True):
+        """Record the state read from the database, publishing what changed; the caller holds the condition."""
+        if publish and generation != self._generation:
+            self._publish('generation', {'generation': generation[0], 'changed_at': generation[1]})
+        self._generation = generation
+
+        for job in reversed(jobs):
+            previous = self._jobs.get(job['id'])
+            # updated_at has one-second resolution: compare the whole row
+            if publish and previous != job:
+                self._publish('job', self.job_event(job, previous))
+        # Jobs that dropped out of the recent list are forgotten
+        self._jobs = {job['id']: job for job in jobs}
+
+    def poll(self):
+        """Read the database once and publish whatever changed since the last poll."""
+        generation, jobs = self._read()
+        with self._condition:
+            published = self._sequence
+            self._apply(generation, jobs)
+            if self._sequence != published:
+                self._condition.notify_all()
+
+    def _run_poller(self):
+        while True:
+            with self._condition:
+                if self._subscribers == 0:
+                    self._poller = None
+                    self._baseline = False
+                    return
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Error polling scan events: {e}")
+            time.sleep(self.poll_interval)
+
+    def _start(self):
+        with self._condition:
+            if self.max_subscribers is not None and self._subscribers >= self.max_subscribers:
+                raise TooManySubscribers(f'Already streaming events to {self._subscribers} clients')
+            self._subscribers += 1
+        try:
+            self._start_poller()
+        except BaseException:
+            self._stop()
+            raise
+
+    def _start_poller(self):
+        """
+        Start the poller unless one is running. Nobody tracked changes without
+        a poller: the current state becomes the baseline before any
+        subscriber reads its snapshot, so nothing that happens after the
+        snapshot can be missed. The database is read without holding the
+        condition; subscribers arriving meanwhile wait for the baseline.
+        """
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._poller is None or self._baseline)
+                if self._poller is not None:
+                    return
+                self._poller = threading.Thread(target=self._run_poller, daemon=True, name='scan-events')
+            try:
+                state = self._read()
+            except BaseException:
+                with self._condition:
+                    # Let a waiting subscriber try instead
+                    self._poller = None
+                    self._condition.notify_all()
+                raise
+            with self._condition:
+                self._apply(*state, publish=False)
+                self._baseline = True
+                self._condition.notify_all()
+                self._poller.start()
+            return
+
+    def _stop(self):
+        with self._condition:
+            self._subscribers -= 1
+
+    def subscribe(self, heartbeat: float = 15.0, max_duration: float = None) -> Iterator[Optional[Tuple[str, Dict]]]:
+        """
+        Yield (event, data) pairs as they happen, starting with a snapshot.
+        Yields None after heartbeat seconds without events so the caller can
+        keep the connection alive, and stops after max_duration seconds.
+        Raises TooManySubscribers on the first next() if the process is
+        already streaming to max_subscribers clients.
+        """
+        self._start()
+        try:
+            with self._condition:
+                position = self._sequence
+            yield from self.snapshot()
+
+            deadline = time.monotonic() + max_duration if max_duration else None
+            while deadline is None or time.monotonic() < deadline:
+                timeout = heartbeat
+                if deadline is not None:
+                    timeout = min(timeout, max(0.0, deadline - time.monotonic()))
+                with self._condition:
+                    self._condition.wait_for(lambda: self._sequence > position, timeout=timeout)
+                    if self._events and self._events[0][0] > position + 1:
+                        # Fell behind the history: start over from the current state
+                        pending = None
+                    else:
+                        pending = [event for event in self._events if event[0] > position]
+                    position = self._sequence
+
+                if pending is None:
+                    yield from self.snapshot()
+                elif pending:
+                    for _, event, data in pending:
+                        yield event, data
+                else:
+                    yield None
+        finally:
+            self._stop()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import uuid
+import fcntl
+import traceback
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the parent directory to the Python path to import the database module
+sys.path.append(str(Path(__file__).parent.parent))
+from database.db_manager import DatabaseManager
+
+class ScanJobConflict(Exception):
+    """A scan of the same kind with different parameters is already running."""
+
+class JobProgress:
+    """
+    Progress callback handed to a scanner. Calls are cheap: the job row is
+    only written when the phase changes or every `interval` seconds.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, job_id: str, interval: float = 1.0):
+        self.db_manager = db_manager
+        self.job_id = job_id
+        self.interval = interval
+        self._phase = None
+        self._last_write = 0.0
+
+    def __call__(self, phase: str, processed: int, total: Optional[int] = None):
+        now = time.monotonic()
+        if phase != self._phase or now - self._last_write >= self.interval:
+            self._phase = phase
+            self._last_write = now
+            self.db_manager.update_scan_job(self.job_id, phase=phase, processed=processed, total=total)
+
+class ScanJobManager:
+    """
+    Runs scans as background jobs on a small in-process thread pool.
+
+    Only one scan of each kind runs at a time across all worker processes:
+    the job that runs holds an exclusive flock on a per-kind lock file next
+    to the database. A request for a scan that is already running attaches
+    to the running job instead of starting another one.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, max_workers: int = 2, lock_dir: str = None):
+        self.db_manager = db_manager
+        self.lock_dir = lock_dir or os.path.dirname(db_manager.db_path)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scan-job')
+
+    def _lock_path(self, kind: str) -> str:
+        return os.path.join(self.lock_dir, f'.scan-{kind}.lock')
+
+    def _try_lock(self, kind: str) -> Optional[int]:
+        """Take the per-kind lock without blocking. Returns the fd, or None if it is held."""
+        fd = os.open(self._lock_path(kind), os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    @staticmethod
+    def _unlock(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def submit(self, kind: str, params: Dict, run: Callable[[JobProgress], Dict]) -> Tuple[Dict, bool]:
+        """
+        Start `run(progress)` as a job of the given kind, or attach to the one
+        already running. Returns (job, created). Raises ScanJobConflict if the
+        running job was started with different parameters.
+        """
+        params_json = json.dumps(params, sort_keys=True)
+        deadline = time.monotonic() + 5.0
+        while True:
+            fd = self._try_lock(kind)
+            if fd is not None:
+                break
+
+            # Someone else holds the lock; their job row may take a moment to appear
+            running = self.db_manager.get_scan_jobs(kind, active_only=True, limit=1)
+            if running:
+                job = running[0]
+                if job['params'] != params_json:
+                    raise ScanJobConflict(
+                        f"A {kind} scan with different options is already running (job {job['id']})"
+                    )
+                return job, False
+            if time.monotonic() > deadline:
+                raise ScanJobConflict(f'Could not acquire the {kind} scan lock')
+            time.sleep(0.05)
+
+        try:
+            # We hold the lock, so any job still marked running was orphaned by a dead process
+            for job in self.db_manager.get_scan_jobs(kind, active_only=True, limit=100):
+                self.db_manager.update_scan_job(
+                    job['id'], status='failed', message='Interrupted', finished_at=int(time.time())
+                )
+
+            job_id = uuid.uuid4().hex
+            self.db_manager.create_scan_job(job_id, kind, params_json, os.getpid())
+            self.executor.submit(self._run, job_id, fd, run)
+        except Exception:
+            self._unlock(fd)
+            raise
+        return self.db_manager.get_scan_job(job_id), True
+
+    def _run(self, job_id: str, fd: int, run: Callable[[JobProgress], Dict]):
+        """Execute a job on the pool, record its outcome and release the lock."""
+        try:
+            result = run(JobProgress(self.db_manager, job_id))
+            self.db_manager.update_scan_job(
+                job_id, status='succeeded', phase='done',
+                message=result.get('message'), result=json.dumps(result, default=str),
+                finished_at=int(time.time())
+            )
+        except Exception as e:
+            traceback.print_exc()
+            self.db_manager.update_scan_job(
+                job_id, status='failed', message=str(e), finished_at=int(time.time())
+            )
+        finally:
+            self._unlock(fd)
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Return a job with its elapsed time, processing rate and ETA."""
+        job = self.db_manager.get_scan_job(job_id)
+        return self.describe(job) if job else None
+
+    def list_jobs(self, limit: int = 20) -> list:
+        return [self.describe(job) for job in self.db_manager.get_scan_jobs(limit=limit)]
+
+    @staticmethod
+    def describe(job: Dict) -> Dict:
+        """Add elapsed seconds, rate (items/s) and ETA (s) to a job row."""
+        job = dict(job)
+        job['params'] = json.loads(job['params']) if job['params'] else {}
+        job['result'] = json.loads(job['result']) if job['result'] else None
+
+        end = job['finished_at'] or (time.time() if job['status'] == 'running' else job['updated_at'])
+        elapsed = max(0.0, (end or job['started_at']) - job['started_at'])
+        rate = job['processed'] / elapsed if elapsed > 0 else None
+        eta = None
+        if job['status'] == 'running' and rate and job['total'] is not None:
+            eta = max(0.0, (job['total'] - job['processed']) / rate)
+
+        job['elapsed'] = round(elapsed, 3)
+        job['rate'] = round(rate, 3) if rate is not None else None
+        job['eta'] = round(eta, 1) if eta is not None else None
+        return job
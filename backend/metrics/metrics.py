@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import math
+import time
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Seconds; wide enough for both single queries and whole scans
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+# Metrics settings; override any of them with the "metrics" section of config.json
+DEFAULT_SETTINGS = {
+    'enabled': True,
+    'flush_interval': 5.0  # seconds between writes of each process's metrics to the database
+}
+
+class _Child:
+    """The values of one label set of a metric; all updates hold the metric's lock."""
+
+    __slots__ = ('_lock', 'value', 'flushed', 'counts', 'flushed_counts', 'total', 'flushed_total', '_buckets')
+
+    def __init__(self, lock: threading.Lock, buckets: Tuple[float, ...] = None):
+        self._lock = lock
+        self.value = 0.0
+        self.flushed = 0.0
+        self._buckets = buckets
+        if buckets is not None:
+            self.counts = [0] * (len(buckets) + 1)
+            self.flushed_counts = list(self.counts)
+            self.total = 0.0
+            self.flushed_total = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = value
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += value
+
+    def time(self) -> '_Timer':
+        """Context manager observing the seconds spent in its block."""
+        return _Timer(self)
+
+class _Timer:
+    __slots__ = ('_child', '_start')
+
+    def __init__(self, child: _Child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._child.observe(time.perf_counter() - self._start)
+        return False
+
+class Metric:
+    """
+    A metric family: counter, gauge or histogram, with optional labels.
+
+    Updates only touch memory under a lock, so they are cheap enough for hot
+    paths: look a child up once with labels() and keep it where the same
+    labels are used in a loop. Each process accumulates its own values;
+    Registry.flush() adds what changed since the previous flush to the
+    shared metrics table, which is what /metrics serves. Counters and
+    histograms are summed across processes, gauges keep the last value set
+    by any process.
+    """
+
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = None, registry: 'Registry' = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets or DEFAULT_BUCKETS)) if self.kind == 'histogram' else None
+        self._lock = threading.Lock()
+        self._children = {}
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values, **labels) -> _Child:
+        """The child for a label set, given in labelnames order or by name."""
+        if labels:
+            values = tuple(str(labels[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f'{self.name} takes labels {self.labelnames}')
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, _Child(self._lock, self.buckets))
+        return child
+
+    # A metric without labels is updated directly
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def _collect(self) -> Tuple[List[Tuple], List]:
+        """
+        Rows describing the changes since the last flush, and a list of
+        (child, snapshot) pairs to commit once the rows are stored.
+        """
+        rows = []
+        snapshots = []
+        with self._lock:
+            for values, child in self._children.items():
+                labels = dict(zip(self.labelnames, values))
+                if self.kind == 'histogram':
+                    delta = [count - flushed for count, flushed in zip(child.counts, child.flushed_counts)]
+                    if not any(delta):
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (math.inf,), delta):
+                        cumulative += count
+                        rows.append((self.name + '_bucket', {**labels, 'le': _format_value(bound)}, cumulative))
+                    rows.append((self.name + '_sum', labels, child.total - child.flushed_total))
+                    rows.append((self.name + '_count', labels, cumulative))
+                    snapshots.append((child, (list(child.counts), child.total)))
+                elif child.value != child.flushed:
+                    value = child.value if self.kind == 'gauge' else child.value - child.flushed
+                    rows.append((self.name, labels, value))
+                    snapshots.append((child, child.value))
+        return [
+            (self.name, self.kind, self.documentation, sample, _encode_labels(labels), value)
+            for sample, labels, value in rows
+        ], snapshots
+
+    def _commit(self, snapshots: List):
+        with self._lock:
+            for child, snapshot in snapshots:
+                if self.kind == 'histogram':
+                    child.flushed_counts, child.flushed_total = snapshot
+                else:
+                    child.flushed = snapshot
+
+class Counter(Metric):
+    kind = 'counter'
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+class Registry:
+    """The metrics of this process, and the flusher thread that stores them."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        # One flush at a time, or two could store the same changes
+        self._flush_lock = threading.Lock()
+        self._flusher_pid = None
+
+    def register(self, metric: Metric):
+        """
+        Add a metric. A module imported twice (as a script and as part of its
+        package) declares its metrics twice; both copies are flushed, so they
+        must agree on kind and labels.
+        """
+        with self._lock:
+            same_name = self._metrics.setdefault(metric.name, [])
+            for other in same_name:
+                if (other.kind, other.labelnames) != (metric.kind, metric.labelnames):
+                    raise ValueError(f'Metric {metric.name} is already registered differently')
+            same_name.append(metric)
+
+    def flush(self, db_manager) -> int:
+        """
+        Add this process's changes since the last flush to the metrics table.
+        Returns the number of rows written. Changes stay pending if the write
+        fails, so the next flush picks them up.
+        """
+        with self._lock:
+            metrics = [metric for same_name in self._metrics.values() for metric in same_name]
+        with self._flush_lock:
+            rows = []
+            pending = []
+            for metric in metrics:
+                metric_rows, snapshots = metric._collect()
+                rows.extend(metric_rows)
+                pending.append((metric, snapshots))
+            if rows:
+                db_manager.add_metric_samples(rows, int(time.time()))
+            for metric, snapshots in pending:
+                metric._commit(snapshots)
+            return len(rows)
+
+    def start_flusher(self, get_db_manager: Callable, interval: float):
+        """
+        Flush to the DatabaseManager get_db_manager() returns every interval
+        seconds on a daemon thread. Safe to call on every request: a thread
+        is started once per process, including after a fork.
+        """
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        with self._lock:
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.flush(get_db_manager())
+                except Exception as e:
+                    print(f"Error flushing metrics: {e}")
+
+        threading.Thread(target=run, daemon=True, name='metrics-flusher').start()
+
+REGISTRY = Registry()
+
+def _encode_labels(labels: Dict[str, str]) -> str:
+    return json.dumps(labels, sort_keys=True, separators=(',', ':'))
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + '}'
+
+def render(rows: Iterable[Tuple], gauges: Dict[Tuple[str, str], Dict[Tuple, float]] = None) -> str:
+    """
+    The Prometheus text exposition format for stored rows (family, kind,
+    help, sample, labels, value) plus gauges computed at scrape time, given
+    as {(name, help): {((label, value), ...): value}}.
+    """
+    families = {}
+    for family, kind, documentation, sample, labels, value in rows:
+        families.setdefault(family, (kind, documentation, []))[2].append((sample, json.loads(labels), value))
+    for (name, documentation), samples in (gauges or {}).items():
+        families[name] = ('gauge', documentation, [(name, dict(labels), value) for labels, value in samples.items()])
+
+    suffixes = {'_bucket': 0, '_sum': 1, '_count': 2}
+
+    def order(sample):
+        name, labels, _ = sample
+        le = labels.get('le')
+        rest = sorted((key, value) for key, value in labels.items() if key != 'le')
+        suffix = next((rank for end, rank in suffixes.items() if name.endswith(end)), 0)
+        return rest, suffix, float(le.replace('+Inf', 'inf')) if le is not None else 0.0
+
+    lines = []
+    for family in sorted(families):
+        kind, documentation, samples = families[family]
+        lines.append(f'# HELP {family} {_escape(documentation)}')
+        lines.append(f'# TYPE {family} {kind}')
+        for name, labels, value in sorted(samples, key=order):
+            if 'le' in labels:
+                labels = {**{key: val for key, val in labels.items() if key != 'le'}, 'le': labels['le']}
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(float(value))}')
+    return '\n'.join(lines) + '\n'
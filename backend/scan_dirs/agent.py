@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import socket
+import argparse
+from urllib.parse import quote
+from typing import Dict, List, Tuple
+
+import requests
+
+try:
+    from .walker import ParallelWalker
+    from .manifest import Entry, encode_chunks
+except ImportError:
+    # Run as a script: this directory is already on the Python path
+    from walker import ParallelWalker
+    from manifest import Entry, encode_chunks
+
+class ScanAgent:
+    """
+    Runs on a storage host and reports its backup directories to a backup
+    checker server, so the server does not walk them over NFS or SMB.
+
+    Every local root is walked with the directory scanner's ParallelWalker;
+    its listing is sorted and posted, chunk_files files at a time, to
+    POST /api/agents/<agent>/manifests as gzip-compressed NDJSON (see
+    manifest.encode_chunks). Each chunk covers a range of paths and applying
+    it is idempotent, so a chunk that fails is simply posted again. Files
+    are recorded under the server-side root each local root maps to, which
+    is usually the path the server would mount the share at. Directories and
+    files that cannot be read, or that the walker gave up on, are sent as
+    kept, so the server does not take them for removed.
+    """
+
+    # Agent settings; override any of them with the command line options
+    DEFAULT_SETTINGS = {
+        'chunk_files': 20000,   # files per manifest chunk
+        'max_workers': 16,      # directory listings in flight
+        'workers_per_root': 4,  # of which under the same root
+        'directory_timeout': 120.0,  # seconds before a hung listing is abandoned
+        'root_timeout': 3600.0,      # seconds before the rest of a root is given up on
+        'slow_stat': 0.05,           # mean seconds per stat above which a root's listings back off
+        'timeout': 300,         # seconds to wait for the server to apply a chunk
+        'retries': 5,           # attempts after a failed post of a chunk
+        'retry_backoff': 2.0    # seconds, doubled on every retry
+    }
+
+    def __init__(self, server: str, agent: str, roots: Dict[str, str], token: str = None,
+                 settings: Dict = None, session=None):
+        self.server = server.rstrip('/')
+        self.agent = agent
+        self.roots = {os.path.join(local, ''): os.path.join(remote, '') for local, remote in roots.items()}
+        self.token = token
+        self.settings = {**self.DEFAULT_SETTINGS, **(settings or {})}
+        self.session = session or requests.Session()
+
+    def list_roots(self) -> Dict[str, Tuple[List[Entry], List[str]]]:
+        """
+        Walk the local roots concurrently. Returns {local root: (entries,
+        keep)}: the files as (relpath, size, mtime_ns, inode) sorted by
+        relative path, and the relative paths that could not be read.
+        """
+        walker = ParallelWalker(
+            max_workers=self.settings['max_workers'],
+            workers_per_root=self.settings['workers_per_root'],
+            directory_timeout=self.settings['directory_timeout'],
+            root_timeout=self.settings['root_timeout'],
+            slow_stat=self.settings['slow_stat']
+        )
+        listings = {root: ([], []) for root in self.roots}
+        for root, dirpath, files, error in walker.walk(list(self.roots)):
+            entries, keep = listings[root]
+            relative = os.path.relpath(dirpath, root)
+            relative = '' if relative == '.' else relative.replace(os.sep, '/') + '/'
+            if error is not None:
+                print(f"Error scanning directory {dirpath}: {error}")
+                keep.append(relative)
+            for filename, stats in files:
+                if isinstance(stats, OSError):
+                    print(f"Error processing file {os.path.join(dirpath, filename)}: {stats}")
+                    keep.append(relative + filename)
+                    continue
+                entries.append((relative + filename, stats.st_size, stats.st_mtime_ns, stats.st_ino))
+        for root, (entries, keep) in listings.items():
+            # Directories the walker gave up on are unread, not empty
+            for dirpath in walker.unwalked[root]:
+                relative = os.path.relpath(dirpath, root)
+                keep.append('' if relative == '.' else relative.replace(os.sep, '/') + '/')
+            health = walker.health[root]
+            if health['status'] != 'complete':
+                print(f"{root}: {health['status']}, {health['unwalked']} directories not listed")
+            entries.sort()
+        return listings
+
+    def post_chunk(self, body: bytes) -> Dict:
+        """Post one manifest chunk, retrying while the server cannot be reached or fails."""
+        url = f"{self.server}/api/agents/{quote(self.agent, safe='')}/manifests"
+        headers = {'Content-Type': 'application/x-ndjson', 'Content-Encoding': 'gzip'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        error = None
+        for attempt in range(self.settings['retries'] + 1):
+            if attempt:
+                time.sleep(self.settings['retry_backoff'] * (2 ** (attempt - 1)))
+            try:
+                response = self.session.post(url, data=body, headers=headers, timeout=self.settings['timeout'])
+            except requests.RequestException as e:
+                error = e
+                continue
+            if response.status_code >= 500:
+                error = f'HTTP {response.status_code}'
+                continue
+            try:
+                payload = response.json()
+            except ValueError:
+                # Not the API answering, e.g. a proxy's 413 page
+                payload = None
+            if response.status_code != 200 or not isinstance(payload, dict):
+                message = payload.get('message') if isinstance(payload, dict) else f'HTTP {response.status_code}'
+                raise RuntimeError(f"Server rejected manifest chunk: {message}")
+            return payload
+        raise RuntimeError(f'Could not post manifest chunk: {error}')
+
+    def run(self) -> Dict[str, Dict]:
+        """Walk every root and post its manifest. Returns the server's counts per server-side root."""
+        results = {}
+        for local, (entries, keep) in self.list_roots().items():
+            remote = self.roots[local]
+            stats = {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 0}
+            for _, body in encode_chunks(self.agent, remote, entries, self.settings['chunk_files'], keep):
+                for status, count in self.post_chunk(body)['stats'].items():
+                    stats[status] += count
+            results[remote] = stats
+        return results
+
+def parse_root(value: str) -> Tuple[str, str]:
+    """LOCAL or LOCAL=REMOTE, both absolute."""
+    local, _, remote = value.partition('=')
+    local, remote = os.path.abspath(local), remote or os.path.abspath(local)
+    if not os.path.isabs(remote):
+        raise argparse.ArgumentTypeError(f'{remote} is not an absolute path')
+    return local, remote
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Walk backup directories on this host and report them to a backup checker server.'
+    )
+    parser.add_argument('--server', required=True, help='URL of the backup checker backend')
+    parser.add_argument('--agent', default=socket.gethostname(), help='name of this agent (default: hostname)')
+    parser.add_argument('--root', dest='roots', type=parse_root, action='append', required=True,
+                        metavar='LOCAL[=REMOTE]',
+                        help='directory to report, recorded under REMOTE on the server (default: LOCAL); repeatable')
+    parser.add_argument('--token', default=os.environ.get('BACKUP_CHECKER_AGENT_TOKEN'),
+                        help='the server\'s agents.token (default: $BACKUP_CHECKER_AGENT_TOKEN)')
+    parser.add_argument('--interval', type=float, default=None,
+                        help='keep reporting every INTERVAL seconds instead of once')
+    for name, default in ScanAgent.DEFAULT_SETTINGS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    args = parser.parse_args()
+
+    agent = ScanAgent(args.server, args.agent, dict(args.roots), token=args.token,
+                      settings={name: getattr(args, name) for name in ScanAgent.DEFAULT_SETTINGS})
+    while True:
+        started = time.monotonic()
+        try:
+            for root, stats in agent.run().items():
+                print(f"{root}: " + ', '.join(f"{count} {name}" for name, count in stats.items()))
+        except RuntimeError as e:
+            print(e)
+            if args.interval is None:
+                sys.exit(1)
+        if args.interval is None:
+            return
+        time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import errno
+import fnmatch
+import hashlib
+import threading
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Add the parent directory to the Python path to import the database module
+sys.path.append(str(Path(__file__).parent.parent))
+from database.db_manager import DatabaseManager
+
+MiB = 1024 * 1024
+
+def _sample_ranges(size: int, block_size: int, samples: int) -> List[Tuple[int, int]]:
+    """
+    (offset, length) of the blocks a partial fingerprint reads: the head, the
+    tail and `samples` blocks evenly spaced in between. Files no larger than
+    that are read whole.
+    """
+    if size <= (samples + 2) * block_size:
+        return [(0, size)]
+    last = size - block_size
+    offsets = [0] + [last * i // (samples + 1) for i in range(1, samples + 1)] + [last]
+    return [(offset, block_size) for offset in offsets]
+
+class FileChangedError(OSError):
+    """A file whose size no longer matches the size the walk stat'ed."""
+
+def _changed(f, size: int, actual: int) -> FileChangedError:
+    return FileChangedError(errno.ESTALE, f'File size changed from {size} to {actual} bytes', f.name)
+
+def _open(path: str, size: int, advice: Optional[int]):
+    """
+    Open a file for hashing, provided it still has the size the walk saw: one
+    truncated or rewritten since raises FileChangedError and is fingerprinted
+    by a later scan. Files are read with pread/readinto, never memory-mapped:
+    a mapped file shrinking under the reader would kill it with SIGBUS.
+    """
+    f = open(path, 'rb', buffering=0)
+    try:
+        actual = os.fstat(f.fileno()).st_size
+        if actual != size:
+            raise _changed(f, size, actual)
+        if advice is not None and hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, advice)
+    except BaseException:
+        f.close()
+        raise
+    return f
+
+def partial_hash(path: str, size: int, block_size: int, samples: int) -> Tuple[str, int]:
+    """
+    Hash the size and the sampled blocks of a file, reading only the sampled
+    blocks from disk. Returns (hex digest, bytes read).
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(size.to_bytes(8, 'little'))
+    if size == 0:
+        return digest.hexdigest(), 0
+    read = 0
+    # Sampled blocks are far apart: read-ahead would only waste NAS bandwidth
+    with _open(path, size, getattr(os, 'POSIX_FADV_RANDOM', None)) as f:
+        for offset, length in _sample_ranges(size, block_size, samples):
+            block = os.pread(f.fileno(), length, offset)
+            if len(block) != length:
+                raise _changed(f, size, offset + len(block))
+            digest.update(offset.to_bytes(8, 'little'))
+            digest.update(block)
+            read += length
+    return digest.hexdigest(), read
+
+def full_hash(path: str, size: int, chunk_size: int) -> Tuple[str, int]:
+    """Hash a whole file chunk by chunk. Returns (hex digest, bytes read)."""
+    digest = hashlib.blake2b(digest_size=32)
+    if size == 0:
+        return digest.hexdigest(), 0
+    buffer = bytearray(min(chunk_size, size))
+    view = memoryview(buffer)
+    read = 0
+    with _open(path, size, getattr(os, 'POSIX_FADV_SEQUENTIAL', None)) as f:
+        while read < size:
+            n = f.readinto(view[:min(len(buffer), size - read)])
+            if not n:
+                raise _changed(f, size, read)
+            digest.update(view[:n])
+            read += n
+    return digest.hexdigest(), size
+
+def _hash_task(kind: str, path: str, size: int, block_size: int, samples: int,
+               chunk_size: int) -> Tuple[str, int]:
+    """Process pool entry point."""
+    if kind == 'partial':
+        return partial_hash(path, size, block_size, samples)
+    return full_hash(path, size, chunk_size)
+
+class IOBudget:
+    """Bytes a scan may still read for fingerprints; None means unlimited."""
+
+    def __init__(self, max_bytes: Optional[int]):
+        self.remaining = max_bytes
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes: int) -> bool:
+        """Take nbytes from the budget if they fit."""
+        with self._lock:
+            if self.remaining is None:
+                return True
+            if nbytes > self.remaining:
+                return False
+            self.remaining -= nbytes
+            return True
+
+class Fingerprinter:
+    """
+    Content fingerprints for backup files, used to spot backups that were
+    truncated, duplicated, or touched without their content changing.
+
+    Every candidate file gets a partial fingerprint: a hash of its size, head,
+    tail and evenly spaced sample blocks. With
+    full_hash enabled, files up to full_hash_max_size are also hashed
+    completely. Results are cached in the file_fingerprints table and reused
+    while a file's device, inode, size and mtime are unchanged (also if it
+    was moved), so unchanged files are never read again. Hashing runs in a
+    process pool of `workers` processes (0 hashes in the calling process),
+    and each run reads at most io_budget bytes: files that do not fit are
+    left for a later scan. A worker that dies breaks the pool; it is rebuilt
+    and the files it had not hashed are retried once.
+
+    A rehashed file is classified against the previous fingerprint of its
+    path: 'new', 'truncated' (it shrank), 'touched' (same content, new
+    mtime or inode) or 'modified'.
+    """
+
+    DEFAULT_SETTINGS = {
+        'enabled': False,
+        'patterns': None,           # fnmatch patterns of files to fingerprint (None: every file)
+        'min_size': 0,              # skip smaller files
+        'block_size': MiB,          # size of each sampled block
+        'samples': 16,              # sampled blocks between head and tail
+        'full_hash': False,
+        'full_hash_max_size': None, # bytes; larger files only get the partial fingerprint
+        'chunk_size': 8 * MiB,      # read size for full hashes
+        'io_budget': 10 * 1024 * MiB,  # bytes read per scan (None: unlimited)
+        'workers': 4                # hashing processes (0: hash in this process)
+    }
+
+    def __init__(self, db_manager: DatabaseManager, settings: Dict = None):
+        self.db_manager = db_manager
+        self.settings = {**self.DEFAULT_SETTINGS, **(settings or {})}
+        self.scheme = f"blake2b:{self.settings['block_size']}x{self.settings['samples']}"
+        self.stats = self._empty_stats()
+
+    @staticmethod
+    def _empty_stats() -> Dict:
+        return {
+            'candidates': 0, 'cached': 0, 'hashed': 0, 'full_hashed': 0, 'deferred': 0,
+            'errors': 0, 'bytes_read': 0, 'new': 0, 'modified': 0, 'touched': 0, 'truncated': 0
+        }
+
+    def wants(self, filepath: str, size: int) -> bool:
+        """Whether a file is a fingerprint candidate under the configured patterns and min_size."""
+        if size < self.settings['min_size']:
+            return False
+        patterns = self.settings['patterns']
+        name = os.path.basename(filepath)
+        return patterns is None or any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+    def _wants_full(self, size: int) -> bool:
+        limit = self.settings['full_hash_max_size']
+        return self.settings['full_hash'] and (limit is None or size <= limit)
+
+    def _partial_cost(self, size: int) -> int:
+        return sum(length for _, length in _sample_ranges(
+            size, self.settings['block_size'], self.settings['samples']
+        ))
+
+    @staticmethod
+    def classify(previous: Optional[Dict], size: int, partial: str, full: Optional[str]) -> str:
+        if previous is None:
+            return 'new'
+        if size < previous['size']:
+            return 'truncated'
+        if partial == previous['partial_hash'] and (
+                full is None or previous['full_hash'] is None or full == previous['full_hash']):
+            return 'touched'
+        return 'modified'
+
+    def run(self, files: Iterable[Dict], progress: Callable = None) -> Dict:
+        """
+        Fingerprint files (dicts with filepath, size, device, inode and
+        mtime_ns, as DirectoryScanner collects them) and store the results.
+        progress(phase, processed, total) is called as files are hashed.
+        Returns the run's stats.
+        """
+        self.stats = self._empty_stats()
+        progress = progress or (lambda phase, processed, total=None: None)
+        cached = self.db_manager.get_fingerprints()
+        by_identity = {
+            (row['device'], row['inode'], row['size'], row['mtime_ns']): row
+            for row in cached.values() if row['scheme'] == self.scheme
+        }
+
+        rows = []
+        partial_jobs = []
+        full_jobs = []
+        for file in files:
+            if not self.wants(file['filepath'], file['size']):
+                continue
+            self.stats['candidates'] += 1
+            identity = (file['device'], file['inode'], file['size'], file['mtime_ns'])
+            hit = by_identity.get(identity)
+            if hit is not None:
+                self.stats['cached'] += 1
+                if hit['filepath'] != file['filepath']:
+                    # Moved or hard linked: same content, nothing to read
+                    rows.append(dict(hit, filepath=file['filepath']))
+                if hit['full_hash'] is None and self._wants_full(file['size']):
+                    full_jobs.append((dict(hit, filepath=file['filepath']), file))
+                continue
+            partial_jobs.append(file)
+
+        # New files first, then changed ones, newest first within each group
+        partial_jobs.sort(key=lambda file: (file['filepath'] in cached, -file['mtime_ns']))
+        budget = IOBudget(self.settings['io_budget'])
+        total = len(partial_jobs) + len(full_jobs)
+        done = 0
+
+        jobs = []
+        for file in partial_jobs:
+            if budget.reserve(self._partial_cost(file['size'])):
+                jobs.append(file)
+            else:
+                self.stats['deferred'] += 1
+        fresh = {}
+        for file, outcome in self._hash_all('partial', [(file, file) for file in jobs]):
+            done += 1
+            progress('fingerprinting', done, total)
+            if isinstance(outcome, Exception):
+                print(f"Error fingerprinting {file['filepath']}: {outcome}")
+                self.stats['errors'] += 1
+                continue
+            partial, nbytes = outcome
+            self.stats['hashed'] += 1
+            self.stats['bytes_read'] += nbytes
+            fresh[file['filepath']] = {
+                'filepath': file['filepath'], 'device': file['device'], 'inode': file['inode'],
+                'size': file['size'], 'mtime_ns': file['mtime_ns'], 'scheme': self.scheme,
+                'partial_hash': partial, 'full_hash': None
+            }
+            if self._wants_full(file['size']):
+                full_jobs.append((fresh[file['filepath']], file))
+
+        # Full hashes get whatever budget the partial fingerprints left
+        jobs = []
+        for row, file in full_jobs:
+            if budget.reserve(file['size']):
+                jobs.append((row, file))
+            else:
+                self.stats['deferred'] += 1
+        for row, outcome in self._hash_all('full', jobs):
+            done += 1
+            progress('fingerprinting', done, total)
+            if isinstance(outcome, Exception):
+                print(f"Error hashing {row['filepath']}: {outcome}")
+                self.stats['errors'] += 1
+                continue
+            full, nbytes = outcome
+            self.stats['full_hashed'] += 1
+            self.stats['bytes_read'] += nbytes
+            row['full_hash'] = full
+            if row['filepath'] not in fresh:
+                rows.append(row)
+
+        now = int(time.time())
+        for filepath, row in fresh.items():
+            row['status'] = self.classify(cached.get(filepath), row['size'], row['partial_hash'], row['full_hash'])
+            row['hashed_at'] = now
+            self.stats[row['status']] += 1
+            rows.append(row)
+        if rows:
+            self.db_manager.save_fingerprints(rows)
+        return self.stats
+
+    def _hash_all(self, kind: str, jobs: List[Tuple[Any, Dict]]) -> Iterator[Tuple[Any, Any]]:
+        """
+        Hash the files of (key, file) jobs, yielding (key, (digest, bytes
+        read)) as they complete, or (key, exception) for files that could not
+        be read. A worker process that dies (killed by the OOM killer, say)
+        fails every call still queued in its pool: the pool is rebuilt and
+        those files are retried once before they are given up on.
+        """
+        pending = list(enumerate(jobs))
+        retried = set()
+        while pending:
+            broken = []
+            with self._executor() as executor:
+                submitted = {
+                    self._submit(executor, kind, file): (index, key)
+                    for index, (key, file) in pending
+                }
+                for future in as_completed(submitted):
+                    index, key = submitted[future]
+                    try:
+                        outcome = future.result()
+                    except BrokenProcessPool as e:
+                        if index not in retried:
+                            broken.append(index)
+                            continue
+                        outcome = e
+                    except (OSError, ValueError) as e:
+                        outcome = e
+                    yield key, outcome
+            if broken:
+                print(f"Fingerprint worker died; retrying {len(broken)} file(s) in a new pool")
+            retried.update(broken)
+            pending = [(index, jobs[index]) for index in sorted(broken)]
+
+    def _executor(self):
+        if self.settings['workers'] <= 0:
+            return _InlineExecutor()
+        # spawn: the app's worker processes are multi-threaded, which makes fork unsafe
+        return ProcessPoolExecutor(
+            max_workers=self.settings['workers'], mp_context=multiprocessing.get_context('spawn')
+        )
+
+    def _submit(self, executor, kind: str, file: Dict) -> Future:
+        return executor.submit(
+            _hash_task, kind, file['filepath'], file['size'],
+            self.settings['block_size'], self.settings['samples'], self.settings['chunk_size']
+        )
+
+class _InlineExecutor:
+    """Runs submitted calls immediately; stands in for the process pool when workers is 0."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    @staticmethod
+    def submit(fn, *args) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import gzip
+import json
+import uuid
+import posixpath
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Add the parent directory to the Python path to import the backup_status and metrics modules
+sys.path.append(str(Path(__file__).parent.parent))
+from backup_status.backup_status import refresh_backup_status
+from metrics.metrics import Counter, Histogram
+
+MANIFEST_VERSION = 1
+MAX_LINE_BYTES = 65536
+
+# Agent ingestion settings; override any of them with the "agents" section of config.json
+DEFAULT_SETTINGS = {
+    'enabled': True,
+    'token': None,             # secret agents must send as "Authorization: Bearer <token>"; null refuses every agent
+    'max_chunk_files': 100000  # files a manifest chunk may hold
+}
+
+CHUNKS = Counter(
+    'backup_checker_agent_manifest_chunks_total', 'Manifest chunks applied per agent', ['agent']
+)
+CHUNK_SECONDS = Histogram(
+    'backup_checker_agent_manifest_chunk_seconds', 'Time to apply each manifest chunk to the database', ['agent']
+)
+
+# (relpath, size, mtime_ns, inode)
+Entry = Tuple[str, int, int, Optional[int]]
+
+class AgentRootConflict(Exception):
+    """A manifest names a root this server walks itself, or one another agent reports."""
+
+def encode_chunks(agent: str, root: str, entries: List[Entry], chunk_files: int,
+                  keep: Iterable[str] = (), scan_id: str = None) -> Iterator[Tuple[Dict, bytes]]:
+    """
+    Split an agent's listing of a root into gzip-compressed NDJSON manifest
+    chunks and yield them as (header, body). entries must be sorted by
+    relative path, with '/' separators. The first line of each chunk is its
+    header:
+
+        {"version": 1, "agent": ..., "root": ..., "scan_id": ..., "seq": 0,
+         "after": null, "through": "Acronis/ub01.tib", "files": 2, "keep": []}
+
+    and every further line a file:
+
+        {"path": "Acronis/ub01.tib", "size": 10, "mtime_ns": 1700000000000000000, "inode": 42}
+
+    A chunk lists every file whose path sorts after `after` and up to
+    `through`; the last chunk has no `through`, so the chunks of a manifest
+    cover the whole root between them and each can be applied, or applied
+    again, on its own. keep names the directories (ending in '/', '' for the
+    root itself) and files the agent could not read.
+    """
+    scan_id = scan_id or uuid.uuid4().hex
+    keep = list(keep)
+    count = max(1, -(-len(entries) // chunk_files))
+    for seq in range(count):
+        start = seq * chunk_files
+        chunk = entries[start:start + chunk_files]
+        header = {
+            'version': MANIFEST_VERSION,
+            'agent': agent,
+            'root': root,
+            'scan_id': scan_id,
+            'seq': seq,
+            'after': entries[start - 1][0] if seq else None,
+            'through': chunk[-1][0] if seq < count - 1 else None,
+            'files': len(chunk),
+            'keep': keep
+        }
+        lines = [json.dumps(header)]
+        lines.extend(
+            json.dumps({'path': path, 'size': size, 'mtime_ns': mtime_ns, 'inode': inode})
+            for path, size, mtime_ns, inode in chunk
+        )
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6, mtime=0) as f:
+            f.write(('\n'.join(lines) + '\n').encode())
+        yield header, buffer.getvalue()
+
+def _is_relpath(path) -> bool:
+    """A normalized relative path that stays below the root."""
+    return (isinstance(path, str) and path != '' and '\0' not in path and not path.startswith('/')
+            and posixpath.normpath(path) == path and path != '..' and not path.startswith('../'))
+
+def _is_int(value, minimum: int = None) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and (minimum is None or value >= minimum)
+
+def _parse_line(line: bytes) -> Dict:
+    if len(line) > MAX_LINE_BYTES:
+        raise ValueError(f'Manifest line longer than {MAX_LINE_BYTES} bytes')
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError('Manifest lines must be JSON objects')
+    return record
+
+def read_manifest(stream: BinaryIO, max_files: int) -> Tuple[Dict, Iterator[Entry]]:
+    """
+    Parse a manifest chunk from a binary stream, reading it as it arrives.
+    Returns its validated header, with the root normalized to end in a
+    separator, and an iterator over its entries that raises ValueError on
+    a malformed entry, one out of order or outside the chunk's range, or
+    when the chunk ends with more or fewer files than its header says (a
+    truncated upload).
+    """
+    header = _parse_line(stream.readline(MAX_LINE_BYTES + 1))
+    if header.get('version') != MANIFEST_VERSION:
+        raise ValueError(f'Unsupported manifest version: {header.get("version")!r}')
+    root = header.get('root')
+    if not isinstance(root, str) or not os.path.isabs(root) or '\0' in root:
+        raise ValueError('Manifest root must be an absolute path')
+    for key in ('agent', 'scan_id'):
+        if not isinstance(header.get(key), str) or not 0 < len(header[key]) <= 128:
+            raise ValueError(f'Manifest {key} must be a string of 1 to 128 characters')
+    if not _is_int(header.get('seq'), 0):
+        raise ValueError('Manifest seq must be a non-negative integer')
+    if not _is_int(header.get('files'), 0):
+        raise ValueError('Manifest files must be a non-negative integer')
+    if header['files'] > max_files:
+        raise ValueError(f'Manifest chunks may hold at most {max_files} files')
+    after, through = header.get('after'), header.get('through')
+    for key, value in (('after', after), ('through', through)):
+        if value is not None and not _is_relpath(value):
+            raise ValueError(f'Manifest {key} must be null or a relative path')
+    if after is not None and through is not None and after >= through:
+        raise ValueError('Manifest after must sort before through')
+    keep = header.get('keep', [])
+    if not isinstance(keep, list) or not all(
+            path == '' or _is_relpath(path[:-1] if isinstance(path, str) and path.endswith('/') else path)
+            for path in keep):
+        raise ValueError('Manifest keep must be a list of relative paths')
+
+    header = {
+        'agent': header['agent'], 'root': os.path.join(os.path.normpath(root), ''), 'scan_id': header['scan_id'],
+        'seq': header['seq'], 'after': after, 'through': through, 'files': header['files'], 'keep': keep
+    }
+
+    def entries() -> Iterator[Entry]:
+        count = 0
+        previous = after
+        while True:
+            line = stream.readline(MAX_LINE_BYTES + 1)
+            if not line:
+                break
+            if not line.strip():
+                continue
+            record = _parse_line(line)
+            path, size, mtime_ns, inode = (record.get(key) for key in ('path', 'size', 'mtime_ns', 'inode'))
+            if not _is_relpath(path) or not _is_int(size, 0) or not _is_int(mtime_ns) or not (
+                    inode is None or _is_int(inode, 0)):
+                raise ValueError(f'Malformed manifest entry: {line[:200]!r}')
+            if (previous is not None and path <= previous) or (through is not None and path > through):
+                raise ValueError(f'Manifest entry out of order or outside the chunk: {path}')
+            count += 1
+            if count > header['files']:
+                raise ValueError(f"Manifest chunk holds more than the {header['files']} files its header says")
+            previous = path
+            yield path, size, mtime_ns, inode
+        if count != header['files']:
+            raise ValueError(f"Manifest chunk ended after {count} of its {header['files']} files")
+
+    return header, entries()
+
+def _check_root(scanner, root: str):
+    """Refuse roots overlapping one this server walks or another agent reports."""
+    for directory in scanner.directories:
+        walked = os.path.join(os.path.abspath(directory), '')
+        if walked.startswith(root) or root.startswith(walked):
+            raise AgentRootConflict(f'{root} overlaps {directory}, which this server scans itself')
+    for row in scanner.db_manager.get_agent_roots():
+        if row['root'] != root and (row['root'].startswith(root) or root.startswith(row['root'])):
+            raise AgentRootConflict(f"{root} overlaps {row['root']}, reported by agent {row['agent']}")
+
+def ingest_manifest(scanner, agent: str, stream: BinaryIO, max_files: int) -> Dict:
+    """
+    Apply one manifest chunk an agent posted with scanner.apply_manifest():
+    claim its root for the agent, reconcile the chunk's range of paths with
+    the file index, and refresh the backup status when the manifest's last
+    chunk lands if any of its chunks changed anything. Raises ValueError
+    for a malformed chunk and AgentRootConflict for a root that is not the
+    agent's to report. Returns the chunk's root, scan_id, seq, whether it
+    was the last one and its counts.
+    """
+    header, entries = read_manifest(stream, max_files)
+    if header['agent'] != agent:
+        raise ValueError(f"Manifest is from agent {header['agent']}, not {agent}")
+    root = header['root']
+    _check_root(scanner, root)
+    owner = scanner.db_manager.claim_agent_root(agent, root, header['scan_id'])
+    if owner != agent:
+        raise AgentRootConflict(f'{root} is reported by agent {owner}')
+
+    with CHUNK_SECONDS.labels(agent).time():
+        stats = dict(scanner.apply_manifest(root, entries, header['after'], header['through'], header['keep']))
+    final = header['through'] is None
+    changes = scanner.db_manager.record_agent_chunk(
+        root, header['scan_id'], header['seq'], stats['added'] + stats['changed'] + stats['removed'], final
+    )
+    CHUNKS.labels(agent).inc()
+    if final and changes:
+        refresh_backup_status(scanner.db_manager, scanner.history_settings)
+    return {'root': root, 'scan_id': header['scan_id'], 'seq': header['seq'], 'final': final, 'stats': stats}
+
+def release_root(scanner, agent: str, root: str) -> int:
+    """
+    Stop accepting an agent's manifests for a root and remove its files.
+    Raises KeyError if the agent does not report that root. Returns the
+    number of files removed.
+    """
+    root = os.path.join(os.path.normpath(root), '')
+    if not any(row['root'] == root for row in scanner.db_manager.get_agent_roots(agent)):
+        raise KeyError(root)
+    removed = scanner.apply_manifest(root, [])['removed']
+    scanner.db_manager.release_agent_root(root)
+    if removed:
+        refresh_backup_status(scanner.db_manager, scanner.history_settings)
+    return removed
@@ -2,100 +2,487 @@
 
 import os
 import json
+import stat
+import time
+import signal
+import argparse
+import posixpath
 from datetime import datetime
 import sys
 from pathlib import Path
+from typing import Callable, Iterable, NamedTuple, Optional, Tuple
 
 # Add the parent directory to the Python path to import the database module
 sys.path.append(str(Path(__file__).parent.parent))
-from database.db_manager import DatabaseManager
+from database.db_manager import DatabaseManager, BulkFileWriter
+from backup_status.backup_status import refresh_backup_status
+from metrics.metrics import REGISTRY, Counter, Gauge, Histogram, DEFAULT_SETTINGS as METRICS_DEFAULTS
+
+try:
+    from .walker import ParallelWalker, DirectoryTimeout
+    from .fingerprint import Fingerprinter
+    from .watcher import DirectoryWatcher
+except ImportError:
+    # Run as a script: this directory is already on the Python path
+    from walker import ParallelWalker, DirectoryTimeout
+    from fingerprint import Fingerprinter
+    from watcher import DirectoryWatcher
+
+STAGE_SECONDS = Histogram(
+    'backup_checker_directory_scan_stage_seconds', 'Duration of each directory scan stage', ['stage']
+)
+WALK_SECONDS = Histogram(
+    'backup_checker_directory_scan_walk_seconds', 'Time to walk each root', ['root']
+)
+STAT_SECONDS = Counter(
+    'backup_checker_directory_scan_stat_seconds_total', 'Seconds spent in stat calls per root', ['root']
+)
+FILES_SEEN = Counter(
+    'backup_checker_directory_scan_files_total', 'Files seen by directory scans per root and status',
+    ['root', 'status']
+)
+FILES_PER_SECOND = Gauge(
+    'backup_checker_directory_scan_files_per_second', 'Walk throughput of the last scan of each root', ['root']
+)
+ERRORS = Counter(
+    'backup_checker_directory_scan_errors_total', 'Directories and files that could not be read, per root',
+    ['root', 'kind']
+)
+ROOT_STATUS = Gauge(
+    'backup_checker_directory_scan_root_status',
+    'Outcome of the last walk of each root: 1 for its status (complete, partial or timed_out), 0 for the others',
+    ['root', 'status']
+)
+CONCURRENCY = Gauge(
+    'backup_checker_directory_scan_concurrency', 'Listings per root the walker allowed at the end of its last walk',
+    ['root']
+)
+
+class ManifestStat(NamedTuple):
+    """The stat fields a remote agent's manifest gives for a file, named like os.stat_result's."""
+    st_ino: Optional[int]
+    st_size: int
+    st_mtime_ns: int
+    st_dev: Optional[int] = None
+
+    @property
+    def st_mtime(self) -> float:
+        return self.st_mtime_ns / 1e9
 
 class DirectoryScanner:
-    def __init__(self, db_manager: DatabaseManager, config_path: str):
+    def __init__(self, db_manager: DatabaseManager, config_path: str, incremental: bool = None):
         self.db_manager = db_manager
         self.config_path = config_path
-        self.directories = self._load_config()
+        config = self._load_config()
+        self.directories = config.get('directories_to_scan', [])
+        self.settings = config.get('directory_scan', {})
+        self.history_settings = config.get('history', {})
+        if incremental is None:
+            incremental = self.settings.get('incremental', True)
+        self.incremental = incremental
+        self.stats = self._empty_stats()
+        self.health = {}
+        self.fingerprinter = Fingerprinter(db_manager, self.settings.get('fingerprint'))
+        self.fingerprint_stats = None
 
-    def _load_config(self) -> list:
-        """Load directories from config file."""
+    def _load_config(self) -> dict:
+        """Load the scanner configuration from the config file."""
         try:
             with open(self.config_path, 'r') as f:
-                config = json.load(f)
-                return config.get('directories_to_scan', [])
+                return json.load(f)
         except Exception as e:
             print(f"Error loading config file: {e}")
-            return []
+            return {}
+
+    @staticmethod
+    def _empty_stats() -> dict:
+        return {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 0}
+
+    def _bulk_writer(self):
+        """Open a batched writer using the configured batch size and flush interval."""
+        return self.db_manager.bulk_writer(
+            batch_size=self.settings.get('batch_size'),
+            flush_interval=self.settings.get('flush_interval')
+        )
 
-    def scan_directories(self) -> dict:
+    def scan_directories(self, progress: Callable = None) -> dict:
         """
         Scan all configured directories and store file information in the database.
+        The roots are walked concurrently. In incremental mode only new, changed
+        and removed files are written; the counts are left in self.stats.
+        How completely each root was walked is left in self.health (see
+        ParallelWalker); files below directories that timed out or were never
+        listed are kept, and those of a root that timed out not fingerprinted.
+        If fingerprints are enabled, the walked files are fingerprinted after
+        the backup status is refreshed, and that stage's counts are left in
+        self.fingerprint_stats.
+        progress(phase, processed, total) is called as files are walked; total
+        is estimated from the previous scan.
         Returns a dictionary of processed files by directory.
         """
-        results = {}
+        self.stats = self._empty_stats()
+        progress = progress or (lambda phase, processed, total=None: None)
+        estimate = self.db_manager.count_indexed_files(self.directories) or None
         
-        # Clear previous scan results
-        self.db_manager.clear_scanned_files()
+        # Roots remote agents report are theirs to keep current
+        agent_roots = [row['root'] for row in self.db_manager.get_agent_roots()]
+        if not self.incremental or not self.db_manager.has_file_index():
+            # Full scan, or the first incremental scan over a table that was
+            # filled without an index: start from a clean slate
+            self.db_manager.clear_scanned_files(keep_roots=agent_roots)
         
-        for directory in self.directories:
-            results[directory] = self.scan_directory(directory)
-            
+        with STAGE_SECONDS.labels('walk').time(), self._bulk_writer() as writer:
+            results = self._scan_roots(self.directories, writer, progress, estimate)
+
+            # Files under roots that were removed from the config are gone too
+            for root in self.db_manager.get_indexed_roots():
+                if root not in self.directories and root not in agent_roots:
+                    for filepath in self.db_manager.get_file_index(root):
+                        writer.remove(filepath)
+                        self.stats['removed'] += 1
+
+        if self._has_changes():
+            progress('refreshing backup status', self._files_seen(), self._files_seen())
+            with STAGE_SECONDS.labels('refresh').time():
+                refresh_backup_status(self.db_manager, self.history_settings)
+
+        # Hashing only enriches the inventory: it runs once status is current
+        if self.fingerprinter.settings['enabled']:
+            with STAGE_SECONDS.labels('fingerprint').time():
+                # Reading files on a mount that stopped answering would hang too
+                self.fingerprint_stats = self.fingerprinter.run(
+                    (file for directory, files in results.items()
+                     if self.health[directory]['status'] != 'timed_out' for file in files),
+                    progress
+                )
+
         return results
 
-    def scan_directory(self, directory_path: str) -> list:
+    def _files_seen(self) -> int:
+        return self.stats['added'] + self.stats['changed'] + self.stats['unchanged']
+
+    def _has_changes(self) -> bool:
+        return not self.incremental or any(self.stats[key] for key in ('added', 'changed', 'removed'))
+
+    def scan_directory(self, directory_path: str, writer: BulkFileWriter = None) -> list:
         """
         Scan a single directory recursively and store file information in the database.
+        Files whose inode, size and mtime match the file index are left untouched.
         Returns a list of processed files.
         """
-        processed_files = []
-        
-        try:
-            for root, _, files in os.walk(directory_path):
-                for filename in files:
-                    filepath = os.path.join(root, filename)
-                    try:
-                        # Get file stats
-                        stats = os.stat(filepath)
-                        last_modified = datetime.fromtimestamp(stats.st_mtime)
-                        size = stats.st_size
-
-                        # Store in database
-                        file_id = self.db_manager.add_scanned_file(
-                            filename=filename,
-                            filepath=filepath,
-                            last_modified=last_modified,
-                            size=size
-                        )
-                        
-                        processed_files.append({
-                            'id': file_id,
-                            'filename': filename,
-                            'filepath': filepath,
-                            'last_modified': last_modified,
-                            'size': size
-                        })
-                        
-                    except OSError as e:
-                        print(f"Error processing file {filepath}: {e}")
-                        continue
-                    
-        except Exception as e:
-            print(f"Error scanning directory {directory_path}: {e}")
-            
-        return processed_files
+        if writer is None:
+            with self._bulk_writer() as writer:
+                processed_files = self.scan_directory(directory_path, writer)
+            if self._has_changes():
+                refresh_backup_status(self.db_manager, self.history_settings)
+            return processed_files
+        return self._scan_roots([directory_path], writer)[directory_path]
+
+    def root_of(self, path: str) -> Optional[str]:
+        """The configured root a path lies under (the innermost if roots are nested), or None."""
+        matches = [root for root in self.directories if path.startswith(os.path.join(root, ''))]
+        return max(matches, key=len) if matches else None
+
+    def apply_changes(self, filepaths: Iterable[str] = (), subtrees: Iterable[str] = (),
+                      refresh: bool = True) -> list:
+        """
+        Reconcile just the given files and directory subtrees with the file
+        index, as the watcher does with the paths its events name. Files are
+        stat'ed and added, changed or removed; subtrees are walked like roots,
+        and a subtree that no longer exists (under a root that does) has its
+        files removed. Paths outside the configured roots are ignored. The
+        counts are left in self.stats, and the backup status is refreshed if
+        anything changed, unless refresh is False (the watcher throttles its
+        refreshes). Returns the processed files.
+        """
+        self.stats = self._empty_stats()
+        prefixes = []
+        walks = {}
+        for subtree in sorted({os.path.join(path, '') for path in subtrees}, key=len):
+            root = self.root_of(subtree)
+            if root is None or any(subtree.startswith(prefix) for prefix in prefixes):
+                continue
+            prefixes.append(subtree)
+            walks[root if os.path.join(root, '') == subtree else subtree] = root
+        filepaths = [
+            path for path in dict.fromkeys(filepaths)
+            if self.root_of(path) is not None and not any(path.startswith(prefix) for prefix in prefixes)
+        ]
+
+        processed = []
+        with self._bulk_writer() as writer:
+            for directory, root in list(walks.items()):
+                if directory != root and os.path.isdir(root) and not os.path.isdir(directory):
+                    del walks[directory]
+                    for filepath in self.db_manager.get_file_index_under(directory):
+                        writer.remove(filepath)
+                        self.stats['removed'] += 1
+            for files in self._scan_roots(walks, writer).values():
+                processed.extend(files)
+
+            counts = self._empty_stats()
+            known = self.db_manager.get_file_index_entries(filepaths)
+            for filepath in filepaths:
+                try:
+                    stats = os.stat(filepath)
+                except (FileNotFoundError, NotADirectoryError):
+                    if filepath in known:
+                        writer.remove(filepath)
+                        self.stats['removed'] += 1
+                    continue
+                except OSError as e:
+                    print(f"Error processing file {filepath}: {e}")
+                    continue
+                if stat.S_ISDIR(stats.st_mode):
+                    continue
+                processed.append(self._reconcile(
+                    writer, self.root_of(filepath), filepath, os.path.basename(filepath),
+                    stats, known.get(filepath), counts
+                ))
+
+        if self.fingerprinter.settings['enabled']:
+            changed = [file for file in processed if file['status'] != 'unchanged']
+            if changed:
+                self.fingerprint_stats = self.fingerprinter.run(changed)
+
+        if refresh and self._has_changes():
+            refresh_backup_status(self.db_manager, self.history_settings)
+        return processed
+
+    def apply_manifest(self, root: str, entries: Iterable[Tuple[str, int, int, Optional[int]]],
+                       after: str = None, through: str = None, keep: Iterable[str] = ()) -> dict:
+        """
+        Reconcile the file index with a remote agent's listing of the files
+        under root whose relative paths sort after `after` and up to
+        `through` (None: unbounded), given as (relpath, size, mtime_ns,
+        inode) entries. Indexed files of that range missing from the
+        listing are removed, except those the agent could not read: keep
+        holds relative directory prefixes (ending in '/', or '' for the
+        whole root) and exact file paths. Applying a listing twice changes
+        nothing the second time. The counts are left in self.stats and
+        returned; the backup status is not refreshed.
+        """
+        self.stats = self._empty_stats()
+        counts = self._empty_stats()
+        prefix = os.path.join(root, '')
+        known = self.db_manager.get_file_index_between(
+            root,
+            prefix + after if after is not None else None,
+            prefix + through if through is not None else None
+        )
+        keep = [prefix + path for path in keep]
+        with self._bulk_writer() as writer:
+            for relpath, size, mtime_ns, inode in entries:
+                filepath = prefix + relpath
+                self._reconcile(
+                    writer, root, filepath, posixpath.basename(relpath),
+                    ManifestStat(inode, size, mtime_ns), known.pop(filepath, None), counts
+                )
+            for filepath in known:
+                if not any(filepath == path or (path.endswith('/') and filepath.startswith(path)) for path in keep):
+                    writer.remove(filepath)
+                    self.stats['removed'] += 1
+                    counts['removed'] += 1
+
+        for status, count in counts.items():
+            FILES_SEEN.labels(root, status).inc(count)
+        return self.stats
+
+    def _scan_roots(self, directories, writer: BulkFileWriter,
+                    progress: Callable = None, estimate: int = None) -> dict:
+        """
+        Walk the given directories in parallel and reconcile each one with the
+        file index. directories is a list of roots, or a dict mapping each
+        directory to walk to the root it belongs to, for subtrees. Walk time,
+        stat time, file counts and errors are recorded for whole roots, and
+        the walker's health report per directory is left in self.health.
+        """
+        if not isinstance(directories, dict):
+            directories = {directory: directory for directory in directories}
+        walker = ParallelWalker(
+            max_workers=self.settings.get('max_workers', 16),
+            workers_per_root=self.settings.get('workers_per_root', 4),
+            directory_timeout=self.settings.get('directory_timeout', 120),
+            root_timeout=self.settings.get('root_timeout', 3600),
+            max_timeouts=self.settings.get('max_timeouts', 3),
+            slow_stat=self.settings.get('slow_stat', 0.05)
+        )
+        roots = {
+            directory: {
+                'root': root,
+                'processed': [],
+                'previous': (
+                    {} if not self.incremental
+                    else self.db_manager.get_file_index(root) if directory == root
+                    else self.db_manager.get_file_index_under(directory)
+                ),
+                'failed_dirs': [],
+                'counts': {'added': 0, 'changed': 0, 'unchanged': 0, 'removed': 0},
+                'errors': {'directory': 0, 'file': 0, 'timeout': 0},
+                'finished': None
+            }
+            for directory, root in directories.items()
+        }
+
+        started = time.perf_counter()
+        for directory, dirpath, files, error in walker.walk(list(roots)):
+            state = roots[directory]
+            if progress is not None:
+                progress('walking', self._files_seen(), estimate)
+            if error is not None:
+                print(f"Error scanning directory {dirpath}: {error}")
+                state['failed_dirs'].append(os.path.join(dirpath, ''))
+                state['errors']['timeout' if isinstance(error, DirectoryTimeout) else 'directory'] += 1
+
+            for filename, stats in files:
+                filepath = os.path.join(dirpath, filename)
+                if isinstance(stats, OSError):
+                    print(f"Error processing file {filepath}: {stats}")
+                    state['errors']['file'] += 1
+                    # Keep the previous record rather than treating it as removed
+                    state['previous'].pop(filepath, None)
+                    continue
+
+                known = state['previous'].pop(filepath, None)
+                state['processed'].append(
+                    self._reconcile(writer, state['root'], filepath, filename, stats, known, state['counts'])
+                )
+            state['finished'] = time.perf_counter()
+
+        # Whatever is left in the index was not found on disk, except below
+        # directories that could not be listed or were given up on
+        self.health = walker.health
+        for directory, state in roots.items():
+            if walker.unwalked[directory]:
+                print(f"Gave up on {directory} after {walker.health[directory]['seconds']}s, "
+                      f"{len(walker.unwalked[directory])} directories not listed")
+            failed = set(state['failed_dirs'])
+            failed.update(os.path.join(path, '') for path in walker.unwalked[directory])
+            for filepath in state['previous']:
+                if not failed or not self._is_below(filepath, failed):
+                    writer.remove(filepath)
+                    self.stats['removed'] += 1
+                    state['counts']['removed'] += 1
+            if directory == state['root']:
+                self._record_root_metrics(directory, state, walker, started)
+
+        return {directory: state['processed'] for directory, state in roots.items()}
+
+    def _reconcile(self, writer: BulkFileWriter, root: str, filepath: str, filename: str,
+                   stats: os.stat_result, known: tuple, counts: dict) -> dict:
+        """
+        Queue the write a file needs given its file index entry (None if it is
+        not indexed), count it and return its processed-file record.
+        """
+        last_modified = datetime.fromtimestamp(stats.st_mtime)
+        size = stats.st_size
+        signature = (stats.st_ino, size, stats.st_mtime_ns)
+
+        if known is None:
+            writer.add(
+                root, filename, filepath, last_modified, size,
+                stats.st_ino, stats.st_mtime_ns
+            )
+            status = 'added'
+        elif tuple(known) != signature:
+            writer.update(
+                root, filepath, last_modified, size,
+                stats.st_ino, stats.st_mtime_ns
+            )
+            status = 'changed'
+        else:
+            status = 'unchanged'
+        self.stats[status] += 1
+        counts[status] += 1
+
+        return {
+            'filename': filename,
+            'filepath': filepath,
+            'last_modified': last_modified,
+            'size': size,
+            'status': status,
+            'device': stats.st_dev,
+            'inode': stats.st_ino,
+            'mtime_ns': stats.st_mtime_ns
+        }
+
+    @staticmethod
+    def _is_below(filepath: str, directories: set) -> bool:
+        """Whether a path lies below any of a set of directories, each ending in a separator."""
+        directory = os.path.dirname(filepath)
+        while True:
+            if os.path.join(directory, '') in directories:
+                return True
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                return False
+            directory = parent
+
+    @staticmethod
+    def _record_root_metrics(root: str, state: dict, walker: ParallelWalker, started: float):
+        walked = (state['finished'] or started) - started
+        WALK_SECONDS.labels(root).observe(walked)
+        STAT_SECONDS.labels(root).inc(walker.stat_seconds.get(root, 0.0))
+        for status, count in state['counts'].items():
+            FILES_SEEN.labels(root, status).inc(count)
+        for kind, count in state['errors'].items():
+            if count:
+                ERRORS.labels(root, kind).inc(count)
+        files = sum(state['counts'][status] for status in ('added', 'changed', 'unchanged'))
+        if walked > 0:
+            FILES_PER_SECOND.labels(root).set(files / walked)
+        health = walker.health[root]
+        for status in ('complete', 'partial', 'timed_out'):
+            ROOT_STATUS.labels(root, status).set(1 if health['status'] == status else 0)
+        CONCURRENCY.labels(root).set(health['concurrency'])
+
+def watch(db_manager: DatabaseManager, config_path: str):
+    """Keep the database current with inotify until interrupted or terminated."""
+    scanner = DirectoryScanner(db_manager, config_path, incremental=True)
+    watcher = DirectoryWatcher(scanner, scanner.settings.get('watch'))
+    metrics_settings = {**METRICS_DEFAULTS, **scanner._load_config().get('metrics', {})}
+    if metrics_settings['enabled']:
+        REGISTRY.start_flusher(lambda: db_manager, metrics_settings['flush_interval'])
+    signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+
+    print(f"Watching {', '.join(scanner.directories)}")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        REGISTRY.flush(db_manager)
+    print(', '.join(f"{count} {name}" for name, count in watcher.stats.items()))
 
 def main():
+    parser = argparse.ArgumentParser(description='Scan the configured backup directories into the database.')
+    parser.add_argument('--watch', action='store_true',
+                        help='after scanning, keep applying changes as inotify reports them (Linux)')
+    args = parser.parse_args()
+
     # Initialize database manager
     db_manager = DatabaseManager()
     
     # Get config file path
     config_path = os.path.join(Path(__file__).parent.parent, 'config.json')
+    if args.watch:
+        watch(db_manager, config_path)
+        return
     scanner = DirectoryScanner(db_manager, config_path)
     
     # Scan all configured directories
     results = scanner.scan_directories()
+    REGISTRY.flush(db_manager)
     
     # Print results
     print("\nScan Results:")
+    print(', '.join(f"{count} {name}" for name, count in scanner.stats.items()))
+    if scanner.fingerprint_stats is not None:
+        print("Fingerprints: " + ', '.join(f"{count} {name}" for name, count in scanner.fingerprint_stats.items()))
+    for directory, health in scanner.health.items():
+        if health['status'] != 'complete':
+            print(f"{directory}: {health['status']} ({health['errors']} errors, {health['timeouts']} timeouts, "
+                  f"{health['unwalked']} directories not listed)")
     for directory, files in results.items():
         print(f"\nDirectory: {directory}")
         print(f"Found {len(files)} files:")
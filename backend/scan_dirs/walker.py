@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import errno
+import queue
+import threading
+from collections import deque
+from typing import Iterator, List, Tuple
+
+class DirectoryTimeout(OSError):
+    """A directory listing that was still running after the walker's directory_timeout."""
+
+class ParallelWalker:
+    """
+    Walks several directory trees at once with os.scandir.
+
+    Every directory listing is a task for a pool of at most max_workers
+    listings in flight; subdirectories found by a task are queued as new
+    tasks, and at most workers_per_root listings of the same root are in
+    flight at a time so one large tree cannot starve the others. Like
+    os.walk (without followlinks) symlinked directories are not descended
+    into. The seconds spent in stat calls are added up per root in
+    stat_seconds.
+
+    Listings run on daemon threads so that a call blocked on a hung mount
+    cannot wedge the walk. A listing still running after directory_timeout
+    seconds is abandoned, its thread left to return on its own and replaced,
+    and reported as a DirectoryTimeout error. A root is given up once
+    max_timeouts of its listings timed out, root_timeout seconds after the
+    walk began, or when its own listing times out; the directories it had
+    yet to list are left in unwalked[root]. Each root's concurrency adapts
+    between 1 and workers_per_root: it halves when a listing's mean stat
+    call takes longer than slow_stat seconds or a listing times out, and
+    grows back by one after about as many fast listings as it allows.
+
+    health[root] reports each walk: its status ('complete', 'partial' if
+    some directories could not be listed or timed out, 'timed_out' if it was
+    given up), the directories listed, errors, timeouts, directories left
+    unwalked, seconds and the concurrency it ended at.
+    """
+
+    def __init__(self, max_workers: int = 16, workers_per_root: int = 4, directory_timeout: float = None,
+                 root_timeout: float = None, max_timeouts: int = 3, slow_stat: float = None):
+        self.max_workers = max(1, max_workers)
+        self.workers_per_root = max(1, workers_per_root)
+        self.directory_timeout = directory_timeout
+        self.root_timeout = root_timeout
+        self.max_timeouts = max_timeouts
+        self.slow_stat = slow_stat
+        self.stat_seconds = {}
+        self.health = {}
+        self.unwalked = {}
+
+    @staticmethod
+    def _scan_dir(path: str) -> Tuple[list, list, OSError, float]:
+        """
+        List one directory. Returns (files, subdirs, error, stat_seconds) where
+        files holds (filename, stat_result) pairs, or (filename, OSError) if
+        the stat failed.
+        """
+        files = []
+        subdirs = []
+        stat_seconds = 0.0
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+
+                    if is_dir:
+                        try:
+                            is_symlink = entry.is_symlink()
+                        except OSError:
+                            is_symlink = False
+                        if not is_symlink:
+                            subdirs.append(entry.path)
+                        continue
+
+                    start = time.perf_counter()
+                    try:
+                        files.append((entry.name, entry.stat()))
+                    except OSError as e:
+                        files.append((entry.name, e))
+                    stat_seconds += time.perf_counter() - start
+        except OSError as e:
+            return files, subdirs, e, stat_seconds
+        return files, subdirs, None, stat_seconds
+
+    def _work(self, tasks: queue.Queue, results: queue.Queue):
+        """Listing thread: list the queued directories until told to stop with None."""
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            token, path = task
+            results.put((token, self._scan_dir(path)))
+
+    def walk(self, roots: List[str]) -> Iterator[Tuple[str, str, list, OSError]]:
+        """
+        Yield (root, dirpath, files, error) for every directory under the given
+        roots, in completion order. error is the OSError raised while listing
+        dirpath, in which case files may be incomplete, or a DirectoryTimeout.
+        """
+        roots = list(dict.fromkeys(roots))
+        started = time.monotonic()
+        pending = {root: deque([root]) for root in roots}
+        running = {root: {} for root in roots}   # token -> (path, dispatched at)
+        limits = {root: float(self.workers_per_root) for root in roots}
+        backed_off = {root: started for root in roots}
+        finished = {root: started for root in roots}
+        self.stat_seconds = {root: 0.0 for root in roots}
+        self.unwalked = {root: [] for root in roots}
+        self.health = {
+            root: {'status': 'complete', 'directories': 0, 'errors': 0, 'timeouts': 0, 'unwalked': 0}
+            for root in roots
+        }
+        tasks, results = queue.Queue(), queue.Queue()
+        owners = {}         # token -> root, for listings in flight
+        abandoned = set()   # tokens of listings given up on whose threads have not returned
+        threads = 0
+        tokens = iter(range(1, 2 ** 62))
+
+        def in_flight() -> int:
+            return len(owners) - len(abandoned)
+
+        def dispatch(root: str, path: str):
+            nonlocal threads
+            token = next(tokens)
+            owners[token] = root
+            running[root][token] = (path, time.monotonic())
+            # Threads stuck in abandoned listings do not count towards the pool
+            if threads < len(owners):
+                threading.Thread(target=self._work, args=(tasks, results), daemon=True,
+                                 name='walker').start()
+                threads += 1
+            tasks.put((token, path))
+
+        def schedule():
+            # Round-robin over roots until the pool or every root is saturated
+            submitted = True
+            while submitted and in_flight() < self.max_workers:
+                submitted = False
+                for root in roots:
+                    if in_flight() >= self.max_workers:
+                        break
+                    if pending[root] and len(running[root]) < int(limits[root]):
+                        dispatch(root, pending[root].popleft())
+                        submitted = True
+
+        def back_off(root: str, dispatched: float, now: float):
+            # Once per round of listings: those already in flight saw the same conditions
+            if dispatched >= backed_off[root]:
+                limits[root] = max(1.0, limits[root] / 2)
+                backed_off[root] = now
+
+        def abandon(root: str, token: int) -> str:
+            path, _ = running[root].pop(token)
+            abandoned.add(token)
+            return path
+
+        def give_up(root: str, now: float):
+            for token in list(running[root]):
+                self.unwalked[root].append(abandon(root, token))
+            self.unwalked[root].extend(pending[root])
+            pending[root].clear()
+            self.health[root]['status'] = 'timed_out'
+            finished[root] = now
+
+        def next_deadline() -> float:
+            deadlines = []
+            if self.directory_timeout is not None:
+                deadlines.extend(
+                    dispatched + self.directory_timeout
+                    for listings in running.values() for _, dispatched in listings.values()
+                )
+            if self.root_timeout is not None:
+                deadlines.append(started + self.root_timeout)
+            return min(deadlines) if deadlines else None
+
+        try:
+            schedule()
+            while in_flight():
+                deadline = next_deadline()
+                items = []
+                try:
+                    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                    items.append(results.get(timeout=timeout))
+                    while True:
+                        items.append(results.get_nowait())
+                except queue.Empty:
+                    pass
+
+                now = time.monotonic()
+                completed = []
+                for token, (files, subdirs, error, stat_seconds) in items:
+                    root = owners.pop(token)
+                    if token in abandoned:
+                        abandoned.discard(token)
+                        continue
+                    path, dispatched = running[root].pop(token)
+                    self.stat_seconds[root] += stat_seconds
+                    health = self.health[root]
+                    health['directories'] += 1
+                    if error is not None:
+                        health['errors'] += 1
+                    if (self.slow_stat is not None and files
+                            and stat_seconds / len(files) > self.slow_stat):
+                        back_off(root, dispatched, now)
+                    else:
+                        limits[root] = min(float(self.workers_per_root), limits[root] + 1 / limits[root])
+                    pending[root].extend(subdirs)
+                    finished[root] = now
+                    completed.append((root, path, files, error))
+
+                for root in roots:
+                    if self.directory_timeout is not None:
+                        for token, (path, dispatched) in list(running[root].items()):
+                            if now - dispatched < self.directory_timeout:
+                                continue
+                            abandon(root, token)
+                            self.health[root]['timeouts'] += 1
+                            back_off(root, dispatched, now)
+                            finished[root] = now
+                            if path == root:
+                                # Nothing below it can be reached
+                                self.health[root]['status'] = 'timed_out'
+                            completed.append((root, path, [], DirectoryTimeout(
+                                errno.ETIMEDOUT, f'Listing took longer than {self.directory_timeout}s', path
+                            )))
+                        if self.max_timeouts and self.health[root]['timeouts'] >= self.max_timeouts:
+                            if running[root] or pending[root]:
+                                give_up(root, now)
+                    if (self.root_timeout is not None and now - started >= self.root_timeout
+                            and (running[root] or pending[root])):
+                        give_up(root, now)
+
+                # Keep the pool busy while the caller processes the results
+                schedule()
+                for result in completed:
+                    yield result
+        finally:
+            # Idle threads exit now, stuck ones whenever their call returns
+            for _ in range(threads):
+                tasks.put(None)
+            for root in roots:
+                health = self.health[root]
+                health['unwalked'] = len(self.unwalked[root])
+                if health['status'] == 'complete' and (health['errors'] or health['timeouts']):
+                    health['status'] = 'partial'
+                health['seconds'] = round(finished[root] - started, 3)
+                health['concurrency'] = int(limits[root])
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Add the parent directory to the Python path to import the metrics and backup_status modules
+sys.path.append(str(Path(__file__).parent.parent))
+from metrics.metrics import Counter, Gauge, Histogram
+from backup_status.backup_status import refresh_backup_status
+
+# inotify(7) event bits
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+# Files are picked up when created and again when their writer closes them,
+# rather than on every write (IN_MODIFY), which would flood the queue while
+# a multi-gigabyte backup is being written
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+EVENTS = Counter(
+    'backup_checker_watcher_events_total', 'inotify events received by the directory watcher', ['root', 'kind']
+)
+BATCH_SECONDS = Histogram(
+    'backup_checker_watcher_batch_seconds', 'Duration of each batch of watched changes applied to the database'
+)
+WATCHES = Gauge(
+    'backup_checker_watcher_watches', 'Directories watched per root', ['root']
+)
+
+class Inotify:
+    """A minimal non-blocking inotify(7) instance, bound through libc with ctypes."""
+
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available on this platform')
+        libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        libc.inotify_rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            self._raise('inotify_init1')
+
+    def _raise(self, call: str, path: str = None):
+        code = ctypes.get_errno()
+        raise OSError(code, f'{call}: {os.strerror(code)}', path)
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            self._raise('inotify_add_watch', path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        # Fails harmlessly if the kernel already dropped the watch
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self) -> List[Tuple[int, int, int, str]]:
+        """Return the queued events as (wd, mask, cookie, name) without blocking."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = self._EVENT.unpack_from(data, offset)
+                offset += self._EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                events.append((wd, mask, cookie, name))
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+class DirectoryWatcher:
+    """
+    Keeps scanned_files current between scans by applying inotify events
+    from the configured roots through DirectoryScanner.apply_changes().
+
+    Every directory under each root is watched. Events only mark paths as
+    dirty: a batch is applied once no event has arrived for coalesce_delay
+    seconds, or max_delay seconds after its first event while events keep
+    coming, so a burst of writes costs one transaction. The backup status
+    refresh, which re-matches every file and records a history snapshot,
+    follows a batch at most once every refresh_interval seconds; batches in
+    between are folded into the next one. New and moved-in directories are watched and walked, since
+    files may land in them before their watch exists; removed and moved-out
+    directories have their files removed.
+
+    Each root has its own inotify instance, so its own event queue: when a
+    queue overflows (IN_Q_OVERFLOW) only that root's events were lost and
+    only that root is rescanned, incrementally. A root whose directories
+    exceed fs.inotify.max_user_watches is only partly watched and relies on
+    the periodic rescan of every root every rescan_interval seconds, which
+    also covers changes inotify cannot see, such as those made on an NFS
+    server rather than through this host.
+
+    Linux only; a manual scan may run alongside, as both write idempotently.
+    """
+
+    # Watcher settings; override any of them with the "directory_scan.watch" section of config.json
+    DEFAULT_SETTINGS = {
+        'coalesce_delay': 1.0,    # seconds without events before a batch is applied
+        'max_delay': 10.0,        # seconds after its first event a batch is applied at the latest
+        'refresh_interval': 60.0, # minimum seconds between backup status refreshes after batches
+        'rescan_interval': 3600   # seconds between incremental rescans of every root; null to disable
+    }
+
+    def __init__(self, scanner, settings: Dict = None):
+        self.scanner = scanner
+        self.settings = {**self.DEFAULT_SETTINGS, **(settings or {})}
+        self.stats = {'events': 0, 'batches': 0, 'overflows': 0, 'rescans': 0, 'refreshes': 0}
+        self._instances = {}   # root -> Inotify
+        self._watches = {}     # root -> {wd: directory}
+        self._watched = {}     # root -> {directory: wd}
+        self._dirty_files = set()
+        self._dirty_dirs = set()
+        self._first_event = None
+        self._last_event = None
+        self._last_rescan = None
+        self._last_refresh = None
+        self._refresh_pending = False
+        self._full_warned = set()
+        self._stop = threading.Event()
+
+    def start(self):
+        """Watch every root, then scan them incrementally so no change falls between the two."""
+        for root in self.scanner.directories:
+            self._watch_root(root)
+        self.rescan()
+
+    def _watch_root(self, root: str):
+        if root in self._instances or not os.path.isdir(root):
+            if root not in self._instances:
+                print(f"Not watching {root}: not a directory")
+            return
+        self._instances[root] = Inotify()
+        self._watches[root] = {}
+        self._watched[root] = {}
+        self._watch_tree(root, root)
+
+    def _watch_tree(self, root: str, directory: str):
+        """Watch a directory and every directory below it, not following symlinks."""
+        pending = [directory]
+        while pending:
+            path = pending.pop()
+            try:
+                wd = self._instances[root].add_watch(path, WATCH_MASK)
+            except OSError as e:
+                if e.errno == errno.ENOSPC and root not in self._full_warned:
+                    self._full_warned.add(root)
+                    print(f"Watch limit reached under {root}; raise fs.inotify.max_user_watches. "
+                          f"Unwatched directories are only updated by periodic rescans.")
+                elif e.errno not in (errno.ENOENT, errno.ENOTDIR, errno.ENOSPC):
+                    print(f"Error watching directory {path}: {e}")
+                continue
+            # A directory moved within the root keeps its watch descriptor
+            previous = self._watches[root].get(wd)
+            if previous is not None:
+                self._watched[root].pop(previous, None)
+            self._watches[root][wd] = path
+            self._watched[root][path] = wd
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                pending.append(entry.path)
+                        except OSError:
+                            pass
+            except OSError:
+                pass
+        WATCHES.labels(root).set(len(self._watches[root]))
+
+    def _unwatch_tree(self, root: str, directory: str):
+        """Stop watching a directory that went away and everything watched below it."""
+        prefix = os.path.join(directory, '')
+        for path in [path for path in self._watched[root] if path == directory or path.startswith(prefix)]:
+            wd = self._watched[root].pop(path)
+            self._watches[root].pop(wd, None)
+            self._instances[root].rm_watch(wd)
+        WATCHES.labels(root).set(len(self._watches[root]))
+
+    def handle(self, root: str, wd: int, mask: int, name: str):
+        """Mark the paths an event names as dirty."""
+        self.stats['events'] += 1
+        now = time.monotonic()
+        self._last_event = now
+        if self._first_event is None:
+            self._first_event = now
+
+        if mask & IN_Q_OVERFLOW:
+            # Events were dropped: the whole root is suspect, but only this one
+            self.stats['overflows'] += 1
+            EVENTS.labels(root, 'overflow').inc()
+            print(f"Event queue overflowed for {root}; rescanning it")
+            self._dirty_dirs.add(root)
+            return
+
+        directory = self._watches[root].get(wd)
+        if directory is None:
+            return
+        if mask & IN_IGNORED:
+            # The kernel dropped the watch: the directory was deleted or unmounted
+            self._watches[root].pop(wd, None)
+            self._watched[root].pop(directory, None)
+            if directory == root:
+                self._dirty_dirs.add(root)
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            # Below the root the parent's event covers it
+            if directory == root:
+                self._dirty_dirs.add(root)
+            return
+
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            EVENTS.labels(root, 'directory').inc()
+            if mask & (IN_MOVED_FROM | IN_DELETE):
+                self._unwatch_tree(root, path)
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(root, path)
+            self._dirty_dirs.add(path)
+        else:
+            EVENTS.labels(root, 'file').inc()
+            self._dirty_files.add(path)
+
+    @property
+    def pending(self) -> bool:
+        return bool(self._dirty_files or self._dirty_dirs)
+
+    def poll(self, timeout: float) -> int:
+        """Wait up to timeout seconds for events and handle them. Returns the number handled."""
+        poller = select.poll()
+        roots = {}
+        for root, instance in self._instances.items():
+            poller.register(instance.fd, select.POLLIN)
+            roots[instance.fd] = root
+        handled = 0
+        for fd, _ in poller.poll(max(0.0, timeout) * 1000):
+            root = roots[fd]
+            for wd, mask, _, name in self._instances[root].read():
+                self.handle(root, wd, mask, name)
+                handled += 1
+        return handled
+
+    def _apply_due(self) -> Optional[float]:
+        """When the pending batch is due, or None if nothing is pending."""
+        if not self.pending:
+            return None
+        return min(self._last_event + self.settings['coalesce_delay'],
+                   self._first_event + self.settings['max_delay'])
+
+    def apply(self) -> list:
+        """Apply the dirty paths to the database now. Returns the processed files."""
+        files, dirs = self._dirty_files, self._dirty_dirs
+        self._dirty_files, self._dirty_dirs = set(), set()
+        self._first_event = self._last_event = None
+        if not files and not dirs:
+            return []
+        with BATCH_SECONDS.time():
+            processed = self.scanner.apply_changes(files, dirs, refresh=False)
+        self.stats['batches'] += 1
+        stats = self.scanner.stats
+        if any(stats[key] for key in ('added', 'changed', 'removed')):
+            print(', '.join(f"{count} {name}" for name, count in stats.items()))
+            self._refresh_pending = True
+            self.refresh()
+        return processed
+
+    def _refresh_due(self) -> Optional[float]:
+        """When the pending backup status refresh is due, or None if none is pending."""
+        if not self._refresh_pending:
+            return None
+        if self._last_refresh is None:
+            return time.monotonic()
+        return self._last_refresh + self.settings['refresh_interval']
+
+    def refresh(self, force: bool = False):
+        """Refresh the backup status for the batches applied since the last refresh, once it is due."""
+        due = self._refresh_due()
+        if due is None or (not force and time.monotonic() < due):
+            return
+        refresh_backup_status(self.scanner.db_manager, self.scanner.history_settings)
+        self._refreshed()
+
+    def _refreshed(self):
+        self.stats['refreshes'] += 1
+        self._refresh_pending = False
+        self._last_refresh = time.monotonic()
+
+    def rescan(self):
+        """Rescan every root incrementally, watching roots that have (re)appeared first."""
+        for root in self.scanner.directories:
+            if root in self._instances and not self._watched[root].get(root):
+                self._instances.pop(root).close()
+            self._watch_root(root)
+        self.scanner.scan_directories()
+        self.stats['rescans'] += 1
+        self._last_rescan = time.monotonic()
+        # The scan refreshed the backup status itself if it changed anything,
+        # which covers the batches applied before it
+        if any(self.scanner.stats[key] for key in ('added', 'changed', 'removed')):
+            self._refreshed()
+
+    def run(self):
+        """Watch until stop() is called."""
+        self.start()
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                deadlines = [due for due in (self._apply_due(), self._refresh_due()) if due is not None]
+                if self.settings['rescan_interval']:
+                    deadlines.append(self._last_rescan + self.settings['rescan_interval'])
+                # Wake up at least once a second to notice stop()
+                timeout = min([1.0] + [due - now for due in deadlines])
+                self.poll(timeout)
+
+                now = time.monotonic()
+                due = self._apply_due()
+                if due is not None and now >= due:
+                    self.apply()
+                self.refresh()
+                if (self.settings['rescan_interval'] and not self._stop.is_set()
+                        and now >= self._last_rescan + self.settings['rescan_interval']):
+                    self.apply()
+                    self.rescan()
+        finally:
+            try:
+                self.refresh(force=True)
+            finally:
+                self.close()
+
+    def stop(self):
+        self._stop.set()
+
+    def close(self):
+        for instance in self._instances.values():
+            instance.close()
+        self._instances = {}
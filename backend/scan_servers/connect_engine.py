@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+
+import time
+import queue
+import socket
+import asyncio
+import resource
+import ipaddress
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from .engines import DISCOVERY_SECONDS, HOST_SECONDS, ScanEngine
+except ImportError:
+    from engines import DISCOVERY_SECONDS, HOST_SECONDS, ScanEngine
+
+# The ports nmap -F scans (its 100 most common TCP ports)
+TOP_100_PORTS = [
+    7, 9, 13, 21, 22, 23, 25, 26, 37, 53, 79, 80, 81, 88, 106, 110, 111, 113, 119, 135,
+    139, 143, 144, 179, 199, 389, 427, 443, 444, 445, 465, 513, 514, 515, 543, 544, 548,
+    554, 587, 631, 646, 873, 990, 993, 995, 1025, 1026, 1027, 1028, 1029, 1110, 1433,
+    1720, 1723, 1755, 1900, 2000, 2001, 2049, 2121, 2717, 3000, 3128, 3306, 3389, 3986,
+    4899, 5000, 5009, 5051, 5060, 5101, 5190, 5357, 5432, 5631, 5666, 5800, 5900, 6000,
+    6001, 6646, 7070, 8000, 8008, 8009, 8080, 8081, 8443, 8888, 9100, 9999, 10000, 32768,
+    49152, 49153, 49154, 49155, 49156, 49157
+]
+
+# Ports tried first to tell whether a host is up at all
+DISCOVERY_PORTS = [22, 80, 443, 445, 3389, 135, 139, 8080]
+
+class RttEstimator:
+    """
+    Connect timeout that adapts to the network, computed like TCP's
+    retransmission timeout: smoothed RTT plus four times its variance,
+    clamped to [min_timeout, max_timeout]. Starts at max_timeout.
+    """
+
+    def __init__(self, min_timeout: float, max_timeout: float):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.srtt = None
+        self.rttvar = None
+
+    @property
+    def timeout(self) -> float:
+        if self.srtt is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, self.srtt + 4 * self.rttvar))
+
+    def update(self, rtt: float):
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+class ConnectEngine(ScanEngine):
+    """
+    Unprivileged scan engine built on asyncio TCP connects, for running
+    without root.
+
+    A host is up when any discovery port answers, whether the connection
+    is accepted or refused (a refusal is the host's own RST), so no raw
+    sockets are needed. Live hosts are then checked on every port in
+    ports, straight away, while discovery of other addresses goes on.
+    At most max_hosts addresses are in flight and at most max_concurrency
+    connects are open at once (bounded by the open file limit), and
+    max_rate caps connect attempts per second. Connect timeouts follow the
+    round trip times measured in each /24.
+
+    There is no OS detection or MAC address, so hosts report detected_os
+    'Unknown' and mac_address None.
+    """
+
+    name = 'connect'
+    requires_root = False
+
+    def __init__(self, ports: List[int] = None, discovery_ports: List[int] = None,
+                 max_concurrency: int = 1000, max_hosts: int = 256, min_timeout: float = 0.05,
+                 max_timeout: float = 1.0, max_rate: int = None):
+        self.ports = sorted(set(ports or TOP_100_PORTS))
+        self.discovery_ports = list(dict.fromkeys(discovery_ports or DISCOVERY_PORTS))
+        # Leave file descriptors for the database, logs and the web server
+        soft_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        if soft_limit != resource.RLIM_INFINITY:
+            max_concurrency = min(max_concurrency, soft_limit - 64)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_hosts = max(1, max_hosts)
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.max_rate = max_rate
+
+    @staticmethod
+    def service_name(port: int) -> str:
+        try:
+            return socket.getservbyport(port, 'tcp')
+        except OSError:
+            return 'unknown'
+
+    def _host_result(self, ip_address: str, answers: Dict[int, Optional[bool]],
+                     ports: List[int]) -> Dict:
+        """
+        Build a host record from {port: True (open), False (refused) or None
+        (no answer)}. Every answer counts towards liveness, but only ports
+        are reported open, so discovery-only ports stay out of open_ports.
+        """
+        open_ports = [
+            f'{port}/tcp ({self.service_name(port)})'
+            for port in sorted(ports) if answers.get(port)
+        ]
+        up = any(answer is not None for answer in answers.values())
+        return {
+            'ip_address': ip_address,
+            'mac_address': None,
+            'state': 'up' if up else 'down',
+            'detected_os': 'Unknown',
+            'open_ports': ', '.join(open_ports) if open_ports else None
+        }
+
+    class _Run:
+        """Per-scan asyncio state: connect limits, rate pacing and RTT estimators."""
+
+        def __init__(self, engine: 'ConnectEngine'):
+            self.engine = engine
+            self.sockets = asyncio.Semaphore(engine.max_concurrency)
+            self.interval = 1.0 / engine.max_rate if engine.max_rate else 0.0
+            self.next_slot = 0.0
+            self.estimators = {}
+
+        def estimator(self, ip_address: str) -> RttEstimator:
+            key = ip_address.rsplit('.', 1)[0]
+            if key not in self.estimators:
+                self.estimators[key] = RttEstimator(self.engine.min_timeout, self.engine.max_timeout)
+            return self.estimators[key]
+
+        async def pace(self):
+            """Wait for this connect's turn under max_rate."""
+            if not self.interval:
+                return
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+
+        async def connect(self, ip_address: str, port: int) -> Optional[bool]:
+            """True if the port accepted, False if refused, None if nothing answered in time."""
+            await self.pace()
+            estimator = self.estimator(ip_address)
+            loop = asyncio.get_running_loop()
+            async with self.sockets:
+                start = loop.time()
+                try:
+                    _, writer = await asyncio.wait_for(
+                        asyncio.open_connection(ip_address, port), timeout=estimator.timeout
+                    )
+                except ConnectionRefusedError:
+                    estimator.update(loop.time() - start)
+                    return False
+                except (asyncio.TimeoutError, OSError):
+                    return None
+                estimator.update(loop.time() - start)
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
+                return True
+
+        async def probe(self, ip_address: str, ports: List[int],
+                        answers: Dict[int, Optional[bool]] = None) -> Dict[int, Optional[bool]]:
+            """Connect to every port not answered yet, concurrently."""
+            answers = dict(answers or {})
+            ports = [port for port in ports if port not in answers]
+            results = await asyncio.gather(*(self.connect(ip_address, port) for port in ports))
+            answers.update(zip(ports, results))
+            return answers
+
+        async def scan_host(self, ip_address: str,
+                            answers: Dict[int, Optional[bool]] = None) -> Dict:
+            """Full result for one host, reusing answers already collected during discovery."""
+            start = time.perf_counter()
+            answers = await self.probe(ip_address, self.engine.ports, answers)
+            HOST_SECONDS.labels(self.engine.name, 'full').observe(time.perf_counter() - start)
+            return self.engine._host_result(ip_address, answers, self.engine.ports)
+
+    async def _scan_addresses(self, items: Iterable[Tuple[str, object]],
+                              handle: Callable, emit: Callable):
+        """Run handle(run, ip_address, tag) for every (ip_address, tag) with max_hosts in flight."""
+        run = self._Run(self)
+        pending = asyncio.Queue(maxsize=self.max_hosts)
+
+        async def worker():
+            while True:
+                item = await pending.get()
+                if item is None:
+                    return
+                ip_address, tag = item
+                try:
+                    await handle(run, ip_address, tag)
+                except Exception as e:
+                    emit(('host', {'ip_address': ip_address, 'scan': 'full', 'error': str(e)}))
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(self.max_hosts)]
+        for item in items:
+            await pending.put(item)
+        for _ in workers:
+            await pending.put(None)
+        await asyncio.gather(*workers)
+
+    def _events(self, coroutine_factory: Callable[[Callable], object]) -> Iterator:
+        """Run a scan coroutine on its own event loop thread and yield what it emits."""
+        events = queue.Queue()
+        done = object()
+        failure = []
+
+        def run():
+            try:
+                asyncio.run(coroutine_factory(events.put))
+            except BaseException as e:
+                failure.append(e)
+            finally:
+                events.put(done)
+
+        threading.Thread(target=run, daemon=True, name='connect-scan').start()
+        while True:
+            event = events.get()
+            if event is done:
+                break
+            yield event
+        if failure:
+            raise failure[0]
+
+    def scan_hosts(self, ip_addresses: Iterable[str]) -> Iterator[Dict]:
+        """
+        Connect scan the given addresses on every configured port and yield
+        one result per host in completion order; hosts where nothing
+        answered are reported with state 'down'.
+        """
+        ip_addresses = list(dict.fromkeys(ip_addresses))
+
+        def scan(emit):
+            async def handle(run, ip_address, _):
+                emit(('host', dict(await run.scan_host(ip_address), scan='full')))
+
+            return self._scan_addresses(((ip, None) for ip in ip_addresses), handle, emit)
+
+        for _, host in self._events(scan):
+            yield host
+
+    def _addresses(self, blocks: List[str], emit: Callable) -> Iterator[Tuple[str, str]]:
+        """(ip_address, block) for every host address of every block, in order."""
+        for block in blocks:
+            try:
+                network = ipaddress.ip_network(block, strict=False)
+            except ValueError:
+                emit(('block_error', {'block': block, 'error': 'not an IP network'}))
+                continue
+            hosts = [network.network_address] if network.num_addresses == 1 else network.hosts()
+            for address in hosts:
+                yield str(address), block
+
+    def scan_networks(self, targets: Iterable[str], block_prefix: int = 24, parallel_discovery: int = 4,
+                      plan: Callable[[Dict], bool] = None,
+                      verify: Callable[[Dict], bool] = None) -> Iterator[Tuple[str, Dict]]:
+        """
+        Discover and scan networks (see ScanEngine.scan_networks). Every
+        address is a connect probe on discovery_ports; live hosts are
+        scanned on all ports right away. parallel_discovery is not used:
+        concurrency comes from max_hosts and max_concurrency. A connect scan
+        has no cheaper variant, so plan() and verify() only decide whether
+        an unchanged host is reported as scan='probe', keeping the details
+        of its last full nmap scan.
+        """
+        blocks = self.split_targets(targets, block_prefix)
+        seen = set()
+
+        def scan(emit):
+            async def handle(run, ip_address, block):
+                if ip_address in seen:
+                    return
+                seen.add(ip_address)
+                start = time.perf_counter()
+                answers = await run.probe(ip_address, self.discovery_ports)
+                DISCOVERY_SECONDS.labels(self.name).observe(time.perf_counter() - start)
+                if all(answer is None for answer in answers.values()):
+                    return
+                found = {'ip_address': ip_address, 'mac_address': None, 'block': block}
+                emit(('found', found))
+                result = await run.scan_host(ip_address, answers)
+                probed = plan is not None and plan(found) and verify(result)
+                emit(('host', dict(result, scan='probe' if probed else 'full')))
+
+            return self._scan_addresses(self._addresses(blocks, emit), handle, emit)
+
+        yield from self._events(scan)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import sys
+import ipaddress
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+# Add the parent directory to the Python path to import the metrics module
+sys.path.append(str(Path(__file__).parent.parent))
+from metrics.metrics import Histogram
+
+DISCOVERY_SECONDS = Histogram(
+    'backup_checker_server_scan_discovery_seconds',
+    'Time to sweep one discovery target: an nmap block, or one address for the connect engine',
+    ['engine']
+)
+HOST_SECONDS = Histogram(
+    'backup_checker_server_scan_host_seconds',
+    'Time from the start of a host scan until its result arrived', ['engine', 'scan']
+)
+
+class ScanEngine:
+    """
+    Interface of the engines SubnetScanner can discover and scan hosts with.
+
+    Engines report hosts as dicts with ip_address, mac_address, state,
+    detected_os, open_ports ("22/tcp (ssh), ...") and scan ('full' or
+    'probe'), or ip_address and error when a host could not be scanned.
+    requires_root tells callers whether the engine needs raw sockets.
+    """
+
+    name = None
+    requires_root = False
+
+    @staticmethod
+    def split_targets(targets: Iterable[str], block_prefix: int = 24) -> List[str]:
+        """
+        Split CIDRs larger than block_prefix into blocks of that size so they
+        can be discovered concurrently. Duplicates are dropped; entries that
+        are not networks (hostnames, ranges) are passed through unchanged.
+        """
+        blocks = []
+        for target in targets:
+            try:
+                network = ipaddress.ip_network(target, strict=False)
+            except ValueError:
+                blocks.append(target)
+                continue
+            if network.version == 4 and network.prefixlen < block_prefix:
+                blocks.extend(str(block) for block in network.subnets(new_prefix=block_prefix))
+            else:
+                blocks.append(str(network))
+        return list(dict.fromkeys(blocks))
+
+    def scan_hosts(self, ip_addresses: Iterable[str]) -> Iterator[Dict]:
+        """Scan the given addresses and yield one host per address in completion order."""
+        raise NotImplementedError
+
+    def scan_networks(self, targets: Iterable[str], block_prefix: int = 24, parallel_discovery: int = 4,
+                      plan: Callable[[Dict], bool] = None,
+                      verify: Callable[[Dict], bool] = None) -> Iterator[Tuple[str, Dict]]:
+        """
+        Discover the live hosts in targets and scan each one as soon as it is
+        found. plan(found) returning True allows a cheaper scan for a host;
+        verify(result) then decides whether that result stands (scan='probe')
+        or the host needs a full scan. Yields ('found', {'ip_address',
+        'mac_address', 'block'}), ('host', result) and ('block_error',
+        {'block', 'error'}) events in completion order.
+        """
+        raise NotImplementedError
+
+def _engine_classes() -> Dict[str, type]:
+    try:
+        from .nmap_engine import NmapEngine
+        from .connect_engine import ConnectEngine
+    except ImportError:
+        from nmap_engine import NmapEngine
+        from connect_engine import ConnectEngine
+    return {engine.name: engine for engine in (NmapEngine, ConnectEngine)}
+
+def get_engine_class(settings: Dict) -> type:
+    """The engine class named by server_scan.engine ('nmap' unless configured otherwise)."""
+    engines = _engine_classes()
+    name = settings.get('engine', 'nmap')
+    if name not in engines:
+        raise ValueError(f"Unknown scan engine '{name}'. Valid engines: {', '.join(engines)}")
+    return engines[name]
+
+def create_engine(settings: Dict) -> ScanEngine:
+    """Build the engine configured in the server_scan settings."""
+    try:
+        from .nmap_engine import ScanBudget
+    except ImportError:
+        from nmap_engine import ScanBudget
+
+    engine = get_engine_class(settings)
+    budget = ScanBudget(
+        max_processes=settings.get('max_processes', 8),
+        max_rate=settings.get('max_rate')
+    )
+    if engine.name == 'nmap':
+        return engine(
+            nmap_path=settings.get('nmap_path', 'nmap'),
+            batch_size=settings.get('batch_size', 64),
+            parallel_batches=settings.get('parallel_batches', 4),
+            budget=budget
+        )
+    connect = settings.get('connect', {})
+    return engine(
+        ports=connect.get('ports'),
+        discovery_ports=connect.get('discovery_ports'),
+        max_concurrency=connect.get('max_concurrency', 1000),
+        max_hosts=connect.get('max_hosts', 256),
+        min_timeout=connect.get('min_timeout', 0.05),
+        max_timeout=connect.get('max_timeout', 1.0),
+        max_rate=budget.max_rate
+    )
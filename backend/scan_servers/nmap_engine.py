@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+
+import time
+import queue
+import shlex
+import threading
+import subprocess
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from .engines import DISCOVERY_SECONDS, HOST_SECONDS, ScanEngine
+except ImportError:
+    from engines import DISCOVERY_SECONDS, HOST_SECONDS, ScanEngine
+
+class NmapError(Exception):
+    """nmap could not be started or exited with an error."""
+
+class ScanBudget:
+    """
+    Global limit for everything an engine runs: at most max_processes nmap
+    processes at once, and a combined packet rate of at most max_rate per
+    second (each process gets an equal share through --max-rate).
+    """
+
+    def __init__(self, max_processes: int = 8, max_rate: int = None):
+        self.max_processes = max(1, max_processes)
+        self.max_rate = max_rate
+        self._slots = threading.BoundedSemaphore(self.max_processes)
+
+    @property
+    def rate_per_process(self) -> Optional[int]:
+        return max(1, self.max_rate // self.max_processes) if self.max_rate else None
+
+    @contextmanager
+    def slot(self):
+        """Hold one process slot for the duration of the block."""
+        self._slots.acquire()
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+class NmapEngine(ScanEngine):
+    """
+    Runs nmap as a subprocess with XML written to stdout (-oX -) and parses
+    that output incrementally, so each host is available as soon as nmap
+    has finished it rather than when the whole run completes.
+
+    Host scans send batch_size targets to a single nmap process, with up to
+    parallel_batches processes running at once. Every result is built from
+    its own <host> element, so nothing is shared between concurrent batches.
+    scan_networks() chains discovery and host scans into one pipeline. All
+    processes an engine starts count against its ScanBudget.
+    """
+
+    name = 'nmap'
+    requires_root = True  # OS detection needs raw sockets
+
+    # Seconds a host-scan worker waits for more live hosts before running a partial batch
+    BATCH_LINGER = 0.5
+
+    # -n: No DNS resolution
+    # -sn: Ping scan only
+    # --min-parallelism 100: Increase parallel probe attempts
+    DISCOVERY_ARGS = '-n -sn --min-parallelism 100'
+
+    # -T4: Aggressive timing template
+    # -F: Fast scan (top 100 ports)
+    # --max-retries 1: Minimize retries
+    # -O: OS detection (needs root)
+    HOST_ARGS = '-n -T4 -F --min-parallelism 100 --max-retries 1 -O'
+
+    # Cheap re-check of hosts discovery just saw up: the same ports, no OS detection
+    # -Pn: Skip the ping, the host is known to be up
+    PROBE_ARGS = '-n -Pn -T4 -F --min-parallelism 100 --max-retries 1'
+
+    def __init__(self, nmap_path: str = 'nmap', batch_size: int = 64, parallel_batches: int = 4,
+                 discovery_args: str = None, host_args: str = None, probe_args: str = None,
+                 budget: ScanBudget = None):
+        self.nmap_path = nmap_path
+        self.budget = budget or ScanBudget()
+        self.batch_size = max(1, batch_size)
+        self.parallel_batches = max(1, parallel_batches)
+        self.discovery_args = shlex.split(discovery_args or self.DISCOVERY_ARGS)
+        self.host_args = shlex.split(host_args or self.HOST_ARGS)
+        self.probe_args = shlex.split(probe_args or self.PROBE_ARGS)
+
+    @staticmethod
+    def parse_host(element: ET.Element) -> Optional[Dict]:
+        """
+        Convert one <host> element to a dict with ip_address, mac_address,
+        state, detected_os and open_ports. Returns None for hosts without an IP.
+        """
+        ip_address = None
+        mac_address = None
+        for address in element.iter('address'):
+            if address.get('addrtype') in ('ipv4', 'ipv6') and ip_address is None:
+                ip_address = address.get('addr')
+            elif address.get('addrtype') == 'mac':
+                mac_address = address.get('addr')
+        if ip_address is None:
+            return None
+
+        status = element.find('status')
+        osmatch = element.find('os/osmatch')
+
+        open_ports = []
+        for port in element.iterfind('ports/port'):
+            state = port.find('state')
+            if state is None or state.get('state') != 'open':
+                continue
+            service = port.find('service')
+            name = service.get('name', 'unknown') if service is not None else 'unknown'
+            open_ports.append(f"{port.get('portid')}/{port.get('protocol')} ({name})")
+
+        return {
+            'ip_address': ip_address,
+            'mac_address': mac_address,
+            'state': status.get('state') if status is not None else None,
+            'detected_os': osmatch.get('name') if osmatch is not None else 'Unknown',
+            'open_ports': ', '.join(open_ports) if open_ports else None
+        }
+
+    @classmethod
+    def parse_hosts(cls, stream) -> Iterator[Dict]:
+        """Yield a parsed host for every <host> element in an nmap XML stream as it completes."""
+        for _, element in ET.iterparse(stream, events=('end',)):
+            if element.tag == 'host':
+                host = cls.parse_host(element)
+                # Finished hosts are dropped from the tree to keep memory flat
+                element.clear()
+                if host is not None:
+                    yield host
+
+    def run(self, args: List[str], targets: List[str]) -> Iterator[Dict]:
+        """
+        Run one nmap process over targets and yield its hosts as they stream
+        in, once the budget has a free process slot.
+        """
+        with self.budget.slot():
+            yield from self._run(args, targets)
+
+    def _run(self, args: List[str], targets: List[str]) -> Iterator[Dict]:
+        command = [self.nmap_path] + args + ['-oX', '-']
+        if self.budget.rate_per_process:
+            command += ['--max-rate', str(self.budget.rate_per_process)]
+        command += list(targets)
+        try:
+            process = subprocess.Popen(
+                command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL
+            )
+        except OSError as e:
+            raise NmapError(f'Could not run {self.nmap_path}: {e}')
+
+        # Drain stderr on the side so a chatty nmap cannot block on a full pipe
+        stderr = []
+        reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+        reader.start()
+        try:
+            yield from self.parse_hosts(process.stdout)
+            process.wait()
+        except ET.ParseError as e:
+            process.wait()
+            reader.join()
+            message = b''.join(stderr).decode(errors='replace').strip()
+            raise NmapError(message or f'Invalid nmap output: {e}')
+        finally:
+            # Only still running if the caller stopped early or parsing failed
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+
+        reader.join()
+        if process.returncode != 0:
+            message = b''.join(stderr).decode(errors='replace').strip()
+            raise NmapError(message or f'nmap exited with status {process.returncode}')
+
+    def discover(self, targets: Iterable[str]) -> Iterator[str]:
+        """Ping scan the given subnets or addresses and yield the IPs of hosts that are up."""
+        for host in self.run(self.discovery_args, list(targets)):
+            if host['state'] == 'up':
+                yield host['ip_address']
+
+    def _batch_worker(self, hosts: queue.Queue, stop: object, handle: Callable[[List], None]):
+        """
+        Take items from the hosts queue and pass them to handle() in batches
+        of up to batch_size. A partial batch is handled once nothing new has
+        arrived for BATCH_LINGER seconds. Returns when it takes stop.
+        """
+        stopping = False
+        while not stopping:
+            first = hosts.get()
+            if first is stop:
+                return
+            batch = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    item = hosts.get(timeout=self.BATCH_LINGER)
+                except queue.Empty:
+                    break
+                if item is stop:
+                    stopping = True
+                    break
+                batch.append(item)
+            handle(batch)
+
+    def _full_scan(self, batch: List[str], events: queue.Queue):
+        """Port and OS scan a batch, putting a ('host', result) event for every host."""
+        reported = set()
+        seconds = HOST_SECONDS.labels(self.name, 'full')
+        start = time.perf_counter()
+        try:
+            for host in self.run(self.host_args, batch):
+                seconds.observe(time.perf_counter() - start)
+                reported.add(host['ip_address'])
+                events.put(('host', dict(host, scan='full')))
+        except Exception as e:
+            for ip_address in batch:
+                if ip_address not in reported:
+                    events.put(('host', {'ip_address': ip_address, 'scan': 'full', 'error': str(e)}))
+
+    def _probe(self, batch: List[str], verify: Callable[[Dict], bool],
+               events: queue.Queue, rescan: queue.Queue):
+        """
+        Port scan a batch without OS detection. Hosts whose result verify()
+        accepts become ('host', result) events; all others, including hosts
+        nmap did not report, go to the rescan queue for a full scan.
+        """
+        results = {}
+        seconds = HOST_SECONDS.labels(self.name, 'probe')
+        start = time.perf_counter()
+        try:
+            for host in self.run(self.probe_args, batch):
+                seconds.observe(time.perf_counter() - start)
+                results[host['ip_address']] = host
+        except Exception:
+            results = {}
+
+        for ip_address in batch:
+            host = results.get(ip_address)
+            if host is not None and verify(host):
+                events.put(('host', dict(host, scan='probe')))
+            else:
+                rescan.put(ip_address)
+
+    def _run_workers(self, workers: List, events: queue.Queue) -> Iterator[Tuple[str, object]]:
+        """Start the worker callables on threads and yield their events until all have finished."""
+        done = object()
+
+        def run(worker):
+            try:
+                worker()
+            finally:
+                events.put(done)
+
+        for worker in workers:
+            threading.Thread(target=run, args=(worker,), daemon=True, name='nmap-worker').start()
+
+        finished = 0
+        while finished < len(workers):
+            event = events.get()
+            if event is done:
+                finished += 1
+            else:
+                yield event
+
+    def scan_hosts(self, ip_addresses: Iterable[str]) -> Iterator[Dict]:
+        """
+        Port and OS scan the given addresses in batches and yield one result
+        per host in completion order, across all running batches. A failed
+        batch yields {'ip_address': ..., 'error': ...} for each of its hosts
+        that did not report.
+        """
+        ip_addresses = list(ip_addresses)
+        if not ip_addresses:
+            return
+
+        hosts, events, stop = queue.Queue(), queue.Queue(), object()
+        workers = min(self.parallel_batches, -(-len(ip_addresses) // self.batch_size))
+        for ip_address in ip_addresses:
+            hosts.put(ip_address)
+        for _ in range(workers):
+            hosts.put(stop)
+
+        scan = lambda: self._batch_worker(hosts, stop, lambda batch: self._full_scan(batch, events))
+        for _, host in self._run_workers([scan] * workers, events):
+            yield host
+
+    def scan_networks(self, targets: Iterable[str], block_prefix: int = 24, parallel_discovery: int = 4,
+                      plan: Callable[[Dict], bool] = None,
+                      verify: Callable[[Dict], bool] = None) -> Iterator[Tuple[str, Dict]]:
+        """
+        Discover and scan networks as a pipeline. Targets are split into
+        blocks (see split_targets) that up to parallel_discovery ping sweeps
+        work through concurrently; every live host goes straight to the
+        host-scan workers instead of waiting for its sweep to finish.
+
+        With plan and verify, hosts can skip OS detection: plan(found) is
+        called for each discovered host and returns True to only probe its
+        ports (PROBE_ARGS). Probed hosts whose result verify() accepts are
+        reported with scan='probe'; the rest get the full scan after all.
+
+        Yields events in completion order:
+        ('found', {'ip_address', 'mac_address', 'block'}) when discovery finds a live host,
+        ('host', result) when a host is done, with scan='full' or 'probe' (see scan_hosts),
+        ('block_error', {'block', 'error'}) when a block cannot be discovered.
+        """
+        blocks = queue.Queue()
+        for block in self.split_targets(targets, block_prefix):
+            blocks.put(block)
+
+        events, stop = queue.Queue(), object()
+        full, probe = queue.Queue(), queue.Queue()
+        seen = set()
+        lock = threading.Lock()
+        discovery_workers = max(1, min(parallel_discovery, blocks.qsize()))
+        probe_workers = self.parallel_batches if plan is not None else 0
+        running = {'discovery': discovery_workers, 'probe': probe_workers}
+
+        def finished(stage):
+            # Each stage tells the next one to stop once its last worker is done
+            with lock:
+                running[stage] -= 1
+                if running[stage]:
+                    return
+                if stage == 'discovery' and probe_workers:
+                    for _ in range(probe_workers):
+                        probe.put(stop)
+                else:
+                    for _ in range(self.parallel_batches):
+                        full.put(stop)
+
+        def discover():
+            try:
+                while True:
+                    try:
+                        block = blocks.get_nowait()
+                    except queue.Empty:
+                        return
+                    start = time.perf_counter()
+                    try:
+                        for host in self.run(self.discovery_args, [block]):
+                            if host['state'] != 'up':
+                                continue
+                            with lock:
+                                if host['ip_address'] in seen:
+                                    continue
+                                seen.add(host['ip_address'])
+                            found = {'ip_address': host['ip_address'],
+                                     'mac_address': host['mac_address'], 'block': block}
+                            events.put(('found', found))
+                            if plan is not None and plan(found):
+                                probe.put(host['ip_address'])
+                            else:
+                                full.put(host['ip_address'])
+                    except Exception as e:
+                        events.put(('block_error', {'block': block, 'error': str(e)}))
+                    DISCOVERY_SECONDS.labels(self.name).observe(time.perf_counter() - start)
+            finally:
+                finished('discovery')
+
+        def check():
+            try:
+                self._batch_worker(probe, stop, lambda batch: self._probe(batch, verify, events, full))
+            finally:
+                finished('probe')
+
+        scan = lambda: self._batch_worker(full, stop, lambda batch: self._full_scan(batch, events))
+        yield from self._run_workers(
+            [discover] * discovery_workers + [check] * probe_workers + [scan] * self.parallel_batches,
+            events
+        )
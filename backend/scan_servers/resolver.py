@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import socket
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+# Add the parent directory to the Python path to import the database module
+sys.path.append(str(Path(__file__).parent.parent))
+from database.db_manager import DatabaseManager
+from metrics.metrics import Counter, Histogram
+
+LOOKUP_SECONDS = Histogram(
+    'backup_checker_dns_lookup_seconds', 'Duration of reverse DNS lookups that missed the cache', ['result']
+)
+LOOKUPS = Counter(
+    'backup_checker_dns_lookups_total', 'Reverse DNS lookups by outcome (counted once per address and scan)',
+    ['result']
+)
+
+class ReverseResolver:
+    """
+    Reverse DNS lookups for scanned hosts, run concurrently and cached.
+
+    lookup() starts a lookup in the background and returns at once, so
+    callers can start resolving a host as soon as it is discovered and
+    collect the name later with hostname(), which never waits longer than
+    timeout seconds from the moment a worker starts the lookup. Results are
+    cached for ttl seconds, failures and timeouts (negative results) for
+    negative_ttl, and the cache is persisted in the dns_cache table by save()
+    so later scans start warm. A lookup still queued for a worker after
+    queue_timeout seconds is given up without being cached: a saturated pool
+    says nothing about the host. close() the resolver (or use it as a context
+    manager) to save the cache and stop its worker threads.
+
+    stats counts hits, negative_hits, misses, timeouts and errors, once
+    per address no matter how often it is looked up.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, ttl: int = 86400, negative_ttl: int = 3600,
+                 timeout: float = 2.0, max_workers: int = 32, queue_timeout: float = 30.0):
+        self.db_manager = db_manager
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.stats = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'timeouts': 0, 'errors': 0}
+        self._lock = threading.Lock()
+        self._cache = db_manager.get_dns_cache(int(time.time()))
+        self._lookups = {}   # ip_address -> [future, queued at, timed out]
+        self._started = {}   # ip_address -> when a worker started its lookup
+        self._unsaved = {}
+        self._counted = set()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rdns')
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        """Fraction of lookups answered from the cache, or None before the first lookup."""
+        hits = self.stats['hits'] + self.stats['negative_hits']
+        total = hits + self.stats['misses']
+        return hits / total if total else None
+
+    def _count(self, result: str):
+        """Count a lookup outcome; the caller holds the lock."""
+        self.stats[result] += 1
+        LOOKUPS.labels(result).inc()
+
+    @staticmethod
+    def _gethostbyaddr(ip_address: str) -> Optional[str]:
+        start = time.perf_counter()
+        result = 'error'
+        try:
+            hostname = socket.gethostbyaddr(ip_address)[0]
+            result = 'found'
+            return hostname
+        except (socket.herror, socket.gaierror):
+            result = 'not_found'
+            return None
+        finally:
+            LOOKUP_SECONDS.labels(result).observe(time.perf_counter() - start)
+
+    def _resolve(self, ip_address: str) -> Optional[str]:
+        with self._lock:
+            self._started[ip_address] = time.monotonic()
+        return self._gethostbyaddr(ip_address)
+
+    def _store(self, ip_address: str, hostname: Optional[str]):
+        now = int(time.time())
+        expires_at = now + (self.ttl if hostname else self.negative_ttl)
+        with self._lock:
+            self._cache[ip_address] = (hostname, expires_at)
+            self._unsaved[ip_address] = (ip_address, hostname, now, expires_at)
+
+    def lookup(self, ip_address: str) -> Future:
+        """
+        Start resolving ip_address unless it is cached or already in flight.
+        Returns a future for the hostname (None if there is no PTR record).
+        """
+        with self._lock:
+            first = ip_address not in self._counted
+            self._counted.add(ip_address)
+            cached = self._cache.get(ip_address)
+            if cached is not None and cached[1] > time.time():
+                if first:
+                    self._count('hits' if cached[0] else 'negative_hits')
+                future = Future()
+                future.set_result(cached[0])
+                return future
+            if ip_address in self._lookups:
+                return self._lookups[ip_address][0]
+            if first:
+                self._count('misses')
+            future = self._executor.submit(self._resolve, ip_address)
+            self._lookups[ip_address] = [future, time.monotonic(), False]
+
+        def done(future):
+            with self._lock:
+                self._lookups.pop(ip_address, None)
+                self._started.pop(ip_address, None)
+            if future.exception() is not None:
+                with self._lock:
+                    self._count('errors')
+                self._store(ip_address, None)
+            else:
+                self._store(ip_address, future.result())
+
+        future.add_done_callback(done)
+        return future
+
+    def hostname(self, ip_address: str) -> Optional[str]:
+        """
+        Return the hostname for ip_address, waiting for a lookup in flight
+        until timeout seconds after it started. A lookup that times out is
+        cached as negative; one that never left the queue is not. Once a
+        lookup in flight has timed out, later calls return None at once.
+        """
+        future = self.lookup(ip_address)
+        with self._lock:
+            entry = self._lookups.get(ip_address)
+        if entry is not None and not future.done() and (entry[2] or not self._wait(ip_address, entry)):
+            return None
+        try:
+            return future.result(timeout=0)
+        except Exception:
+            return None
+
+    def _wait(self, ip_address: str, entry: list) -> bool:
+        """Wait for a lookup in flight; False if it timed out or never started."""
+        future, queued_at = entry[0], entry[1]
+        while not future.done():
+            with self._lock:
+                started = self._started.get(ip_address)
+            now = time.monotonic()
+            if started is not None:
+                wait([future], timeout=max(0.0, started + self.timeout - now))
+                if future.done():
+                    break
+                if self._timed_out(entry):
+                    self._store(ip_address, None)
+                return False
+            if now >= queued_at + self.queue_timeout:
+                self._timed_out(entry)
+                return False
+            # Still queued behind other lookups: check again when it may have started
+            wait([future], timeout=min(0.05, queued_at + self.queue_timeout - now))
+        return True
+
+    def _timed_out(self, entry: list) -> bool:
+        """Mark a pending lookup as timed out; True (and counted) only the first time."""
+        with self._lock:
+            if entry[2]:
+                return False
+            entry[2] = True
+            self._count('timeouts')
+            return True
+
+    def resolve_many(self, ip_addresses: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Resolve many addresses concurrently; returns {ip_address: hostname or None}."""
+        ip_addresses = list(dict.fromkeys(ip_addresses))
+        for ip_address in ip_addresses:
+            self.lookup(ip_address)
+        return {ip_address: self.hostname(ip_address) for ip_address in ip_addresses}
+
+    def save(self):
+        """Persist results gathered since the last save and prune expired cache rows."""
+        with self._lock:
+            rows = list(self._unsaved.values())
+            self._unsaved = {}
+        self.db_manager.save_dns_cache(rows, int(time.time()))
+
+    def close(self):
+        """Save the cache and stop accepting lookups; stuck lookups are abandoned."""
+        self.save()
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
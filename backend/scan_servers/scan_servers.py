@@ -2,18 +2,28 @@
 
 import os
 import json
-import subprocess
+import time
 from datetime import datetime
 import sys
 from pathlib import Path
-import nmap
-import socket
-from typing import Dict, List, Optional
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
 
 # Add the parent directory to the Python path to import the database module
 sys.path.append(str(Path(__file__).parent.parent))
 from database.db_manager import DatabaseManager
+from backup_status.backup_status import refresh_backup_status
+from metrics.metrics import REGISTRY, Histogram
+
+try:
+    from .engines import create_engine, get_engine_class
+    from .resolver import ReverseResolver
+except ImportError:
+    from engines import create_engine, get_engine_class
+    from resolver import ReverseResolver
+
+STAGE_SECONDS = Histogram(
+    'backup_checker_server_scan_stage_seconds', 'Duration of each server scan stage', ['stage']
+)
 
 def check_root():
     """Check if script is running with root privileges."""
@@ -30,145 +40,256 @@ def restart_with_sudo():
         sys.exit(1)
 
 class SubnetScanner:
-    def __init__(self, db_manager: DatabaseManager, config_path: str):
+    """
+    Finds live hosts in the configured subnets and stores what the
+    configured scan engine (server_scan.engine, nmap by default) reports
+    about them.
+
+    Scans are incremental unless full=True or server_scan.incremental.enabled
+    is false: a host whose last full scan is younger than
+    server_scan.incremental.ttl seconds, whose MAC address has not changed
+    and whose previously open ports are still exactly the open ones is only
+    port scanned, without the expensive OS detection, and keeps its stored
+    OS match. Every other host gets the full port and OS detection scan.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, config_path: str, full: bool = False):
         self.db_manager = db_manager
         self.config_path = config_path
         self.subnets = self._load_config()
-        self.nm = nmap.PortScanner()
+        incremental = self.settings.get('incremental', {})
+        self.incremental = incremental.get('enabled', True) and not full
+        self.fingerprint_ttl = incremental.get('ttl', 604800)
+        self.stats = {'full': 0, 'probed': 0}
+        self._fingerprints = {}
+        self.engine = create_engine(self.settings)
+        dns = self.settings.get('dns', {})
+        self.resolver = ReverseResolver(
+            db_manager,
+            ttl=dns.get('ttl', 86400),
+            negative_ttl=dns.get('negative_ttl', 3600),
+            timeout=dns.get('timeout', 2.0),
+            max_workers=dns.get('max_workers', 32),
+            queue_timeout=dns.get('queue_timeout', 30.0)
+        )
+        self._hosts_found = 0
+        self._hosts_scanned = 0
+
+    def close(self):
+        """Save the DNS cache and stop the resolver's worker threads."""
+        self.resolver.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
 
     def _load_config(self) -> list:
-        """Load subnets from config file."""
+        """Load subnets and server scan settings from config file."""
+        self.settings = {}
+        self.history_settings = {}
         try:
             with open(self.config_path, 'r') as f:
                 config = json.load(f)
+                self.settings = config.get('server_scan', {})
+                self.history_settings = config.get('history', {})
                 return config.get('subnets_to_scan', [])
         except Exception as e:
             print(f"Error loading config file: {e}")
             return []
 
-    def scan_host(self, ip_address: str) -> Dict:
+    @staticmethod
+    def _is_up(host: Dict) -> bool:
+        """Whether an engine result is a live host worth storing."""
+        if host.get('error'):
+            print(f"Error scanning host {host['ip_address']}: {host['error']}")
+            return False
+        return host.get('state') == 'up'
+
+    def _host_record(self, host: Dict, hostname: Optional[str]) -> Dict:
+        """Turn an engine result and its reverse DNS name into the record stored for a server."""
+        ip_address = host['ip_address']
+        now = datetime.now()
+        record = {
+            'hostname': hostname or ip_address,
+            'ip_address': ip_address,
+            'mac_address': host.get('mac_address'),
+            'detected_os': host['detected_os'],
+            'open_ports': host['open_ports'],
+            'is_reachable': True,
+            'last_scan': now,
+            'last_full_scan': now
+        }
+        if host.get('scan') == 'probe':
+            # Nothing changed: keep what the last full scan found
+            fingerprint = self._fingerprints[ip_address]
+            record['detected_os'] = fingerprint['detected_os']
+            record['open_ports'] = fingerprint['open_ports']
+            record['last_full_scan'] = None
+        return record
+
+    @staticmethod
+    def _port_set(open_ports: Optional[str]) -> set:
+        """Parse a stored open_ports string ("22/tcp (ssh), ...") into {(port, proto)}."""
+        ports = set()
+        for entry in (open_ports or '').split(', '):
+            if '/' in entry:
+                port, rest = entry.split('/', 1)
+                ports.add((int(port), rest.split(' ', 1)[0]))
+        return ports
+
+    def _plan(self, found: Dict) -> bool:
         """
-        Scan a single host using fast nmap settings.
-        Returns a dictionary with host information.
+        Engine plan callback: True if a discovered host has a fresh
+        fingerprint with the same MAC address, so a probe may be enough.
         """
-        try:
-            # Fast scan settings:
-            # -n: No DNS resolution
-            # -T4: Aggressive timing template
-            # -F: Fast scan (top 100 ports)
-            # --min-parallelism 100: Increase parallel probe attempts
-            # --max-retries 1: Minimize retries
-            # -O: OS detection (might need sudo)
-            scan_args = '-n -T4 -F --min-parallelism 100 --max-retries 1 -O'
-            
-            self.nm.scan(ip_address, arguments=scan_args)
-            
-            if ip_address not in self.nm.all_hosts():
-                return None
-
-            host_info = self.nm[ip_address]
-            
-            # Get hostname (reverse DNS)
-            try:
-                hostname = socket.gethostbyaddr(ip_address)[0]
-            except socket.herror:
-                hostname = ip_address
-
-            # Get OS information
-            if 'osmatch' in host_info:
-                os_info = host_info['osmatch'][0]['name']
-            else:
-                os_info = 'Unknown'
-
-            # Get open ports
-            open_ports = []
-            for proto in host_info.all_protocols():
-                ports = host_info[proto].keys()
-                for port in ports:
-                    service = host_info[proto][port]
-                    open_ports.append(f"{port}/{proto} ({service.get('name', 'unknown')})")
-            
-            open_ports_str = ', '.join(open_ports) if open_ports else None
+        fingerprint = self._fingerprints.get(found['ip_address'])
+        if fingerprint is None or fingerprint['last_full_scan'] is None:
+            return False
+        if fingerprint['last_full_scan'] < time.time() - self.fingerprint_ttl:
+            return False
+        return not (found.get('mac_address') and fingerprint['mac_address']
+                    and found['mac_address'] != fingerprint['mac_address'])
 
-            return {
-                'hostname': hostname,
-                'ip_address': ip_address,
-                'detected_os': os_info,
-                'open_ports': open_ports_str,
-                'is_reachable': True,
-                'last_scan': datetime.now()
-            }
+    def _verify(self, host: Dict) -> bool:
+        """Engine verify callback: does a probe result match the stored fingerprint?"""
+        fingerprint = self._fingerprints[host['ip_address']]
+        if host.get('state') != 'up':
+            return False
+        if (host.get('mac_address') and fingerprint['mac_address']
+                and host['mac_address'] != fingerprint['mac_address']):
+            return False
+        return self._port_set(host['open_ports']) == self._port_set(fingerprint['open_ports'])
 
-        except Exception as e:
-            print(f"Error scanning host {ip_address}: {e}")
-            return None
+    def scan_host(self, ip_address: str) -> Dict:
+        """
+        Scan a single host with the configured engine.
+        Returns a dictionary with host information.
+        """
+        self.resolver.lookup(ip_address)
+        for host in self.engine.scan_hosts([ip_address]):
+            if self._is_up(host):
+                return self._host_record(host, self.resolver.hostname(ip_address))
+        return None
 
-    def scan_subnet(self, subnet: str) -> List[Dict]:
+    def scan_subnet(self, subnet: str, progress: Callable = None) -> List[Dict]:
         """
         Scan a subnet for live hosts and their information.
-        Uses fast ping scan first to identify live hosts.
+        progress(phase, processed, total) is called as hosts are discovered and scanned.
+        """
+        return self._scan_networks([subnet], progress)
+
+    def _scan_networks(self, subnets: List[str], progress: Callable = None) -> List[Dict]:
+        """
+        Discover and scan the given subnets as one pipeline: large subnets
+        are split into blocks swept concurrently, and each live host is
+        port scanned by the engine and stored as soon as its result
+        arrives, while discovery of other blocks is still going on.
         """
         results = []
+        progress = progress or (lambda phase, processed, total=None: None)
+
+        def store(host):
+            self._hosts_scanned += 1
+            progress('scanning hosts', self._hosts_scanned, self._hosts_found)
+            try:
+                if self._is_up(host):
+                    self.stats['probed' if host.get('scan') == 'probe' else 'full'] += 1
+                    host_result = self._host_record(host, self.resolver.hostname(host['ip_address']))
+                    # Update database
+                    self.db_manager.update_server(host_result['hostname'], host_result)
+                    results.append(host_result)
+                    print(f"Scanned {host_result['ip_address']}: {len(results)} hosts processed")
+            except Exception as e:
+                print(f"Error processing {host['ip_address']}: {e}")
+
         try:
-            # Fast ping scan to find live hosts
-            # -n: No DNS resolution
-            # -sn: Ping scan only
-            # --min-parallelism 100: Increase parallel probe attempts
-            print(f"Scanning subnet: {subnet}")
-            self.nm.scan(hosts=subnet, arguments='-n -sn --min-parallelism 100')
-            
-            # Get list of responding hosts
-            live_hosts = [x for x in self.nm.all_hosts() if self.nm[x].state() == 'up']
-            print(f"Found {len(live_hosts)} live hosts in {subnet}")
-
-            # Scan live hosts in parallel
-            with ThreadPoolExecutor(max_workers=20) as executor:
-                future_to_ip = {executor.submit(self.scan_host, ip): ip for ip in live_hosts}
-                
-                for future in as_completed(future_to_ip):
-                    ip = future_to_ip[future]
-                    try:
-                        host_result = future.result()
-                        if host_result:
-                            # Update database
-                            self.db_manager.update_server(host_result['hostname'], host_result)
-                            results.append(host_result)
-                            print(f"Scanned {ip}: {len(results)} hosts processed")
-                    except Exception as e:
-                        print(f"Error processing {ip}: {e}")
+            print(f"Scanning subnets: {', '.join(subnets)}")
+            if self.incremental:
+                self._fingerprints = self.db_manager.get_server_fingerprints()
+            events = self.engine.scan_networks(
+                subnets,
+                block_prefix=self.settings.get('block_prefix', 24),
+                parallel_discovery=self.settings.get('parallel_discovery', 4),
+                plan=self._plan if self.incremental else None,
+                verify=self._verify
+            )
+
+            # Reverse DNS starts as soon as a host is discovered and runs
+            # alongside its port scan; a scanned host waits only if its name
+            # has not arrived yet, and hosts behind it keep flowing meanwhile
+            waiting = []
+            for event, data in events:
+                if event == 'found':
+                    self._hosts_found += 1
+                    self.resolver.lookup(data['ip_address'])
+                    progress('scanning hosts', self._hosts_scanned, self._hosts_found)
+                elif event == 'block_error':
+                    print(f"Error scanning subnet {data['block']}: {data['error']}")
+                else:
+                    waiting.append((data, self.resolver.lookup(data['ip_address'])))
+                still_waiting = []
+                for host, lookup in waiting:
+                    if lookup.done():
+                        store(host)
+                    else:
+                        still_waiting.append((host, lookup))
+                waiting = still_waiting
+            for host, _ in waiting:
+                store(host)
 
         except Exception as e:
-            print(f"Error scanning subnet {subnet}: {e}")
-            
+            print(f"Error scanning subnets: {e}")
+        finally:
+            self.resolver.save()
+
+        hit_rate = self.resolver.hit_rate
+        print(f"Reverse DNS: {self.resolver.stats}"
+              + (f", {hit_rate:.0%} from cache" if hit_rate is not None else ''))
+        print(f"Found {self._hosts_found} live hosts")
         return results
 
-    def scan_all_subnets(self) -> List[Dict]:
+    def scan_all_subnets(self, progress: Callable = None) -> List[Dict]:
         """
-        Scan all configured subnets.
+        Scan all configured subnets concurrently.
+        progress(phase, processed, total) is called as hosts are discovered and scanned.
         Returns a list of all scan results.
         """
-        all_results = []
+        progress = progress or (lambda phase, processed, total=None: None)
+        self._hosts_found = 0
+        self._hosts_scanned = 0
+        self.stats = {'full': 0, 'probed': 0}
         
-        for subnet in self.subnets:
-            subnet_results = self.scan_subnet(subnet)
-            all_results.extend(subnet_results)
+        progress('discovering', self._hosts_scanned, self._hosts_found)
+        with STAGE_SECONDS.labels('scan').time():
+            all_results = self._scan_networks(self.subnets, progress)
+
+        if all_results:
+            progress('refreshing backup status', self._hosts_scanned, self._hosts_found)
+            with STAGE_SECONDS.labels('refresh').time():
+                refresh_backup_status(self.db_manager, self.history_settings)
             
         return all_results
 
 def main():
-    # Check for root privileges
-    if not check_root():
+    # Get config file path
+    config_path = os.path.join(Path(__file__).parent.parent, 'config.json')
+    with open(config_path, 'r') as f:
+        settings = json.load(f).get('server_scan', {})
+
+    # Check for root privileges if the engine needs raw sockets
+    if get_engine_class(settings).requires_root and not check_root():
         restart_with_sudo()
     
     # Initialize database manager
     db_manager = DatabaseManager()
     
-    # Get config file path
-    config_path = os.path.join(Path(__file__).parent.parent, 'config.json')
-    scanner = SubnetScanner(db_manager, config_path)
-    
     # Scan all configured subnets
-    results = scanner.scan_all_subnets()
+    with SubnetScanner(db_manager, config_path) as scanner:
+        results = scanner.scan_all_subnets()
+    REGISTRY.flush(db_manager)
     
     # Print summary
     print("\nScan Summary:")
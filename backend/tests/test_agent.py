@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import io
+import gzip
+import json
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+from unittest import mock
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+from database.db_manager import DatabaseManager
+from scan_dirs.scan_dirs import DirectoryScanner
+from scan_dirs.agent import ScanAgent
+from scan_dirs.manifest import encode_chunks, read_manifest
+import app as app_module
+
+REMOTE = '/mnt/nas01/'
+TOKEN = 's3cret'
+
+class ClientSession:
+    """Posts through the Flask test client the way a requests.Session would."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def post(self, url, data, headers, timeout):
+        response = self.client.post(urlsplit(url).path, data=data, headers=headers)
+        payload = response.get_json()
+        return SimpleNamespace(status_code=response.status_code, json=lambda: payload)
+
+class TestManifestFormat(unittest.TestCase):
+    """Test cases for encoding and reading manifest chunks."""
+
+    def _read(self, body, max_files=10):
+        header, entries = read_manifest(gzip.GzipFile(fileobj=io.BytesIO(body)), max_files)
+        return header, list(entries)
+
+    def test_chunks_cover_the_root(self):
+        entries = [(f'f{i}', i, i * 10, i + 100) for i in range(5)]
+        chunks = list(encode_chunks('nas01', REMOTE, entries, 2, keep=['broken/']))
+        self.assertEqual([(h['seq'], h['after'], h['through'], h['files']) for h, _ in chunks],
+                         [(0, None, 'f1', 2), (1, 'f1', 'f3', 2), (2, 'f3', None, 1)])
+        self.assertEqual(len({h['scan_id'] for h, _ in chunks}), 1)
+        header, read = self._read(chunks[1][1])
+        self.assertEqual(header['keep'], ['broken/'])
+        self.assertEqual(read, entries[2:4])
+
+        # An empty root still sends one chunk, which removes everything
+        [(header, _)] = encode_chunks('nas01', REMOTE, [], 2)
+        self.assertEqual((header['after'], header['through'], header['files']), (None, None, 0))
+
+    def test_rejects_bad_chunks(self):
+        def chunk(header=None, lines=()):
+            header = {'version': 1, 'agent': 'nas01', 'root': REMOTE, 'scan_id': 's', 'seq': 0,
+                      'after': None, 'through': None, 'files': len(lines), 'keep': [], **(header or {})}
+            return gzip.compress('\n'.join(json.dumps(line) for line in [header, *lines]).encode())
+
+        entry = {'path': 'a', 'size': 1, 'mtime_ns': 1, 'inode': None}
+        for body in (
+            chunk({'version': 2}),
+            chunk({'root': 'relative/'}),
+            chunk({'files': 11}),
+            chunk({'after': 'b', 'through': 'a'}),
+            chunk({'keep': ['../up/']}),
+            chunk(lines=[dict(entry, path='../etc/passwd')]),
+            chunk(lines=[dict(entry, path='/etc/passwd')]),
+            chunk(lines=[dict(entry, size=-1)]),
+            chunk(lines=[dict(entry, path='b'), entry]),
+            chunk({'through': 'a'}, lines=[dict(entry, path='b')]),
+            chunk({'files': 2}, lines=[entry])
+        ):
+            with self.assertRaises(ValueError):
+                self._read(body)
+
+class TestScanAgent(unittest.TestCase):
+    """Test cases for agents reporting roots to /api/agents end to end."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.local = os.path.join(self.tmp.name, 'volume1', 'backups', '')
+        os.makedirs(os.path.join(self.local, 'Acronis'))
+        os.makedirs(os.path.join(self.local, 'Tar'))
+        self._write('Acronis/ub01_10.197.38.239_sda_19TB.tib', b'a' * 10)
+        self._write('Acronis/rhel_10.197.38.12.tib', b'b')
+        self._write('Tar/web01.tar', b'c')
+        self._write('Tar/web02.tar', b'd')
+        self._write('notes.cfg', b'e')
+
+        # The server walks a directory of its own, next to the agent's roots
+        self.central = os.path.join(self.tmp.name, 'central', '')
+        os.makedirs(self.central)
+        self._write('local.tar', b'f', root=self.central)
+        self.config_path = os.path.join(self.tmp.name, 'config.json')
+        with open(self.config_path, 'w') as f:
+            json.dump({'directories_to_scan': [self.central], 'subnets_to_scan': []}, f)
+
+        self.db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+        self.settings = {**app_module.AGENT_DEFAULTS, 'token': TOKEN}
+        for name, value in (('db_manager', self.db_manager), ('agent_scanner', self._scanner),
+                            ('get_agent_settings', lambda: self.settings)):
+            patcher = mock.patch.object(app_module, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = app_module.app.test_client()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, relpath, data, root=None):
+        with open(os.path.join(root or self.local, relpath), 'wb') as f:
+            f.write(data)
+
+    def _scanner(self):
+        return DirectoryScanner(self.db_manager, self.config_path, incremental=True)
+
+    def _agent(self, name='nas01', roots=None, **settings):
+        return ScanAgent('http://backup-checker:5000', name, roots or {self.local: REMOTE}, token=TOKEN,
+                         settings={'chunk_files': 2, 'retries': 0, **settings}, session=ClientSession(self.client))
+
+    def _stored(self):
+        return {row[2]: row[4] for row in self.db_manager.get_all_scanned_files()}
+
+    def _post(self, body, agent='nas01', **headers):
+        return self.client.post(f'/api/agents/{agent}/manifests', data=body,
+                                headers={'Content-Encoding': 'gzip', 'Authorization': f'Bearer {TOKEN}', **headers})
+
+    def _delete(self, agent, root):
+        return self.client.delete(f'/api/agents/{agent}/roots?root={root}',
+                                  headers={'Authorization': f'Bearer {TOKEN}'})
+
+    def test_reports_and_updates_root(self):
+        self.db_manager.update_server('ub01', {'ip_address': '10.197.38.239'})
+        self.assertEqual(self._agent().run(), {REMOTE: {'added': 5, 'changed': 0, 'removed': 0, 'unchanged': 0}})
+        self.assertEqual(self._stored(), {
+            REMOTE + 'Acronis/rhel_10.197.38.12.tib': 1,
+            REMOTE + 'Acronis/ub01_10.197.38.239_sda_19TB.tib': 10,
+            REMOTE + 'Tar/web01.tar': 1,
+            REMOTE + 'Tar/web02.tar': 1,
+            REMOTE + 'notes.cfg': 1
+        })
+        _, servers = self.db_manager.query_servers(datetime.now() - timedelta(days=365))
+        status = DatabaseManager.SERVER_COLUMNS.index('backup_status')
+        self.assertEqual([row[status] for row in servers], ['green'])
+
+        os.remove(os.path.join(self.local, 'Tar', 'web01.tar'))
+        self._write('Tar/web03.tar', b'g')
+        self._write('notes.cfg', b'longer')
+        self.assertEqual(self._agent().run(), {REMOTE: {'added': 1, 'changed': 1, 'removed': 1, 'unchanged': 3}})
+        self.assertEqual(self._stored()[REMOTE + 'notes.cfg'], 6)
+        self.assertNotIn(REMOTE + 'Tar/web01.tar', self._stored())
+
+        [root] = self.client.get('/api/agents').get_json()['roots']
+        self.assertEqual((root['agent'], root['root'], root['last_seq'], root['changes']), ('nas01', REMOTE, 2, 3))
+        self.assertIsNotNone(root['completed_at'])
+
+        # The server's own scans leave the agent's files alone, even full ones
+        DirectoryScanner(self.db_manager, self.config_path, incremental=False).scan_directories()
+        self.assertEqual(len(self._stored()), 6)
+        self._scanner().scan_directories()
+        self.assertEqual(len(self._stored()), 6)
+
+    def test_chunks_are_idempotent(self):
+        self._agent().run()
+        entries, keep = self._agent().list_roots()[self.local]
+        chunks = [body for _, body in encode_chunks('nas01', REMOTE, entries, 2, keep)]
+        os.remove(os.path.join(self.local, 'notes.cfg'))
+        entries, keep = self._agent().list_roots()[self.local]
+        retried = [body for _, body in encode_chunks('nas01', REMOTE, entries, 3, keep)]
+        for body in retried + retried + chunks[:1]:
+            self.assertEqual(self._post(body).status_code, 200)
+        self.assertEqual(len(self._stored()), 4)
+        response = self._post(retried[-1]).get_json()
+        self.assertEqual(response['stats'], {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 1})
+        self.assertTrue(response['final'])
+
+    def test_truncated_and_unreadable_keep_files(self):
+        self._agent().run()
+        entries, _ = self._agent().list_roots()[self.local]
+        [(_, body)] = encode_chunks('nas01', REMOTE, entries, 10)
+        lines = gzip.decompress(body).split(b'\n')
+        response = self._post(gzip.compress(b'\n'.join(lines[:3]) + b'\n'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ended after 2 of its 5 files', response.get_json()['message'])
+        self.assertEqual(len(self._stored()), 5)
+
+        # An unreadable directory and file are kept, not taken for removed
+        [(_, body)] = encode_chunks('nas01', REMOTE, entries[:1], 10, keep=['Tar/', 'notes.cfg'])
+        self.assertEqual(self._post(body).get_json()['stats']['removed'], 1)
+        self.assertEqual(sorted(self._stored()), [
+            REMOTE + 'Acronis/rhel_10.197.38.12.tib', REMOTE + 'Tar/web01.tar', REMOTE + 'Tar/web02.tar',
+            REMOTE + 'notes.cfg'
+        ])
+
+    def test_root_ownership(self):
+        self._agent().run()
+        with self.assertRaisesRegex(RuntimeError, 'reported by agent nas01'):
+            self._agent('nas02').run()
+        with self.assertRaisesRegex(RuntimeError, 'overlaps'):
+            self._agent('nas02', {self.local: REMOTE + 'Acronis/'}).run()
+        with self.assertRaisesRegex(RuntimeError, 'scans itself'):
+            self._agent('nas02', {self.local: self.central}).run()
+        [(_, body)] = encode_chunks('nas01', REMOTE, [], 10)
+        self.assertEqual(self._post(body, agent='nas02').status_code, 400)
+
+        self.assertEqual(self._delete('nas02', REMOTE).status_code, 404)
+        response = self._delete('nas01', REMOTE)
+        self.assertEqual(response.get_json()['removed'], 5)
+        self.assertEqual(self._stored(), {})
+        self.assertEqual(self.client.get('/api/agents').get_json()['roots'], [])
+        self.assertEqual(self._agent('nas02').run()[REMOTE]['added'], 5)
+
+    def test_token_and_disabled(self):
+        agent = self._agent()
+        agent.token = 'wrong'
+        with self.assertRaisesRegex(RuntimeError, 'agent token'):
+            agent.run()
+        self.assertEqual(self.client.delete(f'/api/agents/nas01/roots?root={REMOTE}').status_code, 401)
+
+        # Without a configured token no agent is accepted at all
+        self.settings = {**app_module.AGENT_DEFAULTS}
+        with self.assertRaisesRegex(RuntimeError, 'requires agents.token'):
+            self._agent().run()
+        agent.token = None
+        with self.assertRaisesRegex(RuntimeError, 'requires agents.token'):
+            agent.run()
+        self.assertEqual(self._stored(), {})
+
+        self.settings = {**app_module.AGENT_DEFAULTS, 'token': TOKEN, 'enabled': False}
+        [(_, body)] = encode_chunks('nas01', REMOTE, [], 10)
+        self.assertEqual(self._post(body).status_code, 404)
+
+    def test_non_json_error_response(self):
+        # A proxy in front of the API answers a too large chunk with its own HTML page
+        def proxy(url, data, headers, timeout):
+            return SimpleNamespace(status_code=413, json=lambda: json.loads('<html>Too Large</html>'))
+
+        agent = self._agent()
+        agent.session = SimpleNamespace(post=proxy)
+        with self.assertRaisesRegex(RuntimeError, 'HTTP 413'):
+            agent.run()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import gzip
+import json
+import tempfile
+from pathlib import Path
+from datetime import datetime, timedelta
+from unittest import mock
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+import app as app_module
+from database.db_manager import DatabaseManager
+from backup_status.backup_status import refresh_backup_status
+
+class AppTestCase(unittest.TestCase):
+    """Runs the Flask app in-process against a throwaway database."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+        patcher = mock.patch.object(app_module, 'db_manager', self.db_manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = app_module.app.test_client()
+
+    def tearDown(self):
+        # Let background snapshot builds finish writing into the directory first
+        app_module.snapshot_store.join()
+        self.tmp.cleanup()
+
+    def add_server(self, hostname, ip_address, **data):
+        data.setdefault('is_reachable', True)
+        data.setdefault('last_scan', datetime.now())
+        self.db_manager.update_server(hostname, {'ip_address': ip_address, **data})
+
+    def add_file(self, filename, age_days, size=1024, directory='/nas01'):
+        self.db_manager.add_scanned_file(
+            filename, f'{directory}/{filename}',
+            datetime.now() - timedelta(days=age_days), size
+        )
+
+class TestServersBackupStatus(AppTestCase):
+    """Test cases for the materialized backup status behind /api/servers."""
+
+    def setUp(self):
+        super().setUp()
+        self.add_server('ub02', '10.197.38.12')
+        self.add_server('checkmk01', '10.197.38.165')
+        self.add_server('nobackup', '10.0.0.99')
+        self.add_file('ub02_sda_6TB.dd', 400)
+        self.add_file('ub02_sda_6TB_new.dd', 10)
+        self.add_file('checkmk01_10.197.38.165.gho', 500)
+        refresh_backup_status(self.db_manager)
+
+    def _servers(self):
+        response = self.client.get('/api/servers')
+        self.assertEqual(response.status_code, 200)
+        return {server['hostname']: server for server in response.get_json()['servers']}
+
+    def test_status_from_newest_backup(self):
+        servers = self._servers()
+        self.assertEqual(servers['ub02']['backup_status'], 'green')
+        self.assertEqual(servers['ub02']['backup_filename'], 'ub02_sda_6TB_new.dd')
+        self.assertEqual(servers['checkmk01']['backup_status'], 'yellow')
+        self.assertEqual(servers['nobackup']['backup_status'], 'red')
+        self.assertIsNone(servers['nobackup']['backup_filename'])
+
+    def test_threshold_is_evaluated_at_query_time(self):
+        config = {'backup_status': {'max_age_days': 5}}
+        with mock.patch.object(app_module, 'load_config', return_value=config):
+            servers = self._servers()
+        self.assertEqual(servers['ub02']['backup_status'], 'yellow')
+
+        config = {'backup_status': {'max_age_days': 1000}}
+        with mock.patch.object(app_module, 'load_config', return_value=config):
+            servers = self._servers()
+        self.assertEqual(servers['checkmk01']['backup_status'], 'green')
+
+    def test_status_filter_and_sort(self):
+        response = self.client.get('/api/servers?status=green,yellow&sort=hostname&order=desc')
+        data = response.get_json()
+        self.assertEqual(data['total'], 2)
+        self.assertEqual([server['hostname'] for server in data['servers']], ['ub02', 'checkmk01'])
+
+        response = self.client.get('/api/servers?sort=backup_status&limit=1')
+        data = response.get_json()
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['total'], 3)
+        self.assertEqual(data['servers'][0]['backup_status'], 'green')
+
+class TestFileListing(AppTestCase):
+    """Test cases for SQL-side filtering, sorting and paging of /api/files."""
+
+    def setUp(self):
+        super().setUp()
+        for i in range(10):
+            self.add_file(f'host{i}.tar.gz', age_days=i, size=i * 100, directory=f'/nas0{i % 2}')
+
+    def _get(self, query=''):
+        response = self.client.get(f'/api/files{query}')
+        return response.status_code, response.get_json()
+
+    def test_unpaged_returns_everything(self):
+        status, data = self._get()
+        self.assertEqual(status, 200)
+        self.assertEqual(data['count'], 10)
+        self.assertEqual(data['total'], 10)
+        self.assertNotIn('limit', data)
+
+    def test_paging_and_sorting(self):
+        status, data = self._get('?sort=size&order=desc&limit=3&offset=2')
+        self.assertEqual(status, 200)
+        self.assertEqual(data['total'], 10)
+        self.assertEqual([f['size'] for f in data['files']], [700, 600, 500])
+        self.assertEqual((data['limit'], data['offset']), (3, 2))
+
+    def test_filters(self):
+        _, data = self._get('?path_prefix=/nas01/&min_size=200&max_size=800')
+        self.assertEqual(sorted(f['size'] for f in data['files']), [300, 500, 700])
+
+        cutoff = (datetime.now() - timedelta(days=3, hours=12)).isoformat()
+        _, data = self._get(f'?modified_after={cutoff}&filename=host')
+        self.assertEqual(data['total'], 4)
+
+        _, data = self._get('?filename=%25')
+        self.assertEqual(data['total'], 0)
+
+    def test_rejects_bad_arguments(self):
+        for query in ('?sort=filepath;DROP', '?order=sideways', '?limit=-1', '?min_size=big'):
+            status, data = self._get(query)
+            self.assertEqual(status, 400, query)
+            self.assertEqual(data['status'], 'error')
+
+class TestFileStreaming(AppTestCase):
+    """Test cases for the NDJSON and columnar streaming formats of /api/files."""
+
+    def setUp(self):
+        super().setUp()
+        with self.db_manager.bulk_writer() as writer:
+            for i in range(1203):
+                writer.add('/nas01', f'host{i}.tar.gz', f'/nas01/host{i}.tar.gz',
+                           datetime.now() - timedelta(days=i % 30), i)
+
+    def test_ndjson(self):
+        response = self.client.get('/api/files?format=ndjson&sort=size')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual(response.headers['X-Total-Count'], '1203')
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([row['size'] for row in rows], list(range(1203)))
+        self.assertEqual(set(rows[0]), {'id', 'filename', 'filepath', 'last_modified', 'size', 'scan_time'})
+
+    def test_ndjson_from_accept_header(self):
+        response = self.client.get('/api/files?limit=2', headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 2)
+
+    def test_columnar(self):
+        response = self.client.get('/api/files?format=columnar&sort=size&order=desc&limit=600')
+        data = json.loads(response.get_data(as_text=True))
+        self.assertEqual(data['total'], 1203)
+        self.assertEqual(data['count'], 600)
+        self.assertEqual(data['columns'], ['id', 'filename', 'filepath', 'last_modified', 'size', 'scan_time'])
+        size = data['columns'].index('size')
+        self.assertEqual([row[size] for row in data['rows']], list(range(1202, 602, -1)))
+
+    def test_gzip(self):
+        response = self.client.get('/api/files?format=columnar', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        data = json.loads(gzip.decompress(response.get_data()))
+        self.assertEqual(data['count'], 1203)
+
+    def test_unknown_format(self):
+        response = self.client.get('/api/files?format=xml')
+        self.assertEqual(response.status_code, 400)
+
+class TestResponseCache(AppTestCase):
+    """Test cases for generation-keyed caching and conditional GETs."""
+
+    def setUp(self):
+        super().setUp()
+        self.add_server('ub02', '10.197.38.12')
+        self.add_file('ub02_sda_6TB.dd', 10)
+        refresh_backup_status(self.db_manager)
+
+    def test_revalidation_returns_304(self):
+        for path in ('/api/servers', '/api/files?sort=size', '/api/files?format=ndjson'):
+            first = self.client.get(path)
+            self.assertEqual(first.status_code, 200)
+            etag = first.headers['ETag']
+            self.assertTrue(etag.startswith('W/'))
+            self.assertEqual(first.headers['Cache-Control'], 'no-cache')
+
+            again = self.client.get(path, headers={'If-None-Match': etag})
+            self.assertEqual(again.status_code, 304, path)
+            self.assertEqual(again.get_data(), b'')
+
+            since = self.client.get(path, headers={'If-Modified-Since': first.headers['Last-Modified']})
+            self.assertEqual(since.status_code, 304, path)
+
+    def test_write_bumps_generation(self):
+        first = self.client.get('/api/servers')
+        generation = self.db_manager.get_data_generation()[0]
+        self.add_server('ub03', '10.197.38.13')
+        self.assertEqual(self.db_manager.get_data_generation()[0], generation + 1)
+
+        response = self.client.get('/api/servers', headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['total'], 2)
+
+    def test_cached_body_is_shared(self):
+        first = self.client.get('/api/files?limit=5&sort=size').get_json()
+        # Same query in another order: served from the cache without touching scanned_files
+        with mock.patch.object(self.db_manager, 'query_scanned_files', side_effect=AssertionError):
+            response = self.client.get('/api/files?sort=size&limit=5', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.get_data())), first)
+
+    def test_query_string_and_threshold_are_part_of_the_key(self):
+        etags = {self.client.get(path).headers['ETag']
+                 for path in ('/api/files', '/api/files?limit=1', '/api/servers')}
+        self.assertEqual(len(etags), 3)
+
+        config = {'backup_status': {'max_age_days': 5}}
+        with mock.patch.object(app_module, 'load_config', return_value=config):
+            servers = self.client.get('/api/servers').get_json()['servers']
+        self.assertEqual(servers[0]['backup_status'], 'yellow')
+
+    def test_backups_aging_change_the_etag(self):
+        # The 10 day old backup turned yellow 5 days after it was written
+        backup_time = (datetime.now() - timedelta(days=10)).timestamp()
+        changed = self.db_manager.get_last_status_change(datetime.now() - timedelta(days=5), 5 * 86400)
+        self.assertAlmostEqual(changed, backup_time + 5 * 86400, delta=2)
+
+        first = self.client.get('/api/servers')
+        # A status change after the last write invalidates the cached response
+        later = self.db_manager.get_data_generation()[1] + 60
+        with mock.patch.object(self.db_manager, 'get_last_status_change', return_value=later):
+            response = self.client.get('/api/servers', headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.last_modified.timestamp(), later)
+
+    def test_disabled_cache(self):
+        config = {'response_cache': {'enabled': False}}
+        with mock.patch.object(app_module, 'load_config', return_value=config):
+            first = self.client.get('/api/files')
+            again = self.client.get('/api/files', headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(again.status_code, 304)
+        with self.db_manager._connect() as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM response_cache').fetchone()[0], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import random
+from pathlib import Path
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+from backup_status.backup_matcher import BackupMatcher
+
+def naive_matches(server, files):
+    """The original substring rule from get_backup_status()."""
+    identifiers = [
+        server['hostname'].lower(),
+        server['ip_address'].lower() if server['ip_address'] else None
+    ]
+    return [
+        file for file in files
+        if any(id and id in file['filename'].lower() for id in identifiers if id)
+    ]
+
+class TestBackupMatcher(unittest.TestCase):
+    """Test cases for the Aho-Corasick backup matcher."""
+
+    def test_example_filenames(self):
+        servers = [
+            {'hostname': 'ub02', 'ip_address': '10.197.38.12'},
+            {'hostname': 'checkmk01', 'ip_address': '10.197.38.165'},
+            {'hostname': 'nobackup', 'ip_address': '10.197.38.1'},
+            {'hostname': 'UB01', 'ip_address': None},
+        ]
+        matcher = BackupMatcher(servers)
+        # Substring semantics: 10.197.38.1 is a prefix of both other IPs
+        self.assertEqual(matcher.match('ub02_10.197.38.12_sda_6TB.dd'), {0, 2})
+        self.assertEqual(matcher.match('checkmk01_10.197.38.165.gho'), {1, 2})
+        self.assertEqual(matcher.match('ub01_10.197.38.239_sda_19TB.tib'), {3})
+        self.assertEqual(matcher.match('tokei01_192.168.7.5.cfg'), set())
+
+    def test_newest_match(self):
+        servers = [{'hostname': 'web01', 'ip_address': '10.0.0.5'}]
+        files = [
+            {'filename': 'web01_old.tar.gz', 'last_modified': '2020-01-01T00:00:00'},
+            {'filename': '10.0.0.5_new.tar.gz', 'last_modified': '2024-01-01T00:00:00'},
+            {'filename': 'web02.tar.gz', 'last_modified': '2025-01-01T00:00:00'},
+        ]
+        match = BackupMatcher(servers).match_files(files)[0]
+        self.assertEqual(len(match['files']), 2)
+        self.assertEqual(match['newest']['filename'], '10.0.0.5_new.tar.gz')
+
+    def test_same_as_substring_rule(self):
+        rng = random.Random(1234)
+        alphabet = 'ab01._-'
+
+        def word(low, high):
+            return ''.join(rng.choice(alphabet) for _ in range(rng.randint(low, high)))
+
+        servers = [
+            {'hostname': word(1, 5), 'ip_address': rng.choice([None, '', word(2, 6)])}
+            for _ in range(40)
+        ]
+        files = [
+            {'filename': word(0, 25), 'last_modified': f'2024-01-{rng.randint(1, 28):02d}'}
+            for _ in range(300)
+        ]
+
+        matches = BackupMatcher(servers).match_files(files)
+        for server, match in zip(servers, matches):
+            expected = naive_matches(server, files)
+            self.assertEqual(match['files'], expected)
+            expected_newest = max(expected, key=lambda x: x['last_modified']) if expected else None
+            self.assertIs(match['newest'], expected_newest)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import tempfile
+from pathlib import Path
+from argparse import Namespace
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+from backup_status.backup_matcher import BackupMatcher
+from benchmarks.synthetic import generate_inventory, generate_tree, iter_backup_files, parse_count
+from benchmarks.bench_suite import API_REQUESTS, bench_size, compare
+
+class TestSyntheticData(unittest.TestCase):
+    """Test cases for the synthetic trees and inventories the benchmarks use."""
+
+    def test_parse_count(self):
+        self.assertEqual([parse_count(value) for value in ('500', '10k', '1M', '2.5k')],
+                         [500, 10000, 1000000, 2500])
+
+    def test_inventory_is_unique_and_deterministic(self):
+        inventory = generate_inventory(1000, seed=1)
+        self.assertEqual(inventory, generate_inventory(1000, seed=1))
+        self.assertEqual(len({server['hostname'] for server in inventory}), 1000)
+        self.assertEqual(len({server['ip_address'] for server in inventory}), 1000)
+
+    def test_files_name_their_hosts(self):
+        inventory = generate_inventory(100)
+        files = list(iter_backup_files(2000, inventory, orphans=0.1))
+        matcher = BackupMatcher(inventory)
+        matched = [path for path, _, _ in files if matcher.match(os.path.basename(path))]
+        # Orphans belong to hosts outside the inventory; everything else matches
+        self.assertAlmostEqual(len(matched) / len(files), 0.9, delta=0.03)
+
+    def test_tree_is_reused(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = os.path.join(tmp, 'nas')
+            inventory = generate_inventory(10)
+            self.assertTrue(generate_tree(root, 50, inventory))
+            self.assertFalse(generate_tree(root, 50, inventory))
+            self.assertEqual(sum(len(files) for _, _, files in os.walk(root)), 50)
+            with self.assertRaises(ValueError):
+                generate_tree(root, 60, inventory)
+
+class TestBenchSuite(unittest.TestCase):
+    """Test cases for the benchmark suite's results and regression check."""
+
+    def test_small_run_and_compare(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            results = bench_size(tmp, '300', 300, Namespace(seed=0, repeat=2))
+        names = [result['name'] for result in results]
+        self.assertEqual(names[:4], ['ingest.files', 'ingest.servers', 'scan.full', 'scan.incremental'])
+        self.assertEqual(names[4:], [f'api.{name}' for name, _ in API_REQUESTS])
+        self.assertEqual(results[2]['metrics']['added'], 300)
+        self.assertEqual(results[3]['metrics']['unchanged'], 300)
+
+        self.assertEqual(compare(results, {'results': results}, 0.2), [])
+        slower = [{**result, 'metrics': dict(result['metrics'])} for result in results]
+        slower[2]['metrics']['files_per_second'] *= 2
+        slower[4]['metrics']['p50_ms'] /= 2
+        slower[4]['metrics']['max_ms'] /= 2
+        regressions = compare(results, {'results': slower}, 0.2)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('scan.full [300] files_per_second'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import time
+import socket
+from pathlib import Path
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+from scan_servers.engines import create_engine, get_engine_class
+from scan_servers.nmap_engine import NmapEngine
+from scan_servers.connect_engine import ConnectEngine, RttEstimator
+
+def listen(address):
+    """Listening socket on an ephemeral port of a loopback address."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((address, 0))
+    server.listen(64)
+    return server
+
+class TestConnectEngine(unittest.TestCase):
+    """Test cases for the unprivileged TCP connect engine against loopback listeners."""
+
+    def setUp(self):
+        self.servers = [listen('127.0.0.2'), listen('127.0.0.3')]
+        self.port_a = self.servers[0].getsockname()[1]
+        self.port_b = self.servers[1].getsockname()[1]
+        # A port nothing listens on: connects to it are refused
+        closed = listen('127.0.0.1')
+        self.closed_port = closed.getsockname()[1]
+        closed.close()
+
+    def tearDown(self):
+        for server in self.servers:
+            server.close()
+
+    def engine(self, **kwargs):
+        ports = [self.port_a, self.port_b, self.closed_port]
+        return ConnectEngine(ports=ports, discovery_ports=[self.closed_port],
+                             max_timeout=0.5, **kwargs)
+
+    def test_scan_networks_reports_open_ports(self):
+        events = list(self.engine(max_hosts=4).scan_networks(['127.0.0.0/29']))
+        found = sorted(data['ip_address'] for event, data in events if event == 'found')
+        hosts = {data['ip_address']: data for event, data in events if event == 'host'}
+
+        # Loopback addresses refuse the discovery port, which proves they are up
+        self.assertEqual(found, [f'127.0.0.{i}' for i in range(1, 7)])
+        self.assertEqual(sorted(hosts), found)
+        self.assertEqual(hosts['127.0.0.2']['open_ports'],
+                         f'{self.port_a}/tcp ({ConnectEngine.service_name(self.port_a)})')
+        self.assertEqual(hosts['127.0.0.3']['open_ports'],
+                         f'{self.port_b}/tcp ({ConnectEngine.service_name(self.port_b)})')
+        self.assertIsNone(hosts['127.0.0.4']['open_ports'])
+        for host in hosts.values():
+            self.assertEqual(host['state'], 'up')
+            self.assertEqual(host['scan'], 'full')
+            self.assertEqual(host['detected_os'], 'Unknown')
+            self.assertIsNone(host['mac_address'])
+
+    def test_plan_and_verify_mark_probes(self):
+        events = self.engine().scan_networks(
+            ['127.0.0.2/32', '127.0.0.3/32'],
+            plan=lambda found: found['ip_address'] == '127.0.0.2',
+            verify=lambda host: bool(host['open_ports'])
+        )
+        scans = {data['ip_address']: data['scan'] for event, data in events if event == 'host'}
+        self.assertEqual(scans, {'127.0.0.2': 'probe', '127.0.0.3': 'full'})
+
+    def test_invalid_block_is_reported(self):
+        events = list(self.engine().scan_networks(['not-a-network', '127.0.0.2/32']))
+        self.assertIn(('block_error', {'block': 'not-a-network', 'error': 'not an IP network'}), events)
+        self.assertIn('127.0.0.2', [data['ip_address'] for event, data in events if event == 'host'])
+
+    def test_scan_hosts(self):
+        hosts = {host['ip_address']: host for host in self.engine().scan_hosts(['127.0.0.2', '127.0.0.5'])}
+        self.assertEqual(hosts['127.0.0.2']['state'], 'up')
+        self.assertTrue(hosts['127.0.0.2']['open_ports'].startswith(f'{self.port_a}/tcp'))
+        self.assertEqual(hosts['127.0.0.5']['state'], 'up')
+        self.assertIsNone(hosts['127.0.0.5']['open_ports'])
+
+    def test_max_rate_paces_connects(self):
+        start = time.monotonic()
+        list(self.engine(max_rate=100).scan_hosts(['127.0.0.1', '127.0.0.2', '127.0.0.3']))
+        # 9 connects at 100/s cannot finish in less than 80ms
+        self.assertGreaterEqual(time.monotonic() - start, 0.08)
+
+    def test_rtt_estimator_clamps_timeout(self):
+        estimator = RttEstimator(min_timeout=0.05, max_timeout=1.0)
+        self.assertEqual(estimator.timeout, 1.0)
+        for _ in range(10):
+            estimator.update(0.0001)
+        self.assertEqual(estimator.timeout, 0.05)
+        for _ in range(10):
+            estimator.update(5.0)
+        self.assertEqual(estimator.timeout, 1.0)
+
+class TestEngineSelection(unittest.TestCase):
+    """Test cases for choosing the scan engine from the server_scan settings."""
+
+    def test_default_is_nmap(self):
+        self.assertIs(get_engine_class({}), NmapEngine)
+        self.assertTrue(NmapEngine.requires_root)
+        self.assertIsInstance(create_engine({'max_rate': 100}), NmapEngine)
+
+    def test_connect_engine_settings(self):
+        engine = create_engine({
+            'engine': 'connect',
+            'max_rate': 100,
+            'connect': {'ports': [22, 80], 'max_hosts': 8}
+        })
+        self.assertIsInstance(engine, ConnectEngine)
+        self.assertFalse(engine.requires_root)
+        self.assertEqual(engine.ports, [22, 80])
+        self.assertEqual(engine.max_hosts, 8)
+        self.assertEqual(engine.max_rate, 100)
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            get_engine_class({'engine': 'masscan'})
+
+if __name__ == '__main__':
+    unittest.main()
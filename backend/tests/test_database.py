@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import tempfile
+import sqlite3
+import threading
+from pathlib import Path
+from datetime import datetime, timezone
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+from database.db_manager import DatabaseManager, retry_on_busy
+from database.migrations import MIGRATIONS, SCHEMA_VERSION
+
+class TestBulkFileWriter(unittest.TestCase):
+    """Test cases for batched file ingestion."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _add(self, writer, count, start=0):
+        for i in range(start, start + count):
+            writer.add('/nas', f'host{i}.tar.gz', f'/nas/host{i}.tar.gz', datetime.now(), i, i, i)
+
+    def test_flushes_in_batches(self):
+        writer = self.db_manager.bulk_writer(batch_size=10, flush_interval=3600)
+        self._add(writer, 25)
+        # Two full batches written, five rows still buffered
+        self.assertEqual(writer.rows_written, 20)
+        self.assertEqual(writer.pending, 5)
+        self.assertEqual(len(self.db_manager.get_all_scanned_files()), 20)
+        writer.close()
+        self.assertEqual(len(self.db_manager.get_all_scanned_files()), 25)
+        self.assertEqual(len(self.db_manager.get_file_index('/nas')), 25)
+
+    def test_flush_interval(self):
+        writer = self.db_manager.bulk_writer(batch_size=1000, flush_interval=1e-9)
+        self._add(writer, 3)
+        self.assertEqual(writer.pending, 0)
+        writer.close()
+
+    def test_update_and_remove(self):
+        with self.db_manager.bulk_writer() as writer:
+            self._add(writer, 3)
+        with self.db_manager.bulk_writer() as writer:
+            writer.update('/nas', '/nas/host1.tar.gz', datetime.now(), 999, 1, 42)
+            writer.remove('/nas/host2.tar.gz')
+
+        files = {row[2]: row for row in self.db_manager.get_all_scanned_files()}
+        self.assertEqual(sorted(files), ['/nas/host0.tar.gz', '/nas/host1.tar.gz'])
+        self.assertEqual(files['/nas/host1.tar.gz'][4], 999)
+        index = self.db_manager.get_file_index('/nas')
+        self.assertEqual(tuple(index['/nas/host1.tar.gz']), (1, 999, 42))
+        self.assertNotIn('/nas/host2.tar.gz', index)
+
+    def test_operations_on_one_path_apply_in_order(self):
+        with self.db_manager.bulk_writer() as writer:
+            self._add(writer, 3)
+        with self.db_manager.bulk_writer() as writer:
+            # Deleted and recreated, then modified
+            writer.remove('/nas/host0.tar.gz')
+            writer.add('/nas', 'host0.tar.gz', '/nas/host0.tar.gz', datetime.now(), 500, 5, 50)
+            # Removed and recreated in place before a later update
+            writer.remove('/nas/host1.tar.gz')
+            writer.update('/nas', '/nas/host1.tar.gz', datetime.now(), 600, 6, 60)
+            # Created, then deleted again
+            writer.add('/nas', 'host9.tar.gz', '/nas/host9.tar.gz', datetime.now(), 9, 9, 9)
+            writer.remove('/nas/host9.tar.gz')
+            self.assertEqual(writer.pending, 3)
+
+        files = {row[2]: row for row in self.db_manager.get_all_scanned_files()}
+        self.assertEqual(sorted(files), ['/nas/host0.tar.gz', '/nas/host1.tar.gz', '/nas/host2.tar.gz'])
+        self.assertEqual(files['/nas/host0.tar.gz'][4], 500)
+        self.assertEqual(files['/nas/host1.tar.gz'][4], 600)
+        index = self.db_manager.get_file_index('/nas')
+        self.assertEqual(tuple(index['/nas/host0.tar.gz']), (5, 500, 50))
+        self.assertEqual(tuple(index['/nas/host1.tar.gz']), (6, 600, 60))
+        self.assertNotIn('/nas/host9.tar.gz', index)
+
+    def test_flush_retries_while_the_database_is_locked(self):
+        db_manager = DatabaseManager(self.db_manager.db_path,
+                                     settings={'busy_timeout': 0, 'retries': 6, 'retry_backoff': 0.02})
+        writer = db_manager.bulk_writer(flush_interval=3600)
+        self._add(writer, 3)
+
+        # Another writer holds the lock for longer than busy_timeout
+        other = sqlite3.connect(self.db_manager.db_path, check_same_thread=False)
+        other.execute('BEGIN IMMEDIATE')
+        timer = threading.Timer(0.2, other.commit)
+        timer.start()
+        writer.close()
+        timer.join()
+        other.close()
+        self.assertEqual(writer.rows_written, 3)
+        self.assertEqual(len(self.db_manager.get_all_scanned_files()), 3)
+
+class TestConnectionManagement(unittest.TestCase):
+    """Test cases for connection reuse, pragmas and busy retries."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp.cleanup()
+
+    def test_reuses_connection_per_thread(self):
+        conn = self.db_manager._connect()
+        self.assertIs(self.db_manager._connect(), conn)
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(self.db_manager._connect()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], conn)
+
+    def test_connection_per_call_when_disabled(self):
+        db_manager = DatabaseManager(self.db_manager.db_path, settings={'reuse_connections': False})
+        self.assertIsNot(db_manager._connect(), db_manager._connect())
+
+    def test_retries_when_busy(self):
+        calls = []
+
+        class Flaky:
+            settings = {'retries': 2, 'retry_backoff': 0}
+
+            @retry_on_busy
+            def run(self):
+                calls.append(1)
+                if len(calls) < 3:
+                    raise sqlite3.OperationalError('database is locked')
+                return 'ok'
+
+        self.assertEqual(Flaky().run(), 'ok')
+        self.assertEqual(len(calls), 3)
+
+class TestMigrations(unittest.TestCase):
+    """Test cases for upgrading existing databases in place."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, 'test.db')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _create_legacy_db(self):
+        """A database as created before versioned migrations: text timestamps, no unique keys."""
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript('''
+            CREATE TABLE scanned_files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT NOT NULL,
+                filepath TEXT NOT NULL,
+                last_modified TIMESTAMP,
+                size INTEGER,
+                scan_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE scanned_servers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                hostname TEXT NOT NULL,
+                ip_address TEXT,
+                detected_os TEXT,
+                open_ports TEXT,
+                last_scan TIMESTAMP,
+                is_reachable BOOLEAN,
+                scan_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            INSERT INTO scanned_files (filename, filepath, last_modified, size, scan_time) VALUES
+                ('a.tib', '/nas/a.tib', '2024-01-01 10:00:00.500000', 1, '2024-01-02 00:00:00'),
+                ('a.tib', '/nas/a.tib', '2024-01-03 10:00:00', 2, '2024-01-04 00:00:00'),
+                ('b.tib', '/nas/b.tib', '2024-01-05 10:00:00', 3, '2024-01-06 00:00:00');
+            INSERT INTO scanned_servers (hostname, ip_address, last_scan, is_reachable) VALUES
+                ('ub01', '10.0.0.1', '2024-01-01 12:00:00', 1),
+                ('ub01', '10.0.0.2', '2024-01-02 12:00:00', 1);
+        ''')
+        conn.commit()
+        conn.close()
+
+    def test_fresh_database_is_current(self):
+        DatabaseManager(self.db_path)
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute('PRAGMA user_version').fetchone()[0], SCHEMA_VERSION)
+        conn.close()
+
+    def test_upgrades_legacy_database(self):
+        self._create_legacy_db()
+        db_manager = DatabaseManager(self.db_path)
+
+        files = {row[2]: row for row in db_manager.get_all_scanned_files()}
+        self.assertEqual(sorted(files), ['/nas/a.tib', '/nas/b.tib'])
+        # Duplicates collapse to the newest row; local and UTC text become epochs
+        self.assertEqual(files['/nas/a.tib'][4], 2)
+        self.assertEqual(files['/nas/a.tib'][3], int(datetime(2024, 1, 3, 10).timestamp()))
+        self.assertEqual(
+            files['/nas/a.tib'][5],
+            int(datetime(2024, 1, 4, tzinfo=timezone.utc).timestamp())
+        )
+
+        servers = db_manager.get_all_servers()
+        self.assertEqual(len(servers), 1)
+        self.assertEqual(servers[0][2], '10.0.0.2')
+        self.assertIsInstance(servers[0][5], int)
+
+        conn = sqlite3.connect(self.db_path)
+        indexes = {row[1] for row in conn.execute("SELECT * FROM sqlite_master WHERE type = 'index'")}
+        conn.close()
+        self.assertTrue({
+            'idx_scanned_files_filepath', 'idx_scanned_files_last_modified',
+            'idx_scanned_servers_hostname', 'idx_scanned_servers_ip_address'
+        } <= indexes)
+
+        # Reopening is a no-op
+        DatabaseManager(self.db_path)
+        self.assertEqual(len(db_manager.get_all_scanned_files()), 2)
+
+    def test_upgraded_schema_matches_a_fresh_one(self):
+        def schema(path):
+            conn = sqlite3.connect(path)
+            rows = conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY name").fetchall()
+            conn.close()
+            return rows
+
+        self._create_legacy_db()
+        DatabaseManager(self.db_path)
+        fresh = os.path.join(self.tmp.name, 'fresh.db')
+        DatabaseManager(fresh)
+        self.assertEqual(schema(self.db_path), schema(fresh))
+
+        # Version 1 is the schema from before migrations, nothing added since
+        conn = sqlite3.connect(':memory:')
+        MIGRATIONS[0](conn)
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        conn.close()
+        self.assertEqual(tables, {'scanned_files', 'scanned_servers', 'sqlite_sequence'})
+
+    def test_upgrade_converts_scan_job_times(self):
+        self._create_legacy_db()
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript('''
+            CREATE TABLE scan_jobs (
+                id TEXT PRIMARY KEY, kind TEXT NOT NULL, params TEXT, status TEXT NOT NULL,
+                phase TEXT, processed INTEGER NOT NULL DEFAULT 0, total INTEGER, message TEXT,
+                result TEXT, owner_pid INTEGER, created_at REAL, started_at REAL,
+                updated_at REAL, finished_at REAL
+            );
+            INSERT INTO scan_jobs (id, kind, status, created_at, started_at, updated_at)
+            VALUES ('j1', 'directories', 'running', 1700000000.75, 1700000000.75, 1700000001.5);
+        ''')
+        conn.close()
+
+        db_manager = DatabaseManager(self.db_path)
+        job = db_manager.get_scan_job('j1')
+        self.assertEqual((job['started_at'], job['updated_at'], job['finished_at']),
+                         (1700000000, 1700000001, None))
+        db_manager.update_scan_job('j1', status='failed', finished_at=1700000002)
+        self.assertIsInstance(db_manager.get_scan_job('j1')['updated_at'], int)
+
+    def test_upgrade_fills_backup_status(self):
+        self._create_legacy_db()
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            INSERT INTO scanned_files (filename, filepath, last_modified, size)
+            VALUES ('ub01_10.0.0.2_sda.tib', '/nas/ub01_10.0.0.2_sda.tib', '2024-01-07 10:00:00', 4)
+        ''')
+        conn.commit()
+        conn.close()
+
+        db_manager = DatabaseManager(self.db_path)
+        _, servers = db_manager.query_servers(datetime(2024, 1, 1))
+        row = dict(zip(DatabaseManager.SERVER_COLUMNS, servers[0]))
+        self.assertEqual((row['backup_filename'], row['backup_status']), ('ub01_10.0.0.2_sda.tib', 'green'))
+
+    def test_upserts_keep_one_row(self):
+        db_manager = DatabaseManager(self.db_path)
+        first = db_manager.update_server('ub01', {'ip_address': '10.0.0.1', 'last_scan': datetime.now()})
+        second = db_manager.update_server('ub01', {'ip_address': '10.0.0.9', 'last_scan': datetime.now()})
+        self.assertEqual(first, second)
+        self.assertEqual(db_manager.get_all_servers()[0][2], '10.0.0.9')
+
+        file_id = db_manager.add_scanned_file('a.tib', '/nas/a.tib', datetime.now(), 1)
+        self.assertEqual(db_manager.add_scanned_file('a.tib', '/nas/a.tib', datetime.now(), 5), file_id)
+        self.assertEqual(db_manager.get_all_scanned_files()[0][4], 5)
+
+if __name__ == '__main__':
+    unittest.main()
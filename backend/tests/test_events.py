@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import json
+import time
+import tempfile
+import threading
+from pathlib import Path
+from datetime import datetime
+from unittest import mock
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+import app as app_module
+from database.db_manager import DatabaseManager
+from jobs.events import EventBroadcaster
+
+class TestEventBroadcaster(unittest.TestCase):
+    """Test cases for turning scan_jobs and data generation changes into events."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+        self.broadcaster = EventBroadcaster(self.db_manager, poll_interval=0.02)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def next_events(self, stream, count):
+        return [next(stream) for _ in range(count)]
+
+    def test_snapshot_then_changes(self):
+        self.db_manager.create_scan_job('old', 'directories', '{}', os.getpid())
+        stream = self.broadcaster.subscribe(heartbeat=2.0)
+
+        (event, data), (job_event, job) = self.next_events(stream, 2)
+        self.assertEqual(event, 'generation')
+        self.assertEqual(data['generation'], self.db_manager.get_data_generation()[0])
+        self.assertEqual((job_event, job['id']), ('job', 'old'))
+        self.assertEqual(job['progress'], {'files_walked': 0, 'files_per_second': job['rate']})
+
+        # A write in any process bumps the generation
+        self.db_manager.add_scanned_file('a.tar', '/nas01/a.tar', datetime.now(), 1)
+        event, data = next(stream)
+        self.assertEqual(event, 'generation')
+        self.assertEqual(data['generation'], self.db_manager.get_data_generation()[0])
+
+        self.db_manager.create_scan_job('scan', 'servers', '{}', os.getpid())
+        event, job = next(stream)
+        self.assertEqual((event, job['id'], job['status']), ('job', 'scan', 'running'))
+
+        # Job times are whole seconds: progress two seconds on
+        later = time.time() + 2
+        with mock.patch('time.time', return_value=later):
+            self.db_manager.update_scan_job('scan', phase='scanning hosts', processed=10, total=40)
+        event, job = next(stream)
+        self.assertEqual(job['phase'], 'scanning hosts')
+        self.assertEqual(job['progress']['hosts_discovered'], 40)
+        self.assertEqual(job['progress']['hosts_scanned'], 10)
+        self.assertGreater(job['current_rate'], 0)
+
+        # Updated again within the same second: still published
+        with mock.patch('time.time', return_value=later):
+            self.db_manager.update_scan_job('scan', processed=20)
+        event, job = next(stream)
+        self.assertEqual((event, job['processed']), ('job', 20))
+        stream.close()
+
+    def test_starting_state_is_read_without_the_lock(self):
+        reading, release = threading.Event(), threading.Event()
+        read = self.broadcaster._read
+
+        def slow_read():
+            reading.set()
+            release.wait(2.0)
+            return read()
+
+        streams = [self.broadcaster.subscribe(heartbeat=2.0) for _ in range(2)]
+        with mock.patch.object(self.broadcaster, '_read', side_effect=slow_read):
+            threads = [threading.Thread(target=next, args=(stream,)) for stream in streams]
+            threads[0].start()
+            self.assertTrue(reading.wait(2.0))
+            threads[1].start()
+            # Polls and other subscribers are not held up behind the query
+            self.assertTrue(self.broadcaster._condition.acquire(timeout=0.5))
+            self.broadcaster._condition.release()
+            release.set()
+            for thread in threads:
+                thread.join(2.0)
+        self.assertEqual(self.broadcaster._subscribers, 2)
+        for stream in streams:
+            stream.close()
+        self.assertEqual(self.broadcaster._subscribers, 0)
+
+    def test_heartbeat_and_duration(self):
+        stream = self.broadcaster.subscribe(heartbeat=0.05, max_duration=0.3)
+        messages = list(stream)
+        self.assertEqual(messages[0][0], 'generation')
+        self.assertIn(None, messages)
+
+    def test_poller_stops_without_subscribers(self):
+        stream = self.broadcaster.subscribe(heartbeat=0.05)
+        next(stream)
+        self.assertIsNotNone(self.broadcaster._poller)
+        stream.close()
+        time.sleep(0.1)
+        self.assertIsNone(self.broadcaster._poller)
+
+    def test_slow_subscriber_gets_a_snapshot(self):
+        broadcaster = EventBroadcaster(self.db_manager, poll_interval=0.01, history=2)
+        stream = broadcaster.subscribe(heartbeat=1.0)
+        self.next_events(stream, 1)
+        for i in range(5):
+            self.db_manager.add_scanned_file(f'{i}.tar', f'/nas01/{i}.tar', datetime.now(), 1)
+            time.sleep(0.03)
+        generations = []
+        while True:
+            event, data = next(stream)
+            generations.append(data['generation'])
+            if data['generation'] == self.db_manager.get_data_generation()[0]:
+                break
+        self.assertLess(len(generations), 5)
+        stream.close()
+
+class TestEventsEndpoint(unittest.TestCase):
+    """Test cases for the /api/events Server-Sent Events stream."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+        settings = {**app_module.EVENTS_DEFAULTS, 'heartbeat': 0.05, 'max_duration': 0.2}
+        for name, value in (('db_manager', self.db_manager),
+                            ('event_broadcaster', EventBroadcaster(self.db_manager, poll_interval=0.02)),
+                            ('events_settings', settings)):
+            patcher = mock.patch.object(app_module, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = app_module.app.test_client()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_stream(self):
+        response = self.client.get('/api/events')
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        messages = response.get_data(as_text=True).split('\n\n')
+        self.assertEqual(messages[0], 'retry: 2000')
+        event, data = messages[1].split('\n')
+        self.assertEqual(event, 'event: generation')
+        self.assertEqual(json.loads(data[len('data: '):])['generation'], 1)
+        self.assertIn(': keep-alive', messages)
+
+    def test_subscriber_limit(self):
+        app_module.event_broadcaster.max_subscribers = 1
+        stream = app_module.event_broadcaster.subscribe(heartbeat=0.05)
+        next(stream)
+        response = self.client.get('/api/events')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '2')
+
+        # The slot is free again once the stream closes
+        stream.close()
+        response = self.client.get('/api/events')
+        self.assertEqual(response.status_code, 200)
+        response.get_data()
+        self.assertEqual(app_module.event_broadcaster._subscribers, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+import app as app_module
+from database.db_manager import DatabaseManager
+from scan_dirs.scan_dirs import DirectoryScanner
+from scan_dirs import fingerprint
+from scan_dirs.fingerprint import Fingerprinter, partial_hash, full_hash
+
+BLOCK = 4096
+
+class TestPartialHash(unittest.TestCase):
+    """Test cases for sampled content hashing."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'image.dd')
+        with open(self.path, 'wb') as f:
+            f.write(os.urandom(100 * BLOCK))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def patch(self, offset, data):
+        with open(self.path, 'r+b') as f:
+            f.seek(offset)
+            f.write(data)
+
+    def test_reads_only_the_samples(self):
+        digest, read = partial_hash(self.path, 100 * BLOCK, BLOCK, 2)
+        self.assertEqual(read, 4 * BLOCK)
+
+        # Between the samples: invisible to the partial hash, not to the full one
+        full, _ = full_hash(self.path, 100 * BLOCK, BLOCK)
+        self.patch(10 * BLOCK, b'x')
+        self.assertEqual(partial_hash(self.path, 100 * BLOCK, BLOCK, 2)[0], digest)
+        self.assertNotEqual(full_hash(self.path, 100 * BLOCK, BLOCK)[0], full)
+
+        self.patch(100 * BLOCK - 1, b'x')
+        self.assertNotEqual(partial_hash(self.path, 100 * BLOCK, BLOCK, 2)[0], digest)
+
+    def test_small_and_empty_files_are_read_whole(self):
+        self.assertEqual(partial_hash(self.path, 100 * BLOCK, BLOCK, 200)[1], 100 * BLOCK)
+        empty = os.path.join(self.tmp.name, 'empty')
+        open(empty, 'wb').close()
+        self.assertEqual(partial_hash(empty, 0, BLOCK, 2)[1], 0)
+        self.assertEqual(full_hash(empty, 0, BLOCK)[0], hashlib.blake2b(digest_size=32).hexdigest())
+
+class TestFingerprintStage(unittest.TestCase):
+    """Test cases for the fingerprint stage of DirectoryScanner."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, 'nas01', '')
+        os.makedirs(os.path.join(self.root, 'DD'))
+        self.dd = os.path.join(self.root, 'DD', 'ub02_10.197.38.12_sda_6TB.dd')
+        self.tib = os.path.join(self.root, 'ub01_10.197.38.239_sda_19TB.tib')
+        self.write(self.dd, os.urandom(50 * BLOCK))
+        self.write(self.tib, os.urandom(20 * BLOCK))
+        self.write(os.path.join(self.root, 'notes.cfg'), b'c')
+
+        self.config_path = os.path.join(self.tmp.name, 'config.json')
+        self.configure()
+        self.db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def configure(self, **settings):
+        fingerprint = {'enabled': True, 'patterns': ['*.dd', '*.tib'], 'block_size': BLOCK,
+                       'samples': 2, 'workers': 0, **settings}
+        with open(self.config_path, 'w') as f:
+            json.dump({'directories_to_scan': [self.root], 'subnets_to_scan': [],
+                       'directory_scan': {'fingerprint': fingerprint}}, f)
+
+    @staticmethod
+    def write(path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def scan(self):
+        scanner = DirectoryScanner(self.db_manager, self.config_path)
+        scanner.scan_directories()
+        return scanner.fingerprint_stats
+
+    def test_unchanged_files_are_not_read_again(self):
+        stats = self.scan()
+        self.assertEqual((stats['candidates'], stats['hashed'], stats['new']), (2, 2, 2))
+        self.assertEqual(stats['bytes_read'], 8 * BLOCK)
+
+        stats = self.scan()
+        self.assertEqual((stats['cached'], stats['hashed'], stats['bytes_read']), (2, 0, 0))
+
+        # A move keeps device, inode, size and mtime: still nothing to read
+        os.rename(self.tib, self.tib + '.moved.tib')
+        stats = self.scan()
+        self.assertEqual((stats['cached'], stats['hashed']), (2, 0))
+        self.assertIn(self.tib + '.moved.tib', self.db_manager.get_fingerprints())
+
+    def test_touched_truncated_and_duplicated(self):
+        self.scan()
+        os.utime(self.dd, ns=(0, 10 ** 18))
+        with open(self.tib, 'r+b') as f:
+            f.truncate(10 * BLOCK)
+        shutil.copy(self.dd, os.path.join(self.root, 'DD', 'copy.dd'))
+
+        stats = self.scan()
+        self.assertEqual((stats['touched'], stats['truncated'], stats['new']), (1, 1, 1))
+        report = self.db_manager.get_fingerprint_report()
+        self.assertEqual([row[0] for row in report['touched']], [self.dd])
+        self.assertEqual([row[0] for row in report['truncated']], [self.tib])
+        self.assertEqual(report['duplicates'], [[os.path.join(self.root, 'DD', 'copy.dd'), self.dd]])
+
+        # Removed files drop out of the report
+        os.remove(os.path.join(self.root, 'DD', 'copy.dd'))
+        self.scan()
+        self.assertEqual(self.db_manager.get_fingerprint_report()['duplicates'], [])
+
+    def test_full_hashes_split_sampled_lookalikes(self):
+        data = bytearray(os.urandom(50 * BLOCK))
+        self.write(self.dd, data)
+        data[10 * BLOCK] ^= 1
+        other = os.path.join(self.root, 'DD', 'other.dd')
+        self.write(other, data)
+        self.scan()
+        self.assertEqual(len(self.db_manager.get_fingerprint_report()['duplicates']), 1)
+
+        self.configure(full_hash=True, workers=2)
+        stats = self.scan()
+        self.assertEqual((stats['cached'], stats['full_hashed']), (3, 3))
+        self.assertEqual(self.db_manager.get_fingerprints()[other]['full_hash'],
+                         hashlib.blake2b(bytes(data), digest_size=32).hexdigest())
+        self.assertEqual(self.db_manager.get_fingerprint_report()['duplicates'], [])
+
+    def test_file_truncated_after_the_walk(self):
+        hash_task = fingerprint._hash_task
+
+        def truncate_first(kind, path, *args):
+            # The walk stat'ed the file at its old size; empty it before it is hashed
+            if path == self.tib:
+                open(path, 'wb').close()
+            return hash_task(kind, path, *args)
+
+        with mock.patch.object(fingerprint, '_hash_task', truncate_first):
+            scanner = DirectoryScanner(self.db_manager, self.config_path)
+            scanner.scan_directories()
+        stats = scanner.fingerprint_stats
+        self.assertEqual((stats['hashed'], stats['errors']), (1, 1))
+        self.assertEqual(list(self.db_manager.get_fingerprints()), [self.dd])
+        self.assertEqual(scanner.stats['added'], 3)
+
+        # The next scan sees the new size and fingerprints it
+        stats = self.scan()
+        self.assertEqual((stats['cached'], stats['new'], stats['errors']), (1, 1, 0))
+
+    def test_dead_worker_rebuilds_the_pool(self):
+        executors = []
+
+        def executor():
+            # The first pool breaks: every call in it fails as if a worker died
+            pool = fingerprint._InlineExecutor()
+            if not executors or always_broken:
+                pool.submit = lambda fn, *args: broken()
+            executors.append(pool)
+            return pool
+
+        def broken():
+            future = fingerprint.Future()
+            future.set_exception(fingerprint.BrokenProcessPool('worker died'))
+            return future
+
+        always_broken = False
+        with mock.patch.object(Fingerprinter, '_executor', side_effect=executor):
+            stats = self.scan()
+        self.assertEqual((stats['hashed'], stats['errors']), (2, 0))
+        self.assertEqual(len(executors), 2)
+
+        # Files that break the rebuilt pool as well are left unhashed
+        os.utime(self.dd, ns=(0, 10 ** 18))
+        always_broken = True
+        with mock.patch.object(Fingerprinter, '_executor', side_effect=executor):
+            scanner = DirectoryScanner(self.db_manager, self.config_path)
+            scanner.scan_directories()
+        self.assertEqual((scanner.fingerprint_stats['hashed'], scanner.fingerprint_stats['errors']), (0, 1))
+        self.assertEqual(len(self.db_manager.get_all_scanned_files()), 3)
+
+    def test_io_budget_defers_to_later_scans(self):
+        self.configure(io_budget=5 * BLOCK)
+        stats = self.scan()
+        self.assertEqual((stats['hashed'], stats['deferred']), (1, 1))
+        self.assertLessEqual(stats['bytes_read'], 5 * BLOCK)
+
+        stats = self.scan()
+        self.assertEqual((stats['cached'], stats['hashed'], stats['deferred']), (1, 1, 0))
+
+    def test_disabled_by_default(self):
+        self.assertFalse(Fingerprinter(self.db_manager).settings['enabled'])
+        with open(self.config_path, 'w') as f:
+            json.dump({'directories_to_scan': [self.root]}, f)
+        self.assertIsNone(self.scan())
+        self.assertEqual(self.db_manager.get_fingerprints(), {})
+
+    def test_endpoint(self):
+        self.scan()
+        os.utime(self.dd, ns=(0, 10 ** 18))
+        self.scan()
+        with mock.patch.object(app_module, 'db_manager', self.db_manager):
+            response = app_module.app.test_client().get('/api/files/fingerprints')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([file['filepath'] for file in data['touched']], [self.dd])
+        self.assertEqual((data['truncated'], data['duplicates']), ([], []))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import tempfile
+from pathlib import Path
+from datetime import datetime
+from unittest import mock
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+import app as app_module
+from database.db_manager import DatabaseManager
+from backup_status.backup_status import refresh_backup_status
+from backup_status.history import (
+    DAY, WEEK, apply_retention, backup_age_series, last_fresh_backup, record_history
+)
+
+# Start of an epoch-aligned week (Thursday 00:00 UTC), so day and week buckets line up with it
+T0 = int(datetime(2024, 1, 1).timestamp()) // WEEK * WEEK
+
+class HistoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def history(self, hostname='ub02'):
+        with self.db_manager._connect() as conn:
+            return conn.execute('''
+                SELECT recorded_at, present, is_reachable FROM server_history
+                WHERE hostname = ? ORDER BY recorded_at
+            ''', (hostname,)).fetchall()
+
+    def set_reachable(self, reachable, hostname='ub02'):
+        self.db_manager.update_server(hostname, {'ip_address': '10.0.0.2', 'is_reachable': reachable})
+
+class TestRecordHistory(HistoryTestCase):
+    """Test cases for recording backup state changes as deltas."""
+
+    def test_only_changes_are_recorded(self):
+        self.set_reachable(True)
+        self.db_manager.add_scanned_file('ub02.tar', '/nas01/ub02.tar', datetime.now(), 10)
+        refresh_backup_status(self.db_manager)
+        refresh_backup_status(self.db_manager)
+        self.assertEqual(len(self.history()), 1)
+        generation = self.db_manager.get_data_generation()[0]
+
+        self.set_reachable(False)
+        self.assertEqual(record_history(self.db_manager, now=int(datetime.now().timestamp()) + 10), 1)
+        self.assertGreater(self.db_manager.get_data_generation()[0], generation + 1)
+        self.assertEqual([row[2] for row in self.history()], [1, 0])
+
+        self.db_manager.clear_scanned_servers()
+        record_history(self.db_manager, now=int(datetime.now().timestamp()) + 20)
+        self.assertEqual(self.history()[-1][1:], (0, None))
+
+    def test_snapshots(self):
+        self.set_reachable(True)
+        self.db_manager.add_scanned_file('ub02.tar', '/nas01/ub02.tar', datetime.now(), 10)
+        self.db_manager.add_scanned_file('other.tar', '/nas01/other.tar', datetime.now(), 5)
+        refresh_backup_status(self.db_manager)
+        snapshots = self.db_manager.get_scan_snapshots(0, 2 ** 40)
+        self.assertEqual(len(snapshots), 1)
+        self.assertEqual(snapshots[0][1:], (1, 1, 2, 15, 1))
+
+    def test_disabled(self):
+        self.set_reachable(True)
+        refresh_backup_status(self.db_manager, {'enabled': False})
+        self.assertEqual(self.history(), [])
+
+    def test_range_query_uses_the_index(self):
+        with self.db_manager._connect() as conn:
+            plan = ' '.join(str(row) for row in conn.execute('''
+                EXPLAIN QUERY PLAN SELECT recorded_at FROM server_history
+                WHERE hostname = ? AND recorded_at > ? AND recorded_at <= ?
+            ''', ('ub02', 0, 1)))
+        self.assertIn('idx_server_history_hostname_recorded_at', plan)
+
+class TestRetention(HistoryTestCase):
+    """Test cases for downsampling and expiring old history."""
+
+    def record_changes(self, times):
+        """Alternate ub02 between reachable and not, recording at each time."""
+        for i, at in enumerate(times):
+            self.set_reachable(i % 2 == 0)
+            self.db_manager.record_history(at)
+
+    def test_downsamples_to_daily_then_weekly(self):
+        # Day 0: four changes; day 1: two; day 9: one
+        self.record_changes([T0 + 100, T0 + 200, T0 + 300, T0 + 400,
+                             T0 + DAY + 100, T0 + DAY + 200, T0 + 9 * DAY])
+        settings = {'raw_days': 5, 'daily_days': 100, 'vacuum_threshold': None}
+
+        stats = apply_retention(self.db_manager, settings, now=T0 + 20 * DAY)
+        # Day 0 keeps its last state (unreachable), day 1 ends unreachable too and is
+        # dropped as a repeat; day 9 is past raw_days as well
+        self.assertEqual(self.history(), [(T0 + 400, 1, 0), (T0 + 9 * DAY, 1, 1)])
+        self.assertEqual(stats['daily'], 5)
+
+        # Running again reads nothing new
+        self.assertEqual(apply_retention(self.db_manager, settings, now=T0 + 20 * DAY)['daily'], 0)
+
+        settings['daily_days'] = 1
+        stats = apply_retention(self.db_manager, settings, now=T0 + 30 * DAY)
+        # Both rows fall in different weeks and differ, so both stay
+        self.assertEqual(stats['weekly'], 0)
+        self.assertEqual(len(self.history()), 2)
+
+    def test_weekly_keeps_the_last_state_of_each_week(self):
+        self.record_changes([T0 + DAY, T0 + 2 * DAY, T0 + 3 * DAY, T0 + WEEK + DAY])
+        stats = apply_retention(self.db_manager, {'raw_days': 1, 'daily_days': 2, 'vacuum_threshold': None},
+                                now=T0 + 10 * WEEK)
+        self.assertEqual(stats['weekly'], 2)
+        self.assertEqual(self.history(), [(T0 + 3 * DAY, 1, 1), (T0 + WEEK + DAY, 1, 0)])
+
+    def test_expire_keeps_the_state_in_effect(self):
+        self.record_changes([T0, T0 + DAY, T0 + 2 * DAY])
+        self.db_manager.update_server('gone', {'is_reachable': True})
+        self.db_manager.record_history(T0 + 3 * DAY)
+        self.db_manager.clear_scanned_servers()
+        self.set_reachable(True)
+        self.db_manager.record_history(T0 + 4 * DAY)
+
+        apply_retention(self.db_manager, {'raw_days': 1000, 'daily_days': 2000, 'max_days': 1,
+                                          'vacuum_threshold': None}, now=T0 + 10 * DAY)
+        # ub02's last state before the cutoff stays; 'gone' was gone at the cutoff
+        self.assertEqual(self.history(), [(T0 + 2 * DAY, 1, 1)])
+        self.assertEqual(self.history('gone'), [])
+        self.assertEqual(self.db_manager.get_scan_snapshots(0, 2 ** 40), [])
+
+    def test_vacuum_after_large_deletes(self):
+        self.record_changes([T0 + i * 60 for i in range(2000)])
+        stats = apply_retention(self.db_manager, {'raw_days': 1, 'daily_days': 2, 'vacuum_threshold': 0.1},
+                                now=T0 + 10 * WEEK)
+        self.assertTrue(stats['vacuumed'])
+        self.assertEqual(len(self.history()), 1)
+
+class TestBackupAgeSeries(HistoryTestCase):
+    """Test cases for sampling backup age trends from history."""
+
+    def setUp(self):
+        super().setUp()
+        self.set_reachable(True)
+        self.db_manager.add_scanned_file('ub02_old.tar', '/nas01/ub02_old.tar', datetime.fromtimestamp(T0), 1)
+        refresh_backup_status(self.db_manager, {'enabled': False})
+        self.db_manager.record_history(T0 + DAY)
+        self.db_manager.add_scanned_file('ub02_new.tar', '/nas01/ub02_new.tar',
+                                         datetime.fromtimestamp(T0 + 5 * DAY), 1)
+        refresh_backup_status(self.db_manager, {'enabled': False})
+        self.db_manager.record_history(T0 + 5 * DAY)
+
+    def test_series(self):
+        points = backup_age_series(self.db_manager, 'ub02', T0, T0 + 6 * DAY, DAY, max_age=3 * DAY)
+        self.assertEqual(points[0]['state'], None)
+        self.assertEqual([point['backup_age'] for point in points[1:]],
+                         [DAY, 2 * DAY, 3 * DAY, 4 * DAY, 0, DAY])
+        self.assertEqual([point['backup_status'] for point in points[1:]],
+                         ['green', 'green', 'green', 'yellow', 'green', 'green'])
+        self.assertEqual(points[-1]['backup_filepath'], '/nas01/ub02_new.tar')
+
+    def test_last_fresh_backup(self):
+        self.assertEqual(last_fresh_backup(self.db_manager, 'ub02', DAY, now=T0 + 100 * DAY), T0 + 6 * DAY)
+        self.assertEqual(last_fresh_backup(self.db_manager, 'ub02', DAY, now=T0 + 5 * DAY), T0 + 5 * DAY)
+        self.assertIsNone(last_fresh_backup(self.db_manager, 'unknown', DAY))
+
+    def test_endpoint(self):
+        client = app_module.app.test_client()
+        config = {'backup_status': {'max_age_days': 3}}
+        start = datetime.fromtimestamp(T0).isoformat()
+        end = datetime.fromtimestamp(T0 + 6 * DAY).isoformat()
+        with mock.patch.object(app_module, 'db_manager', self.db_manager), \
+                mock.patch.object(app_module, 'load_config', return_value=config):
+            response = client.get(f'/api/history/servers/ub02?start={start}&end={end}')
+            bad = client.get(f'/api/history/servers/ub02?start={start}&end={end}&step=1')
+            scans = client.get(f'/api/history/scans?start={start}&end={end}')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['points']), 7)
+        self.assertEqual(data['points'][4]['backup_age_days'], 4.0)
+        self.assertEqual(data['points'][4]['backup_status'], 'yellow')
+        self.assertEqual(data['last_fresh_backup'], datetime.fromtimestamp(T0 + 8 * DAY).isoformat())
+        self.assertEqual(bad.status_code, 400)
+        self.assertEqual(scans.get_json()['count'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import json
+import tempfile
+import multiprocessing
+from pathlib import Path
+from unittest import mock
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+import app as app_module
+from database.db_manager import DatabaseManager
+from metrics.metrics import REGISTRY, Counter, Gauge, Histogram, Registry, render
+from scan_dirs.scan_dirs import DirectoryScanner
+
+def _declare(registry):
+    return (
+        Counter('test_files_total', 'Files', ['root'], registry=registry),
+        Gauge('test_rate', 'Rate', registry=registry),
+        Histogram('test_seconds', 'Durations', buckets=(0.1, 1), registry=registry)
+    )
+
+def _child_process(db_path):
+    # A separate process with its own registry, as a gunicorn worker or a scan script has
+    registry = Registry()
+    files, rate, seconds = _declare(registry)
+    files.labels('/nas01/').inc(5)
+    rate.set(7)
+    seconds.observe(2)
+    registry.flush(DatabaseManager(db_path))
+
+class TestRegistry(unittest.TestCase):
+    """Test cases for flushing metrics from several processes into one table."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, 'test.db')
+        self.db_manager = DatabaseManager(self.db_path)
+        self.registry = Registry()
+        self.files, self.rate, self.seconds = _declare(self.registry)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def samples(self):
+        return {(row[3], row[4]): row[5] for row in self.db_manager.get_metric_samples()}
+
+    def test_processes_are_aggregated(self):
+        self.files.labels('/nas01/').inc(2)
+        self.files.labels(root='/nas02/').inc()
+        self.rate.set(3)
+        self.seconds.observe(0.05)
+        self.seconds.observe(0.5)
+        self.assertEqual(self.registry.flush(self.db_manager), 8)
+        # Nothing changed since: nothing to write
+        self.assertEqual(self.registry.flush(self.db_manager), 0)
+
+        process = multiprocessing.get_context('spawn').Process(target=_child_process, args=(self.db_path,))
+        process.start()
+        process.join(30)
+        self.assertEqual(process.exitcode, 0)
+
+        self.files.labels('/nas01/').inc()
+        self.registry.flush(self.db_manager)
+        samples = self.samples()
+        self.assertEqual(samples[('test_files_total', '{"root":"/nas01/"}')], 8)
+        self.assertEqual(samples[('test_files_total', '{"root":"/nas02/"}')], 1)
+        # Gauges keep the last value set by any process
+        self.assertEqual(samples[('test_rate', '{}')], 7)
+        self.assertEqual(samples[('test_seconds_bucket', '{"le":"0.1"}')], 1)
+        self.assertEqual(samples[('test_seconds_bucket', '{"le":"1"}')], 2)
+        self.assertEqual(samples[('test_seconds_bucket', '{"le":"+Inf"}')], 3)
+        self.assertEqual(samples[('test_seconds_count', '{}')], 3)
+        self.assertAlmostEqual(samples[('test_seconds_sum', '{}')], 2.55)
+
+    def test_failed_flush_keeps_changes(self):
+        self.files.labels('/nas01/').inc(4)
+        with mock.patch.object(self.db_manager, 'add_metric_samples', side_effect=RuntimeError('busy')):
+            with self.assertRaises(RuntimeError):
+                self.registry.flush(self.db_manager)
+        self.registry.flush(self.db_manager)
+        self.assertEqual(self.samples()[('test_files_total', '{"root":"/nas01/"}')], 4)
+
+    def test_conflicting_declarations(self):
+        Counter('test_files_total', 'Files', ['root'], registry=self.registry)
+        with self.assertRaises(ValueError):
+            Gauge('test_files_total', 'Files', ['root'], registry=self.registry)
+
+    def test_render(self):
+        self.files.labels('a"b').inc(2)
+        self.seconds.observe(0.5)
+        self.registry.flush(self.db_manager)
+        text = render(self.db_manager.get_metric_samples(), {('test_rows', 'Rows'): {(('table', 't'),): 3}})
+        lines = text.splitlines()
+        self.assertIn('# TYPE test_files_total counter', lines)
+        self.assertIn('test_files_total{root="a\\"b"} 2', lines)
+        start = lines.index('# TYPE test_seconds histogram')
+        self.assertEqual(lines[start + 1:start + 6], [
+            'test_seconds_bucket{le="0.1"} 0',
+            'test_seconds_bucket{le="1"} 1',
+            'test_seconds_bucket{le="+Inf"} 1',
+            'test_seconds_sum 0.5',
+            'test_seconds_count 1'
+        ])
+        self.assertIn('test_rows{table="t"} 3', lines)
+
+class TestMetricsEndpoint(unittest.TestCase):
+    """Test cases for /metrics and the instrumented scanners and routes."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+        patcher = mock.patch.object(app_module, 'db_manager', self.db_manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = app_module.app.test_client()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_scrape(self):
+        root = os.path.join(self.tmp.name, 'nas01', '')
+        os.makedirs(root)
+        with open(os.path.join(root, 'ub02_10.197.38.12.tar'), 'wb') as f:
+            f.write(b'x')
+        config_path = os.path.join(self.tmp.name, 'config.json')
+        with open(config_path, 'w') as f:
+            json.dump({'directories_to_scan': [root]}, f)
+        DirectoryScanner(self.db_manager, config_path).scan_directories()
+        self.client.get('/api/health')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        text = response.get_data(as_text=True)
+        self.assertIn(f'backup_checker_directory_scan_files_total{{root="{root}",status="added"}}', text)
+        self.assertIn(f'backup_checker_directory_scan_walk_seconds_count{{root="{root}"}}', text)
+        self.assertIn('backup_checker_scan_db_write_seconds_count', text)
+        self.assertIn('backup_checker_db_call_seconds_bucket{method="get_file_index",le="0.001"}', text)
+        self.assertIn('backup_checker_http_request_seconds_count{method="GET",route="/api/health",status="200"}', text)
+        self.assertIn('backup_checker_table_rows{table="scanned_files"} 1', text)
+
+        # A second scrape sees the first one's request
+        text = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('route="/metrics"', text)
+
+    def test_disabled(self):
+        with mock.patch.object(app_module, 'metrics_settings', {'enabled': False}):
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import io
+import os
+import stat
+import tempfile
+from pathlib import Path
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+from scan_servers.nmap_engine import NmapEngine, NmapError, ScanBudget
+
+NMAP_XML = b'''<?xml version="1.0" encoding="UTF-8"?>
+<nmaprun scanner="nmap" args="nmap -n -T4 -F -O -oX - 10.0.0.1 10.0.0.2 10.0.0.3">
+<host><status state="up" reason="arp-response"/>
+<address addr="10.0.0.1" addrtype="ipv4"/><address addr="00:11:22:33:44:55" addrtype="mac"/>
+<ports>
+<port protocol="tcp" portid="22"><state state="open"/><service name="ssh"/></port>
+<port protocol="tcp" portid="80"><state state="closed"/><service name="http"/></port>
+<port protocol="tcp" portid="443"><state state="open"/></port>
+</ports>
+<os><osmatch name="Linux 5.0 - 5.4" accuracy="100"/><osmatch name="Linux 4.15" accuracy="95"/></os>
+</host>
+<host><status state="up" reason="echo-reply"/>
+<address addr="10.0.0.2" addrtype="ipv4"/>
+<ports><port protocol="tcp" portid="3389"><state state="open"/><service name="ms-wbt-server"/></port></ports>
+</host>
+<host><status state="down" reason="no-response"/>
+<address addr="10.0.0.3" addrtype="ipv4"/>
+</host>
+<runstats><finished time="0"/><hosts up="2" down="1" total="3"/></runstats>
+</nmaprun>
+'''
+
+class TestNmapEngine(unittest.TestCase):
+    """Test cases for streaming nmap XML parsing."""
+
+    def test_parse_hosts(self):
+        hosts = {host['ip_address']: host for host in NmapEngine.parse_hosts(io.BytesIO(NMAP_XML))}
+        self.assertEqual(sorted(hosts), ['10.0.0.1', '10.0.0.2', '10.0.0.3'])
+
+        self.assertEqual(hosts['10.0.0.1']['state'], 'up')
+        self.assertEqual(hosts['10.0.0.1']['mac_address'], '00:11:22:33:44:55')
+        self.assertEqual(hosts['10.0.0.1']['detected_os'], 'Linux 5.0 - 5.4')
+        self.assertEqual(hosts['10.0.0.1']['open_ports'], '22/tcp (ssh), 443/tcp (unknown)')
+
+        self.assertEqual(hosts['10.0.0.2']['detected_os'], 'Unknown')
+        self.assertEqual(hosts['10.0.0.2']['open_ports'], '3389/tcp (ms-wbt-server)')
+
+        self.assertEqual(hosts['10.0.0.3']['state'], 'down')
+        self.assertIsNone(hosts['10.0.0.3']['open_ports'])
+
+    def test_missing_nmap_raises(self):
+        engine = NmapEngine(nmap_path='/nonexistent/nmap')
+        with self.assertRaises(NmapError):
+            list(engine.discover(['10.0.0.0/24']))
+
+    def test_failed_batches_report_every_host(self):
+        engine = NmapEngine(nmap_path='/nonexistent/nmap', batch_size=2, parallel_batches=2)
+        results = list(engine.scan_hosts([f'10.0.0.{i}' for i in range(5)]))
+        self.assertEqual(sorted(r['ip_address'] for r in results), [f'10.0.0.{i}' for i in range(5)])
+        self.assertTrue(all('error' in r for r in results))
+
+# Stand-in for the nmap binary: a ping sweep reports .1 and .2 of every
+# network up, a host scan reports every target with the ports listed for it
+# in ports.json next to the log (port 22 by default) and an OS match with
+# -O. Each run logs its arguments and end so tests can check
+# what ran and how many runs overlapped.
+FAKE_NMAP = '''#!{python}
+import os, sys, json, time, ipaddress
+log = {log!r}
+with open(log, 'a') as f:
+    f.write('start ' + ' '.join(sys.argv[1:]) + '\\n')
+ports_path = os.path.join(os.path.dirname(log), 'ports.json')
+open_ports = json.load(open(ports_path)) if os.path.exists(ports_path) else {{}}
+targets = [a for a in sys.argv[1:] if a[0].isdigit() and '.' in a]
+time.sleep(0.05)
+print('<nmaprun>')
+for target in targets:
+    if '-sn' in sys.argv:
+        network = ipaddress.ip_network(target, strict=False)
+        ips = [network.network_address + 1, network.network_address + 2]
+    else:
+        ips = [target]
+    for ip in ips:
+        print('<host><status state="up"/><address addr="%s" addrtype="ipv4"/>' % ip)
+        if '-sn' not in sys.argv:
+            print('<ports>')
+            for port in open_ports.get(str(ip), [22]):
+                print('<port protocol="tcp" portid="%d"><state state="open"/>'
+                      '<service name="svc%d"/></port>' % (port, port))
+            print('</ports>')
+            if '-O' in sys.argv:
+                print('<os><osmatch name="Linux 5.X"/></os>')
+        print('</host>', flush=True)
+print('</nmaprun>')
+with open(log, 'a') as f:
+    f.write('end\\n')
+'''
+
+class TestScanPipeline(unittest.TestCase):
+    """Test cases for pipelined multi-subnet discovery."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.tmp.name, 'runs.log')
+        self.nmap = os.path.join(self.tmp.name, 'nmap')
+        with open(self.nmap, 'w') as f:
+            f.write(FAKE_NMAP.format(python=sys.executable, log=self.log))
+        os.chmod(self.nmap, os.stat(self.nmap).st_mode | stat.S_IEXEC)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _runs(self):
+        with open(self.log) as f:
+            return [line.split() for line in f]
+
+    def test_split_targets(self):
+        blocks = NmapEngine.split_targets(['10.0.0.0/22', '10.0.1.0/24', '10.0.9.5', 'example.lan'])
+        self.assertEqual(blocks, [
+            '10.0.0.0/24', '10.0.1.0/24', '10.0.2.0/24', '10.0.3.0/24',
+            '10.0.9.5/32', 'example.lan'
+        ])
+
+    def test_budget_splits_rate(self):
+        self.assertEqual(ScanBudget(max_processes=4, max_rate=1000).rate_per_process, 250)
+        self.assertIsNone(ScanBudget(max_processes=4).rate_per_process)
+
+    def test_scan_networks_pipeline(self):
+        engine = NmapEngine(
+            nmap_path=self.nmap, batch_size=3, parallel_batches=2,
+            budget=ScanBudget(max_processes=3, max_rate=3000)
+        )
+        events = list(engine.scan_networks(['10.1.0.0/22', '10.2.0.0/24'], parallel_discovery=3))
+
+        found = sorted(data['ip_address'] for event, data in events if event == 'found')
+        hosts = {data['ip_address']: data for event, data in events if event == 'host'}
+        expected = sorted(f'10.{a}.{b}.{c}' for a, b in ((1, 0), (1, 1), (1, 2), (1, 3), (2, 0)) for c in (1, 2))
+        self.assertEqual(found, expected)
+        self.assertEqual(sorted(hosts), expected)
+        self.assertTrue(all(host['open_ports'] == '22/tcp (svc22)' for host in hosts.values()))
+
+        # Never more processes at once than the budget allows, each with its share of the rate
+        running = peak = 0
+        for run in self._runs():
+            running += 1 if run[0] == 'start' else -1
+            peak = max(peak, running)
+            if run[0] == 'start':
+                self.assertIn('--max-rate', run)
+                self.assertEqual(run[run.index('--max-rate') + 1], '1000')
+        self.assertLessEqual(peak, 3)
+        # Host scans never exceed batch_size targets
+        for run in self._runs():
+            if run[0] == 'start' and '-sn' not in run:
+                self.assertLessEqual(len([a for a in run if a.startswith('10.')]), 3)
+
+    def test_block_errors_are_reported(self):
+        engine = NmapEngine(nmap_path='/nonexistent/nmap')
+        events = list(engine.scan_networks(['10.0.0.0/23']))
+        self.assertEqual(sorted(data['block'] for event, data in events if event == 'block_error'),
+                         ['10.0.0.0/24', '10.0.1.0/24'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import time
+import tempfile
+from pathlib import Path
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+from database.db_manager import DatabaseManager
+from scan_servers.resolver import ReverseResolver
+
+class StubResolver(ReverseResolver):
+    """Resolves from a fixed table instead of DNS; 10.9.* never answer in time, 10.8.* take a while."""
+
+    NAMES = {'10.0.0.1': 'ub01.lan', '10.0.0.2': 'ub02.lan'}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queries = []
+
+    def _gethostbyaddr(self, ip_address):
+        self.queries.append(ip_address)
+        if ip_address.startswith('10.9.'):
+            time.sleep(1.0)
+        elif ip_address.startswith('10.8.'):
+            time.sleep(0.3)
+        return self.NAMES.get(ip_address)
+
+class TestReverseResolver(unittest.TestCase):
+    """Test cases for cached, concurrent reverse DNS."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_cache_persists_across_scans(self):
+        resolver = StubResolver(self.db_manager)
+        self.assertEqual(
+            resolver.resolve_many(['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.1']),
+            {'10.0.0.1': 'ub01.lan', '10.0.0.2': 'ub02.lan', '10.0.0.3': None}
+        )
+        self.assertEqual(resolver.stats['misses'], 3)
+        resolver.close()
+
+        # A new scan starts from the persisted cache, negative entries included
+        resolver = StubResolver(self.db_manager)
+        self.assertEqual(resolver.hostname('10.0.0.1'), 'ub01.lan')
+        self.assertIsNone(resolver.hostname('10.0.0.3'))
+        self.assertEqual(resolver.queries, [])
+        self.assertEqual(resolver.stats['hits'], 1)
+        self.assertEqual(resolver.stats['negative_hits'], 1)
+        self.assertEqual(resolver.hit_rate, 1.0)
+
+    def test_expired_entries_are_resolved_again(self):
+        resolver = StubResolver(self.db_manager, negative_ttl=0)
+        self.assertIsNone(resolver.hostname('10.0.0.3'))
+        resolver.close()
+
+        resolver = StubResolver(self.db_manager)
+        self.assertIsNone(resolver.hostname('10.0.0.3'))
+        self.assertEqual(resolver.queries, ['10.0.0.3'])
+
+    def test_slow_lookups_time_out(self):
+        resolver = StubResolver(self.db_manager, timeout=0.1)
+        start = time.monotonic()
+        names = resolver.resolve_many([f'10.9.0.{i}' for i in range(5)] + ['10.0.0.1'])
+        self.assertLess(time.monotonic() - start, 0.8)
+        self.assertEqual(names['10.0.0.1'], 'ub01.lan')
+        self.assertEqual(resolver.stats['timeouts'], 5)
+        # Timed out addresses are cached as negative
+        self.assertIsNone(resolver.hostname('10.9.0.0'))
+        self.assertEqual(resolver.queries.count('10.9.0.0'), 1)
+
+    def test_queued_lookups_are_not_timed_out(self):
+        # One worker: 10.0.0.1 waits 0.6s in the queue, longer than the timeout
+        with StubResolver(self.db_manager, timeout=0.4, max_workers=1) as resolver:
+            names = resolver.resolve_many(['10.8.0.1', '10.8.0.2', '10.0.0.1'])
+            self.assertEqual(names['10.0.0.1'], 'ub01.lan')
+            self.assertEqual(resolver.stats['timeouts'], 0)
+
+        # Closing stops the worker threads
+        with self.assertRaises(RuntimeError):
+            resolver.lookup('10.0.0.2')
+
+    def test_lookups_that_never_start_are_not_cached(self):
+        resolver = StubResolver(self.db_manager, timeout=0.1, max_workers=1, queue_timeout=0.2)
+        names = resolver.resolve_many(['10.9.0.1', '10.0.0.2'])
+        self.assertEqual(names, {'10.9.0.1': None, '10.0.0.2': None})
+        self.assertEqual(resolver.stats['timeouts'], 2)
+        self.assertNotIn('10.0.0.2', resolver._cache)
+        # Asking again while it is still queued neither waits nor counts another timeout
+        start = time.monotonic()
+        self.assertIsNone(resolver.hostname('10.0.0.2'))
+        self.assertIsNone(resolver.hostname('10.9.0.1'))
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(resolver.stats['timeouts'], 2)
+        time.sleep(1.0)
+        self.assertEqual(resolver.hostname('10.0.0.2'), 'ub02.lan')
+        resolver.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import json
+import time
+import tempfile
+import threading
+from pathlib import Path
+from unittest import mock
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+from database.db_manager import DatabaseManager
+from scan_dirs.scan_dirs import DirectoryScanner
+from scan_dirs.walker import ParallelWalker, DirectoryTimeout
+
+def hang_listings(testcase, paths, stat_seconds=None):
+    """
+    Make ParallelWalker block listing the given paths, as on a hung mount,
+    until the test ends. stat_seconds(path) overrides the stat time reported
+    for a listing.
+    """
+    released = threading.Event()
+    scan_dir = ParallelWalker._scan_dir
+    hung = {os.path.normpath(path) for path in paths}
+
+    def listing(path):
+        if os.path.normpath(path) in hung:
+            released.wait()
+        files, subdirs, error, seconds = scan_dir(path)
+        return files, subdirs, error, seconds if stat_seconds is None else stat_seconds(path)
+
+    patcher = mock.patch.object(ParallelWalker, '_scan_dir', staticmethod(listing))
+    patcher.start()
+    testcase.addCleanup(patcher.stop)
+    testcase.addCleanup(released.set)
+
+class TestIncrementalDirectoryScan(unittest.TestCase):
+    """Test cases for incremental rescans in DirectoryScanner."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, 'nas01', '')
+        os.makedirs(os.path.join(self.root, 'Acronis'))
+        os.makedirs(os.path.join(self.root, 'DD'))
+        self._write('Acronis/ub01_10.197.38.239_sda_19TB.tib', b'a' * 10)
+        self._write('DD/ub02_10.197.38.12_sda_6TB.dd', b'b' * 20)
+        self._write('notes.cfg', b'c')
+
+        self.config_path = os.path.join(self.tmp.name, 'config.json')
+        with open(self.config_path, 'w') as f:
+            json.dump({'directories_to_scan': [self.root], 'subnets_to_scan': []}, f)
+        self.db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, relpath, data):
+        with open(os.path.join(self.root, relpath), 'wb') as f:
+            f.write(data)
+
+    def _scan(self):
+        scanner = DirectoryScanner(self.db_manager, self.config_path)
+        results = scanner.scan_directories()
+        return scanner, results
+
+    def _stored_paths(self):
+        return sorted(row[2] for row in self.db_manager.get_all_scanned_files())
+
+    def test_first_scan_adds_everything(self):
+        scanner, results = self._scan()
+        self.assertEqual(scanner.stats, {'added': 3, 'changed': 0, 'removed': 0, 'unchanged': 0})
+        self.assertEqual(len(results[self.root]), 3)
+        self.assertEqual(len(self._stored_paths()), 3)
+
+    def test_rescan_only_writes_delta(self):
+        self._scan()
+        ids_before = {row[2]: row[0] for row in self.db_manager.get_all_scanned_files()}
+
+        self._write('DD/ub02_10.197.38.12_sda_6TB.dd', b'b' * 30)
+        os.remove(os.path.join(self.root, 'notes.cfg'))
+        self._write('Acronis/new_host_10.0.0.1.tib', b'd')
+
+        scanner, _ = self._scan()
+        self.assertEqual(scanner.stats, {'added': 1, 'changed': 1, 'removed': 1, 'unchanged': 1})
+
+        files = {row[2]: row for row in self.db_manager.get_all_scanned_files()}
+        self.assertNotIn(os.path.join(self.root, 'notes.cfg'), files)
+        changed = files[os.path.join(self.root, 'DD', 'ub02_10.197.38.12_sda_6TB.dd')]
+        self.assertEqual(changed[4], 30)
+        # Unchanged and changed files keep their rows
+        unchanged_path = os.path.join(self.root, 'Acronis', 'ub01_10.197.38.239_sda_19TB.tib')
+        self.assertEqual(files[unchanged_path][0], ids_before[unchanged_path])
+        self.assertEqual(changed[0], ids_before[changed[2]])
+
+    def test_removed_root_is_tombstoned(self):
+        self._scan()
+        with open(self.config_path, 'w') as f:
+            json.dump({'directories_to_scan': [], 'subnets_to_scan': []}, f)
+        scanner, _ = self._scan()
+        self.assertEqual(scanner.stats['removed'], 3)
+        self.assertEqual(self._stored_paths(), [])
+
+    def test_timed_out_directory_keeps_files(self):
+        self._scan()
+        with open(self.config_path, 'w') as f:
+            json.dump({'directories_to_scan': [self.root], 'subnets_to_scan': [],
+                       'directory_scan': {'directory_timeout': 0.2}}, f)
+        os.remove(os.path.join(self.root, 'Acronis', 'ub01_10.197.38.239_sda_19TB.tib'))
+        os.remove(os.path.join(self.root, 'notes.cfg'))
+        hang_listings(self, [os.path.join(self.root, 'Acronis')])
+
+        scanner, _ = self._scan()
+        # The file under the hung directory is kept, the one listed as gone is not
+        self.assertEqual(scanner.stats, {'added': 0, 'changed': 0, 'removed': 1, 'unchanged': 1})
+        self.assertEqual(self._stored_paths(), [
+            os.path.join(self.root, 'Acronis', 'ub01_10.197.38.239_sda_19TB.tib'),
+            os.path.join(self.root, 'DD', 'ub02_10.197.38.12_sda_6TB.dd')
+        ])
+        health = scanner.health[self.root]
+        self.assertEqual((health['status'], health['timeouts'], health['unwalked']), ('partial', 1, 0))
+
+    def test_full_mode_rewrites_table(self):
+        self._scan()
+        scanner = DirectoryScanner(self.db_manager, self.config_path, incremental=False)
+        scanner.scan_directories()
+        self.assertEqual(scanner.stats['added'], 3)
+        self.assertEqual(len(self._stored_paths()), 3)
+
+class TestParallelWalker(unittest.TestCase):
+    """Test cases for the scandir-based parallel walker."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.roots = []
+        for nas in ('nas01', 'nas02'):
+            root = os.path.join(self.tmp.name, nas)
+            self.roots.append(root)
+            for i in range(5):
+                subdir = os.path.join(root, f'dir{i}', 'nested')
+                os.makedirs(subdir)
+                for j in range(3):
+                    with open(os.path.join(subdir, f'host{i}{j}_10.0.{i}.{j}.tib'), 'w') as f:
+                        f.write('x' * j)
+                with open(os.path.join(root, f'dir{i}', 'top.cfg'), 'w') as f:
+                    f.write('cfg')
+        # Symlinked directories are not followed, symlinked files are reported
+        os.symlink(os.path.join(self.roots[0], 'dir0'), os.path.join(self.roots[0], 'link_dir'))
+        os.symlink(os.path.join(self.roots[0], 'dir0', 'top.cfg'), os.path.join(self.roots[0], 'link.cfg'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_matches_os_walk(self):
+        expected = set()
+        for root in self.roots:
+            for dirpath, _, files in os.walk(root):
+                for filename in files:
+                    filepath = os.path.join(dirpath, filename)
+                    stats = os.stat(filepath)
+                    expected.add((root, filepath, stats.st_size, stats.st_mtime_ns))
+
+        found = set()
+        walker = ParallelWalker(max_workers=4, workers_per_root=2)
+        for root, dirpath, files, error in walker.walk(self.roots):
+            self.assertIsNone(error)
+            for filename, stats in files:
+                found.add((root, os.path.join(dirpath, filename), stats.st_size, stats.st_mtime_ns))
+
+        self.assertEqual(found, expected)
+
+    def test_missing_root_reports_error(self):
+        missing = os.path.join(self.tmp.name, 'missing')
+        results = list(ParallelWalker().walk([missing]))
+        self.assertEqual(len(results), 1)
+        self.assertIsInstance(results[0][3], OSError)
+
+class TestWalkerDeadlines(unittest.TestCase):
+    """Test cases for the walker's timeouts, health report and adaptive concurrency."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.roots = []
+        for nas in ('nas01', 'nas02'):
+            root = os.path.join(self.tmp.name, nas)
+            self.roots.append(root)
+            for i in range(5):
+                subdir = os.path.join(root, f'dir{i}', 'nested')
+                os.makedirs(subdir)
+                for j in range(3):
+                    with open(os.path.join(subdir, f'host{i}{j}_10.0.{i}.{j}.tib'), 'w') as f:
+                        f.write('x')
+                with open(os.path.join(root, f'dir{i}', 'top.cfg'), 'w') as f:
+                    f.write('cfg')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _walk(self, **options):
+        walker = ParallelWalker(max_workers=8, workers_per_root=4, **options)
+        started = time.monotonic()
+        results = list(walker.walk(self.roots))
+        self.assertLess(time.monotonic() - started, 5)
+        return walker, results
+
+    def test_hung_directory_times_out(self):
+        hung = os.path.join(self.roots[0], 'dir1')
+        hang_listings(self, [hung])
+        walker, results = self._walk(directory_timeout=0.2)
+
+        errors = [(dirpath, error) for _, dirpath, _, error in results if error is not None]
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0][0], hung)
+        self.assertIsInstance(errors[0][1], DirectoryTimeout)
+        # Everything else under both roots was listed
+        self.assertEqual(len(results), 2 * 11 - 1)
+        nas01, nas02 = (walker.health[root] for root in self.roots)
+        self.assertEqual((nas01['status'], nas01['timeouts'], nas01['directories']), ('partial', 1, 9))
+        self.assertEqual((nas02['status'], nas02['timeouts'], nas02['directories']), ('complete', 0, 11))
+        self.assertEqual(walker.unwalked, {self.roots[0]: [], self.roots[1]: []})
+
+    def test_gives_up_after_max_timeouts(self):
+        hang_listings(self, [os.path.join(self.roots[0], f'dir{i}') for i in range(4)])
+        walker, results = self._walk(directory_timeout=0.2, max_timeouts=2)
+
+        health = walker.health[self.roots[0]]
+        self.assertEqual(health['status'], 'timed_out')
+        self.assertGreaterEqual(health['timeouts'], 2)
+        self.assertEqual(health['unwalked'], len(walker.unwalked[self.roots[0]]))
+        # Every directory of the root was listed, timed out or left unwalked
+        listed = {dirpath for root, dirpath, _, _ in results if root == self.roots[0]}
+        self.assertLessEqual({os.path.join(self.roots[0], f'dir{i}') for i in range(5)},
+                             listed | set(walker.unwalked[self.roots[0]]))
+        self.assertEqual(walker.health[self.roots[1]]['status'], 'complete')
+
+    def test_root_timeout(self):
+        hang_listings(self, [os.path.join(self.roots[0], 'dir0'), self.roots[1]])
+        walker, results = self._walk(root_timeout=0.3)
+
+        self.assertEqual([error for _, _, _, error in results if error is not None], [])
+        for root in self.roots:
+            self.assertEqual(walker.health[root]['status'], 'timed_out')
+        self.assertIn(os.path.join(self.roots[0], 'dir0'), walker.unwalked[self.roots[0]])
+        self.assertEqual(walker.unwalked[self.roots[1]], [self.roots[1]])
+
+    def test_hung_root_times_out(self):
+        hang_listings(self, [self.roots[0]])
+        walker, results = self._walk(directory_timeout=0.2)
+
+        self.assertIsInstance([error for root, _, _, error in results if root == self.roots[0]][0],
+                              DirectoryTimeout)
+        self.assertEqual(walker.health[self.roots[0]]['status'], 'timed_out')
+        self.assertEqual(walker.health[self.roots[1]]['status'], 'complete')
+
+    def test_backs_off_when_stat_is_slow(self):
+        hang_listings(self, [], stat_seconds=lambda path: 1.0 if path.startswith(self.roots[0]) else 0.0)
+        walker, results = self._walk(slow_stat=0.01)
+
+        self.assertEqual(len(results), 2 * 11)
+        self.assertEqual(walker.health[self.roots[0]]['concurrency'], 1)
+        self.assertEqual(walker.health[self.roots[1]]['concurrency'], 4)
+        self.assertEqual(walker.health[self.roots[0]]['status'], 'complete')
+
+if __name__ == '__main__':
+    unittest.main()
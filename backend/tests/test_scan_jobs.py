@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import time
+import threading
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+import app as app_module
+from database.db_manager import DatabaseManager
+from jobs.scan_jobs import ScanJobManager, ScanJobConflict
+
+def wait_for(job_manager, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = job_manager.get_job(job_id)
+        if job['status'] != 'running':
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'Job {job_id} did not finish')
+
+class TestScanJobManager(unittest.TestCase):
+    """Test cases for background scan jobs and single-flight locking."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+        self.job_manager = ScanJobManager(self.db_manager)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.job_manager.executor.shutdown(wait=True)
+        self.tmp.cleanup()
+
+    def blocking_scan(self, progress):
+        progress('walking', 5, 10)
+        self.release.wait(5)
+        return {'message': 'done', 'files': 10}
+
+    def test_job_runs_in_background(self):
+        job, created = self.job_manager.submit('directories', {}, self.blocking_scan)
+        self.assertTrue(created)
+        self.assertEqual(job['status'], 'running')
+
+        self.release.set()
+        job = wait_for(self.job_manager, job['id'])
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['message'], 'done')
+        self.assertEqual(job['result'], {'message': 'done', 'files': 10})
+
+    def test_identical_request_attaches(self):
+        job, _ = self.job_manager.submit('directories', {}, self.blocking_scan)
+        # A second manager stands in for another gunicorn worker
+        other = ScanJobManager(self.db_manager)
+        attached, created = other.submit('directories', {}, self.blocking_scan)
+        self.assertFalse(created)
+        self.assertEqual(attached['id'], job['id'])
+
+        with self.assertRaises(ScanJobConflict):
+            other.submit('directories', {'full': True}, self.blocking_scan)
+
+        # Other kinds have their own lock
+        servers_job, created = other.submit('servers', {}, lambda progress: {'message': 'ok'})
+        self.assertTrue(created)
+        wait_for(other, servers_job['id'])
+        other.executor.shutdown(wait=True)
+
+    def test_progress_rate_and_eta(self):
+        job, _ = self.job_manager.submit('directories', {}, self.blocking_scan)
+        deadline = time.monotonic() + 5
+        while self.job_manager.get_job(job['id'])['phase'] != 'walking':
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        time.sleep(0.05)
+        job = self.job_manager.get_job(job['id'])
+        self.assertEqual((job['processed'], job['total']), (5, 10))
+        self.assertGreater(job['rate'], 0)
+        self.assertGreater(job['eta'], 0)
+
+    def test_failed_job(self):
+        def broken_scan(progress):
+            raise RuntimeError('No files found during scan')
+        job, _ = self.job_manager.submit('directories', {}, broken_scan)
+        job = wait_for(self.job_manager, job['id'])
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['message'], 'No files found during scan')
+
+    def test_orphaned_job_is_replaced(self):
+        self.db_manager.create_scan_job('dead', 'directories', '{}', 999999)
+        job, created = self.job_manager.submit('directories', {}, self.blocking_scan)
+        self.assertTrue(created)
+        self.assertNotEqual(job['id'], 'dead')
+        self.assertEqual(self.db_manager.get_scan_job('dead')['status'], 'failed')
+
+class TestScanJobEndpoints(unittest.TestCase):
+    """Test cases for the scan job API."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+        self.job_manager = ScanJobManager(db_manager)
+        for name, value in (('db_manager', db_manager), ('job_manager', self.job_manager)):
+            patcher = mock.patch.object(app_module, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = app_module.app.test_client()
+
+    def tearDown(self):
+        self.job_manager.executor.shutdown(wait=True)
+        self.tmp.cleanup()
+
+    def test_post_returns_job_id(self):
+        fake_scan = lambda progress: {'message': 'Directory scan completed successfully.'}
+        with mock.patch.object(app_module, 'run_directory_scan', fake_scan):
+            response = self.client.post('/api/scan/directories')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()['job_id']
+
+        wait_for(self.job_manager, job_id)
+        response = self.client.get(f'/api/scan/jobs/{job_id}')
+        self.assertEqual(response.status_code, 200)
+        job = response.get_json()['job']
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['kind'], 'directories')
+
+    def test_unknown_job(self):
+        response = self.client.get('/api/scan/jobs/nope')
+        self.assertEqual(response.status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import json
+import stat
+import tempfile
+from pathlib import Path
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent))
+from database.db_manager import DatabaseManager
+from scan_servers.scan_servers import SubnetScanner
+from test_nmap_engine import FAKE_NMAP
+
+class TestIncrementalServerScan(unittest.TestCase):
+    """Test cases for fingerprint-based incremental server rescans."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.tmp.name, 'runs.log')
+        self.nmap = os.path.join(self.tmp.name, 'nmap')
+        with open(self.nmap, 'w') as f:
+            f.write(FAKE_NMAP.format(python=sys.executable, log=self.log))
+        os.chmod(self.nmap, os.stat(self.nmap).st_mode | stat.S_IEXEC)
+
+        self.config_path = os.path.join(self.tmp.name, 'config.json')
+        self._write_config(ttl=3600)
+        self.db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write_config(self, ttl):
+        with open(self.config_path, 'w') as f:
+            json.dump({
+                'subnets_to_scan': ['10.0.0.0/24'],
+                'server_scan': {
+                    'nmap_path': self.nmap,
+                    'batch_size': 4,
+                    'incremental': {'enabled': True, 'ttl': ttl},
+                    'dns': {'timeout': 0.2}
+                }
+            }, f)
+
+    def _set_ports(self, ports):
+        with open(os.path.join(self.tmp.name, 'ports.json'), 'w') as f:
+            json.dump(ports, f)
+
+    def _scan(self, full=False):
+        if os.path.exists(self.log):
+            os.remove(self.log)
+        with SubnetScanner(self.db_manager, self.config_path, full=full) as scanner:
+            results = scanner.scan_all_subnets()
+        return scanner, {result['ip_address']: result for result in results}
+
+    def _host_scan_args(self):
+        with open(self.log) as f:
+            return [line.split()[1:] for line in f if line.startswith('start') and '-sn' not in line]
+
+    def _servers(self):
+        return self.db_manager.get_server_fingerprints()
+
+    def test_unchanged_hosts_skip_os_detection(self):
+        scanner, results = self._scan()
+        self.assertEqual(scanner.stats, {'full': 2, 'probed': 0})
+        first = self._servers()
+        self.assertEqual(first['10.0.0.1']['detected_os'], 'Linux 5.X')
+        self.assertIsNotNone(first['10.0.0.1']['last_full_scan'])
+
+        scanner, results = self._scan()
+        self.assertEqual(scanner.stats, {'full': 0, 'probed': 2})
+        for args in self._host_scan_args():
+            self.assertNotIn('-O', args)
+            self.assertIn('-Pn', args)
+        # The stored OS match and full scan time survive a probe
+        self.assertEqual(results['10.0.0.1']['detected_os'], 'Linux 5.X')
+        second = self._servers()
+        self.assertEqual(second['10.0.0.1']['detected_os'], 'Linux 5.X')
+        self.assertEqual(second['10.0.0.1']['last_full_scan'], first['10.0.0.1']['last_full_scan'])
+
+    def test_changed_ports_trigger_full_scan(self):
+        self._scan()
+        self._set_ports({'10.0.0.2': [22, 80]})
+        scanner, results = self._scan()
+        self.assertEqual(scanner.stats, {'full': 1, 'probed': 1})
+        self.assertEqual(results['10.0.0.2']['open_ports'], '22/tcp (svc22), 80/tcp (svc80)')
+
+        self._set_ports({'10.0.0.2': [80]})
+        scanner, results = self._scan()
+        self.assertEqual(scanner.stats, {'full': 1, 'probed': 1})
+        self.assertEqual(results['10.0.0.2']['open_ports'], '80/tcp (svc80)')
+
+    def test_forced_full_and_expired_fingerprints(self):
+        self._scan()
+        scanner, _ = self._scan(full=True)
+        self.assertEqual(scanner.stats, {'full': 2, 'probed': 0})
+        self.assertTrue(all('-O' in args for args in self._host_scan_args()))
+
+        self._write_config(ttl=-1)
+        scanner, _ = self._scan()
+        self.assertEqual(scanner.stats, {'full': 2, 'probed': 0})
+
+if __name__ == '__main__':
+    unittest.main()
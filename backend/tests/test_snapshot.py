@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import random
+import itertools
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from unittest import mock
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+from database.db_manager import DatabaseManager
+from database.snapshot import SnapshotStore, Snapshot
+from backup_status.backup_status import refresh_backup_status
+import app as app_module
+
+EPOCH = 1.6e9
+DAY = 86400
+
+def populate(db_manager, files=600, servers=60, seed=1):
+    """Fill a database with random files and servers, including NULLs, ties and mixed case."""
+    rng = random.Random(seed)
+    names = ['Ub01', 'rhel', 'DOCKER', 'db_1', 'web%x', 'ñandu']
+    with db_manager.bulk_writer() as writer:
+        for i in range(files):
+            filename = f"{rng.choice(names)}_{rng.randrange(20)}_10.0.{rng.randrange(5)}.{rng.randrange(9)}.tib"
+            filepath = f"/nas0{rng.randrange(3)}/{rng.choice(['A', 'B', 'a'])}/{filename}{i}"
+            writer.add('/nas01/', filename, filepath, datetime.fromtimestamp(EPOCH + rng.randrange(100) * DAY),
+                       rng.choice([0, 10, 10, 500, None]), i, i)
+    for i in range(servers):
+        db_manager.update_server(f"{rng.choice(names)}_{i}", {
+            'ip_address': f"10.0.{rng.randrange(5)}.{rng.randrange(9)}",
+            'detected_os': rng.choice([None, 'Linux', 'windows']),
+            'open_ports': rng.choice([None, '22', '']),
+            'last_scan': rng.choice([None, datetime.now()]),
+            'is_reachable': rng.choice([True, False, None])
+        })
+    refresh_backup_status(db_manager, {})
+
+class TestSnapshotQueries(unittest.TestCase):
+    """Test cases for answering list queries from the snapshot exactly as SQLite does."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.db_manager = DatabaseManager(os.path.join(cls.tmp.name, 'test.db'))
+        populate(cls.db_manager)
+        cls.snapshot = SnapshotStore().refresh(cls.db_manager)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def _assert_same(self, expected, actual, sort, limit):
+        if sort is None:
+            # Unsorted SQL rows come in whatever order the query plan yields
+            self.assertEqual(expected[0], actual[0])
+            if limit is None:
+                self.assertEqual(sorted(expected[1]), sorted(actual[1]))
+        else:
+            self.assertEqual(expected, actual)
+
+    def test_files(self):
+        cut = datetime.fromtimestamp(EPOCH + 30 * DAY)
+        filters = [
+            {}, {'path_prefix': '/nas01/'}, {'path_prefix': '/nas01/A/'}, {'filename': 'ub01'}, {'filename': 'ñ'},
+            {'filename': '%'}, {'filename': '_'}, {'modified_after': cut}, {'modified_before': cut},
+            {'min_size': 10}, {'max_size': 10}, {'min_size': 10, 'max_size': 10, 'filename': 'rhel'},
+            {'path_prefix': '/nas02/', 'modified_after': cut, 'max_size': 100}
+        ]
+        for query, sort, order, (limit, offset) in itertools.product(
+                filters, [None] + list(DatabaseManager.FILE_COLUMNS), ['asc', 'desc'],
+                [(None, 0), (10, 0), (7, 13), (None, 590)]):
+            with self.subTest(filters=query, sort=sort, order=order, limit=limit, offset=offset):
+                expected = self.db_manager.query_scanned_files(query, sort, order, limit, offset)
+                actual = self.snapshot.query_files(query, sort, order, limit, offset)
+                self._assert_same((expected[0], list(expected[1])), actual, sort, limit)
+
+    def test_servers(self):
+        fresh_since = datetime.fromtimestamp(EPOCH + 50 * DAY)
+        filters = [
+            {}, {'hostname': 'ub'}, {'ip_address': '.3'}, {'status': ['green']}, {'status': ['red', 'yellow']},
+            {'is_reachable': True}, {'is_reachable': False, 'hostname': 'd'}
+        ]
+        for query, sort, order, (limit, offset) in itertools.product(
+                filters, [None] + list(DatabaseManager.SERVER_COLUMNS), ['asc', 'desc'], [(None, 0), (7, 13)]):
+            with self.subTest(filters=query, sort=sort, order=order, limit=limit, offset=offset):
+                expected = self.db_manager.query_servers(fresh_since, query, sort, order, limit, offset)
+                actual = self.snapshot.query_servers(fresh_since, query, sort, order, limit, offset)
+                self._assert_same(expected, actual, sort, limit)
+
+    def test_stream_and_errors(self):
+        total, rows = self.snapshot.query_files({'min_size': 500}, 'size', 'desc', stream=True)
+        self.assertEqual(len(list(rows)), total)
+        with self.assertRaises(ValueError):
+            self.snapshot.query_files({}, 'inode')
+        with self.assertRaises(ValueError):
+            self.snapshot.query_files({}, 'size', 'sideways')
+
+class TestSnapshotStore(unittest.TestCase):
+    """Test cases for publishing, mapping and rebuilding snapshots."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+        populate(self.db_manager, files=50, servers=5)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_current_follows_generation(self):
+        store = SnapshotStore()
+        with mock.patch.object(store, '_start_build') as start_build:
+            self.assertIsNone(store.current(self.db_manager))
+        start_build.assert_called_once()
+
+        snapshot = store.refresh(self.db_manager)
+        self.assertIs(store.current(self.db_manager), snapshot)
+        self.assertEqual(snapshot.query_files()[0], 50)
+
+        # Another worker maps the file this one published
+        other = SnapshotStore()
+        self.assertEqual(other.current(self.db_manager).generation, snapshot.generation)
+
+        # A write makes it stale until rebuilt; the old mapping stays readable
+        self.db_manager.update_server('late_1', {'ip_address': '10.9.9.9'})
+        with mock.patch.object(store, '_start_build'):
+            self.assertIsNone(store.current(self.db_manager))
+        rebuilt = store.refresh(self.db_manager)
+        self.assertGreater(rebuilt.generation, snapshot.generation)
+        self.assertEqual(rebuilt.query_servers(datetime.now())[0], 6)
+        self.assertEqual(snapshot.query_servers(datetime.now())[0], 5)
+
+    def test_waits_for_the_data_to_settle(self):
+        # populate() just wrote: a scan would still be writing
+        store = SnapshotStore({'min_rebuild_interval': 60})
+        self.assertIsNone(store.current(self.db_manager))
+        self.assertEqual(store._threads, [])
+
+        store = SnapshotStore({'min_rebuild_interval': 0})
+        self.assertIsNone(store.current(self.db_manager))
+        store.join()
+        self.assertEqual(store.current(self.db_manager).query_files()[0], 50)
+
+    def test_rejects_other_files(self):
+        path = os.path.join(self.tmp.name, 'bogus.snapshot')
+        with open(path, 'wb') as f:
+            f.write(b'not a snapshot at all')
+        with self.assertRaises(ValueError):
+            Snapshot(path)
+        self.assertIsNone(SnapshotStore({'path': path})._map(path, None))
+
+    def test_disabled(self):
+        store = SnapshotStore({'enabled': False})
+        store.refresh(self.db_manager)
+        self.assertIsNone(store.current(self.db_manager))
+
+class TestSnapshotEndpoints(unittest.TestCase):
+    """Test cases for the list endpoints reading from the snapshot."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+        populate(self.db_manager, files=80, servers=8)
+        patcher = mock.patch.object(app_module, 'db_manager', self.db_manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = app_module.app.test_client()
+
+    def tearDown(self):
+        app_module.snapshot_store.join()
+        self.tmp.cleanup()
+
+    def _count(self, source):
+        return app_module.SNAPSHOT_QUERIES.labels('files', source).value
+
+    def test_falls_back_until_published(self):
+        url = '/api/files?sort=size&order=desc&limit=5&offset=3&min_size=10'
+        with mock.patch.object(app_module, 'get_cache_settings', return_value={'enabled': False}):
+            with mock.patch.object(app_module.snapshot_store, '_start_build'):
+                before = self._count('database')
+                from_database = self.client.get(url).get_json()
+                self.assertEqual(self._count('database'), before + 1)
+
+            app_module.snapshot_store.refresh(self.db_manager)
+            before = self._count('snapshot')
+            from_snapshot = self.client.get(url).get_json()
+            self.assertEqual(self._count('snapshot'), before + 1)
+        self.assertEqual(from_snapshot, from_database)
+
+if __name__ == '__main__':
+    unittest.main()
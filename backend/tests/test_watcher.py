@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+from database.db_manager import DatabaseManager
+from scan_dirs.scan_dirs import DirectoryScanner
+from scan_dirs import watcher as watcher_module
+from scan_dirs.watcher import DirectoryWatcher, IN_Q_OVERFLOW
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is Linux only')
+class TestDirectoryWatcher(unittest.TestCase):
+    """Test cases for applying inotify events to scanned_files."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.roots = [os.path.join(self.tmp.name, name, '') for name in ('nas01', 'nas02')]
+        os.makedirs(os.path.join(self.roots[0], 'Acronis'))
+        os.makedirs(self.roots[1])
+        self._write(self.roots[0], 'Acronis/ub01_10.197.38.239_sda_19TB.tib', b'a' * 10)
+        self._write(self.roots[1], 'notes.cfg', b'c')
+
+        config_path = os.path.join(self.tmp.name, 'config.json')
+        with open(config_path, 'w') as f:
+            json.dump({'directories_to_scan': self.roots, 'subnets_to_scan': []}, f)
+        self.db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+        self.scanner = DirectoryScanner(self.db_manager, config_path, incremental=True)
+        self.watcher = DirectoryWatcher(self.scanner, {'coalesce_delay': 0, 'rescan_interval': None})
+        self.watcher.start()
+
+    def tearDown(self):
+        self.watcher.close()
+        self.tmp.cleanup()
+
+    def _write(self, root, relpath, data):
+        with open(os.path.join(root, relpath), 'wb') as f:
+            f.write(data)
+
+    def _settle(self):
+        """Handle events until the queues are quiet, then apply them."""
+        while self.watcher.poll(0.2):
+            pass
+        return self.watcher.apply()
+
+    def _stored(self):
+        return {row[2]: row[4] for row in self.db_manager.get_all_scanned_files()}
+
+    def test_initial_scan(self):
+        self.assertEqual(len(self._stored()), 2)
+        self.assertEqual(self.watcher.stats['rescans'], 1)
+
+    def test_file_events(self):
+        root = self.roots[0]
+        self._write(root, 'Acronis/ub02_10.197.38.12.tib', b'new')
+        self._write(root, 'Acronis/ub01_10.197.38.239_sda_19TB.tib', b'a' * 30)
+        os.rename(os.path.join(self.roots[1], 'notes.cfg'), os.path.join(self.roots[1], 'notes.old'))
+        self._settle()
+        self.assertEqual(self.scanner.stats, {'added': 2, 'changed': 1, 'removed': 1, 'unchanged': 0})
+        self.assertEqual(self._stored(), {
+            os.path.join(root, 'Acronis', 'ub01_10.197.38.239_sda_19TB.tib'): 30,
+            os.path.join(root, 'Acronis', 'ub02_10.197.38.12.tib'): 3,
+            os.path.join(self.roots[1], 'notes.old'): 1
+        })
+
+        os.remove(os.path.join(root, 'Acronis', 'ub02_10.197.38.12.tib'))
+        self._settle()
+        self.assertEqual(len(self._stored()), 2)
+
+    def test_directory_events(self):
+        root = self.roots[0]
+        # Files written before the new directory's watch exists are found by walking it
+        os.makedirs(os.path.join(root, 'DD', 'ub03'))
+        self._write(root, 'DD/ub03/ub03_10.0.0.3.dd', b'd')
+        self._settle()
+        self.assertIn(os.path.join(root, 'DD', 'ub03', 'ub03_10.0.0.3.dd'), self._stored())
+
+        # Watches follow a directory moved within the root
+        os.rename(os.path.join(root, 'DD'), os.path.join(root, 'Images'))
+        self._settle()
+        self._write(root, 'Images/ub03/ub03_10.0.0.4.dd', b'e')
+        self._settle()
+        self.assertEqual(sorted(path for path in self._stored() if path.startswith(root)), [
+            os.path.join(root, 'Acronis', 'ub01_10.197.38.239_sda_19TB.tib'),
+            os.path.join(root, 'Images', 'ub03', 'ub03_10.0.0.3.dd'),
+            os.path.join(root, 'Images', 'ub03', 'ub03_10.0.0.4.dd')
+        ])
+
+        shutil.move(os.path.join(root, 'Images'), os.path.join(self.tmp.name, 'elsewhere'))
+        self._settle()
+        self.assertEqual(len(self._stored()), 2)
+
+    def test_overflow_rescans_only_its_root(self):
+        # Lost events: the watcher never hears of this file
+        self._write(self.roots[0], 'Acronis/lost_10.0.0.9.tib', b'x')
+        with mock.patch.object(self.scanner, 'apply_changes', wraps=self.scanner.apply_changes) as apply_changes:
+            self.watcher.handle(self.roots[0], -1, IN_Q_OVERFLOW, '')
+            self.watcher.apply()
+        apply_changes.assert_called_once_with(set(), {self.roots[0]}, refresh=False)
+        self.assertIn(os.path.join(self.roots[0], 'Acronis', 'lost_10.0.0.9.tib'), self._stored())
+        self.assertEqual(self.watcher.stats['overflows'], 1)
+
+    def test_refreshes_are_throttled(self):
+        self.watcher.settings['refresh_interval'] = 3600
+        with mock.patch.object(watcher_module, 'refresh_backup_status') as refresh:
+            # The initial scan just refreshed: these batches wait for the interval
+            for i in range(3):
+                self._write(self.roots[0], f'Acronis/ub0{i}_10.0.0.{i}.tib', b'x')
+                self._settle()
+                self.watcher.refresh()
+            self.assertEqual(self.watcher.stats['batches'], 3)
+            refresh.assert_not_called()
+
+            # Once the interval has passed they cost a single refresh
+            self.watcher.settings['refresh_interval'] = 0
+            self.watcher.refresh()
+            self.watcher.refresh()
+            refresh.assert_called_once_with(self.db_manager, self.scanner.history_settings)
+
+            # Pending batches are not lost when the watcher stops
+            self.watcher.settings['refresh_interval'] = 3600
+            self._write(self.roots[1], 'notes.cfg', b'changed')
+            self._settle()
+            self.assertEqual(refresh.call_count, 1)
+            self.watcher.refresh(force=True)
+            self.assertEqual(refresh.call_count, 2)
+
+class TestApplyChanges(unittest.TestCase):
+    """Test cases for DirectoryScanner.apply_changes on named files and subtrees."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, 'nas01', '')
+        os.makedirs(os.path.join(self.root, 'Tar', 'old'))
+        for relpath in ('Tar/old/a.tar', 'Tar/old/b.tar', 'Tar/c.tar'):
+            with open(os.path.join(self.root, relpath), 'wb') as f:
+                f.write(b't')
+        config_path = os.path.join(self.tmp.name, 'config.json')
+        with open(config_path, 'w') as f:
+            json.dump({'directories_to_scan': [self.root], 'subnets_to_scan': []}, f)
+        self.db_manager = DatabaseManager(os.path.join(self.tmp.name, 'test.db'))
+        self.scanner = DirectoryScanner(self.db_manager, config_path)
+        self.scanner.scan_directories()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_removed_subtree_and_outside_paths(self):
+        shutil.rmtree(os.path.join(self.root, 'Tar', 'old'))
+        processed = self.scanner.apply_changes(
+            [os.path.join(self.root, 'Tar', 'c.tar'), os.path.join(self.tmp.name, 'outside.tar')],
+            [os.path.join(self.root, 'Tar', 'old')]
+        )
+        self.assertEqual(self.scanner.stats, {'added': 0, 'changed': 0, 'removed': 2, 'unchanged': 1})
+        self.assertEqual([file['filepath'] for file in processed], [os.path.join(self.root, 'Tar', 'c.tar')])
+        self.assertEqual([row[2] for row in self.db_manager.get_all_scanned_files()],
+                         [os.path.join(self.root, 'Tar', 'c.tar')])
+
+    def test_nested_subtrees_are_walked_once(self):
+        processed = self.scanner.apply_changes(
+            [os.path.join(self.root, 'Tar', 'old', 'a.tar')],
+            [os.path.join(self.root, 'Tar', 'old'), os.path.join(self.root, 'Tar')]
+        )
+        self.assertEqual(len(processed), 3)
+        self.assertEqual(self.scanner.stats['unchanged'], 3)
+
+if __name__ == '__main__':
+    unittest.main()
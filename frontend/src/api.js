@@ -19,16 +19,146 @@ export const getServers = async () => {
   return response.data;
 };
 
-export const scanDirectories = async () => {
-  const response = await api.post('/scan/directories');
-  return response.data;
+export const getScanJob = async (jobId) => {
+  const response = await api.get(`/scan/jobs/${jobId}`);
+  return response.data.job;
 };
 
-export const scanServers = async () => {
-  const response = await api.post('/scan/servers');
-  return response.data;
+// Live updates from /api/events: onJob(job) for scan progress, onGeneration(generation)
+// whenever scanned data changes (in this or any other user's scan). The stream starts
+// with the current state and EventSource reconnects on its own. Returns an unsubscribe function.
+// Every open stream holds a server thread, so all subscribers in the page share one
+// EventSource, opened by the first subscriber and closed when the last one leaves.
+// Later subscribers are first sent the latest generation and job states the stream has
+// seen, as a stream of their own would have started with them.
+const eventListeners = { job: new Set(), generation: new Set() };
+const latestEvents = { job: new Map(), generation: new Map() };
+let eventSource = null;
+let reconnectTimer = null;
+
+const openEventSource = () => {
+  const source = new EventSource(`${API_BASE_URL}/events`);
+  Object.entries(eventListeners).forEach(([type, listeners]) => {
+    source.addEventListener(type, (event) => {
+      const data = JSON.parse(event.data);
+      const key = type === 'job' ? data.id : type;
+      latestEvents[type].delete(key);
+      latestEvents[type].set(key, data);
+      if (latestEvents.job.size > 10) {
+        latestEvents.job.delete(latestEvents.job.keys().next().value);
+      }
+      listeners.forEach((listener) => listener(data));
+    });
+  });
+  source.onerror = () => {
+    // A refused stream (503 when the server has too many) is not retried by the browser
+    if (source.readyState === EventSource.CLOSED && eventSource === source) {
+      eventSource = null;
+      reconnectTimer = setTimeout(() => {
+        reconnectTimer = null;
+        if (eventListeners.job.size || eventListeners.generation.size) {
+          eventSource = openEventSource();
+        }
+      }, 5000);
+    }
+  };
+  return source;
 };
 
+export const subscribeToEvents = ({ onJob, onGeneration } = {}) => {
+  // Wrapped so the same callback can subscribe twice
+  const added = [];
+  if (onJob) {
+    added.push(['job', (data) => onJob(data)]);
+  }
+  if (onGeneration) {
+    added.push(['generation', (data) => onGeneration(data)]);
+  }
+  added.forEach(([type, listener]) => {
+    eventListeners[type].add(listener);
+    // After subscribeToEvents returns, so callbacks can already unsubscribe
+    const latest = [...latestEvents[type].values()];
+    Promise.resolve().then(() => latest.forEach((data) => {
+      if (eventListeners[type].has(listener)) {
+        listener(data);
+      }
+    }));
+  });
+  if (eventSource === null && reconnectTimer === null) {
+    eventSource = openEventSource();
+  }
+  return () => {
+    added.forEach(([type, listener]) => eventListeners[type].delete(listener));
+    if (!eventListeners.job.size && !eventListeners.generation.size) {
+      clearTimeout(reconnectTimer);
+      reconnectTimer = null;
+      if (eventSource !== null) {
+        eventSource.close();
+        eventSource = null;
+      }
+      latestEvents.job.clear();
+      latestEvents.generation.clear();
+    }
+  };
+};
+
+// Call onGeneration when scanned data changes, at most once per interval,
+// skipping the initial state the stream starts with.
+export const subscribeToDataChanges = (onChange, interval = 2000) => {
+  let current = null;
+  let timer = null;
+  const unsubscribe = subscribeToEvents({
+    onGeneration: ({ generation }) => {
+      if (current !== null && generation !== current && timer === null) {
+        timer = setTimeout(() => {
+          timer = null;
+          onChange();
+        }, interval);
+      }
+      current = generation;
+    },
+  });
+  return () => {
+    clearTimeout(timer);
+    unsubscribe();
+  };
+};
+
+// Scans run as background jobs: start one (or attach to the running one) and
+// follow its progress events until it finishes. onProgress(job) gets every update.
+const runScanJob = async (path, onProgress) => {
+  const response = await api.post(path);
+  let job = response.data.job;
+  if (job.status === 'running') {
+    job = await new Promise((resolve) => {
+      const unsubscribe = subscribeToEvents({
+        onJob: (update) => {
+          if (update.id !== job.id) {
+            return;
+          }
+          if (onProgress) {
+            onProgress(update);
+          }
+          if (update.status !== 'running') {
+            unsubscribe();
+            resolve(update);
+          }
+        },
+      });
+    });
+  }
+  if (job.status !== 'succeeded') {
+    throw new Error(job.message || 'Scan failed');
+  }
+  return { status: 'success', message: job.message, job };
+};
+
+export const scanDirectories = async (onProgress) => runScanJob('/scan/directories', onProgress);
+
+// full=true skips the fingerprint check and runs OS detection on every host
+export const scanServers = async (full = false, onProgress) =>
+  runScanJob(full ? '/scan/servers?full=true' : '/scan/servers', onProgress);
+
 export const checkHealth = async () => {
   const response = await api.get('/health');
   return response.data;
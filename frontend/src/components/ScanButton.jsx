@@ -1,38 +1,61 @@
-import { Button, CircularProgress } from '@mui/material';
+import { Box, Button, CircularProgress, Typography } from '@mui/material';
 import { useState } from 'react';
 
+// One line summary of a scan job's progress event
+const describeProgress = (job) => {
+  const progress = job.progress || {};
+  const rate = (value) => (value != null ? ` (${Math.round(value)}/s)` : '');
+  if (progress.files_walked != null) {
+    return `${job.phase}: ${progress.files_walked} files${rate(progress.files_per_second)}`;
+  }
+  if (progress.hosts_scanned != null) {
+    return `${job.phase}: ${progress.hosts_scanned}/${progress.hosts_discovered ?? 0} hosts${rate(progress.hosts_per_second)}`;
+  }
+  return job.phase;
+};
+
+// onClick(onProgress) runs the scan; onProgress(job) updates the progress line
 export default function ScanButton({ onClick, label }) {
   const [isLoading, setIsLoading] = useState(false);
+  const [progress, setProgress] = useState(null);
 
   const handleClick = async () => {
     setIsLoading(true);
     try {
-      await onClick();
+      await onClick((job) => setProgress(describeProgress(job)));
     } finally {
       setIsLoading(false);
+      setProgress(null);
     }
   };
 
   return (
-    <Button
-      variant="contained"
-      onClick={handleClick}
-      disabled={isLoading}
-      sx={{ position: 'relative' }}
-    >
-      {label}
-      {isLoading && (
-        <CircularProgress
-          size={24}
-          sx={{
-            position: 'absolute',
-            top: '50%',
-            left: '50%',
-            marginTop: '-12px',
-            marginLeft: '-12px',
-          }}
-        />
+    <Box sx={{ display: 'flex', alignItems: 'center', gap: 2 }}>
+      {progress && (
+        <Typography variant="body2" color="text.secondary">
+          {progress}
+        </Typography>
       )}
-    </Button>
+      <Button
+        variant="contained"
+        onClick={handleClick}
+        disabled={isLoading}
+        sx={{ position: 'relative' }}
+      >
+        {label}
+        {isLoading && (
+          <CircularProgress
+            size={24}
+            sx={{
+              position: 'absolute',
+              top: '50%',
+              left: '50%',
+              marginTop: '-12px',
+              marginLeft: '-12px',
+            }}
+          />
+        )}
+      </Button>
+    </Box>
   );
 }
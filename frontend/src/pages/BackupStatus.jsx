@@ -1,7 +1,7 @@
 import { useEffect, useState } from 'react';
 import { Box, Typography, Alert, Chip } from '@mui/material';
 import DataTable from '../components/DataTable';
-import { getServers, getFiles } from '../api';
+import { getServers, subscribeToDataChanges } from '../api';
 
 const getStatusInfo = (status) => {
   switch (status) {
@@ -16,18 +16,6 @@ const getStatusInfo = (status) => {
   }
 };
 
-const findMatchingFile = (server, files) => {
-  const serverIdentifiers = [
-    server.hostname?.toLowerCase(),
-    server.ip_address?.toLowerCase()
-  ].filter(Boolean);
-
-  return files.find(file => {
-    const filename = file.filename.toLowerCase();
-    return serverIdentifiers.some(id => filename.includes(id));
-  });
-};
-
 const formatDateTime = (dateString) => {
   if (!dateString) return '';
   const date = new Date(dateString);
@@ -95,21 +83,15 @@ export default function BackupStatus() {
 
   const fetchData = async () => {
     try {
-      const [serversResponse, filesResponse] = await Promise.all([
-        getServers(),
-        getFiles()
-      ]);
+      const serversResponse = await getServers();
 
-      // Add status_label and filename fields
-      const serversWithExtra = serversResponse.servers.map(server => {
-        const matchingFile = findMatchingFile(server, filesResponse.files);
-        return {
-          ...server,
-          status_label: getStatusInfo(server.backup_status).sortValue,
-          filename: matchingFile?.filename || '',
-          backup_time: matchingFile?.last_modified || ''
-        };
-      });
+      // Add status_label and filename fields (newest matching backup comes from the API)
+      const serversWithExtra = serversResponse.servers.map(server => ({
+        ...server,
+        status_label: getStatusInfo(server.backup_status).sortValue,
+        filename: server.backup_filename || '',
+        backup_time: server.backup_last_modified || ''
+      }));
 
       // Sort by status (green->yellow->red)
       const sortedServers = [...serversWithExtra].sort((a, b) => 
@@ -126,6 +108,8 @@ export default function BackupStatus() {
 
   useEffect(() => {
     fetchData();
+    // Refetch when a scan changes the data
+    return subscribeToDataChanges(fetchData);
   }, []);
 
   const handleExportCsv = () => {
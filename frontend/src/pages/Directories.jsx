@@ -2,7 +2,7 @@ import { useEffect, useState } from 'react';
 import { Box, Typography, Alert } from '@mui/material';
 import DataTable from '../components/DataTable';
 import ScanButton from '../components/ScanButton';
-import { getFiles, scanDirectories } from '../api';
+import { getFiles, scanDirectories, subscribeToDataChanges } from '../api';
 
 const columns = [
   { field: 'filename', headerName: 'Filename' },
@@ -50,12 +50,13 @@ export default function Directories() {
 
   useEffect(() => {
     fetchFiles();
+    // Refetch when any scan (ours or another user's) changes the data
+    return subscribeToDataChanges(fetchFiles);
   }, []);
 
-  const handleScan = async () => {
+  const handleScan = async (onProgress) => {
     try {
-      await scanDirectories();
-      await fetchFiles();
+      await scanDirectories(onProgress);
       setError(null);
     } catch (err) {
       setError('Failed to scan directories');
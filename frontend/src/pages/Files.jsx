@@ -1,7 +1,7 @@
 import { useEffect, useState } from 'react';
 import { Box, Typography, Alert, Chip } from '@mui/material';
 import DataTable from '../components/DataTable';
-import { getFiles } from '../api';
+import { getFiles, subscribeToDataChanges } from '../api';
 
 const formatSize = (bytes) => {
   if (bytes === 0) return '0 B';
@@ -51,6 +51,8 @@ export default function Files() {
 
   useEffect(() => {
     fetchData();
+    // Refetch when a scan changes the data
+    return subscribeToDataChanges(fetchData);
   }, []);
 
   const handleExportCsv = () => {
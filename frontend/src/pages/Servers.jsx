@@ -2,7 +2,7 @@ import { useEffect, useState } from 'react';
 import { Box, Typography, Alert } from '@mui/material';
 import DataTable from '../components/DataTable';
 import ScanButton from '../components/ScanButton';
-import { getServers, scanServers } from '../api';
+import { getServers, scanServers, subscribeToDataChanges } from '../api';
 
 const columns = [
   { field: 'hostname', headerName: 'Hostname' },
@@ -18,6 +18,11 @@ const columns = [
     field: 'last_scan', 
     headerName: 'Last Scan',
     valueFormatter: (value) => new Date(value).toLocaleString()
+  },
+  {
+    field: 'last_full_scan',
+    headerName: 'Last Full Scan',
+    valueFormatter: (value) => value ? new Date(value).toLocaleString() : 'Never'
   }
 ];
 
@@ -38,12 +43,13 @@ export default function Servers() {
 
   useEffect(() => {
     fetchServers();
+    // Refetch when any scan (ours or another user's) changes the data
+    return subscribeToDataChanges(fetchServers);
   }, []);
 
-  const handleScan = async () => {
+  const handleScan = async (onProgress) => {
     try {
-      await scanServers();
-      await fetchServers();
+      await scanServers(false, onProgress);
       setError(null);
     } catch (err) {
       setError('Failed to scan servers');
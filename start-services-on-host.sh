@@ -46,9 +46,6 @@ else
     echo "vite is already installed."
 fi
 
-# Install python-nmap (THIS IS HORRIBLE WAY TO DO THIS!!!!!!!!!!!!!! #FIX #TODO)
-sudo pip3 install python-nmap --break-system-packages # WARNING THIS IS HORRIBLE!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
-
 # Store the script's PID
 SCRIPT_PID=$$
 